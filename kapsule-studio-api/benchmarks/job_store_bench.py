@@ -0,0 +1,269 @@
+"""
+Job store micro-benchmarks.
+
+Times the operations the API performs per request from several threads
+against each JobStore backend, and job listing (first page, full cursor walk, filtered pages, batched
+status reads) over a store seeded with --listing-jobs jobs, and writes ops/s
+and latency percentiles per backend into a JSON report.
+
+Usage (from kapsule-studio-api/):
+    python -m benchmarks.job_store_bench --backends memory sqlite --out benchmarks/results/job_store.json
+    python -m benchmarks.job_store_bench --backends sqlite --operations 0 --listing-jobs 100000
+
+The firestore backend needs credentials or FIRESTORE_EMULATOR_HOST, and writes
+into the configured collections; point it at an emulator or a scratch project.
+Whether the backends behave alike is tested in tests/test_job_store.py.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List
+from uuid import uuid4
+
+import config
+from services.job_store import (
+    JOB_STATUSES,
+    JobFilter,
+    JobStore,
+    MemoryJobStore,
+    SQLiteJobStore,
+    create_job_store,
+)
+from utils.ids import new_job_id
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("memory", "sqlite", "firestore")
+DEFAULT_RESULTS_PATH = os.path.join(os.path.dirname(__file__), "results", "job_store.json")
+GENRES = ("Electronic", "Hip Hop", "Rock", "Pop", "Jazz", "Ambient", "R&B", "Metal")
+
+REQUEST = {
+    "prompt": "A neon city at night",
+    "audio_url": "gs://kapsule-bench/audio/track.mp3",
+    "duration": "8 seconds",
+    "genre": "Electronic",
+    "visualStyle": "Cinematic",
+    "cameraMovement": "Slow Push In",
+    "mood": "Energetic",
+    "subject": "None (Visual Only)",
+    "setting": "Color Studio Background",
+    "priority": "interactive",
+}
+
+
+class CheckFailed(AssertionError):
+    pass
+
+
+def _expect(condition: bool, message: str) -> None:
+    if not condition:
+        raise CheckFailed(message)
+
+
+def build_store(backend: str, workdir: str, max_documents: int = config.JOB_STORE_MEMORY_MAX_DOCUMENTS) -> JobStore:
+    """A fresh store for `backend` (SQLite in its own file under workdir)."""
+    if backend == "sqlite":
+        return SQLiteJobStore(os.path.join(workdir, f"jobs-{uuid4().hex}.sqlite3"))
+    if backend == "memory":
+        return MemoryJobStore(max_documents, config.JOB_STORE_MEMORY_TTL_SECONDS)
+    return create_job_store(backend)
+
+
+# Timings
+
+def _percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _time_operation(operation: Callable[[int], None], count: int, threads: int) -> dict:
+    latencies = []
+    lock = threading.Lock()
+
+    def run(i: int) -> None:
+        start = time.perf_counter()
+        operation(i)
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        list(pool.map(run, range(count)))
+    wall = time.perf_counter() - start
+
+    return {
+        "operations": count,
+        "ops_per_s": round(count / wall, 1),
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+    }
+
+
+def run_timings(backend: str, workdir: str, operations: int, threads: int) -> Dict[str, dict]:
+    """Time the per-request job operations against a fresh store."""
+    store = build_store(backend, workdir)
+    job_ids = [None] * operations
+    timings = {}
+
+    def create(i):
+        job_ids[i] = store.create_job(REQUEST)
+
+    # Accept-path cost, then the time until every document is actually written
+    start = time.perf_counter()
+    timings["create_job"] = _time_operation(create, operations, threads)
+    store.flush()
+    timings["create_job"]["persisted_ops_per_s"] = round(operations / (time.perf_counter() - start), 1)
+
+    timings["get_job"] = _time_operation(lambda i: store.get_job(job_ids[i]), operations, threads)
+    timings["update_job"] = _time_operation(
+        lambda i: store.update_job(job_ids[i], {"playlist_url": f"https://example.com/{i}.m3u8"}), operations, threads
+    )
+    timings["get_jobs_25"] = _time_operation(
+        lambda i: store.get_jobs([job_ids[(i + k) % operations] for k in range(25)]), max(1, operations // 10), threads
+    )
+    timings["cancel_job"] = _time_operation(lambda i: store.cancel_job(job_ids[i]), operations, threads)
+    timings["create_job_idempotent"] = _time_operation(
+        lambda i: store.create_job_idempotent(REQUEST, f"bench-{uuid4()}", "fingerprint"), operations, threads
+    )
+    store.flush()
+    return timings
+
+
+def seed_jobs(store: JobStore, count: int) -> Dict[str, int]:
+    """Write `count` finished and pending jobs spread over 30 days; returns jobs per status."""
+    rng = random.Random(7)
+    start = datetime.utcnow() - timedelta(days=30)
+    step = timedelta(days=30) / count
+    counts = {}
+    chunk = []
+    for i in range(count):
+        job = store._new_job_data(dict(REQUEST, genre=rng.choice(GENRES), prompt=f"{REQUEST['prompt']} " * 20))
+        job["status"] = rng.choices(JOB_STATUSES, weights=(1, 1, 80, 12, 6))[0]
+        job["createdAt"] = start + step * i
+        counts[job["status"]] = counts.get(job["status"], 0) + 1
+        chunk.append((config.JOBS_COLLECTION, new_job_id(), job))
+        if len(chunk) == 500:  # Firestore batched-write limit
+            store._insert(chunk)
+            chunk = []
+    if chunk:
+        store._insert(chunk)
+    return counts
+
+
+def _walk(store: JobStore, job_filter: JobFilter, limit: int) -> dict:
+    """Follow next_cursor to the last page, timing every page."""
+    latencies, total, cursor, previous = [], 0, None, None
+    while True:
+        start = time.perf_counter()
+        jobs, cursor = store.list_jobs(job_filter, limit=limit, cursor=cursor)
+        latencies.append(time.perf_counter() - start)
+        for job in jobs:
+            position = (job["createdAt"], job["job_id"])
+            _expect(previous is None or position < previous, "walk is strictly newest first")
+            previous = position
+        total += len(jobs)
+        if cursor is None:
+            break
+    return {
+        "jobs": total,
+        "pages": len(latencies),
+        "first_page_ms": round(latencies[0] * 1000, 3),
+        "last_page_ms": round(latencies[-1] * 1000, 3),
+        "p50_ms": round(_percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(_percentile(latencies, 0.99) * 1000, 3),
+        "total_s": round(sum(latencies), 3),
+    }
+
+
+def run_listing(backend: str, workdir: str, count: int) -> Dict[str, dict]:
+    """Time job listings and batched status reads over `count` seeded jobs."""
+    store = build_store(backend, workdir, max_documents=count + 1000)
+    timings = {}
+
+    start = time.perf_counter()
+    counts = seed_jobs(store, count)
+    timings["seed"] = {"jobs": count, "jobs_per_s": round(count / (time.perf_counter() - start), 1)}
+
+    job_ids = [job["job_id"] for job in store.list_jobs(limit=1000, fields=())[0]]
+    since = datetime.now(timezone.utc) - timedelta(days=7)
+    pages = {
+        "first_page": JobFilter(),
+        "first_page_status": JobFilter(status="error"),
+        "first_page_genre_7d": JobFilter(genre="Jazz", created_after=since),
+        "first_page_status_genre": JobFilter(status="cancelled", genre="Metal"),
+    }
+    for name, job_filter in pages.items():
+        timings[name] = _time_operation(lambda i: store.list_jobs(job_filter, limit=50), 200, 1)
+
+    timings["walk_all"] = _walk(store, JobFilter(), 200)
+    _expect(timings["walk_all"]["jobs"] == count, "walk returns every seeded job")
+    timings["walk_status_error"] = _walk(store, JobFilter(status="error"), 200)
+    _expect(timings["walk_status_error"]["jobs"] == counts.get("error", 0), "status walk returns every matching job")
+
+    timings["get_jobs_100_projected"] = _time_operation(
+        lambda i: store.get_jobs(job_ids[i % 10 * 100:][:100], fields=("status", "video_url", "error")), 200, 1
+    )
+    timings["get_jobs_100_full"] = _time_operation(lambda i: store.get_jobs(job_ids[i % 10 * 100:][:100]), 200, 1)
+    return timings
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Kapsule Studio job store benchmarks")
+    parser.add_argument("--backends", nargs="+", default=["memory", "sqlite"], choices=BACKENDS)
+    parser.add_argument("--operations", type=int, default=2000, help="Operations timed per kind (0 = skip)")
+    parser.add_argument("--threads", type=int, default=config.JOB_WRITE_BEHIND_WORKERS)
+    parser.add_argument("--listing-jobs", type=int, default=100_000, help="Jobs seeded for the listing timings (0 = skip)")
+    parser.add_argument("--out", default=DEFAULT_RESULTS_PATH)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    logger.setLevel(logging.INFO)
+
+    report = {
+        "meta": {
+            "createdAt": datetime.utcnow().isoformat() + "Z",
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "operations": args.operations,
+            "threads": args.threads,
+            "listing_jobs": args.listing_jobs,
+        },
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="kapsule-job-store-") as workdir:
+        for backend in args.backends:
+            print(f"{backend}:")
+            result = {}
+            if args.operations:
+                result["timings"] = run_timings(backend, workdir, args.operations, args.threads)
+                for operation, timing in result["timings"].items():
+                    print(f"  {operation:<22} {timing['ops_per_s']:>9.1f} ops/s  p50 {timing['p50_ms']:.3f} ms  p99 {timing['p99_ms']:.3f} ms")
+            if args.listing_jobs:
+                result["listing"] = run_listing(backend, workdir, args.listing_jobs)
+                for operation, timing in result["listing"].items():
+                    print(f"  {operation:<24} " + "  ".join(f"{key} {value}" for key, value in timing.items()))
+            report["results"][backend] = result
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Wrote results to {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
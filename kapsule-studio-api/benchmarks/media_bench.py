@@ -0,0 +1,265 @@
+"""
+Media pipeline micro-benchmarks.
+
+Runs every registered media path (see MEDIA_PATHS) against synthetic Veo-like
+clips and audio tracks, and records wall time, CPU time, peak RSS, temp bytes
+written and output size into a JSON results file. Each sample runs in a fresh
+worker process so resource usage is attributed to that sample alone.
+
+Usage (from kapsule-studio-api/):
+    python -m benchmarks.media_bench run --out benchmarks/results/latest.json
+    python -m benchmarks.media_bench compare benchmarks/baseline.json benchmarks/results/latest.json
+
+Runs fully offline; only the ffmpeg/ffprobe binaries are required.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+from benchmarks.synthetic import AUDIO_TRACKS, ensure_audio, ensure_veo_clip
+from utils.video_utils import disk_usage_bytes
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INPUTS_DIR = os.path.join(tempfile.gettempdir(), "kapsule-bench-inputs")
+DEFAULT_RESULTS_PATH = os.path.join(os.path.dirname(__file__), "results", "latest.json")
+
+# Metrics recorded per sample, with the relative increase that counts as a regression
+METRIC_THRESHOLDS = {
+    "wall_s": 0.15,
+    "cpu_s": 0.15,
+    "peak_rss_kb": 0.20,
+    "tmp_bytes": 0.05,
+    "output_bytes": 0.05,
+}
+
+# Differences below these absolute amounts are treated as noise
+METRIC_NOISE_FLOORS = {
+    "wall_s": 0.05,
+    "cpu_s": 0.05,
+    "peak_rss_kb": 4096,
+    "tmp_bytes": 64 * 1024,
+    "output_bytes": 64 * 1024,
+}
+
+
+# Media path registry
+# Each entry takes (video_path, audio_path, workdir) and returns the output path
+# (file or directory). Register new media paths here so they are benchmarked too.
+
+def _run_merge_mp4(video_path: str, audio_path: str, workdir: str) -> Optional[str]:
+    from utils.video_utils import merge_audio_video
+    output_path = os.path.join(workdir, "final.mp4")
+    return output_path if merge_audio_video(video_path, audio_path, output_path) else None
+
+
+def _run_merge_hls(video_path: str, audio_path: str, workdir: str) -> Optional[str]:
+    from utils.video_utils import merge_audio_video_hls, remux_hls_to_mp4, HLS_PLAYLIST_NAME
+    hls_dir = os.path.join(workdir, "hls")
+    if not merge_audio_video_hls(video_path, audio_path, hls_dir):
+        return None
+    output_path = os.path.join(workdir, "final.mp4")
+    return output_path if remux_hls_to_mp4(os.path.join(hls_dir, HLS_PLAYLIST_NAME), output_path) else None
+
+
+def _run_preview(video_path: str, audio_path: str, workdir: str) -> Optional[str]:
+    from utils.video_utils import create_preview
+    preview_path = os.path.join(workdir, "preview.mp4")
+    thumbnail_path = os.path.join(workdir, "thumb.jpg")
+    return preview_path if create_preview(video_path, audio_path, thumbnail_path, preview_path) else None
+
+
+MEDIA_PATHS: Dict[str, Callable[[str, str, str], Optional[str]]] = {
+    "merge_mp4": _run_merge_mp4,
+    "merge_hls": _run_merge_hls,
+    "preview": _run_preview,
+}
+
+
+def run_worker(media_path: str, track_id: str, inputs_dir: str) -> dict:
+    """
+    Run one sample in the current process and measure it.
+
+    Must run in a fresh process: RUSAGE_CHILDREN peak RSS is process-lifetime.
+    """
+    video_path = ensure_veo_clip(inputs_dir)
+    audio_path = ensure_audio(inputs_dir, track_id)
+    workdir = tempfile.mkdtemp(prefix=f"bench_{media_path}_")
+
+    try:
+        before_self = resource.getrusage(resource.RUSAGE_SELF)
+        before_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        start = time.perf_counter()
+
+        output_path = MEDIA_PATHS[media_path](video_path, audio_path, workdir)
+
+        wall = time.perf_counter() - start
+        after_self = resource.getrusage(resource.RUSAGE_SELF)
+        after_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+        if not output_path:
+            raise RuntimeError(f"Media path {media_path} failed for {track_id}")
+
+        cpu = (
+            (after_self.ru_utime + after_self.ru_stime - before_self.ru_utime - before_self.ru_stime)
+            + (after_children.ru_utime + after_children.ru_stime - before_children.ru_utime - before_children.ru_stime)
+        )
+
+        return {
+            "wall_s": round(wall, 4),
+            "cpu_s": round(cpu, 4),
+            "peak_rss_kb": after_children.ru_maxrss,  # ffmpeg/ffprobe children (KiB on Linux)
+            "python_rss_kb": after_self.ru_maxrss,
+            "tmp_bytes": disk_usage_bytes(workdir),
+            "output_bytes": disk_usage_bytes(output_path),
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def run_suite(paths: list, tracks: list, repeat: int, inputs_dir: str) -> dict:
+    """Run every (media path, audio track) case `repeat` times, each in a fresh worker."""
+    # Generate inputs once up front so generation cost never lands in a sample
+    ensure_veo_clip(inputs_dir)
+    for track_id in tracks:
+        ensure_audio(inputs_dir, track_id)
+
+    results = {}
+    for media_path in paths:
+        for track_id in tracks:
+            case_id = f"{media_path}/{track_id}"
+            samples = []
+            for _ in range(repeat):
+                proc = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.media_bench", "worker",
+                     "--path", media_path, "--audio", track_id, "--inputs", inputs_dir],
+                    capture_output=True,
+                    text=True,
+                    cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+                )
+                if proc.returncode != 0:
+                    raise RuntimeError(f"Worker failed for {case_id}: {proc.stderr[-2000:]}")
+                samples.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+            medians = {
+                metric: statistics.median(sample[metric] for sample in samples)
+                for metric in samples[0]
+            }
+            results[case_id] = {"median": medians, "samples": samples}
+            logger.info(f"{case_id}: wall={medians['wall_s']:.2f}s cpu={medians['cpu_s']:.2f}s "
+                        f"rss={medians['peak_rss_kb'] / 1024:.0f}MiB out={medians['output_bytes'] / 1024:.0f}KiB")
+
+    return results
+
+
+def _ffmpeg_version() -> str:
+    try:
+        proc = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True)
+        return proc.stdout.splitlines()[0] if proc.stdout else "unknown"
+    except FileNotFoundError:
+        return "missing"
+
+
+def compare(baseline: dict, current: dict) -> list:
+    """
+    Compare two results files and list regressions.
+
+    Returns:
+        List of (case_id, metric, baseline_value, current_value) regressions
+    """
+    regressions = []
+    for case_id, case in current["results"].items():
+        base_case = baseline["results"].get(case_id)
+        if not base_case:
+            continue
+        for metric, threshold in METRIC_THRESHOLDS.items():
+            base_value = base_case["median"].get(metric)
+            value = case["median"].get(metric)
+            if base_value is None or value is None:
+                continue
+            if value - base_value <= METRIC_NOISE_FLOORS[metric]:
+                continue
+            if base_value == 0 or (value - base_value) / base_value > threshold:
+                regressions.append((case_id, metric, base_value, value))
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Kapsule Studio media pipeline benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="Run the benchmark suite")
+    run_parser.add_argument("--paths", nargs="+", default=list(MEDIA_PATHS), choices=list(MEDIA_PATHS))
+    run_parser.add_argument("--audio", nargs="+", default=list(AUDIO_TRACKS), choices=list(AUDIO_TRACKS))
+    run_parser.add_argument("--repeat", type=int, default=3)
+    run_parser.add_argument("--inputs", default=DEFAULT_INPUTS_DIR, help="Synthetic input cache directory")
+    run_parser.add_argument("--out", default=DEFAULT_RESULTS_PATH)
+
+    compare_parser = sub.add_parser("compare", help="Flag regressions against a stored baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("results")
+
+    worker_parser = sub.add_parser("worker", help=argparse.SUPPRESS)
+    worker_parser.add_argument("--path", required=True, choices=list(MEDIA_PATHS))
+    worker_parser.add_argument("--audio", required=True, choices=list(AUDIO_TRACKS))
+    worker_parser.add_argument("--inputs", required=True)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "worker":
+        # Keep stdout clean for the JSON line
+        logging.basicConfig(level=logging.WARNING)
+        print(json.dumps(run_worker(args.path, args.audio, args.inputs)))
+        return 0
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.command == "run":
+        results = run_suite(args.paths, args.audio, args.repeat, args.inputs)
+        report = {
+            "meta": {
+                "createdAt": datetime.utcnow().isoformat() + "Z",
+                "platform": platform.platform(),
+                "python": platform.python_version(),
+                "cpu_count": os.cpu_count(),
+                "ffmpeg": _ffmpeg_version(),
+                "repeat": args.repeat,
+            },
+            "results": results,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Wrote results to {args.out}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.results) as f:
+        current = json.load(f)
+
+    regressions = compare(baseline, current)
+    for case_id, metric, base_value, value in regressions:
+        print(f"REGRESSION {case_id} {metric}: {base_value} -> {value} (+{(value - base_value) / base_value * 100 if base_value else float('inf'):.1f}%)")
+    missing = sorted(set(baseline["results"]) - set(current["results"]))
+    for case_id in missing:
+        print(f"MISSING {case_id}: present in baseline, not in results")
+    if not regressions:
+        print(f"No regressions across {len(current['results'])} cases")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+Synthetic media inputs for benchmarks and load tests.
+
+Everything is generated offline with FFmpeg's lavfi sources, so no GCS, Veo or
+real user audio is needed. Files are cached by name under the target directory
+and only regenerated when missing.
+"""
+
+import logging
+import os
+import subprocess
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+# Veo-like clip: 720x1280 portrait, 8 s, 24 fps, H.264, no audio
+VEO_CLIP = {
+    "name": "veo_720x1280_8s.mp4",
+    "args": [
+        "-f", "lavfi", "-i", "testsrc2=size=720x1280:rate=24:duration=8",
+        "-c:v", "libx264", "-preset", "medium", "-pix_fmt", "yuv420p",
+    ],
+}
+
+# Audio tracks of various lengths and codecs
+# (5 s exercises the trim path, the rest exercise the loop path)
+AUDIO_TRACKS: Dict[str, dict] = {
+    "mp3_5s": {"name": "audio_5s.mp3", "duration": 5, "codec": ["-c:a", "libmp3lame", "-b:a", "192k"]},
+    "wav_15s": {"name": "audio_15s.wav", "duration": 15, "codec": ["-c:a", "pcm_s16le"]},
+    "mp3_15s": {"name": "audio_15s.mp3", "duration": 15, "codec": ["-c:a", "libmp3lame", "-b:a", "192k"]},
+    "m4a_30s": {"name": "audio_30s.m4a", "duration": 30, "codec": ["-c:a", "aac", "-b:a", "192k"]},
+    "mp3_60s": {"name": "audio_60s.mp3", "duration": 60, "codec": ["-c:a", "libmp3lame", "-b:a", "192k"]},
+}
+
+
+def _generate(output_path: str, args: list) -> None:
+    """Run FFmpeg to create one synthetic file (atomically, via a temp name)."""
+    temp_path = f"{output_path}.part{os.path.splitext(output_path)[1]}"
+    subprocess.run(
+        ["ffmpeg", "-nostdin", "-loglevel", "error", "-y", *args, temp_path],
+        check=True
+    )
+    os.replace(temp_path, output_path)
+    logger.info(f"Generated synthetic input: {output_path}")
+
+
+def ensure_veo_clip(directory: str) -> str:
+    """
+    Create (if missing) the synthetic Veo-like clip.
+
+    Args:
+        directory: Cache directory for synthetic inputs
+
+    Returns:
+        Local path to the clip
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, VEO_CLIP["name"])
+    if not os.path.exists(path):
+        _generate(path, VEO_CLIP["args"])
+    return path
+
+
+def ensure_audio(directory: str, track_id: str) -> str:
+    """
+    Create (if missing) one synthetic audio track.
+
+    Args:
+        directory: Cache directory for synthetic inputs
+        track_id: Key of AUDIO_TRACKS
+
+    Returns:
+        Local path to the audio file
+    """
+    track = AUDIO_TRACKS[track_id]
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, track["name"])
+    if not os.path.exists(path):
+        # A chord plus pink noise gives the encoder realistic, non-trivial content
+        source = (
+            f"sine=frequency=220:duration={track['duration']}[a];"
+            f"sine=frequency=330:duration={track['duration']}[b];"
+            f"anoisesrc=color=pink:amplitude=0.1:duration={track['duration']}[c];"
+            f"[a][b][c]amix=inputs=3,aformat=channel_layouts=stereo:sample_rates=44100"
+        )
+        _generate(path, ["-filter_complex", source, *track["codec"]])
+    return path
@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 from google.cloud import secretmanager
 
@@ -37,16 +38,208 @@ ALLOWED_AUDIO_TYPES = ["audio/mpeg", "audio/wav", "audio/m4a"]
 # Veo Configuration
 VEO_MODEL = "veo-3.0-generate-001"
 VEO_LOCATION = GCP_REGION
+VEO_LOCATIONS = [location.strip() for location in os.getenv("VEO_LOCATIONS", VEO_LOCATION).split(",") if location.strip()]  # Preferred first
+VEO_POLL_INTERVAL_SECONDS = float(os.getenv("VEO_POLL_INTERVAL_SECONDS", 10))
+
+# Veo Submission Scheduler (per instance; keep under the project's Vertex AI quota)
+VEO_REQUESTS_PER_MINUTE = float(os.getenv("VEO_REQUESTS_PER_MINUTE", 10))
+VEO_REQUEST_BURST = int(os.getenv("VEO_REQUEST_BURST", 3))  # Token bucket capacity
+VEO_MAX_CONCURRENT_OPERATIONS = int(os.getenv("VEO_MAX_CONCURRENT_OPERATIONS", 10))
+VEO_PRIORITY_LANES = [lane.strip() for lane in os.getenv("VEO_PRIORITY_LANES", "paid,free").split(",") if lane.strip()]  # Highest first
+# "TOKEN:LANE,..." bearer tokens of trusted callers and their lane; every other request gets the lowest lane
+VEO_LANE_TOKENS = dict(entry.strip().rsplit(":", 1) for entry in os.getenv("VEO_LANE_TOKENS", "").split(",") if ":" in entry)
+VEO_SUBMIT_MAX_ATTEMPTS = int(os.getenv("VEO_SUBMIT_MAX_ATTEMPTS", 6))
+VEO_RETRY_BASE_SECONDS = float(os.getenv("VEO_RETRY_BASE_SECONDS", 2))
+VEO_RETRY_MAX_SECONDS = float(os.getenv("VEO_RETRY_MAX_SECONDS", 60))
 
 # Gemini (Prompt Enhancer) Configuration  
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
 GEMINI_LOCATION = os.getenv("GEMINI_LOCATION", GCP_REGION)
+GEMINI_LOCATIONS = [location.strip() for location in os.getenv("GEMINI_LOCATIONS", GEMINI_LOCATION).split(",") if location.strip()]  # Preferred first
 USE_GEMINI_PROMPT_ENHANCER = os.getenv("USE_GEMINI_PROMPT_ENHANCER", "false").lower() == "true"
+GEMINI_STREAM_FIRST_TOKEN_SECONDS = float(os.getenv("GEMINI_STREAM_FIRST_TOKEN_SECONDS", 3))  # Streamed previews fall back to the rule-based prompt after this
+PROMPT_PREVIEW_CACHE_SIZE = int(os.getenv("PROMPT_PREVIEW_CACHE_SIZE", 1000))  # Gemini previews kept per instance (0 = off)
+PROMPT_PREVIEW_CACHE_TTL_SECONDS = float(os.getenv("PROMPT_PREVIEW_CACHE_TTL_SECONDS", 3600))
+PREVIEW_TOKEN_CACHE_SIZE = int(os.getenv("PREVIEW_TOKEN_CACHE_SIZE", 5000))  # Preview tokens kept per instance (0 = off)
+PREVIEW_TOKEN_TTL_SECONDS = float(os.getenv("PREVIEW_TOKEN_TTL_SECONDS", 1800))  # /api/generate rebuilds the prompt after this
+GEMINI_LATENCY_BUDGET_SECONDS = float(os.getenv("GEMINI_LATENCY_BUDGET_SECONDS", 8))  # Per enhance call, hedge included
+GEMINI_HEDGE_ENABLED = os.getenv("GEMINI_HEDGE_ENABLED", "true").lower() == "true"  # Second request once the first passes the observed p95
+GEMINI_HEDGE_DEFAULT_DELAY_SECONDS = float(os.getenv("GEMINI_HEDGE_DEFAULT_DELAY_SECONDS", 3))  # Until enough latencies are observed
+GEMINI_HEDGE_MIN_DELAY_SECONDS = float(os.getenv("GEMINI_HEDGE_MIN_DELAY_SECONDS", 0.5))
+GEMINI_BREAKER_FAILURE_THRESHOLD = int(os.getenv("GEMINI_BREAKER_FAILURE_THRESHOLD", 5))  # Consecutive failed or slow calls
+GEMINI_BREAKER_SLOW_CALL_SECONDS = float(os.getenv("GEMINI_BREAKER_SLOW_CALL_SECONDS", 6))
+GEMINI_BREAKER_RESET_SECONDS = float(os.getenv("GEMINI_BREAKER_RESET_SECONDS", 30))  # Open time before a half-open probe
+
+# Vertex AI endpoint override for local stand-ins (load tests), e.g. http://127.0.0.1:9100
+# When set, Veo and Gemini calls go there without Google credentials
+VERTEX_API_ENDPOINT = os.getenv("VERTEX_API_ENDPOINT", "").rstrip("/")
+
+# Region Routing Configuration
+# With several VEO_LOCATIONS / GEMINI_LOCATIONS, new calls go to the healthiest
+# region and fail over on quota, server and transport errors (utils/region_router.py).
+# Veo operations are always polled in the region they were started in
+REGION_FAILURE_THRESHOLD = int(os.getenv("REGION_FAILURE_THRESHOLD", 3))  # Consecutive failures before a region is skipped
+REGION_RESET_SECONDS = float(os.getenv("REGION_RESET_SECONDS", 60))  # Before a skipped region gets a probe call
+REGION_SLOW_CALL_SECONDS = float(os.getenv("REGION_SLOW_CALL_SECONDS", 20))  # Slower submits/calls count as failures (0 = never)
+REGION_EWMA_ALPHA = float(os.getenv("REGION_EWMA_ALPHA", 0.2))  # Weight of the newest latency/error sample
+REGION_LATENCY_TOLERANCE = float(os.getenv("REGION_LATENCY_TOLERANCE", 0.25))  # Regions this much slower than the fastest still count as equal
+REGION_ERROR_PENALTY = float(os.getenv("REGION_ERROR_PENALTY", 4))  # Latency multiplier per unit of error rate
 
 # Storage Paths
 AUDIO_FOLDER = "audio/"
 VIDEO_FOLDER = "video/"
+HLS_FOLDER = "hls/"
+PREVIEW_FOLDER = "preview/"
+VEO_TEMP_FOLDER = "veo-temp/"  # Veo writes its clips here; the compactor deletes them
+
+# Output Packaging Configuration
+# 'mp4': single progressive MP4 exposed once encode + upload finish
+# 'hls': fMP4 HLS segments uploaded as they are produced, plus the MP4 for download
+OUTPUT_MODE = os.getenv("OUTPUT_MODE", "mp4").lower()
+HLS_SEGMENT_SECONDS = int(os.getenv("HLS_SEGMENT_SECONDS", 2))
+
+# Early Preview Configuration (poster frame + short low-res clip published before the full render)
+ENABLE_EARLY_PREVIEW = os.getenv("ENABLE_EARLY_PREVIEW", "true").lower() == "true"
+PREVIEW_SECONDS = float(os.getenv("PREVIEW_SECONDS", 3))
+
+# Admission Control (per instance)
+VEO_WAIT_SLOTS = int(os.getenv("VEO_WAIT_SLOTS", 16))  # Jobs submitting to / polling Veo at once (cheap)
+ENCODE_SLOTS = int(os.getenv("ENCODE_SLOTS", 2))  # Concurrent FFmpeg renders (CPU-bound, ~1 per vCPU)
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", 32))  # Jobs waiting for a slot before 429s
+ADMISSION_INITIAL_VEO_SECONDS = float(os.getenv("ADMISSION_INITIAL_VEO_SECONDS", 90))  # ETA seed until measured
+ADMISSION_INITIAL_ENCODE_SECONDS = float(os.getenv("ADMISSION_INITIAL_ENCODE_SECONDS", 20))
+
+# Scratch Space Configuration (local tmpfs counts against instance memory)
+SCRATCH_DIR = os.getenv("SCRATCH_DIR", "/tmp/kapsule-scratch")
+SCRATCH_LIMIT_BYTES = int(os.getenv("SCRATCH_LIMIT_BYTES", 768 * 1024 * 1024))  # Sum of job reservations
+SCRATCH_JOB_BASE_BYTES = int(os.getenv("SCRATCH_JOB_BASE_BYTES", 64 * 1024 * 1024))  # Veo clip, audio, preview
+SCRATCH_BYTES_PER_SECOND = int(os.getenv("SCRATCH_BYTES_PER_SECOND", 1024 * 1024))  # Render output per second of track
+SCRATCH_ACQUIRE_TIMEOUT_SECONDS = float(os.getenv("SCRATCH_ACQUIRE_TIMEOUT_SECONDS", 600))
+SCRATCH_MAX_DEFERRED_JOBS = int(os.getenv("SCRATCH_MAX_DEFERRED_JOBS", 4))  # New jobs get 503 beyond this
+SCRATCH_SWEEP_INTERVAL_SECONDS = float(os.getenv("SCRATCH_SWEEP_INTERVAL_SECONDS", 300))
+SCRATCH_ORPHAN_MAX_AGE_SECONDS = float(os.getenv("SCRATCH_ORPHAN_MAX_AGE_SECONDS", 3600))
+
+# Cancellation Configuration
+VEO_CANCEL_OPERATIONS = os.getenv("VEO_CANCEL_OPERATIONS", "true").lower() == "true"  # Try to cancel the Vertex operation too
+GCS_UPLOAD_CHUNK_BYTES = int(os.getenv("GCS_UPLOAD_CHUNK_BYTES", 8 * 1024 * 1024))  # Resumable chunk size (multiple of 256 KiB)
+
+# Job Durability Configuration
+# Running jobs hold a lease on their document; jobs whose lease expires (the instance
+# died) are claimed by another instance and resumed from their last checkpoint
+WORKER_ID = os.getenv("WORKER_ID") or f"{socket.gethostname()}-{os.getpid()}"
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", 15))  # Lease renewal and remote-cancel check (0 = off)
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", 90))
+JOB_RECOVERY_INTERVAL_SECONDS = float(os.getenv("JOB_RECOVERY_INTERVAL_SECONDS", 60))  # Expired-lease scan (0 = off)
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))  # Runs per job (first run + resumes) before it is failed
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_KEY_TTL_SECONDS", 24 * 3600))
+JOB_WRITE_BEHIND_WORKERS = int(os.getenv("JOB_WRITE_BEHIND_WORKERS", 4))  # Threads persisting new job documents
+JOB_WRITE_BEHIND_ATTEMPTS = int(os.getenv("JOB_WRITE_BEHIND_ATTEMPTS", 5))  # Tries per job document before the job is failed
+JOB_WRITE_FAILED_CACHE_SIZE = int(os.getenv("JOB_WRITE_FAILED_CACHE_SIZE", 1000))  # Unsaved jobs still served (as failed) to pollers
+JOB_WRITE_FAILED_TTL_SECONDS = float(os.getenv("JOB_WRITE_FAILED_TTL_SECONDS", 3600))
 
-# Firestore Collections
+# Batch Generation Configuration
+# A batch and its jobs are written in one Firestore batched write (at most 500 documents)
+BATCH_MAX_JOBS = min(int(os.getenv("BATCH_MAX_JOBS", 25)), 499)
+
+# Job Listing Configuration
+# /api/jobs pages are keyed by (createdAt, job ID); filters use the indexes in firestore.indexes.json
+JOB_LIST_DEFAULT_LIMIT = int(os.getenv("JOB_LIST_DEFAULT_LIMIT", 50))
+JOB_LIST_MAX_LIMIT = int(os.getenv("JOB_LIST_MAX_LIMIT", 200))
+RESULT_BATCH_MAX_JOBS = int(os.getenv("RESULT_BATCH_MAX_JOBS", 100))  # Job IDs per POST /api/result/batch
+
+# Job Stats Configuration
+# Completed jobs' timing ledgers feed rolling percentiles per stage and option (/api/stats),
+# which give /api/result its estimated completion time and poll interval hint
+STATS_WINDOW_SECONDS = float(os.getenv("STATS_WINDOW_SECONDS", 3600))  # Percentiles cover jobs completed this recently
+STATS_WINDOW_SLICES = int(os.getenv("STATS_WINDOW_SLICES", 6))  # The window rolls forward one slice at a time
+STATS_RELATIVE_ACCURACY = float(os.getenv("STATS_RELATIVE_ACCURACY", 0.02))  # Quantile sketch error bound
+STATS_MAX_OPTION_VALUES = int(os.getenv("STATS_MAX_OPTION_VALUES", 50))  # Per option; further values count as "other"
+STATS_MIN_SAMPLES = int(os.getenv("STATS_MIN_SAMPLES", 5))  # Jobs needed before percentiles drive an ETA
+STATS_SEED_JOBS = int(os.getenv("STATS_SEED_JOBS", 500))  # Recent completed jobs loaded at startup (0 = off)
+RESULT_POLL_MIN_MS = int(os.getenv("RESULT_POLL_MIN_MS", 1000))
+RESULT_POLL_MAX_MS = int(os.getenv("RESULT_POLL_MAX_MS", 15000))
+RESULT_POLL_DEFAULT_MS = int(os.getenv("RESULT_POLL_DEFAULT_MS", 5000))  # Until enough jobs have completed for an ETA
+
+# Job Store Configuration
+# JOB_STORE: 'firestore' (production), 'sqlite' (one WAL-mode file; single node, local benchmarks)
+# or 'memory' (bounded in-process dict; development and load tests)
+JOB_STORE = os.getenv("JOB_STORE", "firestore").lower()
+JOB_STORE_SQLITE_PATH = os.getenv("JOB_STORE_SQLITE_PATH", "/tmp/kapsule-jobs.sqlite3")
+JOB_STORE_MEMORY_MAX_DOCUMENTS = int(os.getenv("JOB_STORE_MEMORY_MAX_DOCUMENTS", 10000))  # Per collection, least recently used evicted
+JOB_STORE_MEMORY_TTL_SECONDS = float(os.getenv("JOB_STORE_MEMORY_TTL_SECONDS", 24 * 3600))  # Since the document's last write
+
+# Compaction Configuration
+# Deletes old veo-temp clips and unreferenced uploads, archives referenced ones and fails
+# jobs no instance will resume (services/compactor.py; also runnable as a scheduled job)
+COMPACT_INTERVAL_SECONDS = float(os.getenv("COMPACT_INTERVAL_SECONDS", 3600))  # Per instance, first run at a random offset (0 = off)
+COMPACT_VEO_TEMP_MAX_AGE_SECONDS = float(os.getenv("COMPACT_VEO_TEMP_MAX_AGE_SECONDS", 6 * 3600))
+COMPACT_UPLOAD_MAX_AGE_SECONDS = float(os.getenv("COMPACT_UPLOAD_MAX_AGE_SECONDS", 24 * 3600))
+COMPACT_ARCHIVE_STORAGE_CLASS = os.getenv("COMPACT_ARCHIVE_STORAGE_CLASS", "NEARLINE").upper()  # For referenced uploads ('' = keep as is)
+COMPACT_STALE_JOB_GRACE_SECONDS = float(os.getenv("COMPACT_STALE_JOB_GRACE_SECONDS", 3600))  # After lease expiry, left to job recovery
+COMPACT_STALE_JOB_MAX_AGE_SECONDS = float(os.getenv("COMPACT_STALE_JOB_MAX_AGE_SECONDS", 6 * 3600))  # For jobs that never got a lease
+COMPACT_BATCH_SIZE = int(os.getenv("COMPACT_BATCH_SIZE", 200))  # Objects or jobs per listing page
+COMPACT_MAX_ITEMS_PER_RUN = int(os.getenv("COMPACT_MAX_ITEMS_PER_RUN", 5000))  # Per set
+COMPACT_OPS_PER_SECOND = float(os.getenv("COMPACT_OPS_PER_SECOND", 20))  # Deletes, rewrites and job updates (0 = unlimited)
+
+# Clip Library Configuration
+# Clips pre-rendered off-peak for the most requested option combinations, served
+# by /api/generate "mode": "instant" without a Veo call (services/clip_library.py)
+LIBRARY_ENABLED = os.getenv("LIBRARY_ENABLED", "false").lower() == "true"
+LIBRARY_FOLDER = "library/"
+LIBRARY_TOP_K = int(os.getenv("LIBRARY_TOP_K", 20))  # Combinations kept stocked
+LIBRARY_CLIPS_PER_COMBO = int(os.getenv("LIBRARY_CLIPS_PER_COMBO", 3))
+LIBRARY_CLIP_MAX_USES = int(os.getenv("LIBRARY_CLIP_MAX_USES", 5))  # Users served per clip before it is retired
+LIBRARY_DAILY_BUDGET = int(os.getenv("LIBRARY_DAILY_BUDGET", 30))  # Veo generations per UTC day, across instances
+LIBRARY_OFF_PEAK_HOURS = os.getenv("LIBRARY_OFF_PEAK_HOURS", "2-6")  # UTC hours "start-end" (end exclusive) stocking runs in
+LIBRARY_INTERVAL_SECONDS = float(os.getenv("LIBRARY_INTERVAL_SECONDS", 1800))  # Per instance (0 = off)
+LIBRARY_HISTORY_SECONDS = float(os.getenv("LIBRARY_HISTORY_SECONDS", 14 * 24 * 3600))  # Jobs counted for popularity
+LIBRARY_HISTORY_MAX_JOBS = int(os.getenv("LIBRARY_HISTORY_MAX_JOBS", 20000))  # Newest jobs read per run
+LIBRARY_POPULARITY_HALF_LIFE_SECONDS = float(os.getenv("LIBRARY_POPULARITY_HALF_LIFE_SECONDS", 3 * 24 * 3600))
+LIBRARY_MIN_SCORE = float(os.getenv("LIBRARY_MIN_SCORE", 3))  # Decayed job count a combination needs to be stocked
+LIBRARY_CONCURRENCY = int(os.getenv("LIBRARY_CONCURRENCY", 2))  # Clips generated at once
+LIBRARY_GENERATION_TIMEOUT_SECONDS = float(os.getenv("LIBRARY_GENERATION_TIMEOUT_SECONDS", 1200))  # Reservation lifetime
+LIBRARY_RETIRED_GRACE_SECONDS = float(os.getenv("LIBRARY_RETIRED_GRACE_SECONDS", 3600))  # Retired clips kept for jobs still downloading them
+
+# Job Store Collections
 JOBS_COLLECTION = "jobs"
+IDEMPOTENCY_COLLECTION = "idempotency_keys"
+BATCHES_COLLECTION = "batches"
+LIBRARY_COLLECTION = "clip_library"
+
+# Warmup Configuration
+# Tokens, clients, pooled connections and FFmpeg are warmed at startup; /readyz
+# reports ready once that has finished (use it as the Cloud Run startup probe)
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "true").lower() == "true"
+WARMUP_TIMEOUT_SECONDS = float(os.getenv("WARMUP_TIMEOUT_SECONDS", 30))  # Ready after this even if steps are still running
+
+# Profiling Configuration
+# Admin endpoints (/admin/*) for CPU sampling, tracemalloc diffs and asyncio task dumps on a
+# live instance, plus per-job peak RSS and FFmpeg usage in job timings (utils/profiling.py).
+# Off unless PROFILING_ENABLED is set and ADMIN_TOKEN is configured
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")  # Bearer token for /admin/*, /api/jobs and /api/result/batch
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", 60))  # Longest CPU or memory capture
+PROFILE_SAMPLE_INTERVAL_SECONDS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_SECONDS", 0.01))  # CPU sampler period (at least 0.005)
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", 10))  # Traceback depth per allocation
+PROFILE_TRACEMALLOC_TOP = int(os.getenv("PROFILE_TRACEMALLOC_TOP", 50))  # Allocation sites in a memory capture
+PROFILE_RESOURCE_SAMPLE_SECONDS = float(os.getenv("PROFILE_RESOURCE_SAMPLE_SECONDS", 0.5))  # Per-job RSS/FFmpeg sampling (0 = off)
+PROFILE_ARTIFACT_DIR = os.getenv("PROFILE_ARTIFACT_DIR", "/tmp/kapsule-profiles")
+PROFILE_MAX_ARTIFACTS = int(os.getenv("PROFILE_MAX_ARTIFACTS", 20))  # Oldest captures deleted beyond this
+
+# Tracing Configuration
+# TRACE_EXPORTER: 'none' (disabled), 'otlp' (OTLP/HTTP JSON collector) or 'file' (JSON lines)
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none").lower()
+TRACE_SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", 1.0))  # Head sampling, per trace
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACE_FILE_PATH = os.getenv("TRACE_FILE_PATH", "/tmp/kapsule-traces.jsonl")
+TRACE_MAX_QUEUE = int(os.getenv("TRACE_MAX_QUEUE", 4096))  # Spans buffered before the oldest are dropped
+TRACE_FLUSH_INTERVAL_SECONDS = float(os.getenv("TRACE_FLUSH_INTERVAL_SECONDS", 2))
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "kapsule-studio-api")
 
+# Logging Configuration
+# LOG_FORMAT: 'json' (structured, written by a background thread) or 'text' (synchronous plain text)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_MAX_MESSAGE_CHARS = int(os.getenv("LOG_MAX_MESSAGE_CHARS", 2000))  # Longer messages are truncated
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))  # Records buffered before new ones are dropped
+LOG_SAMPLE_EVERY = int(os.getenv("LOG_SAMPLE_EVERY", 10))  # Keep 1 in N repetitive per-poll records
@@ -0,0 +1,294 @@
+"""
+Traffic driver for load tests.
+
+Replays user sessions against a running API at a target arrival rate (open loop):
+upload audio -> (optionally) preview the prompt -> generate -> poll /api/result
+until the job finishes. Reports throughput, per-endpoint latency percentiles,
+jobs completed per minute and the API instance's memory (RSS of the server
+process plus its ffmpeg children, sampled from /proc), and checks the
+/api/generate p99 against its latency target on the warm instance.
+
+Usage:
+    python -m loadtest.driver --target http://127.0.0.1:8000 --rate 0.2 --duration 300 \\
+        --audio /tmp/kapsule-bench-inputs/audio_15s.mp3 --server-pid <uvicorn pid>
+"""
+
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import requests
+
+from services.prompt_enhancer import (
+    CAMERA_DESCRIPTORS,
+    CAMERA_TYPE_DESCRIPTORS,
+    GENRE_DESCRIPTORS,
+    LIGHTING_DESCRIPTORS,
+    MOOD_DESCRIPTORS,
+    SETTING_DESCRIPTORS,
+    STYLE_DESCRIPTORS,
+    SUBJECT_DESCRIPTORS,
+)
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("complete", "error", "cancelled")
+
+
+def _zipf_choice(options: list, skew: float = 1.1) -> str:
+    """Pick an option with a Zipf-like popularity skew (first options are most popular)."""
+    weights = [1 / (rank + 1) ** skew for rank in range(len(options))]
+    return random.choices(options, weights=weights, k=1)[0]
+
+
+def random_options() -> dict:
+    """Build a prompt option set with realistic (skewed) popularity."""
+    return {
+        "genre": _zipf_choice(list(GENRE_DESCRIPTORS)),
+        "visualStyle": _zipf_choice(list(STYLE_DESCRIPTORS)),
+        "cameraMovement": _zipf_choice(list(CAMERA_DESCRIPTORS)),
+        "mood": _zipf_choice(list(MOOD_DESCRIPTORS)),
+        "subject": _zipf_choice(list(SUBJECT_DESCRIPTORS)),
+        "setting": _zipf_choice(list(SETTING_DESCRIPTORS)),
+        "lighting": _zipf_choice(list(LIGHTING_DESCRIPTORS)),
+        "cameraType": _zipf_choice(list(CAMERA_TYPE_DESCRIPTORS)),
+        "duration": "15s",
+        "creativeIntensity": random.choice(["Balanced", "Precise", "Experimental"]),
+        "extra": "",
+    }
+
+
+def percentiles(values: List[float]) -> dict:
+    """p50/p90/p95/p99/max of a list of values (empty-safe)."""
+    if not values:
+        return {}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean": round(statistics.fmean(ordered), 2),
+        "p50": round(pick(0.50), 2),
+        "p90": round(pick(0.90), 2),
+        "p95": round(pick(0.95), 2),
+        "p99": round(pick(0.99), 2),
+        "max": round(ordered[-1], 2),
+    }
+
+
+def _process_tree_rss_kb(pid: int) -> int:
+    """RSS (KiB) of a process plus all of its descendants, read from /proc."""
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            children.setdefault(ppid, []).append(int(entry))
+        except (OSError, IndexError, ValueError):
+            continue
+
+    total = 0
+    stack = [pid]
+    while stack:
+        current = stack.pop()
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+                        break
+        except OSError:
+            pass
+        stack.extend(children.get(current, []))
+    return total
+
+
+class LoadDriver:
+    """Runs sessions and collects measurements (thread-safe)."""
+
+    def __init__(self, args):
+        self.args = args
+        self.http = requests.Session()
+        self.http.mount("http://", requests.adapters.HTTPAdapter(pool_connections=64, pool_maxsize=512))
+        with open(args.audio, "rb") as f:
+            self.audio_bytes = f.read()
+        self._lock = threading.Lock()
+        self.samples: Dict[str, list] = {}  # endpoint -> [(latency_ms, status_code)]
+        self.jobs: List[dict] = []
+        self.rss_samples: List[int] = []
+        self._stop = threading.Event()
+
+    def _call(self, endpoint: str, method: str, url: str, **kwargs) -> Optional[requests.Response]:
+        start = time.perf_counter()
+        try:
+            response = self.http.request(method, f"{self.args.target}{url}", timeout=self.args.request_timeout, **kwargs)
+            status = response.status_code
+        except requests.RequestException:
+            response, status = None, 0
+        latency_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.samples.setdefault(endpoint, []).append((latency_ms, status))
+        return response
+
+    def run_session(self) -> None:
+        """One user: upload, optional preview, generate, poll until done."""
+        options = random_options()
+        started = time.time()
+
+        response = self._call("POST /api/upload-audio", "POST", "/api/upload-audio",
+                              files={"file": ("track.mp3", self.audio_bytes, "audio/mpeg")})
+        if response is None or response.status_code != 200:
+            return
+        audio_url = response.json()["audio_url"]
+
+        if random.random() < self.args.preview_ratio:
+            self._call("POST /api/prompt/preview", "POST", "/api/prompt/preview",
+                       json={**options, "force_gemini": random.random() < self.args.gemini_ratio})
+
+        response = self._call("POST /api/generate", "POST", "/api/generate", json={**options, "audio_url": audio_url})
+        if response is None or response.status_code != 200:
+            with self._lock:
+                self.jobs.append({"status": "rejected", "code": getattr(response, "status_code", 0)})
+            return
+        job_id = response.json()["job_id"]
+
+        status = "unknown"
+        deadline = time.time() + self.args.job_timeout
+        while time.time() < deadline and not self._stop.is_set():
+            time.sleep(self.args.poll_interval)
+            response = self._call("GET /api/result/{job_id}", "GET", f"/api/result/{job_id}")
+            if response is not None and response.status_code == 200:
+                status = response.json().get("status")
+                if status in TERMINAL_STATUSES:
+                    break
+
+        with self._lock:
+            self.jobs.append({"job_id": job_id, "status": status, "e2e_s": time.time() - started, "finished_at": time.time()})
+
+    def sample_memory(self) -> None:
+        while not self._stop.is_set():
+            if self.args.server_pid:
+                rss = _process_tree_rss_kb(self.args.server_pid)
+                with self._lock:
+                    self.rss_samples.append(rss)
+            self._stop.wait(1.0)
+
+    def run(self) -> dict:
+        memory_thread = threading.Thread(target=self.sample_memory, daemon=True)
+        memory_thread.start()
+
+        start = time.time()
+        sessions = 0
+        with ThreadPoolExecutor(max_workers=self.args.max_sessions) as pool:
+            futures = []
+            next_arrival = start
+            while time.time() - start < self.args.duration:
+                # Poisson arrivals at the target session rate
+                next_arrival += random.expovariate(self.args.rate)
+                time.sleep(max(0.0, next_arrival - time.time()))
+                futures.append(pool.submit(self.run_session))
+                sessions += 1
+            logger.info(f"Arrivals finished ({sessions} sessions), draining in-flight sessions...")
+            for future in futures:
+                future.result()
+        elapsed = time.time() - start
+
+        self._stop.set()
+        memory_thread.join(timeout=2)
+        return self.report(elapsed, sessions)
+
+    def report(self, elapsed: float, sessions: int) -> dict:
+        endpoints = {}
+        total_requests = 0
+        for endpoint, samples in sorted(self.samples.items()):
+            latencies = [latency for latency, _ in samples]
+            codes = {}
+            for _, code in samples:
+                codes[str(code)] = codes.get(str(code), 0) + 1
+            total_requests += len(samples)
+            endpoints[endpoint] = {
+                "rps": round(len(samples) / elapsed, 3),
+                "status_codes": codes,
+                "latency_ms": percentiles(latencies),
+            }
+
+        statuses = {}
+        for job in self.jobs:
+            statuses[job["status"]] = statuses.get(job["status"], 0) + 1
+        completed = [job for job in self.jobs if job["status"] == "complete"]
+
+        # Accept-path latency target, ignoring the first requests while the instance warms up
+        generate_latencies = [latency for latency, _ in self.samples.get("POST /api/generate", [])]
+        warm = percentiles(generate_latencies[self.args.warmup_requests:])
+        slo = {
+            "generate_p99_ms": warm.get("p99"),
+            "target_ms": self.args.generate_p99_target_ms,
+            "met": warm.get("p99") is not None and warm["p99"] < self.args.generate_p99_target_ms,
+        }
+
+        return {
+            "config": {k: v for k, v in vars(self.args).items() if k != "out"},
+            "elapsed_s": round(elapsed, 1),
+            "sessions": sessions,
+            "throughput_rps": round(total_requests / elapsed, 3),
+            "jobs": {
+                "statuses": statuses,
+                "completed_per_minute": round(len(completed) / (elapsed / 60), 3),
+                "e2e_s": percentiles([job["e2e_s"] for job in completed]),
+            },
+            "endpoints": endpoints,
+            "slo": slo,
+            "memory_mb": {
+                "peak": round(max(self.rss_samples) / 1024, 1) if self.rss_samples else None,
+                "mean": round(statistics.fmean(self.rss_samples) / 1024, 1) if self.rss_samples else None,
+            },
+        }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Kapsule Studio load-test driver")
+    parser.add_argument("--target", default="http://127.0.0.1:8000")
+    parser.add_argument("--rate", type=float, default=0.2, help="New user sessions per second")
+    parser.add_argument("--duration", type=float, default=300, help="Seconds of arrivals (in-flight sessions are drained)")
+    parser.add_argument("--audio", required=True, help="Audio file uploaded by every session")
+    parser.add_argument("--preview-ratio", type=float, default=0.7, help="Fraction of sessions that preview first")
+    parser.add_argument("--gemini-ratio", type=float, default=0.5, help="Fraction of previews that force Gemini")
+    parser.add_argument("--poll-interval", type=float, default=3.0, help="Status poll interval (the frontend uses 3s)")
+    parser.add_argument("--job-timeout", type=float, default=900)
+    parser.add_argument("--request-timeout", type=float, default=60)
+    parser.add_argument("--max-sessions", type=int, default=512, help="Upper bound on concurrent sessions")
+    parser.add_argument("--server-pid", type=int, default=None, help="PID of the API server for memory sampling")
+    parser.add_argument("--generate-p99-target-ms", type=float, default=20, help="Latency target for POST /api/generate")
+    parser.add_argument("--warmup-requests", type=int, default=5, help="Generate requests left out of the target check")
+    parser.add_argument("--out", default=None, help="Write the JSON report here")
+    return parser
+
+
+def main(argv=None) -> dict:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    report = LoadDriver(args).run()
+    print(json.dumps(report, indent=2))
+    if not report["slo"]["met"]:
+        logger.warning(f"POST /api/generate p99 {report['slo']['generate_p99_ms']} ms misses the {args.generate_p99_target_ms} ms target")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Wrote report to {args.out}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""
+Minimal in-memory Google Cloud Storage stand-in for load tests.
+
+Implements the subset of the GCS JSON API that google-cloud-storage uses in this
+service: multipart and resumable uploads, media downloads, object metadata
+get/patch, paged listing, deletion and storage-class rewrites. Point clients at it with
+STORAGE_EMULATOR_HOST=http://127.0.0.1:<port>.
+
+Usage:
+    python -m loadtest.fake_gcs --port 9200 --seed my-bucket/veo-temp/clip.mp4=/path/to/clip.mp4
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import threading
+import uuid
+from datetime import datetime
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+logger = logging.getLogger(__name__)
+
+
+class ObjectStore:
+    """Thread-safe in-memory bucket/object store."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._objects = {}  # (bucket, name) -> {"data": bytes, "metadata": dict}
+        self._uploads = {}  # upload_id -> {"bucket", "name", "metadata", "data": bytearray}
+
+    def put(self, bucket: str, name: str, data: bytes, metadata: dict = None) -> dict:
+        now = datetime.utcnow().isoformat() + "Z"
+        resource = {
+            "kind": "storage#object",
+            "bucket": bucket,
+            "name": name,
+            "id": f"{bucket}/{name}/1",
+            "generation": "1",
+            "metageneration": "1",
+            "size": str(len(data)),
+            "contentType": "application/octet-stream",
+            "md5Hash": base64.b64encode(hashlib.md5(data).digest()).decode(),
+            "storageClass": "STANDARD",
+            "timeCreated": now,
+            "updated": now,
+        }
+        resource.update({k: v for k, v in (metadata or {}).items() if k not in ("name", "bucket", "size")})
+        with self._lock:
+            self._objects[(bucket, name)] = {"data": bytes(data), "metadata": resource}
+        return resource
+
+    def get(self, bucket: str, name: str):
+        with self._lock:
+            return self._objects.get((bucket, name))
+
+    def patch(self, bucket: str, name: str, metadata: dict):
+        with self._lock:
+            obj = self._objects.get((bucket, name))
+            if obj is None:
+                return None
+            obj["metadata"].update(metadata)
+            obj["metadata"]["metageneration"] = str(int(obj["metadata"]["metageneration"]) + 1)
+            return obj["metadata"]
+
+    def delete(self, bucket: str, name: str) -> bool:
+        with self._lock:
+            return self._objects.pop((bucket, name), None) is not None
+
+    def list(self, bucket: str, prefix: str = "") -> list:
+        with self._lock:
+            return sorted(
+                (obj["metadata"] for (b, n), obj in self._objects.items() if b == bucket and n.startswith(prefix)),
+                key=lambda m: m["name"]
+            )
+
+    def start_upload(self, bucket: str, name: str, metadata: dict) -> str:
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self._uploads[upload_id] = {"bucket": bucket, "name": name, "metadata": metadata, "data": bytearray()}
+        return upload_id
+
+    def append_upload(self, upload_id: str, chunk: bytes, final: bool):
+        with self._lock:
+            upload = self._uploads.get(upload_id)
+            if upload is None:
+                return None, 0
+            upload["data"].extend(chunk)
+            size = len(upload["data"])
+            if not final:
+                return None, size
+            del self._uploads[upload_id]
+        return self.put(upload["bucket"], upload["name"], bytes(upload["data"]), upload["metadata"]), size
+
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(len(obj["data"]) for obj in self._objects.values())
+
+
+class FakeGCSHandler(BaseHTTPRequestHandler):
+    store: ObjectStore = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _send_json(self, status: int, body: dict, headers: dict = None) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _not_found(self) -> None:
+        self._send_json(404, {"error": {"code": 404, "message": "Not Found"}})
+
+    def _read_body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    @staticmethod
+    def _split_path(path: str, prefix: str):
+        """Parse '<prefix>/b/<bucket>/o[/<name>]' into (bucket, name)."""
+        rest = path[len(prefix):].lstrip("/")
+        parts = rest.split("/", 3)
+        if len(parts) < 3 or parts[0] != "b" or parts[2] != "o":
+            return None, None
+        return parts[1], unquote(parts[3]) if len(parts) == 4 else None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+
+        if url.path.startswith("/download/storage/v1/"):
+            bucket, name = self._split_path(url.path, "/download/storage/v1")
+            obj = self.store.get(bucket, name) if name else None
+            if obj is None:
+                return self._not_found()
+            self.send_response(200)
+            self.send_header("Content-Type", obj["metadata"].get("contentType", "application/octet-stream"))
+            self.send_header("Content-Length", str(len(obj["data"])))
+            self.send_header("X-Goog-Hash", f"md5={obj['metadata']['md5Hash']}")
+            self.end_headers()
+            self.wfile.write(obj["data"])
+            return
+
+        if url.path.startswith("/storage/v1/"):
+            bucket, name = self._split_path(url.path, "/storage/v1")
+            if bucket is None:
+                return self._not_found()
+            if name is None:
+                items = self.store.list(bucket, query.get("prefix", [""])[0])
+                page_token = query.get("pageToken", [""])[0]
+                if page_token:
+                    items = [item for item in items if item["name"] > page_token]
+                page_size = int(query.get("maxResults", ["1000"])[0])
+                response = {"kind": "storage#objects", "items": items[:page_size]}
+                if len(items) > page_size:
+                    response["nextPageToken"] = items[page_size - 1]["name"]
+                return self._send_json(200, response)
+            obj = self.store.get(bucket, name)
+            if obj is None:
+                return self._not_found()
+            if query.get("alt", [""])[0] == "media":
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(obj["data"])))
+                self.end_headers()
+                self.wfile.write(obj["data"])
+                return
+            return self._send_json(200, obj["metadata"])
+
+        self._not_found()
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        body = self._read_body()
+
+        if url.path.startswith("/storage/v1/") and "/rewriteTo/" in url.path:
+            return self._rewrite(url.path, body)
+
+        if not url.path.startswith("/upload/storage/v1/"):
+            return self._not_found()
+
+        bucket, _ = self._split_path(url.path, "/upload/storage/v1")
+        upload_type = query.get("uploadType", [""])[0]
+
+        if upload_type == "multipart":
+            message = BytesParser(policy=HTTP).parsebytes(
+                f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body
+            )
+            parts = list(message.iter_parts())
+            metadata = json.loads(parts[0].get_content())
+            data = parts[1].get_payload(decode=True) or b""
+            if parts[1].get_content_type():
+                metadata.setdefault("contentType", parts[1].get_content_type())
+            name = metadata.get("name") or query.get("name", [""])[0]
+            return self._send_json(200, self.store.put(bucket, name, data, metadata))
+
+        if upload_type == "resumable":
+            metadata = json.loads(body) if body else {}
+            name = metadata.get("name") or query.get("name", [""])[0]
+            upload_id = self.store.start_upload(bucket, name, metadata)
+            host = self.headers.get("Host")
+            location = f"http://{host}/upload/storage/v1/b/{quote(bucket)}/o?uploadType=resumable&upload_id={upload_id}"
+            return self._send_json(200, {}, headers={"Location": location})
+
+        if upload_type == "media":
+            name = query.get("name", [""])[0]
+            return self._send_json(200, self.store.put(bucket, name, body, {"contentType": self.headers.get("Content-Type")}))
+
+        self._send_json(400, {"error": {"code": 400, "message": f"Unsupported uploadType: {upload_type}"}})
+
+    def _rewrite(self, path: str, body: bytes):
+        """
+        Rewrite '.../o/<name>/rewriteTo/b/<bucket>/o/<name>': in place (how
+        Blob.update_storage_class works) or a copy to another name (Blob.rewrite).
+        """
+        source, _, destination = path.partition("/rewriteTo/")
+        bucket, name = self._split_path(source, "/storage/v1")
+        dest_bucket, dest_name = self._split_path("/" + destination, "")
+        obj = self.store.get(bucket, name) if name else None
+        if obj is None:
+            return self._not_found()
+        metadata = json.loads(body) if body else {}
+        if (dest_bucket, dest_name) != (bucket, name):
+            copied = {k: v for k, v in obj["metadata"].items() if k in ("contentType", "storageClass")}
+            copied.update({k: v for k, v in metadata.items() if k in ("contentType", "storageClass")})
+            resource = self.store.put(dest_bucket, dest_name, obj["data"], copied)
+        else:
+            resource = self.store.patch(bucket, name, {k: v for k, v in metadata.items() if k == "storageClass"})
+        size = resource["size"]
+        self._send_json(200, {
+            "kind": "storage#rewriteResponse",
+            "totalBytesRewritten": size,
+            "objectSize": size,
+            "done": True,
+            "resource": resource,
+        })
+
+    def do_PUT(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        upload_id = query.get("upload_id", [""])[0]
+        body = self._read_body()
+
+        # Content-Range: bytes START-END/TOTAL (final once END reaches TOTAL) or bytes START-END/* (more to come)
+        content_range = self.headers.get("Content-Range", "")
+        span, _, total = content_range.rpartition("/")
+        final = total != "*"
+        if final and "-" in span:
+            final = int(span.rsplit("-", 1)[1]) + 1 >= int(total)
+        resource, size = self.store.append_upload(upload_id, body, final)
+
+        if resource is not None:
+            return self._send_json(200, resource)
+        if size == 0 and not body and not final:
+            return self._not_found()
+        self.send_response(308)
+        self.send_header("Range", f"bytes=0-{size - 1}")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_PATCH(self):
+        url = urlparse(self.path)
+        bucket, name = self._split_path(url.path, "/storage/v1")
+        body = self._read_body()
+        metadata = self.store.patch(bucket, name, json.loads(body) if body else {})
+        if metadata is None:
+            return self._not_found()
+        self._send_json(200, metadata)
+
+    def do_DELETE(self):
+        url = urlparse(self.path)
+        bucket, name = self._split_path(url.path, "/storage/v1")
+        if not self.store.delete(bucket, name):
+            return self._not_found()
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+def create_server(host: str = "127.0.0.1", port: int = 9200, store: ObjectStore = None) -> ThreadingHTTPServer:
+    """Create (but do not start) a fake GCS server bound to host:port."""
+    handler = type("BoundFakeGCSHandler", (FakeGCSHandler,), {"store": store or ObjectStore()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="In-memory fake GCS server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9200)
+    parser.add_argument("--seed", action="append", default=[], help="bucket/object/path=local_file (repeatable)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    server = create_server(args.host, args.port)
+    for seed in args.seed:
+        target, local_path = seed.split("=", 1)
+        bucket, name = target.split("/", 1)
+        with open(local_path, "rb") as f:
+            server.RequestHandlerClass.store.put(bucket, name, f.read(), {"contentType": "video/mp4"})
+        logger.info(f"Seeded gs://{bucket}/{name} from {local_path}")
+
+    logger.info(f"Fake GCS listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+"""
+Fake Vertex AI endpoint for load tests.
+
+Implements the calls this service makes:
+  - POST .../models/<model>:predictLongRunning    (Veo submit)
+  - POST .../models/<model>:fetchPredictOperation  (Veo poll)
+  - POST .../models/<model>:generateContent       (Gemini prompt enhancer)
+  - POST .../models/<model>:streamGenerateContent (streamed preview, SSE; the
+    Gemini latency is the time to the first chunk)
+
+Latencies and error rates are configurable per call, and can be overridden per
+location (the region in the request path) to simulate a slow or failing region.
+Operations are only found when polled in the location they were started in, as
+on Vertex. Completed Veo operations point at a pre-seeded clip in the (fake) GCS
+bucket. Point the API at it with VERTEX_API_ENDPOINT=http://127.0.0.1:<port>.
+
+Latency specs: "fixed:S", "uniform:LO,HI" or "lognormal:MEDIAN,SIGMA" (seconds).
+
+Usage:
+    python -m loadtest.fake_vertex --port 9100 --clip-uri gs://bucket/veo-temp/clip.mp4 \\
+        --veo-run lognormal:60,0.3 --gemini-latency lognormal:1.5,0.4 --submit-error-rate 0.02 \\
+        --region us-central1:veo_run=lognormal:180,0.3 --region europe-west4:submit_error_rate=1
+"""
+
+import argparse
+import json
+import logging
+import math
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+
+def parse_latency(spec: str):
+    """Turn a latency spec string into a zero-argument sampler returning seconds."""
+    kind, _, params = spec.partition(":")
+    values = [float(v) for v in params.split(",") if v]
+    if kind == "fixed":
+        return lambda: values[0]
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1])
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda: random.lognormvariate(math.log(median), sigma)
+    raise ValueError(f"Unknown latency spec: {spec}")
+
+
+LATENCY_SETTINGS = ("submit_latency", "poll_latency", "veo_run", "gemini_latency", "gemini_chunk_interval")
+RATE_SETTINGS = ("submit_error_rate", "operation_error_rate", "poll_error_rate", "gemini_error_rate")
+
+
+def parse_region_override(spec: str):
+    """Turn "LOCATION:SETTING=VALUE" into (location, setting, sampler or rate)."""
+    location, _, assignment = spec.partition(":")
+    setting, _, value = assignment.partition("=")
+    if setting in LATENCY_SETTINGS:
+        return location, setting, parse_latency(value)
+    if setting in RATE_SETTINGS:
+        return location, setting, float(value)
+    raise ValueError(f"Unknown region setting in {spec!r} (one of {', '.join(LATENCY_SETTINGS + RATE_SETTINGS)})")
+
+
+def path_location(path: str) -> str:
+    """The location segment of a Vertex resource path ('' if there is none)."""
+    _, _, rest = path.partition("/locations/")
+    return rest.split("/", 1)[0]
+
+
+class FakeVertexState:
+    """Operation table and counters shared by all handler threads."""
+
+    def __init__(self, args):
+        self.clip_uri = args.clip_uri
+        self.submit_latency = parse_latency(args.submit_latency)
+        self.poll_latency = parse_latency(args.poll_latency)
+        self.veo_run = parse_latency(args.veo_run)
+        self.gemini_latency = parse_latency(args.gemini_latency)
+        self.gemini_chunk_interval = parse_latency(args.gemini_chunk_interval)
+        self.submit_error_rate = args.submit_error_rate
+        self.operation_error_rate = args.operation_error_rate
+        self.poll_error_rate = args.poll_error_rate
+        self.gemini_error_rate = args.gemini_error_rate
+        self.region_overrides = {}  # location -> {setting: sampler or rate}
+        for spec in args.region or []:
+            location, setting, value = parse_region_override(spec)
+            self.region_overrides.setdefault(location, {})[setting] = value
+        self._lock = threading.Lock()
+        self.operations = {}  # operation name -> {"ready_at": float, "failed": bool, "cancelled": bool}
+        self.counters = {}
+
+    def setting(self, location: str, name: str):
+        """A latency sampler or error rate, as overridden for the location."""
+        return self.region_overrides.get(location, {}).get(name, getattr(self, name))
+
+    def count(self, key: str, location: str = "") -> None:
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+            if location:
+                self.counters[f"{location}/{key}"] = self.counters.get(f"{location}/{key}", 0) + 1
+
+
+class FakeVertexHandler(BaseHTTPRequestHandler):
+    state: FakeVertexState = None
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def _send_json(self, status: int, body: dict, headers: dict = None) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, kind: str, location: str = "") -> None:
+        # Mix quota errors (with Retry-After) and transient server errors
+        if random.random() < 0.5:
+            self.state.count(f"{kind}_429", location)
+            self._send_json(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED", "message": "Quota exceeded"}},
+                            headers={"Retry-After": "2"})
+        else:
+            self.state.count(f"{kind}_503", location)
+            self._send_json(503, {"error": {"code": 503, "status": "UNAVAILABLE", "message": "Service unavailable"}})
+
+    def do_GET(self):
+        if self.path == "/stats":
+            return self._send_json(200, {"counters": self.state.counters, "operations": len(self.state.operations)})
+        self._send_json(404, {"error": {"code": 404, "message": "Not Found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = json.loads(self.rfile.read(length) or b"{}")
+        path = self.path.split("?", 1)[0]
+        model_path, _, method = path.rpartition(":")
+
+        if method == "predictLongRunning":
+            return self._predict_long_running(model_path)
+        if method == "fetchPredictOperation":
+            return self._fetch_operation(path_location(model_path), body.get("operationName", ""))
+        if method == "generateContent":
+            return self._generate_content(path_location(model_path), body)
+        if method == "streamGenerateContent":
+            return self._stream_generate_content(path_location(model_path), body)
+        if method == "cancel":
+            return self._cancel_operation(model_path.split('/v1/', 1)[-1].lstrip('/'))
+        self._send_json(404, {"error": {"code": 404, "message": f"Unknown method: {method}"}})
+
+    def _predict_long_running(self, model_path: str) -> None:
+        location = path_location(model_path)
+        time.sleep(self.state.setting(location, "submit_latency")())
+        if random.random() < self.state.setting(location, "submit_error_rate"):
+            return self._send_error("submit", location)
+
+        # Same shape as Vertex: projects/P/locations/L/publishers/google/models/M/operations/ID
+        operation_name = f"{model_path.split('/v1/', 1)[-1].lstrip('/')}/operations/{uuid.uuid4()}"
+        self.state.operations[operation_name] = {
+            "ready_at": time.time() + self.state.setting(location, "veo_run")(),
+            "failed": random.random() < self.state.setting(location, "operation_error_rate"),
+        }
+        self.state.count("submit_200", location)
+        self._send_json(200, {"name": operation_name})
+
+    def _fetch_operation(self, location: str, operation_name: str) -> None:
+        time.sleep(self.state.setting(location, "poll_latency")())
+        if random.random() < self.state.setting(location, "poll_error_rate"):
+            return self._send_error("poll", location)
+
+        operation = self.state.operations.get(operation_name)
+        if operation is None or path_location(operation_name) != location:
+            # Operations only exist in the region they were started in
+            self.state.count("poll_404", location)
+            return self._send_json(404, {"error": {"code": 404, "message": "Operation not found"}})
+
+        self.state.count("poll_200", location)
+        if operation.get("cancelled"):
+            return self._send_json(200, {"name": operation_name, "done": True,
+                                         "error": {"code": 1, "message": "Operation cancelled"}})
+        if time.time() < operation["ready_at"]:
+            return self._send_json(200, {"name": operation_name, "done": False})
+        if operation["failed"]:
+            return self._send_json(200, {"name": operation_name, "done": True,
+                                         "error": {"code": 3, "message": "Simulated generation failure"}})
+        self._send_json(200, {
+            "name": operation_name,
+            "done": True,
+            "response": {"videos": [{"gcsUri": self.state.clip_uri, "mimeType": "video/mp4"}]},
+        })
+
+    def _cancel_operation(self, operation_name: str) -> None:
+        operation = self.state.operations.get(operation_name)
+        if operation is None:
+            self.state.count("cancel_404")
+            return self._send_json(404, {"error": {"code": 404, "message": "Operation not found"}})
+        operation["cancelled"] = True
+        self.state.count("cancel_200")
+        self._send_json(200, {})
+
+    @staticmethod
+    def _enhanced_prompt(body: dict) -> str:
+        parts = body.get("contents", [{}])[0].get("parts", [])
+        base_prompt = parts[2].get("text", "") if len(parts) > 2 else ""
+        return f"Cinematic vertical 9:16 music video. {base_prompt}"
+
+    def _generate_content(self, location: str, body: dict) -> None:
+        time.sleep(self.state.setting(location, "gemini_latency")())
+        if random.random() < self.state.setting(location, "gemini_error_rate"):
+            return self._send_error("gemini", location)
+
+        self.state.count("gemini_200", location)
+        self._send_json(200, {
+            "candidates": [{"content": {"role": "model", "parts": [{"text": self._enhanced_prompt(body)}]}}]
+        })
+
+    def _stream_generate_content(self, location: str, body: dict) -> None:
+        time.sleep(self.state.setting(location, "gemini_latency")())
+        if random.random() < self.state.setting(location, "gemini_error_rate"):
+            return self._send_error("gemini_stream", location)
+
+        self.state.count("gemini_stream_200", location)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        words = self._enhanced_prompt(body).split(" ")
+        for i in range(0, len(words), 4):
+            if i:
+                time.sleep(self.state.setting(location, "gemini_chunk_interval")())
+            text = " ".join(words[i:i + 4]) + (" " if i + 4 < len(words) else "")
+            chunk = {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\r\n\r\n".encode())
+            self.wfile.flush()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Fake Vertex AI (Veo + Gemini) server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--clip-uri", required=True, help="gs:// URI returned for completed Veo operations")
+    parser.add_argument("--submit-latency", default="lognormal:0.8,0.3")
+    parser.add_argument("--poll-latency", default="lognormal:0.15,0.3")
+    parser.add_argument("--veo-run", default="lognormal:60,0.3", help="Time from submit until the operation is done")
+    parser.add_argument("--gemini-latency", default="lognormal:1.5,0.4")
+    parser.add_argument("--gemini-chunk-interval", default="fixed:0.05", help="Gap between streamed Gemini chunks")
+    parser.add_argument("--submit-error-rate", type=float, default=0.0)
+    parser.add_argument("--operation-error-rate", type=float, default=0.0)
+    parser.add_argument("--poll-error-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--region", action="append", metavar="LOCATION:SETTING=VALUE",
+                        help="Override a latency or error rate setting for one location (repeatable)")
+    return parser
+
+
+def create_server(args) -> ThreadingHTTPServer:
+    """Create (but do not start) a fake Vertex server from parsed arguments."""
+    handler = type("BoundFakeVertexHandler", (FakeVertexHandler,), {"state": FakeVertexState(args)})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main(argv=None) -> None:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    server = create_server(args)
+    logger.info(f"Fake Vertex listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Self-contained load test: fake Vertex + fake GCS + in-memory job store + the real API.
+
+Starts the stand-ins in-process, seeds a synthetic Veo clip into the fake bucket,
+launches `uvicorn main:app` against them (optionally pinned to N CPUs to mimic the
+Cloud Run `--cpu` setting), runs the traffic driver and prints its report.
+
+Jobs are stored in the in-memory job store (JOB_STORE=memory) unless
+FIRESTORE_EMULATOR_HOST is set in the environment, in which case the Firestore
+emulator is used; JOB_STORE=sqlite can be passed with --api-env.
+
+Usage (from kapsule-studio-api/):
+    python -m loadtest.run --rate 0.2 --duration 300 --cpus 2 --out loadtest-report.json
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+
+from benchmarks.synthetic import ensure_audio, ensure_veo_clip
+from loadtest import driver, fake_gcs, fake_vertex
+
+logger = logging.getLogger(__name__)
+
+BUCKET = "kapsule-loadtest"
+CLIP_OBJECT = "veo-temp/synthetic/sample_0.mp4"
+
+
+def _wait_for(url: str, timeout: float = 60) -> None:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(url, timeout=2).status_code < 500:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError(f"Timed out waiting for {url}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Run a local end-to-end load test")
+    parser.add_argument("--api-port", type=int, default=8765)
+    parser.add_argument("--vertex-port", type=int, default=9100)
+    parser.add_argument("--gcs-port", type=int, default=9200)
+    parser.add_argument("--cpus", type=int, default=None, help="Pin the API to this many CPUs (taskset)")
+    parser.add_argument("--inputs", default=os.path.join("/tmp", "kapsule-bench-inputs"))
+    parser.add_argument("--audio-track", default="mp3_15s")
+    parser.add_argument("--veo-poll-interval", type=float, default=10)
+    parser.add_argument("--api-env", action="append", default=[], help="Extra KEY=VALUE for the API process")
+    # Fake Vertex behaviour (see loadtest/fake_vertex.py)
+    parser.add_argument("--veo-run", default="lognormal:60,0.3")
+    parser.add_argument("--gemini-latency", default="lognormal:1.5,0.4")
+    parser.add_argument("--submit-error-rate", type=float, default=0.0)
+    parser.add_argument("--operation-error-rate", type=float, default=0.0)
+    parser.add_argument("--gemini-error-rate", type=float, default=0.0)
+    parser.add_argument("--region", action="append", default=[], help="Per-location override, LOCATION:SETTING=VALUE")
+    args, driver_argv = parser.parse_known_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    clip_path = ensure_veo_clip(args.inputs)
+    audio_path = ensure_audio(args.inputs, args.audio_track)
+
+    # Fake GCS with the synthetic Veo clip pre-seeded
+    gcs_server = fake_gcs.create_server(port=args.gcs_port)
+    with open(clip_path, "rb") as f:
+        gcs_server.RequestHandlerClass.store.put(BUCKET, CLIP_OBJECT, f.read(), {"contentType": "video/mp4"})
+    threading.Thread(target=gcs_server.serve_forever, daemon=True).start()
+
+    vertex_args = fake_vertex.build_parser().parse_args([
+        "--port", str(args.vertex_port),
+        "--clip-uri", f"gs://{BUCKET}/{CLIP_OBJECT}",
+        "--veo-run", args.veo_run,
+        "--gemini-latency", args.gemini_latency,
+        "--submit-error-rate", str(args.submit_error_rate),
+        "--operation-error-rate", str(args.operation_error_rate),
+        "--gemini-error-rate", str(args.gemini_error_rate),
+    ] + [option for spec in args.region for option in ("--region", spec)])
+    vertex_server = fake_vertex.create_server(vertex_args)
+    threading.Thread(target=vertex_server.serve_forever, daemon=True).start()
+
+    env = dict(os.environ)
+    env.update({
+        "VERTEX_API_ENDPOINT": f"http://127.0.0.1:{args.vertex_port}",
+        "STORAGE_EMULATOR_HOST": f"http://127.0.0.1:{args.gcs_port}",
+        "GCS_BUCKET_NAME": BUCKET,
+        "GCP_PROJECT_ID": "kapsule-loadtest",
+        "GOOGLE_CLOUD_PROJECT": "kapsule-loadtest",
+        "NO_GCE_CHECK": "True",  # Skip the metadata-server probe when credentials are absent
+        "VEO_POLL_INTERVAL_SECONDS": str(args.veo_poll_interval),
+        "USE_GEMINI_PROMPT_ENHANCER": "true",
+        "JOB_STORE": "firestore" if os.getenv("FIRESTORE_EMULATOR_HOST") else "memory",
+    })
+    for item in args.api_env:
+        key, value = item.split("=", 1)
+        env[key] = value
+
+    command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(args.api_port)]
+    if args.cpus and shutil.which("taskset"):
+        command = ["taskset", "-c", f"0-{args.cpus - 1}", *command]
+
+    api_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    api_process = subprocess.Popen(command, cwd=api_dir, env=env)
+    try:
+        _wait_for(f"http://127.0.0.1:{args.api_port}/readyz")  # After warmup, like a Cloud Run startup probe
+        driver.main([
+            "--target", f"http://127.0.0.1:{args.api_port}",
+            "--audio", audio_path,
+            "--server-pid", str(api_process.pid),
+            *driver_argv,
+        ])
+    finally:
+        api_process.terminate()
+        try:
+            api_process.wait(timeout=15)
+        except subprocess.TimeoutExpired:
+            api_process.kill()
+        gcs_server.shutdown()
+        vertex_server.shutdown()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,62 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import hashlib
+import hmac
+import json
 import logging
 import os
+import random
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from uuid import uuid4
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import Optional
+from typing import Dict, List, Optional
 import config
 from services.storage_service import StorageService
-from services.firestore_service import FirestoreService
+from services.clip_library import ClipLibrary
+from services.compactor import Compactor
+from services.job_store import (
+    IdempotencyKeyConflict,
+    InvalidCursor,
+    JobFilter,
+    JOB_STATUSES,
+    JOB_SUMMARY_FIELDS,
+    TERMINAL_STATUSES,
+    create_job_store,
+)
 from services.veo_service import VeoService
+from services import prompt_enhancer
 from services.prompt_enhancer import build_enhanced_prompt
 from services.gemini_service import GeminiService
-from utils.video_utils import merge_audio_video, cleanup_temp_files
+from utils.video_utils import (
+    merge_audio_video,
+    merge_audio_video_hls,
+    remux_hls_to_mp4,
+    create_preview,
+    warm_up_ffmpeg,
+    ENCODE_ARGS,
+    HLS_PLAYLIST_NAME,
+)
+from utils import metrics, profiling, tracing
+from utils.admission import JobAdmission, QueueFullError
+from utils.cancellation import CancelToken, JobCancelled, cancel_scope
+from utils.job_stats import JobStats, TimingLedger, add_file_bytes, ledger_scope, retry_after_ms
+from utils.scratch import ScratchFullError, ScratchManager, estimate_job_bytes
+from utils.logging_config import configure_logging, job_context, shutdown_logging
+from utils.tracing import SpanContext, pipeline_stage, run_in_context
+from utils.ttl_cache import TTLCache
+from utils.warmup import Warmup
 
 # Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 # Initialize FastAPI app
@@ -40,15 +79,248 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins,
     allow_credentials=True,
-    allow_methods=["GET", "POST", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization"],
+    allow_methods=["GET", "POST", "DELETE", "OPTIONS"],
+    allow_headers=["Content-Type", "Authorization", "traceparent", "Idempotency-Key"],
+    expose_headers=["traceparent", "Retry-After", "X-Queue-Length"],
 )
 
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Open a server span per request, continuing the caller's trace if it sent a traceparent."""
+    parent = SpanContext.from_traceparent(request.headers.get("traceparent"))
+    with tracing.span(f"{request.method} {request.url.path}", parent=parent, **{
+        "http.method": request.method,
+        "http.target": request.url.path,
+    }) as server_span:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        if route is not None:
+            server_span.set_attribute("http.route", route.path)
+        server_span.set_attribute("http.status_code", response.status_code)
+        if server_span.context.sampled:
+            response.headers["traceparent"] = server_span.context.to_traceparent()
+        return response
+
+
+@app.on_event("startup")
+async def start_warmup():
+    """Warm credentials, clients, connections and FFmpeg in the background; /readyz waits for it."""
+    if not config.WARMUP_ENABLED:
+        warmup.skip()
+        return
+    asyncio.get_running_loop().run_in_executor(None, warmup.run)
+
+
+@app.on_event("startup")
+async def start_resource_monitor():
+    """Sample per-job RSS and FFmpeg usage while the profiling endpoints are enabled."""
+    if config.PROFILING_ENABLED and not config.ADMIN_TOKEN:
+        logger.warning("PROFILING_ENABLED is set but ADMIN_TOKEN is empty; profiling stays off")
+    if _admin_enabled:
+        profiling.monitor.start()
+
+
+@app.on_event("startup")
+async def start_scratch_sweeper():
+    """Sweep scratch dirs left by a crashed or killed instance, then keep sweeping periodically."""
+    metrics.SCRATCH_ORPHANS_SWEPT_TOTAL.inc(scratch.sweep(config.SCRATCH_ORPHAN_MAX_AGE_SECONDS))
+    
+    async def sweep_periodically():
+        while True:
+            await asyncio.sleep(config.SCRATCH_SWEEP_INTERVAL_SECONDS)
+            try:
+                swept = scratch.sweep(config.SCRATCH_ORPHAN_MAX_AGE_SECONDS)
+                metrics.SCRATCH_ORPHANS_SWEPT_TOTAL.inc(swept)
+            except Exception as e:
+                logger.warning(f"Scratch sweep failed: {e}")
+    
+    asyncio.create_task(sweep_periodically())
+
+
+@app.on_event("startup")
+async def start_job_recovery():
+    """Periodically take over jobs orphaned by instances that died mid-run."""
+    if config.JOB_RECOVERY_INTERVAL_SECONDS <= 0:
+        return
+    
+    async def recover_periodically():
+        while True:
+            try:
+                await _recover_expired_jobs()
+            except Exception as e:
+                logger.warning(f"Job recovery failed: {e}")
+            await asyncio.sleep(config.JOB_RECOVERY_INTERVAL_SECONDS)
+    
+    asyncio.create_task(recover_periodically())
+
+
+@app.on_event("startup")
+async def start_compactor():
+    """Periodically clean up veo-temp clips, old uploads and stuck jobs (see services/compactor.py)."""
+    if config.COMPACT_INTERVAL_SECONDS <= 0:
+        return
+    
+    async def compact_periodically():
+        # Random first run so instances started together don't all compact at once
+        await asyncio.sleep(random.uniform(0, config.COMPACT_INTERVAL_SECONDS))
+        while True:
+            try:
+                await asyncio.to_thread(compactor.run)
+            except Exception as e:
+                logger.warning(f"Compaction failed: {e}")
+            await asyncio.sleep(config.COMPACT_INTERVAL_SECONDS)
+    
+    asyncio.create_task(compact_periodically())
+
+
+@app.on_event("startup")
+async def start_clip_library():
+    """Periodically stock the clip library for instant mode (see services/clip_library.py)."""
+    if not config.LIBRARY_ENABLED or config.LIBRARY_INTERVAL_SECONDS <= 0:
+        return
+    
+    async def stock_periodically():
+        await asyncio.sleep(random.uniform(0, config.LIBRARY_INTERVAL_SECONDS))
+        while True:
+            try:
+                report = await asyncio.to_thread(library.run)
+                logger.info(f"Clip library run: {report}")
+            except Exception as e:
+                logger.warning(f"Clip library run failed: {e}")
+            await asyncio.sleep(config.LIBRARY_INTERVAL_SECONDS)
+    
+    asyncio.create_task(stock_periodically())
+
+
+@app.on_event("shutdown")
+def flush_telemetry():
+    job_store.flush(timeout=10)  # Job documents still in the write-behind queue
+    tracing.flush()
+    shutdown_logging()
+
+
 # Initialize services
 storage_service = StorageService()
-firestore_service = FirestoreService()
+job_store = create_job_store()
 veo_service = VeoService()
+compactor = Compactor(job_store, storage_service.bucket)
 gemini_service = GeminiService()
+scratch = ScratchManager(config.SCRATCH_DIR, config.SCRATCH_LIMIT_BYTES)
+admission = JobAdmission(config.VEO_WAIT_SLOTS, config.ENCODE_SLOTS, config.ADMISSION_QUEUE_SIZE)
+stats = JobStats()
+# Stocking backs off while jobs wait for a Veo slot here
+library = ClipLibrary(job_store, storage_service.bucket, veo_service, busy=lambda: admission.queue_length() > 0)
+
+# Blocking pipeline work (Veo polling, FFmpeg, GCS/Firestore calls) runs here, off the event loop
+_pipeline_executor = ThreadPoolExecutor(
+    max_workers=config.VEO_WAIT_SLOTS + config.ENCODE_SLOTS + 4,
+    thread_name_prefix="pipeline"
+)
+
+
+async def _in_thread(func, *args, **kwargs):
+    """
+    Run a blocking call on the pipeline pool, keeping the caller's trace/log context.
+    
+    A thread can't be interrupted, so if the awaiting task is cancelled this waits
+    for the call to return (a cancelled job's calls return promptly) before
+    propagating; cleanup then never races a thread still using the job's files.
+    """
+    context = contextvars.copy_context()
+    future = asyncio.get_running_loop().run_in_executor(
+        _pipeline_executor, functools.partial(context.run, func, *args, **kwargs)
+    )
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait([future])
+        if not future.cancelled():
+            future.exception()  # Retrieve it so it isn't reported as unhandled
+        raise
+
+# Local job bookkeeping for metrics (mutated only on the event loop)
+_job_states = {}  # job_id -> "queued" | "processing"
+
+# Jobs accepted by this instance that can still be cancelled here
+_cancel_tokens = {}  # job_id -> CancelToken
+_job_tasks = {}  # job_id -> asyncio.Task running the workflow
+_workflow_tasks = set()  # Strong references to running process_video_generation tasks
+
+
+def _jobs_by_state() -> dict:
+    counts = {"queued": 0, "processing": 0}
+    for state in list(_job_states.values()):
+        counts[state] = counts.get(state, 0) + 1
+    return counts
+
+
+def _seed_job_stats(max_jobs: int) -> None:
+    """Load the timing ledgers of recently completed jobs into the rolling stats."""
+    seen = recorded = 0
+    cursor = None
+    while seen < max_jobs:
+        jobs, cursor = job_store.list_jobs(
+            JobFilter(status="complete", created_after=datetime.utcnow() - timedelta(seconds=stats.window_seconds)),
+            limit=min(200, max_jobs - seen),
+            cursor=cursor,
+            fields=("timings", "completedAt", "genre", "visualStyle", "duration")
+        )
+        seen += len(jobs)
+        recorded += stats.seed(jobs)
+        if cursor is None:
+            break
+    logger.info(f"Job stats seeded with {recorded} recently completed jobs")
+
+
+metrics.JOBS_IN_FLIGHT.set_callback(_jobs_by_state)
+metrics.TMP_BYTES_IN_USE.set_callback(scratch.usage_bytes)
+metrics.SCRATCH_RESERVED_BYTES.set_callback(scratch.reserved_bytes)
+metrics.SLOTS_IN_USE.set_callback(lambda: {
+    ("veo_wait",): len(admission.veo.active),
+    ("encode",): len(admission.encode.active),
+})
+metrics.JOB_QUEUE_LENGTH.set_callback(admission.queue_length)
+metrics.JOB_WRITES_PENDING.set_callback(job_store.pending_writes)
+metrics.VEO_SCHEDULER_WAITING.set_callback(veo_service.scheduler.waiting_by_lane)
+metrics.VEO_OPERATIONS_IN_FLIGHT.set_callback(veo_service.scheduler.operations_in_flight)
+metrics.CIRCUIT_BREAKER_STATE.set_callback(lambda: {
+    **gemini_service.breaker.state_by_label(),
+    **veo_service.router.breaker_states(),
+    **gemini_service.router.breaker_states(),
+})
+metrics.REGION_LATENCY_SECONDS.set_callback(lambda: {
+    **veo_service.router.latency_by_region(),
+    **gemini_service.router.latency_by_region(),
+})
+
+# First-request costs paid at startup, off the request path (see /readyz)
+warmup = Warmup(config.WARMUP_TIMEOUT_SECONDS)
+warmup.add("veo", veo_service.warm_up)
+warmup.add("gemini", gemini_service.warm_up)
+warmup.add("gcs", storage_service.warm_up)
+warmup.add("job_store", lambda: job_store.list_jobs(limit=1))
+warmup.add("ffmpeg", warm_up_ffmpeg)
+warmup.add("prompt_tables", prompt_enhancer.warm_up)
+warmup.add("job_stats", lambda: _seed_job_stats(config.STATS_SEED_JOBS))
+metrics.WARMUP_STEP_SECONDS.set_callback(warmup.step_seconds)
+
+
+def _iso_timestamp(epoch_seconds: float) -> str:
+    return datetime.fromtimestamp(epoch_seconds, timezone.utc).isoformat()
+
+
+def _epoch_seconds(value: datetime) -> float:
+    # Job documents store naive UTC datetimes (utcnow)
+    return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
+
+
+def _iso_datetime(value: Optional[datetime]) -> Optional[str]:
+    # Job documents store naive UTC datetimes (utcnow)
+    if value is None:
+        return None
+    return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).isoformat()
 
 
 # Request/Response Models
@@ -73,6 +345,9 @@ class GenerateRequest(BaseModel):
     extra: str
     audio_url: str
     prompt: Optional[str] = None  # Optional: if not provided, built from options
+    preview_token: Optional[str] = None  # From /api/prompt/preview: use the previewed prompt (ignored if 'prompt' is set)
+    mode: Optional[str] = None  # "instant": use a pre-rendered clip library clip when one is stocked
+    user_id: Optional[str] = None  # Client-chosen ID for instant mode's no-repeat rule (defaults to the client IP, see _client_ip)
 
 
 class AudioUploadResponse(BaseModel):
@@ -83,6 +358,38 @@ class AudioUploadResponse(BaseModel):
 class GenerateResponse(BaseModel):
     """Response model for generate endpoint."""
     job_id: str
+    status: str = "queued"
+    queue_position: Optional[int] = None  # 1 = next to start on this instance
+    estimated_start_at: Optional[str] = None  # ISO 8601 UTC
+    instant: Optional[bool] = None  # Instant mode only: whether a library clip was used (else a normal render)
+
+
+class BatchGenerateRequest(BaseModel):
+    """Request model for batch generation: several tracks, or prompt variants of one track."""
+    jobs: List[GenerateRequest]
+
+
+class BatchGenerateResponse(BaseModel):
+    """Response model for batch generate endpoint."""
+    batch_id: str
+    job_ids: List[str]  # In request order
+    status: str = "queued"
+
+
+class BatchJobStatus(BaseModel):
+    job_id: str
+    status: str
+    video_url: Optional[str] = None
+    error: Optional[str] = None
+
+
+class BatchStatusResponse(BaseModel):
+    """Response model for batch status: aggregate status plus one entry per job."""
+    batch_id: str
+    status: str  # queued, processing, complete, partial (some jobs failed), error or cancelled
+    total: int
+    counts: Dict[str, int]  # Jobs per status
+    jobs: List[BatchJobStatus]
 
 
 class PromptPreviewRequest(BaseModel):
@@ -104,94 +411,475 @@ class PromptPreviewRequest(BaseModel):
 class PromptPreviewResponse(BaseModel):
     enhanced_prompt: str
     source: str  # 'gemini' | 'rule_fallback'
+    preview_token: Optional[str] = None  # Pass to /api/generate to generate with exactly this prompt
 
 
 class JobStatusResponse(BaseModel):
     """Response model for job status."""
     status: str
     video_url: Optional[str] = None
+    playlist_url: Optional[str] = None  # HLS playlist, available once the first segments exist
+    preview_url: Optional[str] = None  # Low-resolution preview clip, available right after Veo finishes
+    thumbnail_url: Optional[str] = None  # Poster frame JPEG, available right after Veo finishes
+    queue_position: Optional[int] = None  # While queued on the instance that accepted the job
+    estimated_start_at: Optional[str] = None  # ISO 8601 UTC, while queued
+    veo_queue: Optional[dict] = None  # Veo scheduler state while processing: state, lane, position/retry_at
+    estimated_completion_at: Optional[str] = None  # ISO 8601 UTC, while queued or processing (once enough jobs have completed)
+    retry_after_ms: Optional[int] = None  # Suggested delay before the next poll, while queued or processing
     error: Optional[str] = None
 
 
+class JobSummary(BaseModel):
+    """One job in a listing; only the requested fields are present."""
+    job_id: str
+    status: Optional[str] = None
+    createdAt: Optional[str] = None  # ISO 8601 UTC
+    completedAt: Optional[str] = None  # ISO 8601 UTC
+    genre: Optional[str] = None
+    duration: Optional[str] = None
+    priority: Optional[str] = None
+    batch_id: Optional[str] = None
+    attempts: Optional[int] = None
+    video_url: Optional[str] = None
+    error: Optional[str] = None
+
+
+class JobListResponse(BaseModel):
+    """Response model for job listings: one page, newest first."""
+    jobs: List[JobSummary]
+    next_cursor: Optional[str] = None  # Pass as ?cursor= for the next page; None on the last page
+
+
+class ResultBatchRequest(BaseModel):
+    job_ids: List[str]
+
+
+class ResultBatchResponse(BaseModel):
+    """Response model for batched status reads."""
+    results: Dict[str, JobStatusResponse]  # By job ID
+    missing: List[str]  # Job IDs that don't exist
+
+
+def _publish_preview(job_id: str, veo_video_path: str, audio_path: str, job_scratch) -> None:
+    """
+    Build the poster frame and low-resolution preview clip, upload them and store
+    their URLs on the job. Failures are logged and never affect the main render.
+    """
+    thumbnail_path = job_scratch.file("thumb.jpg")
+    preview_path = job_scratch.file("preview.mp4")
+    
+    try:
+        with pipeline_stage("preview"):
+            if not create_preview(veo_video_path, audio_path, thumbnail_path, preview_path, seconds=config.PREVIEW_SECONDS):
+                return
+            
+            thumbnail_uri = storage_service.upload_preview(thumbnail_path, f"thumb_{job_id}.jpg")
+            preview_uri = storage_service.upload_preview(preview_path, f"preview_{job_id}.mp4")
+        
+        job_store.update_job(job_id, {
+            "thumbnail_url": storage_service.get_signed_url(thumbnail_uri, expiration=3600),
+            "preview_url": storage_service.get_signed_url(preview_uri, expiration=3600),
+        })
+        logger.info(f"[Job {job_id}] Early preview published")
+    except Exception as e:
+        logger.warning(f"[Job {job_id}] Early preview failed: {e}")
+
+
+def _render_hls(job_id: str, veo_video_path: str, audio_path: str, final_video_path: str, job_scratch) -> None:
+    """
+    Render the job as HLS, publishing segments to GCS while FFmpeg is still encoding.
+    
+    The playlist URL is stored on the job as soon as the first media segment is
+    uploaded. Once packaging finishes, the segments are remuxed (no re-encode)
+    into `final_video_path` so the downloadable MP4 stays available.
+    """
+    hls_dir = job_scratch.file("hls")
+    playlist_published = False
+    
+    def publish(new_files: list, playlist_path: str) -> None:
+        nonlocal playlist_published
+        
+        with pipeline_stage("segment_upload"):
+            # Upload segments before the playlist that references them
+            for path in new_files:
+                storage_service.upload_hls_file(path, job_id)
+            
+            # The final callback carries no new files and the playlist now has EXT-X-ENDLIST
+            playlist_uri = storage_service.upload_hls_file(playlist_path, job_id, live=bool(new_files))
+        
+        if not playlist_published and any(path.endswith(".m4s") for path in new_files):
+            playlist_url = storage_service.get_signed_url(playlist_uri, expiration=3600)
+            job_store.update_job(job_id, {"playlist_url": playlist_url})
+            playlist_published = True
+            logger.info(f"[Job {job_id}] First HLS segments available: {playlist_url}")
+    
+    if not merge_audio_video_hls(
+        veo_video_path,
+        audio_path,
+        hls_dir,
+        segment_seconds=config.HLS_SEGMENT_SECONDS,
+        on_update=publish,
+        check=job_scratch.check  # Kills FFmpeg once the job's output goes over its scratch budget
+    ):
+        raise Exception("Failed to package video and audio as HLS")
+    
+    if not remux_hls_to_mp4(os.path.join(hls_dir, HLS_PLAYLIST_NAME), final_video_path, check=job_scratch.check):
+        raise Exception("Failed to remux HLS output to MP4")
+
+
+def _cancel_local_job(job_id: str) -> bool:
+    """
+    Stop a job running on this instance: wake its blocking calls, kill its FFmpeg
+    processes and interrupt any slot or scratch-space wait.
+    
+    Returns:
+        Whether the job was running on this instance
+    """
+    token = _cancel_tokens.get(job_id)
+    if token is None:
+        return False
+    if not token.cancelled:
+        token.cancel()
+        task = _job_tasks.get(job_id)
+        if task is not None:
+            task.cancel()
+    return True
+
+
+def _stop_finished_run(job_id: str) -> None:
+    """
+    End this run of a job the job store refused to move on: the job has finished
+    (cancelled or failed while the run was busy) or another instance has claimed
+    it. The run stops like a cancelled one and leaves the stored job alone.
+    
+    Raises:
+        JobCancelled: Always
+    """
+    token = _cancel_tokens.get(job_id)
+    if token is not None:
+        token.cancel()  # Kills any FFmpeg process the run still has
+    raise JobCancelled(f"Job {job_id} has finished or moved to another instance")
+
+
+async def _job_heartbeat(job_id: str, token: CancelToken) -> None:
+    """
+    Renew the job's lease while it runs here, and stop the local workflow once the
+    lease can't be renewed: the job was cancelled (DELETE may reach another
+    instance) or failed, or another instance has claimed it.
+    """
+    while not token.cancelled:
+        try:
+            renewed = await _in_thread(job_store.renew_lease, job_id, config.WORKER_ID, config.JOB_LEASE_SECONDS)
+        except Exception as e:
+            logger.warning(f"[Job {job_id}] Lease renewal failed: {e}")
+        else:
+            if not renewed:
+                logger.info(f"[Job {job_id}] Job finished or was claimed elsewhere, stopping the local run")
+                _cancel_local_job(job_id)
+                return
+        
+        await asyncio.sleep(config.JOB_HEARTBEAT_SECONDS)
+
+
+def _checkpoint(job_id: str, fields: dict) -> None:
+    """Record a stage's durable output on the job so a resumed run can skip the stage."""
+    try:
+        job_store.update_job(job_id, fields)
+    except Exception as e:
+        logger.warning(f"[Job {job_id}] Checkpoint {sorted(fields)} failed: {e}")
+
+
+def _admit_job(job_id: str) -> dict:
+    """Register a job accepted (or taken over) by this instance; returns its queue info."""
+    _job_states[job_id] = "queued"
+    _cancel_tokens[job_id] = CancelToken(job_id)
+    return admission.admit(job_id)
+
+
+def _start_workflow(job_id: str, request_data: dict) -> None:
+    """
+    Run a job's workflow in the background, detached from the request that started it.
+    
+    Not a BackgroundTasks entry: those keep the HTTP exchange open until they
+    return (the tracing middleware waits for them), which would stall the next
+    request on the same keep-alive connection for the whole render.
+    """
+    task = asyncio.create_task(process_video_generation(job_id, request_data))
+    _workflow_tasks.add(task)
+    task.add_done_callback(_workflow_tasks.discard)
+
+
 # Background task for video generation workflow
 async def process_video_generation(job_id: str, request_data: dict):
+    """
+    Run the generation workflow as a "pipeline" span in the trace of the request that created it.
+    
+    The workflow runs as its own task so a cancellation can interrupt it wherever it waits.
+    """
+    parent = SpanContext.from_traceparent(request_data.get("trace_parent"))
+    token = _cancel_tokens.setdefault(job_id, CancelToken(job_id))
+    ledger = TimingLedger(f"{config.OUTPUT_MODE}/{ENCODE_ARGS['vcodec']}-{ENCODE_ARGS['preset']}")
+    with (
+        tracing.span("pipeline", parent=parent, job_id=job_id),
+        job_context(job_id),
+        cancel_scope(token),
+        ledger_scope(ledger),
+        profiling.monitor.job(ledger)
+    ):
+        task = asyncio.create_task(_run_video_generation(job_id, request_data, token, ledger))
+        _job_tasks[job_id] = task
+        try:
+            await task
+        except asyncio.CancelledError:
+            if not token.cancelled:
+                raise
+            # Cancelled before the workflow started running
+            admission.forget(job_id)
+            _job_states.pop(job_id, None)
+        finally:
+            _job_tasks.pop(job_id, None)
+            _cancel_tokens.pop(job_id, None)
+
+
+async def _run_video_generation(job_id: str, request_data: dict, token: CancelToken, ledger: TimingLedger):
     """
     Background task that handles the complete video generation workflow.
     
     Steps:
-    1. Update job status to "processing"
-    2. Generate video with Veo
-    3. Download audio from GCS
-    4. Merge video and audio with FFmpeg
-    5. Upload final video to GCS
-    6. Update job status to "complete" with video URL
+    1-5. Render the video and upload it to GCS (see _render_video)
+    6. Generate the video URL
+    7. Update job status to "complete" with video URL and the run's timing
+       ledger, and add the ledger to the rolling job stats
+    
+    While the job runs, its lease is renewed (see _job_heartbeat). A run that
+    resumes a job taken over from a dead instance (request_data is then the job
+    document) skips every stage whose checkpoint is already recorded.
+    
+    If the job is cancelled, whichever step is running stops and the job keeps its
+    "cancelled" status. Status changes are refused once the job has finished
+    (see JobStore.update_job_status); the run then stops the same way.
     """
-    temp_files = []
+    outcome = "error"
+    heartbeat = None
     
     try:
+        token.check()
         logger.info(f"[Job {job_id}] Starting video generation workflow")
+        if config.JOB_HEARTBEAT_SECONDS > 0:
+            heartbeat = asyncio.create_task(_job_heartbeat(job_id, token))
         
-        # Step 1: Update status to processing
-        firestore_service.update_job_status(job_id, "processing")
+        video_gcs_uri = request_data.get("final_video_uri")
+        if video_gcs_uri:
+            logger.info(f"[Job {job_id}] Final video already uploaded by an earlier run: {video_gcs_uri}")
+        else:
+            video_gcs_uri = await _render_video(job_id, request_data, ledger)
         
-        # Step 2: Generate video with Veo (always use 8s - max supported)
-        logger.info(f"[Job {job_id}] Calling Veo service...")
-        veo_video_path = veo_service.generate_video(
-            prompt=request_data["prompt"],
-            duration="8s",  # Always use 8s (max supported by Veo), FFmpeg will loop to match audio
-            job_id=job_id
-        )
-        temp_files.append(veo_video_path)
+        # Step 6: Generate signed URL
+        logger.info(f"[Job {job_id}] Generating signed URL...")
+        video_url = await _in_thread(storage_service.get_signed_url, video_gcs_uri, expiration=3600)
+        
+        # Step 7: Update job status to complete
+        token.check()
+        if heartbeat is not None:
+            heartbeat.cancel()  # So no lease renewal lands after the final status
+        timings = ledger.to_dict()
+        with pipeline_stage("firestore_write"):
+            completed = await _in_thread(
+                job_store.update_job_status,
+                job_id,
+                "complete",
+                video_url=video_url,
+                timings=timings
+            )
+        if not completed:
+            _stop_finished_run(job_id)
+        stats.record(request_data, timings)
+        
+        outcome = "complete"
+        logger.info(f"[Job {job_id}] Video generation workflow completed successfully!")
+        
+    except asyncio.CancelledError:
+        if not token.cancelled:
+            raise
+        outcome = "cancelled"
+        logger.info(f"[Job {job_id}] Workflow cancelled")
+    
+    except Exception as e:
+        if heartbeat is not None:
+            heartbeat.cancel()
+        if token.cancelled:
+            # Whatever the interrupted step raised, the job is cancelled, not failed
+            outcome = "cancelled"
+            logger.info(f"[Job {job_id}] Workflow cancelled ({type(e).__name__})")
+        else:
+            error_msg = str(e)
+            logger.error(f"[Job {job_id}] Workflow failed: {error_msg}", exc_info=True)
+            
+            # Update job status to error
+            with pipeline_stage("firestore_write"):
+                await _in_thread(
+                    job_store.update_job_status,
+                    job_id,
+                    "error",
+                    error=error_msg,
+                    timings=ledger.to_dict()
+                )
+    
+    finally:
+        if heartbeat is not None:
+            heartbeat.cancel()
+        admission.forget(job_id)
+        _job_states.pop(job_id, None)
+        metrics.PIPELINE_JOBS_TOTAL.inc(outcome=outcome)
+        tracing.current_span().set_attribute("outcome", outcome)
+
+
+async def _render_video(job_id: str, request_data: dict, ledger: TimingLedger) -> str:
+    """
+    Produce the final video and upload it, checkpointing durable outputs on the job.
+    
+    Steps:
+    0. Wait for a Veo slot and reserve scratch space (the job stays "queued" meanwhile)
+    1. Update job status to "processing"
+    2. Download audio from GCS
+    3. Generate video with Veo (then publish an early preview in the background);
+       checkpoints: veo_operation, veo_clip_uri
+    4. Merge video and audio with FFmpeg (holding an encode slot)
+    5. Upload final video to GCS; checkpoint: final_video_uri
+    
+    Blocking work runs on the pipeline thread pool so the event loop stays responsive.
+    
+    Returns:
+        GCS URI of the final video
+    """
+    preview_thread = None
+    
+    try:
+        async with admission.veo_slot(job_id, needed=not request_data.get("veo_clip_uri")):
+            # Step 0: Reserve scratch space, deferring while other renders hold it
+            job_scratch = await scratch.acquire(
+                job_id,
+                estimate_job_bytes(request_data.get("duration")),
+                timeout=config.SCRATCH_ACQUIRE_TIMEOUT_SECONDS
+            )
+            _job_states[job_id] = "processing"
+            
+            # Step 1: Update status to processing, unless the job finished or was
+            # claimed by another instance while it waited here (resumed runs too)
+            with pipeline_stage("firestore_write"):
+                started = await _in_thread(job_store.start_job, job_id, config.WORKER_ID, config.JOB_LEASE_SECONDS)
+            if not started:
+                _stop_finished_run(job_id)
+            ledger.processing_started = time.time()
+            
+            # Step 2: Download audio from GCS (first, so the preview can start as soon as Veo lands)
+            logger.info(f"[Job {job_id}] Downloading audio from GCS...")
+            audio_path = job_scratch.file("audio.mp3")
+            with pipeline_stage("audio_download"):
+                await _in_thread(storage_service.download_file, request_data["audio_url"], audio_path)
+            add_file_bytes("audio", audio_path)
+            
+            # Step 3: Generate video with Veo (always use 8s - max supported)
+            logger.info(f"[Job {job_id}] Calling Veo service...")
+            veo_video_path = await _in_thread(
+                veo_service.generate_video,
+                prompt=request_data["prompt"],
+                duration="8s",  # Always use 8s (max supported by Veo), FFmpeg will loop to match audio
+                job_id=job_id,
+                output_path=job_scratch.file("veo.mp4"),
+                priority=request_data.get("priority"),
+                resume=request_data,
+                checkpoint=functools.partial(_checkpoint, job_id)
+            )
+            add_file_bytes("veo_clip", veo_video_path)
         
-        # Step 3: Download audio from GCS
-        logger.info(f"[Job {job_id}] Downloading audio from GCS...")
-        audio_path = f"/tmp/audio_{job_id}.mp3"
-        storage_service.download_file(request_data["audio_url"], audio_path)
-        temp_files.append(audio_path)
+        if config.ENABLE_EARLY_PREVIEW:
+            preview_thread = threading.Thread(
+                target=run_in_context(_publish_preview, job_id, veo_video_path, audio_path, job_scratch),
+                daemon=True
+            )
+            preview_thread.start()
         
         # Step 4: Merge video and audio
-        logger.info(f"[Job {job_id}] Merging video and audio with FFmpeg...")
-        final_video_path = f"/tmp/final_{job_id}.mp4"
-        merge_success = merge_audio_video(veo_video_path, audio_path, final_video_path)
+        final_video_path = job_scratch.file("final.mp4")
         
-        if not merge_success:
-            raise Exception("Failed to merge video and audio")
+        async with admission.encode_slot(job_id):
+            if config.OUTPUT_MODE == "hls":
+                logger.info(f"[Job {job_id}] Packaging video and audio as HLS with FFmpeg...")
+                await _in_thread(_render_hls, job_id, veo_video_path, audio_path, final_video_path, job_scratch)
+            else:
+                logger.info(f"[Job {job_id}] Merging video and audio with FFmpeg...")
+                merge_success = await _in_thread(
+                    merge_audio_video,
+                    veo_video_path,
+                    audio_path,
+                    final_video_path,
+                    check=job_scratch.check  # Kills FFmpeg once the job's output goes over its scratch budget
+                )
+                
+                if not merge_success:
+                    raise Exception("Failed to merge video and audio")
         
-        temp_files.append(final_video_path)
+        job_scratch.check()
+        add_file_bytes("video", final_video_path)
         
         # Step 5: Upload final video to GCS
         logger.info(f"[Job {job_id}] Uploading final video to GCS...")
         final_filename = f"final_{job_id}.mp4"
-        video_gcs_uri = storage_service.upload_video(final_video_path, final_filename)
+        with pipeline_stage("upload"):
+            video_gcs_uri = await _in_thread(storage_service.upload_video, final_video_path, final_filename)
+        await _in_thread(_checkpoint, job_id, {"final_video_uri": video_gcs_uri})
         
-        # Step 6: Generate signed URL
-        logger.info(f"[Job {job_id}] Generating signed URL...")
-        video_url = storage_service.get_signed_url(video_gcs_uri, expiration=3600)
+        return video_gcs_uri
+    
+    finally:
+        # The preview reads the same inputs, so let it finish before deleting them
+        if preview_thread is not None:
+            await _in_thread(preview_thread.join, 30)
         
-        # Step 7: Update job status to complete
-        firestore_service.update_job_status(
+        # Clean up temporary files
+        logger.info(f"[Job {job_id}] Cleaning up temporary files...")
+        scratch.release(job_id)
+
+
+async def _recover_expired_jobs() -> int:
+    """
+    Take over jobs whose instance stopped renewing their lease, and resume them
+    from their last checkpoint. Stops early once the local queue is full.
+    
+    Returns:
+        Number of jobs resumed
+    """
+    resumed = 0
+    for job_id in await _in_thread(job_store.find_expired_leases):
+        if job_id in _cancel_tokens:
+            continue
+        try:
+            admission.check_capacity()
+        except QueueFullError:
+            break
+        
+        job_data = await _in_thread(
+            job_store.claim_job,
             job_id,
-            "complete",
-            video_url=video_url
+            config.WORKER_ID,
+            config.JOB_LEASE_SECONDS,
+            config.JOB_MAX_ATTEMPTS
         )
+        if job_data is None:
+            continue
         
-        logger.info(f"[Job {job_id}] Video generation workflow completed successfully!")
-        
-    except Exception as e:
-        error_msg = str(e)
-        logger.error(f"[Job {job_id}] Workflow failed: {error_msg}", exc_info=True)
-        
-        # Update job status to error
-        firestore_service.update_job_status(
-            job_id,
-            "error",
-            error=error_msg
+        checkpoint = next(
+            (name for name in ("final_video_uri", "veo_clip_uri", "veo_operation") if job_data.get(name)),
+            "none"
         )
-    
-    finally:
-        # Clean up temporary files
-        logger.info(f"[Job {job_id}] Cleaning up temporary files...")
-        cleanup_temp_files(*temp_files)
+        logger.info(f"[Job {job_id}] Resuming job from checkpoint: {checkpoint}", extra={"job_id": job_id})
+        metrics.JOBS_RESUMED_TOTAL.inc(checkpoint=checkpoint)
+        
+        _admit_job(job_id)
+        _start_workflow(job_id, job_data)
+        resumed += 1
+    return resumed
 
 
 # API Endpoints
@@ -201,28 +889,56 @@ async def root():
     return {
         "status": "healthy",
         "service": "Kapsule Studio API",
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "circuit_breakers": {"gemini": gemini_service.breaker.snapshot()},  # Open: previews use the rule-based prompt
+        "regions": {"veo": veo_service.router.snapshot(), "gemini": gemini_service.router.snapshot()}  # In routing order
     }
 
 
+@app.get("/readyz")
+async def readyz(response: Response):
+    """
+    Readiness check: 503 until startup warmup has finished, then 200.
+    
+    Reports each warmup step's outcome and duration in ms.
+    """
+    status = warmup.status()
+    if not status["ready"]:
+        response.status_code = 503
+    return status
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus scrape endpoint (text exposition format)."""
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
 # Simple in-memory rate limit for preview (per-process, per-IP)
 _preview_hits = {}
 
+# Gemini previews by options, shared by the blocking and streaming endpoints
+_preview_cache = TTLCache("prompt_preview", config.PROMPT_PREVIEW_CACHE_SIZE, config.PROMPT_PREVIEW_CACHE_TTL_SECONDS)
 
-@app.post("/api/prompt/preview", response_model=PromptPreviewResponse)
-async def preview_prompt(request: PromptPreviewRequest, x_forwarded_for: Optional[str] = None):
+# Previews handed out, by preview token: {"prompt", "source", "options"}
+_preview_tokens = TTLCache("preview_token", config.PREVIEW_TOKEN_CACHE_SIZE, config.PREVIEW_TOKEN_TTL_SECONDS)
+
+
+def _check_preview_rate_limit(x_forwarded_for: Optional[str]) -> None:
     # Rate limit: 20/min per IP
-    from time import time
-    now = int(time())
+    now = int(time.time())
     window = now // 60
     ip = (x_forwarded_for or "local").split(",")[0].strip()
     key = f"{ip}:{window}"
     _preview_hits[key] = _preview_hits.get(key, 0) + 1
     if _preview_hits[key] > 20:
+        metrics.RATE_LIMIT_REJECTIONS_TOTAL.inc(endpoint="/api/prompt/preview")
         raise HTTPException(status_code=429, detail="Too many preview requests. Please wait a minute and try again.")
 
-    # Build base prompt using our rule-based builder
-    base_prompt = build_enhanced_prompt(
+
+def _preview_base_prompt(request: PromptPreviewRequest) -> str:
+    """Build the base prompt using our rule-based builder."""
+    return build_enhanced_prompt(
         genre=request.genre,
         mood=request.mood,
         visual_style=request.visualStyle,
@@ -236,21 +952,203 @@ async def preview_prompt(request: PromptPreviewRequest, x_forwarded_for: Optiona
         extra=request.extra
     )
 
+
+def _preview_cache_key(request: PromptPreviewRequest) -> str:
+    options = request.model_dump(exclude={"force_gemini"})
+    return hashlib.sha256(json.dumps([config.GEMINI_MODEL, options], sort_keys=True).encode()).hexdigest()
+
+
+def _issue_preview_token(request: PromptPreviewRequest, prompt: str, source: str) -> Optional[str]:
+    """Remember a preview so /api/generate can reuse its prompt; returns the token (None if tokens are off)."""
+    if config.PREVIEW_TOKEN_CACHE_SIZE <= 0:
+        return None
+    token = secrets.token_urlsafe(16)
+    _preview_tokens.set(token, {
+        "prompt": prompt,
+        "source": source,
+        "options": request.model_dump(exclude={"force_gemini"}),
+    })
+    return token
+
+
+def _apply_preview_token(request: GenerateRequest) -> Optional[str]:
+    """
+    Generate with the prompt a preview returned, so the job matches what the user saw.
+    
+    The token is ignored (and the prompt rebuilt) when a custom prompt was given,
+    when it expired or was issued by another instance, or when the options changed
+    since the preview.
+    
+    Returns:
+        The preview's source ('gemini' | 'rule_fallback') if its prompt is used, else None
+    """
+    if request.prompt or not request.preview_token:
+        return None
+    preview = _preview_tokens.get(request.preview_token)
+    if preview is None:
+        logger.info("Preview token unknown or expired, building the prompt from options")
+        return None
+    if request.model_dump(include=set(preview["options"])) != preview["options"]:
+        logger.info("Options changed since the preview, building the prompt from options")
+        return None
+    request.prompt = preview["prompt"]
+    logger.info(f"Using the previewed prompt ({preview['source']})", extra={"prompt_chars": len(request.prompt)})
+    return preview["source"]
+
+
+def _observe_preview(mode: str, source: str, first_token_seconds: float, total_seconds: float) -> None:
+    metrics.PROMPT_PREVIEW_SECONDS.observe(first_token_seconds, mode=mode, phase="first_token", source=source)
+    metrics.PROMPT_PREVIEW_SECONDS.observe(total_seconds, mode=mode, phase="total", source=source)
+
+
+@app.post("/api/prompt/preview", response_model=PromptPreviewResponse)
+async def preview_prompt(request: PromptPreviewRequest, x_forwarded_for: Optional[str] = None):
+    _check_preview_rate_limit(x_forwarded_for)
+    start = time.perf_counter()
+    base_prompt = _preview_base_prompt(request)
+    response = PromptPreviewResponse(enhanced_prompt=base_prompt, source="rule_fallback")
+
     # Optionally call Gemini enhancer (if enabled in config OR force_gemini is True)
     if config.USE_GEMINI_PROMPT_ENHANCER or request.force_gemini:
+        cache_key = _preview_cache_key(request)
+        enhanced = _preview_cache.get(cache_key)
+        if enhanced is not None:
+            response = PromptPreviewResponse(enhanced_prompt=enhanced, source="gemini")
+        else:
+            try:
+                logger.info(f"Calling Gemini enhancer (force_gemini={request.force_gemini}, model={config.GEMINI_MODEL})")
+                options = request.model_dump()
+                enhanced = await asyncio.to_thread(gemini_service.enhance, base_prompt, options)
+                if enhanced:
+                    logger.info(f"Gemini enhancement successful, length={len(enhanced)}")
+                    _preview_cache.set(cache_key, enhanced)
+                    response = PromptPreviewResponse(enhanced_prompt=enhanced, source="gemini")
+                else:
+                    logger.warning("Gemini returned None/empty response")
+            except Exception as e:
+                logger.error(f"Gemini preview failed with exception: {e}", exc_info=True)
+
+    response.preview_token = _issue_preview_token(request, response.enhanced_prompt, response.source)
+    elapsed = time.perf_counter() - start
+    _observe_preview("blocking", response.source, elapsed, elapsed)
+    return response
+
+
+async def _gemini_preview_chunks(base_prompt: str, options: dict):
+    """
+    Gemini's streamed preview as an async generator, read on a worker thread.
+    
+    Raises asyncio.TimeoutError if no text arrives within
+    GEMINI_STREAM_FIRST_TOKEN_SECONDS. Once the consumer stops iterating, the
+    stream is closed after the chunk the thread is waiting on.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stop = threading.Event()
+    finished = object()
+    
+    def produce():
         try:
-            logger.info(f"Calling Gemini enhancer (force_gemini={request.force_gemini}, model={config.GEMINI_MODEL})")
-            options = request.model_dump()
-            enhanced = gemini_service.enhance(base_prompt, options)
-            if enhanced:
-                logger.info(f"Gemini enhancement successful, length={len(enhanced)}")
-                return PromptPreviewResponse(enhanced_prompt=enhanced, source="gemini")
-            else:
-                logger.warning("Gemini returned None/empty response")
+            for chunk in gemini_service.enhance_stream(base_prompt, options, stop=stop):
+                loop.call_soon_threadsafe(queue.put_nowait, chunk)
+            loop.call_soon_threadsafe(queue.put_nowait, finished)
         except Exception as e:
-            logger.error(f"Gemini preview failed with exception: {e}", exc_info=True)
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+    
+    loop.run_in_executor(None, contextvars.copy_context().run, produce)
+    try:
+        timeout = config.GEMINI_STREAM_FIRST_TOKEN_SECONDS
+        while True:
+            item = await asyncio.wait_for(queue.get(), timeout)
+            timeout = None  # Only the first token has a deadline
+            if item is finished:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
 
-    return PromptPreviewResponse(enhanced_prompt=base_prompt, source="rule_fallback")
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _stream_preview(request: PromptPreviewRequest, base_prompt: str):
+    start = time.perf_counter()
+    first_token = None
+    enhanced = None
+    
+    if config.USE_GEMINI_PROMPT_ENHANCER or request.force_gemini:
+        cache_key = _preview_cache_key(request)
+        enhanced = _preview_cache.get(cache_key)
+        if enhanced is not None:
+            first_token = time.perf_counter()
+            yield _sse("token", {"text": enhanced})
+        elif gemini_service.breaker.allow():
+            chunks = []
+            try:
+                async with contextlib.aclosing(_gemini_preview_chunks(base_prompt, request.model_dump())) as stream:
+                    async for chunk in stream:
+                        if first_token is None:
+                            first_token = time.perf_counter()
+                        chunks.append(chunk)
+                        yield _sse("token", {"text": chunk})
+                enhanced = "".join(chunks).strip() or None
+                if enhanced:
+                    _preview_cache.set(cache_key, enhanced)
+                    gemini_service.breaker.record_success(first_token - start)
+                else:
+                    logger.warning("Gemini preview stream returned no text")
+                    gemini_service.breaker.record_failure()
+            except asyncio.TimeoutError:
+                logger.warning(
+                    f"Gemini preview stream sent no text within {config.GEMINI_STREAM_FIRST_TOKEN_SECONDS}s, "
+                    "using the rule-based prompt"
+                )
+                gemini_service.breaker.record_failure()
+            except Exception as e:
+                logger.error(f"Gemini preview stream failed: {e}")
+                gemini_service.breaker.record_failure()
+                enhanced = None
+    
+    # After a fallback the client replaces any partial text with the rule-based prompt
+    source = "gemini" if enhanced else "rule_fallback"
+    end = time.perf_counter()
+    if first_token is None or source == "rule_fallback":
+        first_token = end
+    yield _sse("done", {
+        "enhanced_prompt": enhanced or base_prompt,
+        "source": source,
+        "preview_token": _issue_preview_token(request, enhanced or base_prompt, source),
+        "ttft_ms": round((first_token - start) * 1000, 1),
+        "total_ms": round((end - start) * 1000, 1),
+    })
+    _observe_preview("stream", source, first_token - start, end - start)
+    logger.info(
+        f"Prompt preview streamed ({source}): first text after {(first_token - start) * 1000:.0f} ms, "
+        f"complete after {(end - start) * 1000:.0f} ms"
+    )
+
+
+@app.post("/api/prompt/preview/stream")
+async def preview_prompt_stream(request: PromptPreviewRequest, x_forwarded_for: Optional[str] = None):
+    """
+    Streaming variant of /api/prompt/preview (server-sent events).
+    
+    Sends `token` events ({"text": ...}) as Gemini produces text, then one `done`
+    event with the full prompt, its source, and the time to first token and
+    total time in ms. When no text arrives within GEMINI_STREAM_FIRST_TOKEN_SECONDS,
+    the stream fails or the Gemini circuit breaker is open, `done` carries the
+    rule-based prompt (source 'rule_fallback') and replaces any partial text.
+    """
+    _check_preview_rate_limit(x_forwarded_for)
+    base_prompt = _preview_base_prompt(request)
+    return StreamingResponse(
+        _stream_preview(request, base_prompt),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @app.post("/api/upload-audio", response_model=AudioUploadResponse)
@@ -288,7 +1186,7 @@ async def upload_audio(file: UploadFile = File(...)):
         # Upload to GCS
         from io import BytesIO
         file_obj = BytesIO(file_contents)
-        audio_url = storage_service.upload_audio(file_obj, file.filename)
+        audio_url = await asyncio.to_thread(storage_service.upload_audio, file_obj, file.filename)
         
         logger.info(f"Successfully uploaded audio segment to: {audio_url}")
         
@@ -301,51 +1199,219 @@ async def upload_audio(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
 
+async def _existing_job_response(job_id: str) -> GenerateResponse:
+    """Answer a repeated Idempotency-Key with the job the first request created."""
+    metrics.IDEMPOTENT_REPLAYS_TOTAL.inc()
+    logger.info(f"Idempotency-Key matched existing job: {job_id}", extra={"job_id": job_id})
+    job_data = await asyncio.to_thread(job_store.get_job, job_id) or {}
+    response = GenerateResponse(job_id=job_id, status=job_data.get("status", "queued"))
+    queue_info = admission.queue_info(job_id)
+    if queue_info:
+        response.queue_position = queue_info["queue_position"]
+        response.estimated_start_at = _iso_timestamp(queue_info["estimated_start_at"])
+    return response
+
+
+def _fill_prompt(request: GenerateRequest) -> None:
+    """Build the enhanced prompt from the structured options unless a custom prompt was given."""
+    if not request.prompt:
+        logger.info("No custom prompt provided, building enhanced prompt from options")
+        enhanced_prompt = build_enhanced_prompt(
+            genre=request.genre,
+            mood=request.mood,
+            visual_style=request.visualStyle,
+            camera_movement=request.cameraMovement,
+            duration=request.duration,
+            lighting=request.lighting,
+            camera_type=request.cameraType,
+            creative_intensity=request.creativeIntensity,
+            subject=request.subject,
+            setting=request.setting,
+            extra=request.extra
+        )
+        request.prompt = enhanced_prompt
+        logger.info(f"Enhanced prompt: {enhanced_prompt[:150]}...", extra={"prompt_chars": len(enhanced_prompt)})
+    else:
+        logger.info(f"Using custom prompt: {request.prompt[:150]}...", extra={"prompt_chars": len(request.prompt)})
+
+
+def _caller_lane(authorization: Optional[str]) -> str:
+    """
+    Veo scheduler lane for the caller: the lane VEO_LANE_TOKENS maps its bearer
+    token to, else the lowest lane. Never taken from the request body.
+    """
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() == "bearer" and token:
+        for known_token, lane in config.VEO_LANE_TOKENS.items():
+            if hmac.compare_digest(token.encode(), known_token.encode()):
+                return veo_service.scheduler.lane_for(lane)
+    return veo_service.scheduler.lanes[-1]
+
+
+def _job_request_data(request: GenerateRequest, priority: str) -> dict:
+    """The request as stored on the job and handed to the pipeline."""
+    request_dict = request.model_dump()
+    request_dict["priority"] = priority
+    trace_context = tracing.current_context()
+    if trace_context is not None and trace_context.sampled:
+        # The pipeline runs after the response is sent, so hand it the trace explicitly
+        request_dict["trace_id"] = trace_context.trace_id
+        request_dict["trace_parent"] = trace_context.to_traceparent()
+    return request_dict
+
+
+def _client_ip(http_request: Request) -> str:
+    """
+    The caller's IP address. Behind Cloud Run's proxy the peer address is the
+    proxy, so the first X-Forwarded-For hop (the original client) wins.
+    """
+    forwarded_for = http_request.headers.get("x-forwarded-for", "").split(",")[0].strip()
+    if forwarded_for:
+        return forwarded_for
+    return http_request.client.host if http_request.client else ""
+
+
+async def _claim_library_clip(request: GenerateRequest, request_dict: dict, http_request: Request) -> bool:
+    """
+    Take a clip library clip for an instant-mode request; the job resumes from it as if Veo had run.
+    
+    Returns:
+        Whether a clip was found (False: the job renders normally)
+    """
+    if not config.LIBRARY_ENABLED:
+        return False
+    user = request.user_id or _client_ip(http_request)
+    try:
+        clip_uri = await asyncio.to_thread(library.claim, request_dict, user)
+    except Exception as e:
+        logger.warning(f"Clip library claim failed, rendering normally: {e}")
+        return False
+    if clip_uri is None:
+        return False
+    logger.info(f"Instant mode: using library clip {clip_uri}")
+    request_dict["veo_clip_uri"] = clip_uri
+    return True
+
+
+def _check_capacity(requests: List[GenerateRequest]) -> None:
+    """
+    Raise 429 when the local queue has no room for these jobs, 503 when jobs
+    already wait for scratch space and these would have to wait too.
+    """
+    try:
+        admission.check_capacity(len(requests))
+    except QueueFullError as e:
+        metrics.ADMISSION_REJECTIONS_TOTAL.inc(reason="queue_full")
+        raise HTTPException(
+            status_code=429,
+            detail=f"Too many videos are being generated right now. Please retry in {e.retry_after} seconds.",
+            headers={"Retry-After": str(e.retry_after), "X-Queue-Length": str(e.queue_length)}
+        )
+    needed_bytes = sum(estimate_job_bytes(request.duration) for request in requests)
+    if scratch.waiting + len(requests) > config.SCRATCH_MAX_DEFERRED_JOBS and not scratch.fits(needed_bytes):
+        metrics.ADMISSION_REJECTIONS_TOTAL.inc(reason="scratch_space")
+        raise HTTPException(
+            status_code=503,
+            detail="Server is busy rendering other videos. Please try again shortly.",
+            headers={"Retry-After": "30"}
+        )
+
+
 @app.post("/api/generate", response_model=GenerateResponse)
-async def generate_video(request: GenerateRequest, background_tasks: BackgroundTasks):
+async def generate_video(
+    request: GenerateRequest,
+    http_request: Request,
+    idempotency_key: Optional[str] = Header(None),
+    authorization: Optional[str] = Header(None)
+):
     """
     Start video generation job.
     
-    Creates a job in Firestore and triggers background task for video generation.
-    Returns the job ID for status polling.
+    Creates a job and triggers background task for video generation. The job ID is
+    generated locally and its document is written in the background, so this
+    returns without waiting on the job store. Returns the job ID for status polling.
+    
+    With an Idempotency-Key header, repeating the request (double-click, network
+    retry) returns the job the first request created instead of starting another.
+    Such requests write the key and the job document in one transaction before
+    responding, since only the job store can tell whether another instance took the key.
+    
+    With "mode": "instant" and no custom prompt, a pre-rendered clip for the same
+    options is taken from the clip library when one is stocked that this user
+    (user_id, else the first X-Forwarded-For hop) hasn't had before; the job then skips Veo and
+    goes straight to the merge. Otherwise it renders normally ("instant": false).
     """
     try:
-        logger.info(f"Received video generation request")
-        logger.info(f"  Genre: {request.genre}, Duration: {request.duration}")
-        logger.info(f"  Audio URL: {request.audio_url}")
+        if idempotency_key is not None and not 0 < len(idempotency_key) <= 255:
+            raise HTTPException(status_code=400, detail="Idempotency-Key must be 1-255 characters")
+        if request.mode not in (None, "instant"):
+            raise HTTPException(status_code=400, detail="mode must be 'instant' or omitted")
+        
+        # Before the prompt is filled in, so retries of the same request hash identically
+        fingerprint = hashlib.sha256(request.model_dump_json().encode()).hexdigest()
+        
+        logger.info(
+            f"Received video generation request (genre: {request.genre}, duration: {request.duration})",
+            extra={"genre": request.genre, "duration": request.duration, "audio_url": request.audio_url}
+        )
+        
+        # Reuse the prompt the user previewed, if any
+        preview_source = _apply_preview_token(request)
+        
+        # Instant mode only covers prompts built from the options
+        library_eligible = request.mode == "instant" and (not request.prompt or preview_source == "rule_fallback")
         
         # Build enhanced prompt if not provided
-        if not request.prompt:
-            logger.info("No custom prompt provided, building enhanced prompt from options")
-            enhanced_prompt = build_enhanced_prompt(
-                genre=request.genre,
-                mood=request.mood,
-                visual_style=request.visualStyle,
-                camera_movement=request.cameraMovement,
-                duration=request.duration,
-                lighting=request.lighting,
-                camera_type=request.cameraType,
-                creative_intensity=request.creativeIntensity,
-                subject=request.subject,
-                setting=request.setting,
-                extra=request.extra
+        _fill_prompt(request)
+        
+        # Refuse new work once the local queue is full, or while jobs already wait for scratch space
+        try:
+            _check_capacity([request])
+        except HTTPException:
+            # A retry of a request that was accepted earlier still gets its job
+            existing_job_id = idempotency_key and await asyncio.to_thread(
+                job_store.find_idempotent_job, idempotency_key, fingerprint
             )
-            request.prompt = enhanced_prompt
-            logger.info(f"  Enhanced Prompt: {enhanced_prompt[:150]}...")
-        else:
-            logger.info(f"  Using custom prompt: {request.prompt[:150]}...")
+            if existing_job_id:
+                return await _existing_job_response(existing_job_id)
+            raise
         
-        # Create job in Firestore
-        request_dict = request.model_dump()
-        job_id = firestore_service.create_job(request_dict)
+        # Create the job (write-behind unless an Idempotency-Key needs the transaction)
+        request_dict = _job_request_data(request, _caller_lane(authorization))
+        instant = False if request.mode == "instant" else None
+        if idempotency_key:
+            job_id, created = await asyncio.to_thread(
+                job_store.create_job_idempotent, request_dict, idempotency_key, fingerprint
+            )
+            if not created:
+                return await _existing_job_response(job_id)  # A concurrent duplicate got there first
+            # Only once the job is known to be new, so a retried request doesn't use up another clip
+            if library_eligible and await _claim_library_clip(request, request_dict, http_request):
+                await asyncio.to_thread(_checkpoint, job_id, {"veo_clip_uri": request_dict["veo_clip_uri"]})
+                instant = True
+        else:
+            if library_eligible:
+                instant = await _claim_library_clip(request, request_dict, http_request)
+            job_id = job_store.create_job(request_dict)
         
-        logger.info(f"Created job: {job_id}")
+        logger.info(f"Created job: {job_id}", extra={"job_id": job_id})
+        tracing.current_span().set_attribute("job_id", job_id)
+        queue_info = _admit_job(job_id)
         
         # Trigger background task
-        background_tasks.add_task(process_video_generation, job_id, request_dict)
+        _start_workflow(job_id, request_dict)
         
-        return GenerateResponse(job_id=job_id)
+        return GenerateResponse(
+            job_id=job_id,
+            queue_position=queue_info["queue_position"],
+            estimated_start_at=_iso_timestamp(queue_info["estimated_start_at"]),
+            instant=instant
+        )
         
+    except HTTPException:
+        raise
+    except IdempotencyKeyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         error_msg = str(e)
         logger.error(f"Error creating generation job: {error_msg}", exc_info=True)
@@ -360,39 +1426,483 @@ async def generate_video(request: GenerateRequest, background_tasks: BackgroundT
         raise HTTPException(status_code=500, detail=f"Failed to create job: {error_msg}")
 
 
+@app.post("/api/generate/batch", response_model=BatchGenerateResponse)
+async def generate_batch(request: BatchGenerateRequest, authorization: Optional[str] = Header(None)):
+    """
+    Start a batch of video generation jobs (several tracks, or variants of one).
+    
+    The batch and all of its jobs are created with a single batched write to the
+    job store, in the background like /api/generate. The jobs then run like any other:
+    they share the instance's Veo and encode slots and the Veo submission quota,
+    so a batch queues behind (and alongside) other work instead of bursting past it.
+    The batch is admitted whole or not at all.
+    
+    Poll /api/batch/{batch_id} for the aggregated status. Batch jobs always render
+    normally: instant mode is only available through /api/generate.
+    """
+    try:
+        if not 0 < len(request.jobs) <= config.BATCH_MAX_JOBS:
+            raise HTTPException(status_code=400, detail=f"A batch must contain 1-{config.BATCH_MAX_JOBS} jobs")
+        if any(job_request.mode is not None for job_request in request.jobs):
+            raise HTTPException(status_code=422, detail="Batch jobs can't set mode; use /api/generate for instant mode")
+        
+        logger.info(f"Received batch generation request ({len(request.jobs)} jobs)", extra={"jobs": len(request.jobs)})
+        
+        for job_request in request.jobs:
+            _apply_preview_token(job_request)
+            _fill_prompt(job_request)
+        
+        _check_capacity(request.jobs)
+        
+        priority = _caller_lane(authorization)
+        requests_data = [_job_request_data(job_request, priority) for job_request in request.jobs]
+        batch_fields = {"priority": priority, "trace_id": requests_data[0].get("trace_id")}
+        batch_id, job_ids = job_store.create_batch(requests_data, batch_fields)
+        
+        logger.info(f"Created batch {batch_id} with jobs: {', '.join(job_ids)}", extra={"batch_id": batch_id})
+        tracing.current_span().set_attribute("batch_id", batch_id)
+        for job_id, request_data in zip(job_ids, requests_data):
+            _admit_job(job_id)
+            _start_workflow(job_id, request_data)
+        
+        return BatchGenerateResponse(batch_id=batch_id, job_ids=job_ids)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error creating generation batch: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to create batch: {str(e)}")
+
+
+def _batch_status(statuses: List[str]) -> str:
+    """Aggregate status of a batch from its jobs' statuses."""
+    if any(status not in TERMINAL_STATUSES for status in statuses):
+        return "processing" if any(status != "queued" for status in statuses) else "queued"
+    if all(status == "complete" for status in statuses):
+        return "complete"
+    if all(status == "cancelled" for status in statuses):
+        return "cancelled"
+    return "partial" if "complete" in statuses else "error"
+
+
+@app.get("/api/batch/{batch_id}", response_model=BatchStatusResponse)
+async def get_batch_result(batch_id: str):
+    """
+    Get the aggregated status of a batch, with each job's status and video URL.
+    
+    One request (and two job store reads) instead of polling every job.
+    """
+    try:
+        batch_data = await asyncio.to_thread(job_store.get_batch, batch_id)
+        if not batch_data:
+            raise HTTPException(status_code=404, detail=f"Batch not found: {batch_id}")
+        
+        job_ids = batch_data.get("job_ids", [])
+        jobs_data = await asyncio.to_thread(job_store.get_jobs, job_ids, ("status", "video_url", "error"))
+        
+        jobs = []
+        counts = {}
+        for job_id in job_ids:
+            job_data = jobs_data.get(job_id, {})
+            status = job_data.get("status", "error")
+            counts[status] = counts.get(status, 0) + 1
+            jobs.append(BatchJobStatus(
+                job_id=job_id,
+                status=status,
+                video_url=job_data.get("video_url") if status == "complete" else None,
+                error=job_data.get("error", "Unknown error occurred") if status == "error" else None
+            ))
+        
+        return BatchStatusResponse(
+            batch_id=batch_id,
+            status=_batch_status([job.status for job in jobs]),
+            total=len(jobs),
+            counts=counts,
+            jobs=jobs
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error retrieving batch status: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to get batch status: {str(e)}")
+
+
+def _remaining_seconds(job_id: str, job_data: dict, queue_info: Optional[dict]) -> Optional[float]:
+    """Expected time until an unfinished job completes, from the rolling job stats."""
+    now = time.time()
+    if queue_info:
+        # Queued here: the admission estimate of its start plus a typical run
+        run_seconds = stats.expected_seconds(job_data, "run")
+        if run_seconds is None:
+            return None
+        return max(0.0, queue_info["estimated_start_at"] - now) + run_seconds
+    if job_data.get("status") == "processing" and isinstance(job_data.get("startedAt"), datetime):
+        return stats.remaining_seconds(job_data, "run", now - _epoch_seconds(job_data["startedAt"]))
+    if isinstance(job_data.get("createdAt"), datetime):
+        return stats.remaining_seconds(job_data, "total", now - _epoch_seconds(job_data["createdAt"]))
+    return None
+
+
+def _job_status_response(job_id: str, job_data: dict) -> JobStatusResponse:
+    """
+    Status response for a job document (plus this instance's queue and Veo scheduler state).
+    
+    Unfinished jobs get an estimated completion time and a poll interval hint
+    from the rolling job stats.
+    """
+    status = job_data.get("status")
+    
+    # Build response based on status
+    response = JobStatusResponse(
+        status=status,
+        playlist_url=job_data.get("playlist_url"),
+        preview_url=job_data.get("preview_url"),
+        thumbnail_url=job_data.get("thumbnail_url")
+    )
+    
+    queue_info = None
+    if status == "complete":
+        response.video_url = job_data.get("video_url")
+    elif status == "queued":
+        queue_info = admission.queue_info(job_id)
+        if queue_info:
+            response.queue_position = queue_info["queue_position"]
+            response.estimated_start_at = _iso_timestamp(queue_info["estimated_start_at"])
+    elif status == "processing":
+        veo_state = veo_service.scheduler.state(job_id)
+        if veo_state and "retry_at" in veo_state:
+            veo_state["retry_at"] = _iso_timestamp(veo_state["retry_at"])
+        response.veo_queue = veo_state
+    elif status == "error":
+        response.error = job_data.get("error", "Unknown error occurred")
+    
+    if status in ("queued", "processing"):
+        remaining = _remaining_seconds(job_id, job_data, queue_info)
+        if remaining is not None:
+            response.estimated_completion_at = _iso_timestamp(time.time() + remaining)
+        response.retry_after_ms = retry_after_ms(remaining)
+    
+    return response
+
+
+# Fields a status response is built from (read as a projection by /api/result/batch)
+_STATUS_FIELDS = (
+    "status", "video_url", "playlist_url", "preview_url", "thumbnail_url", "error",
+    "createdAt", "startedAt", "genre", "visualStyle", "duration",
+)
+
+
+@app.get("/api/stats")
+async def get_stats():
+    """
+    Rolling timing percentiles of jobs completed on this instance.
+    
+    Covers the last STATS_WINDOW_SECONDS: end-to-end ("total") and processing
+    ("run") time and each pipeline stage, overall and per option value (genre,
+    style, duration). These are what /api/result ETAs are based on.
+    """
+    return stats.snapshot()
+
+
+def _check_admin_token(authorization: Optional[str]) -> None:
+    """
+    Guard for endpoints that expose other users' jobs (listings, batched reads).
+    
+    Raises:
+        HTTPException: 404 while no ADMIN_TOKEN is configured, 401 without it as bearer token
+    """
+    if not config.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(token.encode(), config.ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@app.get("/api/jobs", response_model=JobListResponse, response_model_exclude_unset=True)
+async def list_jobs(
+    status: Optional[str] = None,
+    genre: Optional[str] = None,
+    created_after: Optional[datetime] = None,
+    created_before: Optional[datetime] = None,
+    limit: int = Query(config.JOB_LIST_DEFAULT_LIMIT, ge=1, le=config.JOB_LIST_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    authorization: Optional[str] = Header(None)
+):
+    """
+    List jobs, newest first, for support tools and dashboards (needs the admin token).
+    
+    Filters: status, genre and a creation-time range (created_after inclusive,
+    created_before exclusive, ISO 8601). Pages are cursor-based: pass the
+    response's next_cursor to get the next page, with the same filters. Only
+    summary fields are read (never the prompt); `fields` narrows them further,
+    as a comma-separated list.
+    """
+    _check_admin_token(authorization)
+    try:
+        if status is not None and status not in JOB_STATUSES:
+            raise HTTPException(status_code=400, detail=f"Unknown status: {status} (expected one of {', '.join(JOB_STATUSES)})")
+        
+        selected = JOB_SUMMARY_FIELDS
+        if fields:
+            selected = tuple(field.strip() for field in fields.split(",") if field.strip() and field.strip() != "job_id")
+            unknown = [field for field in selected if field not in JOB_SUMMARY_FIELDS]
+            if unknown:
+                raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)} (expected any of {', '.join(JOB_SUMMARY_FIELDS)})")
+        
+        job_filter = JobFilter(status=status, genre=genre, created_after=created_after, created_before=created_before)
+        jobs, next_cursor = await asyncio.to_thread(job_store.list_jobs, job_filter, limit, cursor, selected)
+        
+        summaries = []
+        for job in jobs:
+            for field in ("createdAt", "completedAt"):
+                if field in job:
+                    job[field] = _iso_datetime(job[field])
+            summaries.append(JobSummary(**job))
+        
+        return JobListResponse(jobs=summaries, next_cursor=next_cursor)
+        
+    except HTTPException:
+        raise
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error listing jobs: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to list jobs: {str(e)}")
+
+
+@app.post("/api/result/batch", response_model=ResultBatchResponse)
+async def get_results(request: ResultBatchRequest, authorization: Optional[str] = Header(None)):
+    """
+    Get the status of many jobs in one request (needs the admin token).
+    
+    Reads all of them with one batched, projected read instead of one
+    /api/result call (and one full document read) per job.
+    """
+    _check_admin_token(authorization)
+    try:
+        job_ids = list(dict.fromkeys(request.job_ids))
+        if not job_ids:
+            raise HTTPException(status_code=400, detail="job_ids must not be empty")
+        if len(job_ids) > config.RESULT_BATCH_MAX_JOBS:
+            raise HTTPException(status_code=400, detail=f"At most {config.RESULT_BATCH_MAX_JOBS} job IDs per request")
+        
+        jobs_data = await asyncio.to_thread(job_store.get_jobs, job_ids, _STATUS_FIELDS)
+        
+        return ResultBatchResponse(
+            results={job_id: _job_status_response(job_id, jobs_data[job_id]) for job_id in job_ids if job_id in jobs_data},
+            missing=[job_id for job_id in job_ids if job_id not in jobs_data]
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error retrieving job statuses: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to get job statuses: {str(e)}")
+
+
 @app.get("/api/result/{job_id}", response_model=JobStatusResponse)
 async def get_result(job_id: str):
     """
     Get the status of a video generation job.
     
-    Returns job status: queued, processing, complete (with video URL), or error (with error message).
+    Returns job status: queued, processing, complete (with video URL), error (with error message) or cancelled.
     """
     try:
-        logger.info(f"Status check for job: {job_id}")
+        logger.info(f"Status check for job: {job_id}", extra={"job_id": job_id, "sample": "status_poll"})
         
-        # Get job from Firestore
-        job_data = firestore_service.get_job(job_id)
+        # Get job from the job store (or from memory while its document is being written)
+        job_data = await asyncio.to_thread(job_store.get_job, job_id)
         
         if not job_data:
             raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
         
-        status = job_data.get("status")
+        return _job_status_response(job_id, job_data)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error retrieving job status: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to get job status: {str(e)}")
+
+
+@app.delete("/api/job/{job_id}", response_model=JobStatusResponse)
+async def cancel_job(job_id: str):
+    """
+    Cancel a queued or processing job.
+    
+    Marks the job cancelled. If it runs on this instance it stops right away: the
+    Veo poll ends (the operation is cancelled upstream where supported), FFmpeg is
+    killed, uploads are aborted and its scratch files are deleted. An instance
+    running it elsewhere notices within JOB_HEARTBEAT_SECONDS.
+    
+    Returns 404 for unknown jobs and 409 for jobs that have already finished.
+    """
+    try:
+        previous_status = await asyncio.to_thread(job_store.cancel_job, job_id)
         
-        # Build response based on status
-        response = JobStatusResponse(status=status)
+        if previous_status is None:
+            raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+        if previous_status in TERMINAL_STATUSES:
+            raise HTTPException(status_code=409, detail=f"Job already {previous_status}: {job_id}")
         
-        if status == "complete":
-            response.video_url = job_data.get("video_url")
-        elif status == "error":
-            response.error = job_data.get("error", "Unknown error occurred")
+        running_here = _cancel_local_job(job_id)
+        logger.info(
+            f"[Job {job_id}] Cancelled (was {previous_status}, {'stopping' if running_here else 'not running'} on this instance)",
+            extra={"job_id": job_id}
+        )
         
-        return response
+        return JobStatusResponse(status="cancelled")
         
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Error retrieving job status: {str(e)}", exc_info=True)
-        raise HTTPException(status_code=500, detail=f"Failed to get job status: {str(e)}")
+        logger.error(f"Error cancelling job: {str(e)}", exc_info=True)
+        raise HTTPException(status_code=500, detail=f"Failed to cancel job: {str(e)}")
+
+
+async def _cancel_abandoned_job(job_id: str) -> None:
+    """Cancel a job whose status stream (opted in with cancel_on_disconnect) closed before it finished."""
+    try:
+        previous_status = await asyncio.to_thread(job_store.cancel_job, job_id)
+    except Exception as e:
+        logger.error(f"[Job {job_id}] Failed to cancel job after its status stream disconnected: {e}", extra={"job_id": job_id})
+        return
+    if previous_status is None or previous_status in TERMINAL_STATUSES:
+        return
+    running_here = _cancel_local_job(job_id)
+    logger.info(
+        f"[Job {job_id}] Cancelled: status stream disconnected (was {previous_status}, "
+        f"{'stopping' if running_here else 'not running'} on this instance)",
+        extra={"job_id": job_id}
+    )
+
+
+async def _stream_status(job_id: str, job_data: dict, cancel_on_disconnect: bool):
+    finished = False
+    sent = None
+    try:
+        while True:
+            payload = _job_status_response(job_id, job_data).model_dump()
+            if payload != sent:
+                yield _sse("status", payload)
+                sent = payload
+            if job_data.get("status") in TERMINAL_STATUSES:
+                finished = True
+                return
+            await asyncio.sleep(config.RESULT_POLL_MIN_MS / 1000)
+            job_data = await asyncio.to_thread(job_store.get_job, job_id)
+            if not job_data:
+                finished = True  # Expired or evicted: nothing left to cancel
+                yield _sse("error", {"detail": f"Job not found: {job_id}"})
+                return
+    finally:
+        # Runs when the client goes away mid-stream (the response task is cancelled), so
+        # the cancel is a task of its own rather than awaited here
+        if cancel_on_disconnect and not finished:
+            asyncio.create_task(_cancel_abandoned_job(job_id))
+
+
+@app.get("/api/result/{job_id}/stream")
+async def stream_result(job_id: str, cancel_on_disconnect: bool = False):
+    """
+    Status of a job as server-sent events, until it finishes.
+    
+    Sends a `status` event (the /api/result response) whenever it changes, reading
+    the job every RESULT_POLL_MIN_MS, and closes after the complete, error or
+    cancelled one. With cancel_on_disconnect=true, a client that disconnects
+    before that cancels the job like DELETE /api/job/{job_id}, so a page that
+    closes doesn't leave its render running.
+    
+    Returns 404 for unknown jobs.
+    """
+    job_data = await asyncio.to_thread(job_store.get_job, job_id)
+    if not job_data:
+        raise HTTPException(status_code=404, detail=f"Job not found: {job_id}")
+    return StreamingResponse(
+        _stream_status(job_id, job_data, cancel_on_disconnect),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# Admin endpoints (profiling), hidden unless PROFILING_ENABLED and ADMIN_TOKEN are set
+_admin_enabled = config.PROFILING_ENABLED and bool(config.ADMIN_TOKEN)
+
+
+def _check_admin(authorization: Optional[str]) -> None:
+    """
+    Raises:
+        HTTPException: 404 while profiling is disabled, 401 without the admin bearer token
+    """
+    if not _admin_enabled:
+        raise HTTPException(status_code=404, detail="Not Found")
+    _check_admin_token(authorization)
+
+
+def _artifact_response(result: dict) -> dict:
+    return dict(result, download_url=f"/admin/artifacts/{result['artifact']}")
+
+
+@app.post("/admin/profile/cpu")
+async def profile_cpu(
+    seconds: float = Query(10, gt=0, le=config.PROFILE_MAX_SECONDS),
+    interval: Optional[float] = Query(None, ge=0.005, le=1),
+    authorization: Optional[str] = Header(None)
+):
+    """
+    Sample every thread's Python stack for `seconds`, then return the capture.
+    
+    The artifact is in folded-stack format (flamegraph.pl, speedscope). Returns
+    409 while another capture is running.
+    """
+    _check_admin(authorization)
+    try:
+        return _artifact_response(await asyncio.to_thread(profiling.profile_cpu, seconds, interval))
+    except profiling.CaptureInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.post("/admin/profile/memory")
+async def profile_memory(
+    seconds: float = Query(10, gt=0, le=config.PROFILE_MAX_SECONDS),
+    authorization: Optional[str] = Header(None)
+):
+    """
+    Diff tracemalloc snapshots taken `seconds` apart, then return the capture.
+    
+    tracemalloc runs only during the capture. Returns 409 while another capture is running.
+    """
+    _check_admin(authorization)
+    try:
+        return _artifact_response(await asyncio.to_thread(profiling.profile_memory, seconds))
+    except profiling.CaptureInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.post("/admin/tasks")
+async def dump_tasks(authorization: Optional[str] = Header(None)):
+    """Dump the stack of every asyncio task and thread."""
+    _check_admin(authorization)
+    return _artifact_response(profiling.dump_tasks())
+
+
+@app.get("/admin/artifacts")
+async def list_profile_artifacts(authorization: Optional[str] = Header(None)):
+    """Captures kept on this instance, newest first."""
+    _check_admin(authorization)
+    return {"artifacts": profiling.list_artifacts()}
+
+
+@app.get("/admin/artifacts/{name}")
+async def download_profile_artifact(name: str, authorization: Optional[str] = Header(None)):
+    """Download a capture."""
+    _check_admin(authorization)
+    path = profiling.artifact_path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"Artifact not found: {name}")
+    return FileResponse(path, media_type="text/plain", filename=name)
 
 
 # Run with: uvicorn main:app --reload --port 8000
@@ -0,0 +1,458 @@
+"""
+Library of pre-rendered Veo clips for the most requested option combinations.
+
+Most traffic picks one of a small set of menu combinations (genre, style, camera
+movement, mood, subject, setting, lighting, camera type, creative intensity).
+For the most popular of those, clips are generated ahead of time, so an
+/api/generate request with "mode": "instant" can skip Veo and go straight to the
+merge with a clip the requesting user hasn't been served before.
+
+    popularity  - each job of the last LIBRARY_HISTORY_SECONDS counts
+                  0.5 ** (age / LIBRARY_POPULARITY_HALF_LIFE_SECONDS) toward its
+                  combination; the top LIBRARY_TOP_K combinations scoring at least
+                  LIBRARY_MIN_SCORE are stocked
+    stocking    - up to LIBRARY_CLIPS_PER_COMBO clips per stocked combination,
+                  generated only during LIBRARY_OFF_PEAK_HOURS (UTC) while this
+                  instance has no queued jobs, at most LIBRARY_DAILY_BUDGET Veo
+                  generations per UTC day across all instances
+    claims      - an instant request takes the least used clip its user hasn't
+                  had yet (per-user no-repeat); a clip is retired after
+                  LIBRARY_CLIP_MAX_USES uses
+    eviction    - combinations that decay out of the top K have their clips
+                  retired; retired clips are deleted from GCS after
+                  LIBRARY_RETIRED_GRACE_SECONDS (jobs may still be downloading them)
+
+Entries live in the job store (LIBRARY_COLLECTION, one document per combination,
+updated in transactions so concurrent claims never hand out the same clip twice
+to a user) and clips under LIBRARY_FOLDER in the bucket.
+
+Usage (from kapsule-studio-api/):
+    python -m services.clip_library --plan          # Show the popularity ranking only
+    python -m services.clip_library --force         # Stock now, even outside off-peak hours
+"""
+
+import argparse
+import copy
+import hashlib
+import json
+import logging
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+import config
+from services.job_store import JobFilter, JobStore
+from services import prompt_enhancer
+from utils import metrics, tracing
+
+logger = logging.getLogger(__name__)
+
+# Request options that make up a combination (the duration only changes how the clip is looped)
+COMBO_FIELDS = (
+    "genre", "visualStyle", "cameraMovement", "mood", "subject",
+    "setting", "lighting", "cameraType", "creativeIntensity",
+)
+
+# Menu values per option: only combinations built from these are stocked or served
+_MENUS = {
+    "genre": prompt_enhancer.GENRE_DESCRIPTORS,
+    "visualStyle": prompt_enhancer.STYLE_DESCRIPTORS,
+    "cameraMovement": prompt_enhancer.CAMERA_DESCRIPTORS,
+    "mood": prompt_enhancer.MOOD_DESCRIPTORS,
+    "subject": prompt_enhancer.SUBJECT_DESCRIPTORS,
+    "setting": prompt_enhancer.SETTING_DESCRIPTORS,
+    "lighting": prompt_enhancer.LIGHTING_DESCRIPTORS,
+    "cameraType": prompt_enhancer.CAMERA_TYPE_DESCRIPTORS,
+    "creativeIntensity": ("Precise", "Balanced", "Experimental"),
+}
+
+INDEX_KEY = "_index"  # Keys of every entry that has clips (live or retired)
+
+CLIP_DURATION = "8s"  # Longest Veo clip; FFmpeg loops it to the audio like any other render
+
+
+def combo_key(options: dict) -> Optional[str]:
+    """
+    Library key of a request's option combination.
+
+    Returns:
+        The key, or None if the request can't use the library (custom prompt,
+        extra notes, or an option that isn't a menu value)
+    """
+    if options.get("extra") or options.get("custom_prompt"):
+        return None
+    if any(options.get(field) not in _MENUS[field] for field in COMBO_FIELDS):
+        return None
+    canonical = json.dumps([options[field] for field in COMBO_FIELDS])
+    return hashlib.sha256(canonical.encode()).hexdigest()[:32]
+
+
+def _user_hash(user: str) -> str:
+    # Entries keep hashes, not client IDs or IPs
+    return hashlib.sha256(user.encode()).hexdigest()[:16]
+
+
+def _budget_key(now: datetime) -> str:
+    return f"_budget_{now.strftime('%Y%m%d')}"
+
+
+def in_off_peak_hours(hours: str, now: datetime) -> bool:
+    """Whether now (UTC) falls in an "H1-H2" hour range (end exclusive, may wrap midnight)."""
+    start, _, end = hours.partition("-")
+    start, end = int(start), int(end or start)
+    if start == end:
+        return True
+    if start < end:
+        return start <= now.hour < end
+    return now.hour >= start or now.hour < end
+
+
+class ClipLibrary:
+    """Stocks, serves and evicts pre-rendered clips for popular option combinations."""
+
+    def __init__(
+        self,
+        job_store: JobStore,
+        bucket,
+        veo_service,
+        busy: Callable[[], bool] = lambda: False
+    ):
+        """
+        Args:
+            job_store: Store holding the job history and the library entries
+            bucket: google.cloud.storage Bucket the clips are kept in (None disables stocking)
+            veo_service: VeoService the clips are generated with
+            busy: Whether user jobs are waiting here (stocking stops while they are)
+        """
+        self.job_store = job_store
+        self.bucket = bucket
+        self.veo_service = veo_service
+        self.busy = busy
+        self._running = threading.Lock()
+
+    # Serving
+
+    def claim(self, options: dict, user: str) -> Optional[str]:
+        """
+        Take a clip for an instant request.
+
+        Args:
+            options: The request's options (see combo_key)
+            user: Requesting user (client-chosen user ID, else client IP)
+
+        Returns:
+            GCS URI of a clip the user hasn't been served yet, or None
+        """
+        key = combo_key(options)
+        if key is None:
+            metrics.LIBRARY_REQUESTS_TOTAL.inc(result="ineligible")
+            return None
+
+        user_hash = _user_hash(user)
+        now = time.time()
+
+        def update(entry: Optional[dict]) -> Tuple[Optional[dict], Tuple[Optional[str], bool]]:
+            # result: (clip URI, whether the clip was retired)
+            if not entry:
+                return None, (None, False)
+            candidates = [clip for clip in entry.get("clips", []) if user_hash not in clip["users"]]
+            if not candidates:
+                return None, (None, False)
+            clip = min(candidates, key=lambda c: (c["uses"], c["created_at"]))
+            clip["uses"] += 1
+            clip["users"].append(user_hash)
+            retired = clip["uses"] >= config.LIBRARY_CLIP_MAX_USES
+            if retired:
+                entry["clips"].remove(clip)
+                entry.setdefault("retired", []).append({"uri": clip["uri"], "retired_at": now})
+            entry["last_claimed_at"] = now
+            return entry, (clip["uri"], retired)
+
+        uri, retired = self.job_store.update_library_entry(key, update)
+        metrics.LIBRARY_REQUESTS_TOTAL.inc(result="hit" if uri else "empty")
+        if retired:
+            metrics.LIBRARY_CLIPS_TOTAL.inc(action="retired")
+        return uri
+
+    # Popularity
+
+    def popularity(self, now: datetime = None) -> List[Tuple[float, str, dict]]:
+        """
+        Decayed popularity of each combination in the job history.
+
+        Returns:
+            (score, key, options) for every eligible combination, most popular first
+        """
+        now = now or datetime.now(timezone.utc)
+        created_after = now - timedelta(seconds=config.LIBRARY_HISTORY_SECONDS)
+        half_life = config.LIBRARY_POPULARITY_HALF_LIFE_SECONDS
+        scores: Dict[str, list] = {}  # key -> [score, options]
+        seen = 0
+        cursor = None
+        while seen < config.LIBRARY_HISTORY_MAX_JOBS:
+            jobs, cursor = self.job_store.list_jobs(
+                JobFilter(created_after=created_after),
+                limit=min(500, config.LIBRARY_HISTORY_MAX_JOBS - seen),
+                cursor=cursor,
+                fields=COMBO_FIELDS + ("extra", "createdAt")
+            )
+            seen += len(jobs)
+            for job in jobs:
+                key = combo_key(job)
+                if key is None:
+                    continue
+                created_at = job["createdAt"]
+                created_at = created_at.replace(tzinfo=timezone.utc) if created_at.tzinfo is None else created_at
+                weight = 0.5 ** (max(0.0, (now - created_at).total_seconds()) / half_life)
+                entry = scores.setdefault(key, [0.0, {field: job[field] for field in COMBO_FIELDS}])
+                entry[0] += weight
+            if cursor is None:
+                break
+        return sorted(((score, key, options) for key, (score, options) in scores.items()), key=lambda item: -item[0])
+
+    def plan(self, now: datetime = None) -> List[Tuple[float, str, dict]]:
+        """The combinations to stock: top LIBRARY_TOP_K scoring at least LIBRARY_MIN_SCORE."""
+        ranked = self.popularity(now)
+        return [item for item in ranked if item[0] >= config.LIBRARY_MIN_SCORE][:config.LIBRARY_TOP_K]
+
+    # Stocking and eviction
+
+    def run(self, force: bool = False) -> dict:
+        """
+        One stocking pass: evict combinations that fell out of the plan, delete
+        retired clips past their grace period, then top up the planned ones.
+
+        Args:
+            force: Stock even outside LIBRARY_OFF_PEAK_HOURS
+
+        Returns:
+            Counts: planned, evicted, deleted, generated, failed, skipped (reason or None)
+        """
+        report = {"planned": 0, "evicted": 0, "deleted": 0, "generated": 0, "failed": 0, "skipped": None}
+        if self.bucket is None:
+            report["skipped"] = "no storage bucket"
+            return report
+        if not self._running.acquire(blocking=False):
+            report["skipped"] = "already running"
+            return report
+
+        try:
+            now = datetime.now(timezone.utc)
+            planned = self.plan(now)
+            report["planned"] = len(planned)
+            planned_keys = {key for _, key, _ in planned}
+
+            index = self.job_store.get_library_entries([INDEX_KEY]).get(INDEX_KEY, {}).get("keys", [])
+            entries = self.job_store.get_library_entries(index) if index else {}
+            for key in index:
+                if key not in planned_keys and entries.get(key, {}).get("clips"):
+                    report["evicted"] += self._retire_all(key)
+            for key in index:
+                report["deleted"] += self._delete_retired(key)
+            self._prune_index()
+
+            if not force and not in_off_peak_hours(config.LIBRARY_OFF_PEAK_HOURS, now):
+                report["skipped"] = "outside off-peak hours"
+                return report
+
+            with ThreadPoolExecutor(max_workers=config.LIBRARY_CONCURRENCY, thread_name_prefix="clip-library") as executor:
+                for _, key, options in planned:
+                    if self.busy():
+                        report["skipped"] = "user jobs waiting"
+                        break
+                    granted = self._reserve(key, options)
+                    if not granted:
+                        continue
+                    budget = self._take_budget(granted, now)
+                    if budget < granted:
+                        self._release(key, granted - budget)
+                    if budget == 0:
+                        report["skipped"] = "daily budget used up"
+                        break
+                    for outcome in executor.map(lambda _: self._generate(key, options), range(budget)):
+                        report["generated" if outcome else "failed"] += 1
+            return report
+        finally:
+            self._running.release()
+
+    def _reserve(self, key: str, options: dict) -> int:
+        """Reserve generation slots for a combination up to LIBRARY_CLIPS_PER_COMBO; returns how many."""
+        now = time.time()
+
+        def update(entry: Optional[dict]) -> Tuple[Optional[dict], int]:
+            entry = entry or {"options": options, "clips": [], "retired": [], "pending": []}
+            pending = [expires for expires in entry.get("pending", []) if expires > now]
+            wanted = config.LIBRARY_CLIPS_PER_COMBO - len(entry["clips"]) - len(pending)
+            if wanted <= 0:
+                return None, 0
+            entry["pending"] = pending + [now + config.LIBRARY_GENERATION_TIMEOUT_SECONDS] * wanted
+            return entry, wanted
+
+        granted = self.job_store.update_library_entry(key, update)
+        if granted:
+            self._add_to_index(key)
+        return granted
+
+    def _release(self, key: str, count: int) -> None:
+        """Give back `count` reserved generation slots."""
+        def update(entry: Optional[dict]) -> Tuple[Optional[dict], None]:
+            if not entry or not entry.get("pending"):
+                return None, None
+            entry["pending"] = sorted(entry["pending"])[count:]
+            return entry, None
+
+        self.job_store.update_library_entry(key, update)
+
+    def _take_budget(self, wanted: int, now: datetime) -> int:
+        """Take up to `wanted` generations from today's LIBRARY_DAILY_BUDGET; returns how many."""
+        def update(entry: Optional[dict]) -> Tuple[Optional[dict], int]:
+            used = (entry or {}).get("used", 0)
+            granted = max(0, min(wanted, config.LIBRARY_DAILY_BUDGET - used))
+            if not granted:
+                return None, 0
+            return {"used": used + granted}, granted
+
+        return self.job_store.update_library_entry(_budget_key(now), update)
+
+    def _generate(self, key: str, options: dict) -> bool:
+        """Generate one clip, copy it under LIBRARY_FOLDER and add it to the entry."""
+        clip_id = uuid.uuid4().hex
+        name = f"{config.LIBRARY_FOLDER}{key}/{clip_id}.mp4"
+        try:
+            prompt = prompt_enhancer.build_enhanced_prompt(
+                genre=options["genre"],
+                mood=options["mood"],
+                visual_style=options["visualStyle"],
+                camera_movement=options["cameraMovement"],
+                duration=CLIP_DURATION,
+                lighting=options["lighting"],
+                camera_type=options["cameraType"],
+                creative_intensity=options["creativeIntensity"],
+                subject=options["subject"],
+                setting=options["setting"]
+            )
+            with tracing.span("library.generate", combo=key):
+                source_uri = self.veo_service.generate_clip(prompt, CLIP_DURATION, f"library-{clip_id}")
+                # The Veo original stays in veo-temp for the compactor
+                source = self.bucket.blob(source_uri.split("/", 3)[3])
+                target = self.bucket.blob(name)
+                token, _, _ = target.rewrite(source)
+                while token is not None:
+                    token, _, _ = target.rewrite(source, token=token)
+        except Exception as e:
+            logger.warning(f"Library clip for {key} failed: {e}")
+            self._release(key, 1)
+            metrics.LIBRARY_CLIPS_TOTAL.inc(action="failed")
+            return False
+
+        uri = f"gs://{self.bucket.name}/{name}"
+        now = time.time()
+
+        def update(entry: Optional[dict]) -> Tuple[Optional[dict], None]:
+            entry = entry or {"options": options, "clips": [], "retired": [], "pending": []}
+            entry["pending"] = sorted(entry.get("pending", []))[1:]
+            entry["clips"].append({"uri": uri, "created_at": now, "uses": 0, "users": []})
+            return entry, None
+
+        self.job_store.update_library_entry(key, update)
+        metrics.LIBRARY_CLIPS_TOTAL.inc(action="generated")
+        logger.info(f"Library clip added for {key}: {uri}")
+        return True
+
+    def _retire_all(self, key: str) -> int:
+        """Retire every clip of a combination that is no longer stocked; returns how many."""
+        now = time.time()
+
+        def update(entry: Optional[dict]) -> Tuple[Optional[dict], int]:
+            if not entry or not entry.get("clips"):
+                return None, 0
+            retired = [{"uri": clip["uri"], "retired_at": now} for clip in entry["clips"]]
+            entry["retired"] = entry.get("retired", []) + retired
+            entry["clips"] = []
+            return entry, len(retired)
+
+        count = self.job_store.update_library_entry(key, update)
+        metrics.LIBRARY_CLIPS_TOTAL.inc(count, action="evicted")
+        return count
+
+    def _delete_retired(self, key: str) -> int:
+        """Delete retired clips past LIBRARY_RETIRED_GRACE_SECONDS from GCS; returns how many."""
+        cutoff = time.time() - config.LIBRARY_RETIRED_GRACE_SECONDS
+
+        def update(entry: Optional[dict]) -> Tuple[Optional[dict], list]:
+            expired = [clip for clip in (entry or {}).get("retired", []) if clip["retired_at"] < cutoff]
+            if not expired:
+                return None, []
+            entry["retired"] = [clip for clip in entry["retired"] if clip["retired_at"] >= cutoff]
+            return entry, [clip["uri"] for clip in expired]
+
+        deleted = 0
+        for uri in self.job_store.update_library_entry(key, update):
+            try:
+                self.bucket.blob(uri.split("/", 3)[3]).delete()
+            except Exception as e:
+                if getattr(e, "code", None) != 404:
+                    logger.warning(f"Could not delete retired library clip {uri}: {e}")
+                    continue
+            deleted += 1
+        metrics.LIBRARY_CLIPS_TOTAL.inc(deleted, action="deleted")
+        return deleted
+
+    def _add_to_index(self, key: str) -> None:
+        def update(entry: Optional[dict]) -> Tuple[Optional[dict], None]:
+            keys = (entry or {}).get("keys", [])
+            return (None, None) if key in keys else ({"keys": keys + [key]}, None)
+
+        self.job_store.update_library_entry(INDEX_KEY, update)
+
+    def _prune_index(self) -> None:
+        """Drop keys whose entries have no clips, retired clips or pending generations left."""
+        index = self.job_store.get_library_entries([INDEX_KEY]).get(INDEX_KEY, {}).get("keys", [])
+        entries = self.job_store.get_library_entries(index) if index else {}
+        now = time.time()
+        empty = {
+            key for key in index
+            if not any((
+                entries.get(key, {}).get("clips"),
+                entries.get(key, {}).get("retired"),
+                any(expires > now for expires in entries.get(key, {}).get("pending", [])),
+            ))
+        }
+        if not empty:
+            return
+
+        def update(entry: Optional[dict]) -> Tuple[Optional[dict], None]:
+            return {"keys": [key for key in (entry or {}).get("keys", []) if key not in empty]}, None
+
+        self.job_store.update_library_entry(INDEX_KEY, update)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Kapsule Studio clip library stocking")
+    parser.add_argument("--plan", action="store_true", help="Print the popularity ranking and exit")
+    parser.add_argument("--force", action="store_true", help="Stock even outside LIBRARY_OFF_PEAK_HOURS")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from services.job_store import create_job_store
+    from services.storage_service import StorageService
+    from services.veo_service import VeoService
+
+    job_store = create_job_store()
+    library = ClipLibrary(job_store, StorageService().bucket, VeoService())
+    if args.plan:
+        print(json.dumps([{"score": round(score, 2), "key": key, "options": options} for score, key, options in library.plan()], indent=2))
+        return 0
+    report = library.run(force=args.force)
+    job_store.flush()
+    print(json.dumps(report, indent=2))
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
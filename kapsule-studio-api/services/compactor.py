@@ -0,0 +1,306 @@
+"""
+Compaction of storage and job documents nothing else cleans up.
+
+Three sets are walked in bounded batches (COMPACT_BATCH_SIZE per page, at most
+COMPACT_MAX_ITEMS_PER_RUN per set), with every delete, rewrite or job update
+rate-limited to COMPACT_OPS_PER_SECOND:
+
+    veo_temp    - Veo output under veo-temp/, deleted once older than
+                  COMPACT_VEO_TEMP_MAX_AGE_SECONDS unless a running job's
+                  checkpoint (veo_clip_uri) still points at it
+    uploads     - audio under audio/ older than COMPACT_UPLOAD_MAX_AGE_SECONDS:
+                  deleted when no job references it, otherwise moved to
+                  COMPACT_ARCHIVE_STORAGE_CLASS
+    stale_jobs  - queued/processing jobs whose lease expired more than
+                  COMPACT_STALE_JOB_GRACE_SECONDS ago (job recovery didn't take
+                  them), or that never got a lease and are older than
+                  COMPACT_STALE_JOB_MAX_AGE_SECONDS, are marked as failed
+
+The API runs a pass every COMPACT_INTERVAL_SECONDS. It can also run on its own,
+e.g. as a scheduled Cloud Run job:
+
+Usage (from kapsule-studio-api/):
+    python -m services.compactor --dry-run
+    python -m services.compactor --sets veo_temp uploads
+"""
+
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Set
+
+import config
+from services.job_store import JobFilter, JobStore
+from utils import metrics, tracing
+
+logger = logging.getLogger(__name__)
+
+COMPACTION_SETS = ("veo_temp", "uploads", "stale_jobs")
+
+STALE_JOB_ERROR = "The job stopped making progress and was stopped. Please try again."
+
+
+class _Throttle:
+    """Spaces calls to wait() at least 1/ops_per_second apart."""
+
+    def __init__(self, ops_per_second: float):
+        self.interval = 1.0 / ops_per_second if ops_per_second > 0 else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+def _new_report() -> dict:
+    return {
+        "scanned": 0,
+        "deleted": 0,
+        "archived": 0,
+        "failed_jobs": 0,
+        "bytes_reclaimed": 0,
+        "bytes_archived": 0,
+        "errors": 0,
+    }
+
+
+class Compactor:
+    """Deletes or archives stale GCS objects and fails jobs no instance is working on."""
+
+    def __init__(
+        self,
+        job_store: JobStore,
+        bucket,
+        batch_size: int = None,
+        max_items: int = None,
+        ops_per_second: float = None,
+        dry_run: bool = False
+    ):
+        """
+        Args:
+            job_store: Store the jobs are read from and failed in
+            bucket: google.cloud.storage Bucket (None skips the GCS sets, e.g. without credentials)
+            batch_size: Objects or jobs per listing page (default COMPACT_BATCH_SIZE)
+            max_items: Objects or jobs examined per set per run (default COMPACT_MAX_ITEMS_PER_RUN)
+            ops_per_second: Rate of deletes, rewrites and job updates (default COMPACT_OPS_PER_SECOND)
+            dry_run: Report what would be done without changing anything
+        """
+        self.job_store = job_store
+        self.bucket = bucket
+        self.batch_size = batch_size or config.COMPACT_BATCH_SIZE
+        self.max_items = max_items or config.COMPACT_MAX_ITEMS_PER_RUN
+        self.throttle = _Throttle(config.COMPACT_OPS_PER_SECOND if ops_per_second is None else ops_per_second)
+        self.dry_run = dry_run
+        self._running = threading.Lock()
+
+    def run(self, sets=COMPACTION_SETS) -> Dict[str, dict]:
+        """
+        Run one compaction pass.
+
+        Args:
+            sets: Which of COMPACTION_SETS to compact
+
+        Returns:
+            Report per set: objects/jobs scanned, deleted, archived and failed,
+            bytes reclaimed and archived, and errors
+        """
+        if not self._running.acquire(blocking=False):
+            logger.info("Compaction already running, skipping this pass")
+            return {}
+
+        try:
+            report = {}
+            for name in sets:
+                report[name] = _new_report()
+                if name != "stale_jobs" and self.bucket is None:
+                    logger.info(f"Compaction of {name} skipped: no storage bucket")
+                    continue
+                started = time.monotonic()
+                with tracing.span(f"compact.{name}", dry_run=self.dry_run):
+                    getattr(self, f"_compact_{name}")(report[name])
+                logger.info(
+                    f"Compacted {name}{' (dry run)' if self.dry_run else ''} in {time.monotonic() - started:.1f}s: "
+                    + ", ".join(f"{key}={value}" for key, value in report[name].items())
+                )
+            return report
+        finally:
+            self._running.release()
+
+    # GCS objects
+
+    def _blobs(self, prefix: str) -> Iterator:
+        """Objects under prefix, a page of batch_size at a time, at most max_items."""
+        listing = self.bucket.client.list_blobs(self.bucket, prefix=prefix, page_size=self.batch_size)
+        seen = 0
+        for page in listing.pages:
+            for blob in page:
+                if seen >= self.max_items:
+                    return
+                seen += 1
+                yield blob
+
+    def _delete(self, blob, report: dict, set_name: str) -> None:
+        if not self.dry_run:
+            self.throttle.wait()
+            try:
+                blob.delete()
+            except Exception as e:
+                if getattr(e, "code", None) != 404:  # Deleted by another pass meanwhile
+                    logger.warning(f"Could not delete gs://{self.bucket.name}/{blob.name}: {e}")
+                    report["errors"] += 1
+                    return
+            metrics.COMPACTION_ITEMS_TOTAL.inc(set=set_name, action="deleted")
+            metrics.COMPACTION_BYTES_TOTAL.inc(blob.size or 0, set=set_name, action="deleted")
+        report["deleted"] += 1
+        report["bytes_reclaimed"] += blob.size or 0
+
+    def _running_clip_uris(self) -> Set[str]:
+        """veo_clip_uri checkpoints of jobs still processing (their resume reads the clip)."""
+        uris = set()
+        cursor = None
+        while True:
+            jobs, cursor = self.job_store.list_jobs(
+                JobFilter(status="processing"), limit=self.batch_size, cursor=cursor, fields=("veo_clip_uri",)
+            )
+            uris.update(job["veo_clip_uri"] for job in jobs if job.get("veo_clip_uri"))
+            if cursor is None:
+                return uris
+
+    def _compact_veo_temp(self, report: dict) -> None:
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=config.COMPACT_VEO_TEMP_MAX_AGE_SECONDS)
+        in_use = self._running_clip_uris()
+        for blob in self._blobs(config.VEO_TEMP_FOLDER):
+            report["scanned"] += 1
+            if blob.time_created is None or blob.time_created >= cutoff:
+                continue
+            if f"gs://{self.bucket.name}/{blob.name}" in in_use:
+                continue
+            self._delete(blob, report, "veo_temp")
+
+    def _compact_uploads(self, report: dict) -> None:
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=config.COMPACT_UPLOAD_MAX_AGE_SECONDS)
+        archive_class = config.COMPACT_ARCHIVE_STORAGE_CLASS
+        for blob in self._blobs(config.AUDIO_FOLDER):
+            report["scanned"] += 1
+            if blob.time_created is None or blob.time_created >= cutoff:
+                continue
+            if archive_class and blob.storage_class == archive_class:
+                continue  # Archived by an earlier pass
+
+            audio_url = f"gs://{self.bucket.name}/{blob.name}"
+            jobs, _ = self.job_store.list_jobs(JobFilter(audio_url=audio_url), limit=1, fields=("status",))
+            if not jobs:
+                self._delete(blob, report, "uploads")
+            elif archive_class:
+                self._archive(blob, archive_class, report)
+
+    def _archive(self, blob, storage_class: str, report: dict) -> None:
+        if not self.dry_run:
+            self.throttle.wait()
+            try:
+                blob.update_storage_class(storage_class)
+            except Exception as e:
+                logger.warning(f"Could not archive gs://{self.bucket.name}/{blob.name}: {e}")
+                report["errors"] += 1
+                return
+            metrics.COMPACTION_ITEMS_TOTAL.inc(set="uploads", action="archived")
+            metrics.COMPACTION_BYTES_TOTAL.inc(blob.size or 0, set="uploads", action="archived")
+        report["archived"] += 1
+        report["bytes_archived"] += blob.size or 0
+
+    # Jobs
+
+    def _fail(self, job_id: str, expired_before: datetime, report: dict) -> None:
+        if self.dry_run:
+            report["failed_jobs"] += 1
+            return
+        self.throttle.wait()
+        try:
+            failed = self.job_store.fail_stale_job(job_id, expired_before, STALE_JOB_ERROR)
+        except Exception as e:
+            logger.warning(f"[Job {job_id}] Could not mark stale job as failed: {e}")
+            report["errors"] += 1
+            return
+        if failed:
+            metrics.COMPACTION_ITEMS_TOTAL.inc(set="stale_jobs", action="failed")
+            report["failed_jobs"] += 1
+
+    def _compact_stale_jobs(self, report: dict) -> None:
+        now = datetime.now(timezone.utc)
+        expired_before = now - timedelta(seconds=config.COMPACT_STALE_JOB_GRACE_SECONDS)
+
+        # Leases that expired long ago: recovery would have resumed these by now
+        seen: Set[str] = set()
+        while report["scanned"] < self.max_items:
+            job_ids = [
+                job_id for job_id in self.job_store.find_expired_leases(self.batch_size, expired_before)
+                if job_id not in seen
+            ]
+            if not job_ids:
+                break
+            for job_id in job_ids:
+                seen.add(job_id)
+                report["scanned"] += 1
+                self._fail(job_id, expired_before, report)
+            if self.dry_run:
+                break  # The same jobs would come back
+
+        # Jobs that never got a lease (the instance went away before the workflow started)
+        created_before = now - timedelta(seconds=config.COMPACT_STALE_JOB_MAX_AGE_SECONDS)
+        for status in ("queued", "processing"):
+            cursor = None
+            while report["scanned"] < self.max_items:
+                jobs, cursor = self.job_store.list_jobs(
+                    JobFilter(status=status, created_before=created_before),
+                    limit=self.batch_size,
+                    cursor=cursor,
+                    fields=("lease_expires_at",)
+                )
+                for job in jobs:
+                    report["scanned"] += 1
+                    if job.get("lease_expires_at") is None:
+                        self._fail(job["job_id"], expired_before, report)
+                if cursor is None:
+                    break
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Kapsule Studio storage and job compaction")
+    parser.add_argument("--sets", nargs="+", default=list(COMPACTION_SETS), choices=COMPACTION_SETS)
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be done without changing anything")
+    parser.add_argument("--batch-size", type=int, default=config.COMPACT_BATCH_SIZE)
+    parser.add_argument("--max-items", type=int, default=config.COMPACT_MAX_ITEMS_PER_RUN)
+    parser.add_argument("--ops-per-second", type=float, default=config.COMPACT_OPS_PER_SECOND)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from services.job_store import create_job_store
+    from services.storage_service import StorageService
+
+    job_store = create_job_store()
+    compactor = Compactor(
+        job_store,
+        StorageService().bucket,
+        batch_size=args.batch_size,
+        max_items=args.max_items,
+        ops_per_second=args.ops_per_second,
+        dry_run=args.dry_run
+    )
+    report = compactor.run(args.sets)
+    job_store.flush()
+    print(json.dumps(report, indent=2))
+    return 1 if any(entry["errors"] for entry in report.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
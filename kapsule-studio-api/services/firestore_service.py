@@ -1,156 +1,106 @@
 import logging
 from datetime import datetime
+from typing import Dict, List, Optional, Tuple
 import config
+from services.job_store import DocumentNotFound, JobStore
 
 logger = logging.getLogger(__name__)
 
 
-class FirestoreService:
-    """Service for handling Firestore job tracking operations."""
+class FirestoreService(JobStore):
+    """Job store backed by Cloud Firestore (JOB_STORE=firestore)."""
     
-    def __init__(self):
-        """Initialize Firestore client."""
-        try:
-            from google.cloud import firestore
-            self.client = firestore.Client(project=config.GCP_PROJECT_ID)
-            self.jobs_collection = self.client.collection(config.JOBS_COLLECTION)
-            logger.info(f"FirestoreService initialized with collection: {config.JOBS_COLLECTION}")
-        except Exception as e:
-            logger.warning(f"FirestoreService initialization failed: {e}")
-            logger.info("Running in mock mode for testing")
-            self.client = None
-            self.jobs_collection = None
-            self._mock_jobs = {}  # In-memory storage for testing
+    backend = "firestore"
     
-    def create_job(self, request_data: dict) -> str:
+    def __init__(self):
         """
-        Create a new job document in Firestore.
+        Initialize Firestore client.
         
-        Args:
-            request_data: Dictionary containing job details (prompt, audio_url, etc.)
-            
-        Returns:
-            Job ID (Firestore document ID)
+        Raises:
+            Exception: If the client can't be created (e.g. no credentials); use
+                JOB_STORE=memory or sqlite to run without Firestore
         """
-        job_data = {
-            "status": "queued",
-            "createdAt": datetime.utcnow(),
-            "prompt": request_data.get("prompt"),
-            "audio_url": request_data.get("audio_url"),
-            "duration": request_data.get("duration"),
-            "genre": request_data.get("genre"),
-            "visualStyle": request_data.get("visualStyle"),
-            "cameraMovement": request_data.get("cameraMovement"),
-            "mood": request_data.get("mood"),
-            "subject": request_data.get("subject"),
-            "setting": request_data.get("setting"),
-            "extra": request_data.get("extra", "")
-        }
+        super().__init__()
         
-        if self.client is None:
-            # Mock mode - use in-memory storage
-            import uuid
-            job_id = str(uuid.uuid4())
-            self._mock_jobs[job_id] = job_data
-            logger.info(f"MOCK: Created job: {job_id}")
-            return job_id
-        
-        # Create document and get auto-generated ID
-        _, doc_ref = self.jobs_collection.add(job_data)
-        job_id = doc_ref.id
-        
-        logger.info(f"Created job: {job_id}")
-        
-        return job_id
+        from google.cloud import firestore
+        try:
+            self.client = firestore.Client(project=config.GCP_PROJECT_ID)
+        except Exception as e:
+            logger.error(f"FirestoreService initialization failed: {e}")
+            raise
+        self.jobs_collection = self.client.collection(config.JOBS_COLLECTION)
+        logger.info(f"FirestoreService initialized with collection: {config.JOBS_COLLECTION}")
     
-    def update_job_status(
-        self,
-        job_id: str,
-        status: str,
-        video_url: str = None,
-        error: str = None
-    ) -> None:
-        """
-        Update job status and related fields.
-        
-        Args:
-            job_id: Job ID to update
-            status: New status (queued, processing, complete, error)
-            video_url: Optional video URL for completed jobs
-            error: Optional error message for failed jobs
-        """
-        if self.client is None:
-            # Mock mode - update in-memory storage
-            if job_id in self._mock_jobs:
-                self._mock_jobs[job_id]["status"] = status
-                self._mock_jobs[job_id]["updatedAt"] = datetime.utcnow()
-                
-                if status == "complete":
-                    self._mock_jobs[job_id]["completedAt"] = datetime.utcnow()
-                    if video_url:
-                        self._mock_jobs[job_id]["video_url"] = video_url
-                
-                if status == "error" and error:
-                    self._mock_jobs[job_id]["error"] = error
-                    self._mock_jobs[job_id]["completedAt"] = datetime.utcnow()
-                
-                logger.info(f"MOCK: Updated job {job_id} to status: {status}")
+    def _insert(self, documents: List[Tuple[str, str, dict]]) -> None:
+        if len(documents) == 1:
+            collection, doc_id, data = documents[0]
+            self.client.collection(collection).document(doc_id).set(data)
             return
         
-        doc_ref = self.jobs_collection.document(job_id)
-        
-        update_data = {
-            "status": status,
-            "updatedAt": datetime.utcnow()
-        }
-        
-        # Add completion timestamp for completed jobs
-        if status == "complete":
-            update_data["completedAt"] = datetime.utcnow()
-            if video_url:
-                update_data["video_url"] = video_url
-        
-        # Add error message for failed jobs
-        if status == "error" and error:
-            update_data["error"] = error
-            update_data["completedAt"] = datetime.utcnow()
-        
-        doc_ref.update(update_data)
-        
-        logger.info(f"Updated job {job_id} to status: {status}")
+        batch = self.client.batch()
+        for collection, doc_id, data in documents:
+            batch.set(self.client.collection(collection).document(doc_id), data)
+        batch.commit()
     
-    def get_job(self, job_id: str) -> dict:
-        """
-        Retrieve job document by ID.
-        
-        Args:
-            job_id: Job ID to retrieve
-            
-        Returns:
-            Job data dictionary or None if not found
-        """
-        if self.client is None:
-            # Mock mode - get from in-memory storage
-            if job_id in self._mock_jobs:
-                job_data = self._mock_jobs[job_id].copy()
-                job_data["job_id"] = job_id
-                logger.info(f"MOCK: Retrieved job: {job_id}, status: {job_data.get('status')}")
-                return job_data
-            else:
-                logger.warning(f"MOCK: Job not found: {job_id}")
-                return None
-        
-        doc_ref = self.jobs_collection.document(job_id)
-        doc = doc_ref.get()
-        
-        if not doc.exists:
-            logger.warning(f"Job not found: {job_id}")
-            return None
-        
-        job_data = doc.to_dict()
-        job_data["job_id"] = job_id
-        
-        logger.info(f"Retrieved job: {job_id}, status: {job_data.get('status')}")
+    def _get(self, collection: str, doc_id: str) -> Optional[dict]:
+        snapshot = self.client.collection(collection).document(doc_id).get()
+        return snapshot.to_dict() if snapshot.exists else None
+    
+    def _get_many(self, collection: str, doc_ids: List[str], fields: Tuple[str, ...] = None) -> Dict[str, dict]:
+        refs = [self.client.collection(collection).document(doc_id) for doc_id in doc_ids]
+        documents = self.client.get_all(refs, field_paths=list(fields) if fields is not None else None)
+        return {doc.id: doc.to_dict() for doc in documents if doc.exists}
+    
+    def _update(self, collection: str, doc_id: str, fields: dict) -> None:
+        from google.api_core.exceptions import NotFound
         
-        return job_data
-
+        try:
+            self.client.collection(collection).document(doc_id).update(fields)
+        except NotFound as e:
+            raise DocumentNotFound(f"{collection}/{doc_id}") from e
+    
+    def _transact(self, collection, doc_id, decide):
+        from google.cloud import firestore
+        
+        doc_ref = self.client.collection(collection).document(doc_id)
+        
+        @firestore.transactional
+        def run(transaction):
+            snapshot = doc_ref.get(transaction=transaction)
+            writes, result = decide(snapshot.to_dict() if snapshot.exists else None)
+            for write_collection, write_id, data, merge in writes:
+                ref = self.client.collection(write_collection).document(write_id)
+                if merge:
+                    transaction.update(ref, data)
+                else:
+                    transaction.set(ref, data)
+            return result
+        
+        return run(self.client.transaction())
+    
+    def _expired_leases(self, now: datetime, limit: int) -> List[str]:
+        query = self.jobs_collection.where("lease_expires_at", "<", now).limit(limit)
+        return [doc.id for doc in query.stream()]
+    
+    def _query_jobs(self, job_filter, after, limit, fields):
+        # Filtered listings need the composite indexes in firestore.indexes.json
+        from google.cloud import firestore
+        
+        query = self.jobs_collection
+        if job_filter.status is not None:
+            query = query.where("status", "==", job_filter.status)
+        if job_filter.genre is not None:
+            query = query.where("genre", "==", job_filter.genre)
+        if job_filter.audio_url is not None:
+            query = query.where("audio_url", "==", job_filter.audio_url)
+        if job_filter.created_after is not None:
+            query = query.where("createdAt", ">=", job_filter.created_after)
+        if job_filter.created_before is not None:
+            query = query.where("createdAt", "<", job_filter.created_before)
+        query = query.order_by("createdAt", direction=firestore.Query.DESCENDING)
+        query = query.order_by("__name__", direction=firestore.Query.DESCENDING)
+        if after is not None:
+            query = query.start_after({"createdAt": after[0], "__name__": after[1]})
+        
+        query = query.select(list(fields)).limit(limit)
+        return [(doc.id, doc.to_dict()) for doc in query.stream()]
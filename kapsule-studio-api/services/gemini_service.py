@@ -1,13 +1,22 @@
 import logging
 import json
+import threading
 import time
-from typing import Dict, Optional
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
 from google.auth import default
+from google.auth.credentials import AnonymousCredentials
 from google.auth.transport.requests import Request
 
 import config
+from utils import metrics
+from utils.circuit_breaker import CircuitBreaker
+from utils.metrics import observe_upstream
+from utils.region_router import RegionRouter
 
 logger = logging.getLogger(__name__)
 
@@ -21,23 +30,76 @@ SYSTEM_INSTRUCTIONS = (
 )
 
 
+class _RecentLatencies:
+    """Latencies of the last successful Gemini requests, for the hedge delay."""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._values = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float) -> None:
+        with self._lock:
+            self._values.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        with self._lock:
+            values = sorted(self._values)
+        if len(values) < self.min_samples:
+            return None
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
 class GeminiService:
     def __init__(self) -> None:
-        self.credentials, _ = default()
-        self.api_base = f"https://{config.GEMINI_LOCATION}-aiplatform.googleapis.com/v1"
-        self.model_endpoint = (
-            f"{self.api_base}/projects/{config.GCP_PROJECT_ID}/locations/{config.GEMINI_LOCATION}/publishers/google/models/{config.GEMINI_MODEL}:generateContent"
+        if config.VERTEX_API_ENDPOINT:
+            # Local stand-in (load tests) - no Google credentials involved
+            self.credentials = AnonymousCredentials()
+        else:
+            self.credentials, _ = default()
+        # Each call goes to the healthiest region; hedges go to another one when there is one
+        self.router = RegionRouter("gemini", config.GEMINI_LOCATIONS, config.GEMINI_BREAKER_SLOW_CALL_SECONDS)
+        self.breaker = CircuitBreaker(
+            "gemini",
+            config.GEMINI_BREAKER_FAILURE_THRESHOLD,
+            config.GEMINI_BREAKER_SLOW_CALL_SECONDS,
+            config.GEMINI_BREAKER_RESET_SECONDS
         )
+        self.latencies = _RecentLatencies()
+        # Primary and hedged requests; a losing request runs out in the background
+        self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="gemini")
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=32)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         logger.info("GeminiService initialized with model %s", config.GEMINI_MODEL)
 
+    @staticmethod
+    def _api_base(location: str) -> str:
+        if config.VERTEX_API_ENDPOINT:
+            return f"{config.VERTEX_API_ENDPOINT}/v1"
+        return f"https://{location}-aiplatform.googleapis.com/v1"
+
+    def _model_path(self, location: str) -> str:
+        return f"{self._api_base(location)}/projects/{config.GCP_PROJECT_ID}/locations/{location}/publishers/google/models/{config.GEMINI_MODEL}"
+
     def _get_access_token(self) -> str:
+        if isinstance(self.credentials, AnonymousCredentials):
+            return "anonymous"
         if not self.credentials.valid:
             self.credentials.refresh(Request())
         return self.credentials.token
 
-    def enhance(self, base_prompt: str, options: Dict[str, str], timeout_s: int = 20) -> Optional[str]:
-        """Call Gemini to enhance the prompt. Returns enhanced string or None on failure."""
-        payload = {
+    def warm_up(self) -> None:
+        """Fetch an access token and open a pooled connection to each Vertex region."""
+        token = self._get_access_token()
+        # Any response will do: the point is the TLS handshake, kept in the pool
+        for api_base in dict.fromkeys(self._api_base(location) for location in self.router.regions):
+            self.session.get(api_base, headers={"Authorization": f"Bearer {token}"}, timeout=10)
+
+    @staticmethod
+    def _payload(base_prompt: str, options: Dict[str, str]) -> dict:
+        return {
             "contents": [
                 {
                     "role": "user",
@@ -53,28 +115,174 @@ class GeminiService:
             ]
         }
 
-        headers = {
+    def _headers(self) -> Dict[str, str]:
+        return {
             "Authorization": f"Bearer {self._get_access_token()}",
             "Content-Type": "application/json",
         }
 
+    @staticmethod
+    def _response_texts(data: dict) -> List[str]:
+        # Vertex response structure varies; support common forms
+        candidates = data.get("candidates") or []
+        if not candidates:
+            return []
+        parts = candidates[0].get("content", {}).get("parts", [])
+        return [p.get("text", "") for p in parts if isinstance(p, dict)]
+
+    def _request(self, payload: dict, headers: Dict[str, str], timeout_s: float, region: str) -> Optional[str]:
+        """One generateContent request to a region (recorded by the router). Returns the text, or None on failure."""
+        start = time.perf_counter()
         try:
-            resp = requests.post(self.model_endpoint, json=payload, headers=headers, timeout=timeout_s)
+            resp = self.session.post(f"{self._model_path(region)}:generateContent", json=payload, headers=headers, timeout=timeout_s)
+            observe_upstream("gemini", "generateContent", start, resp.status_code)
             if resp.status_code != 200:
-                logger.warning("Gemini enhancer error %s: %s", resp.status_code, resp.text[:500])
+                logger.warning("Gemini enhancer error %s in %s: %s", resp.status_code, region, resp.text[:500])
+                if resp.status_code == 429 or resp.status_code >= 500:
+                    self.router.record_failure(region)
+                else:
+                    self.router.record_success(region, time.perf_counter() - start, observe_latency=False)
                 return None
 
-            data = resp.json()
-            # Vertex response structure varies; support common forms
-            candidates = data.get("candidates") or []
-            if not candidates:
-                return None
-            parts = candidates[0].get("content", {}).get("parts", [])
-            texts = [p.get("text", "") for p in parts if isinstance(p, dict)]
+            texts = self._response_texts(resp.json())
             result = " ".join(t for t in texts if t).strip()
+            elapsed = time.perf_counter() - start
+            self.router.record_success(region, elapsed)
+            if result:
+                self.latencies.add(elapsed)
             return result or None
         except requests.RequestException as e:
+            observe_upstream("gemini", "generateContent", start, "error")
+            logger.warning("Gemini enhancer request to %s failed: %s", region, e)
+            self.router.record_failure(region)
+            return None
+
+    def _hedge_delay(self, budget_s: float) -> Optional[float]:
+        """Seconds before a hedged request is sent (the observed p95), or None for no hedge."""
+        if not config.GEMINI_HEDGE_ENABLED:
+            return None
+        p95 = self.latencies.quantile(0.95)
+        delay = max(config.GEMINI_HEDGE_MIN_DELAY_SECONDS, config.GEMINI_HEDGE_DEFAULT_DELAY_SECONDS if p95 is None else p95)
+        return delay if delay < budget_s else None
+
+    def enhance(self, base_prompt: str, options: Dict[str, str], budget_s: float = None) -> Optional[str]:
+        """
+        Call Gemini to enhance the prompt. Returns enhanced string or None on failure.
+
+        The call gets budget_s (GEMINI_LATENCY_BUDGET_SECONDS) in total. If the first
+        request hasn't answered by the observed p95 latency (or has already failed),
+        a hedged second request is sent and the first answer wins. While the circuit
+        breaker is open this returns None at once.
+        """
+        if not self.breaker.allow():
+            return None
+
+        budget = budget_s or config.GEMINI_LATENCY_BUDGET_SECONDS
+        start = time.monotonic()
+        deadline = start + budget
+        try:
+            payload, headers = self._payload(base_prompt, options), self._headers()
+        except Exception as e:
             logger.warning("Gemini enhancer request failed: %s", e)
+            self.breaker.record_failure()
             return None
 
+        primary_region = self.router.pick_or_preferred()
+        pending = {self._executor.submit(self._request, payload, headers, budget, primary_region): "primary"}
+        delay = self._hedge_delay(budget)
+        hedge_at = None if delay is None else start + delay
+        hedged = False
+        result, winner = None, None
+        while pending and result is None:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            wake = deadline if hedge_at is None else min(deadline, hedge_at)
+            done, _ = wait(pending, timeout=wake - now, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = pending.pop(future)
+                text = future.result()
+                if text and result is None:
+                    result, winner = text, name
+            if result is None and hedge_at is not None and (not pending or time.monotonic() >= hedge_at):
+                remaining = deadline - time.monotonic()
+                # Hedge in another region when one is healthy, so a regional slowdown doesn't hit both requests
+                hedge_region = self.router.pick(exclude=[primary_region]) or self.router.pick_or_preferred()
+                if hedge_region != primary_region and not pending:
+                    self.router.failed_over(primary_region, hedge_region, "request failed")
+                pending[self._executor.submit(self._request, payload, headers, remaining, hedge_region)] = "hedge"
+                hedge_at = None
+                hedged = True
+
+        elapsed = time.monotonic() - start
+        if hedged:
+            metrics.GEMINI_HEDGES_TOTAL.inc(winner=winner or "none")
+        if result is None:
+            if pending:
+                logger.warning("Gemini enhancer gave no answer within the %.1fs budget", budget)
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success(elapsed)
+        return result
+
+    def enhance_stream(
+        self,
+        base_prompt: str,
+        options: Dict[str, str],
+        timeout_s: int = 20,
+        stop: Optional[threading.Event] = None
+    ) -> Iterator[str]:
+        """
+        Stream the enhanced prompt from Gemini (streamGenerateContent with alt=sse).
+
+        Args:
+            base_prompt: Rule-based prompt to enhance
+            options: Structured options sent alongside it
+            timeout_s: Connect timeout and the longest gap allowed between chunks
+            stop: Once set, the stream is closed after the chunk in flight
+
+        Yields:
+            Text fragments in the order Gemini produces them
+
+        Raises:
+            Exception: If the request fails or Gemini answers with an error status,
+                so callers can tell a broken stream from a finished one
+        """
+        start = time.perf_counter()
+        status = "error"
+        region = self.router.pick_or_preferred()
+        recorded = False  # Whether the router has heard how the call went
+        try:
+            with self.session.post(
+                f"{self._model_path(region)}:streamGenerateContent",
+                params={"alt": "sse"},
+                json=self._payload(base_prompt, options),
+                headers=self._headers(),
+                timeout=timeout_s,
+                stream=True
+            ) as resp:
+                status = resp.status_code
+                if resp.status_code != 200:
+                    raise Exception(f"Gemini stream error {resp.status_code} in {region}: {resp.text[:500]}")
 
+                # Each server-sent event carries one GenerateContentResponse chunk
+                for line in resp.iter_lines(decode_unicode=True):
+                    if stop is not None and stop.is_set():
+                        return
+                    if not line or not line.startswith("data:"):
+                        continue
+                    text = "".join(self._response_texts(json.loads(line[len("data:"):])))
+                    if text:
+                        if not recorded:
+                            # The region's latency for a stream is the time to the first text
+                            self.router.record_success(region, time.perf_counter() - start)
+                            recorded = True
+                        yield text
+        finally:
+            observe_upstream("gemini", "streamGenerateContent", start, status)
+            if not recorded:
+                # Errors, and streams given up on before their first text (first-token deadline), count against the region
+                if status == "error" or status == 429 or status >= 500 or (stop is not None and stop.is_set()):
+                    self.router.record_failure(region)
+                else:
+                    self.router.record_success(region, time.perf_counter() - start, observe_latency=False)
@@ -0,0 +1,1238 @@
+"""
+Job storage: the JobStore interface and its in-memory and SQLite backends.
+
+JobStore holds everything the API does with job documents (write-behind job
+creation, status updates, idempotency keys, leases) on top of a handful of
+storage primitives that each backend implements:
+
+    firestore - Cloud Firestore (services/firestore_service.py); production
+    sqlite    - one SQLite file in WAL mode; single-node deployments and local benchmarks
+    memory    - a bounded, thread-safe dict (LRU + TTL); development and load tests
+
+The backend is chosen explicitly with JOB_STORE (see create_job_store); nothing
+falls back to another backend silently. tests/test_job_store.py runs the same
+conformance tests against every backend; benchmarks/job_store_bench.py times them.
+"""
+
+import base64
+import binascii
+import bisect
+import copy
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+import config
+from utils.ids import new_job_id
+from utils.metrics import JOB_WRITE_BEHIND_FAILURES_TOTAL, JOB_WRITE_BEHIND_SECONDS
+from utils.ttl_cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Statuses a job never leaves
+TERMINAL_STATUSES = ("complete", "error", "cancelled")
+JOB_STATUSES = ("queued", "processing") + TERMINAL_STATUSES
+
+# Fields list_jobs returns by default (the prompt and request options are left out)
+JOB_SUMMARY_FIELDS = (
+    "status", "createdAt", "completedAt", "genre", "duration", "priority",
+    "batch_id", "attempts", "video_url", "error",
+)
+
+# A document write: (collection, doc_id, data, merge) - merge=False creates/replaces the document
+Write = Tuple[str, str, dict, bool]
+
+
+class IdempotencyKeyConflict(Exception):
+    """Raised when an Idempotency-Key is reused with a different request body."""
+
+
+class DocumentNotFound(LookupError):
+    """Raised when updating a document that doesn't exist."""
+
+
+class InvalidCursor(ValueError):
+    """Raised when a list_jobs cursor can't be decoded."""
+
+
+def _key_doc_id(idempotency_key: str) -> str:
+    # Keys are client-chosen strings; hash them into a valid, fixed-length document ID
+    return hashlib.sha256(idempotency_key.encode()).hexdigest()
+
+
+def _utc(value: datetime) -> datetime:
+    """Aware UTC datetime (naive datetimes are UTC, as written by utcnow())."""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def _project(data: dict, fields: Optional[Tuple[str, ...]]) -> dict:
+    return data if fields is None else {field: data[field] for field in fields if field in data}
+
+
+def encode_cursor(created_at: datetime, job_id: str) -> str:
+    """Opaque list_jobs cursor: the (createdAt, job ID) of the last job on a page."""
+    payload = json.dumps([_utc(created_at).isoformat(), job_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """
+    Position encoded by encode_cursor.
+
+    Raises:
+        InvalidCursor: If the cursor is malformed
+    """
+    try:
+        created_at, job_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return _utc(datetime.fromisoformat(created_at)), str(job_id)
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+
+class JobFilter:
+    """list_jobs filters; created_after is inclusive, created_before exclusive."""
+
+    def __init__(
+        self,
+        status: str = None,
+        genre: str = None,
+        created_after: datetime = None,
+        created_before: datetime = None,
+        audio_url: str = None
+    ):
+        self.status = status
+        self.genre = genre
+        self.audio_url = audio_url
+        self.created_after = _utc(created_after) if created_after else None
+        self.created_before = _utc(created_before) if created_before else None
+
+    def matches(self, job: dict) -> bool:
+        """Whether a job passes the equality filters (range checked by the caller)."""
+        return (
+            (self.status is None or job.get("status") == self.status)
+            and (self.genre is None or job.get("genre") == self.genre)
+            and (self.audio_url is None or job.get("audio_url") == self.audio_url)
+        )
+
+
+class JobStore(ABC):
+    """Job, batch and idempotency-key documents, independent of where they are stored."""
+
+    backend = None  # JOB_STORE name
+
+    def __init__(self):
+        # Write-behind state: documents created by create_job/create_batch that are still being written
+        self._unpersisted = {}  # (collection, doc_id) -> data, served to readers until the write lands
+        self._writes = {}  # (collection, doc_id) -> Future of the write
+        # Documents whose write failed for good: served (jobs as failed) to pollers for a while
+        self._unsaved = TTLCache("unsaved_job", config.JOB_WRITE_FAILED_CACHE_SIZE, config.JOB_WRITE_FAILED_TTL_SECONDS)
+        self._write_lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(
+            max_workers=config.JOB_WRITE_BEHIND_WORKERS,
+            thread_name_prefix="job-writer"
+        )
+
+    # Storage primitives (per backend)
+
+    @abstractmethod
+    def _insert(self, documents: List[Tuple[str, str, dict]]) -> None:
+        """Create documents (collection, doc_id, data), all in one atomic write."""
+
+    @abstractmethod
+    def _get(self, collection: str, doc_id: str) -> Optional[dict]:
+        """A document's data, or None if it doesn't exist."""
+
+    @abstractmethod
+    def _get_many(self, collection: str, doc_ids: List[str], fields: Tuple[str, ...] = None) -> Dict[str, dict]:
+        """Data of the documents that exist, by ID (only `fields`, if given)."""
+
+    @abstractmethod
+    def _update(self, collection: str, doc_id: str, fields: dict) -> None:
+        """
+        Merge fields into an existing document.
+
+        Raises:
+            DocumentNotFound: If the document doesn't exist
+        """
+
+    @abstractmethod
+    def _transact(self, collection: str, doc_id: str, decide: Callable[[Optional[dict]], Tuple[List[Write], object]]):
+        """
+        Read a document and apply the writes decide() returns for it, atomically.
+
+        decide(current data or None) -> (writes, result); returns result. May be
+        called more than once if the backend retries on contention.
+        """
+
+    @abstractmethod
+    def _expired_leases(self, now: datetime, limit: int) -> List[str]:
+        """IDs of jobs whose lease_expires_at is before now."""
+
+    @abstractmethod
+    def _query_jobs(
+        self,
+        job_filter: JobFilter,
+        after: Optional[Tuple[datetime, str]],
+        limit: int,
+        fields: Tuple[str, ...]
+    ) -> List[Tuple[str, dict]]:
+        """
+        Jobs matching job_filter, newest first: ordered by (createdAt, job ID)
+        descending and starting after the `after` position. Returns (job_id, data)
+        with only `fields` (which include createdAt).
+        """
+
+    # Jobs
+
+    @staticmethod
+    def _new_job_data(request_data: dict) -> dict:
+        job_data = {
+            "status": "queued",
+            "createdAt": datetime.utcnow(),
+            "prompt": request_data.get("prompt"),
+            "audio_url": request_data.get("audio_url"),
+            "duration": request_data.get("duration"),
+            "genre": request_data.get("genre"),
+            "visualStyle": request_data.get("visualStyle"),
+            "cameraMovement": request_data.get("cameraMovement"),
+            "mood": request_data.get("mood"),
+            "subject": request_data.get("subject"),
+            "setting": request_data.get("setting"),
+            "lighting": request_data.get("lighting"),
+            "cameraType": request_data.get("cameraType"),
+            "creativeIntensity": request_data.get("creativeIntensity"),
+            "extra": request_data.get("extra", ""),
+            "priority": request_data.get("priority"),
+            "trace_id": request_data.get("trace_id"),
+            "attempts": 1
+        }
+        if request_data.get("veo_clip_uri"):
+            # Clip library clip (instant mode): the run only downloads it
+            job_data["veo_clip_uri"] = request_data["veo_clip_uri"]
+        return job_data
+
+    def create_job(self, request_data: dict) -> str:
+        """
+        Create a new job, writing its document in the background.
+
+        The job ID (a UUIDv7) is generated locally and returned right away. Until the
+        document is written, get_job serves the job from memory, and the other
+        writes to the job wait for the document first, so they never race it.
+
+        Args:
+            request_data: Dictionary containing job details (prompt, audio_url, etc.)
+
+        Returns:
+            Job ID (document ID)
+        """
+        job_id = new_job_id()
+        self._write_behind([(config.JOBS_COLLECTION, job_id, self._new_job_data(request_data))])
+        return job_id
+
+    def create_batch(self, requests_data: List[dict], batch_fields: dict) -> Tuple[str, List[str]]:
+        """
+        Create a batch and its child jobs, written together in the background.
+
+        The batch document and every job document go out in one batched write, so
+        the batch costs one commit instead of one round trip per job. Until it
+        lands, reads are served from memory as with create_job.
+
+        Args:
+            requests_data: One dictionary of job details per child job
+            batch_fields: Extra fields stored on the batch document (e.g. priority, trace_id)
+
+        Returns:
+            (batch_id, job_ids) - job_ids in the order of requests_data
+        """
+        batch_id = new_job_id()
+        job_ids = [new_job_id() for _ in requests_data]
+
+        documents = [
+            (config.BATCHES_COLLECTION, batch_id, dict(batch_fields, createdAt=datetime.utcnow(), job_ids=job_ids))
+        ]
+        for job_id, request_data in zip(job_ids, requests_data):
+            job_data = self._new_job_data(request_data)
+            job_data["batch_id"] = batch_id
+            documents.append((config.JOBS_COLLECTION, job_id, job_data))
+        self._write_behind(documents)
+
+        return batch_id, job_ids
+
+    def _write_behind(self, documents: List[Tuple[str, str, dict]]) -> None:
+        """Queue new documents (collection, doc_id, data) for one write; readers see them right away."""
+        with self._write_lock:
+            future = self._writer.submit(self._persist, documents, time.perf_counter())
+            for collection, doc_id, data in documents:
+                self._unpersisted[(collection, doc_id)] = data
+                self._writes[(collection, doc_id)] = future
+
+    def _persist(self, documents: List[Tuple[str, str, dict]], accepted_at: float) -> None:
+        """Write documents queued by _write_behind (runs on the writer pool)."""
+        names = ", ".join(f"{collection}/{doc_id}" for collection, doc_id, _ in documents)
+        delay = 0.5
+        for attempt in range(1, config.JOB_WRITE_BEHIND_ATTEMPTS + 1):
+            try:
+                self._insert(documents)
+                logger.info(f"Created {names}")
+                break
+            except Exception as e:
+                if attempt == config.JOB_WRITE_BEHIND_ATTEMPTS:
+                    # No longer pending: pollers get the jobs as failed for a while, and the
+                    # job's own run finds no document and stops
+                    logger.error(f"Failed to persist {names} after {attempt} attempts: {e}")
+                    JOB_WRITE_BEHIND_FAILURES_TOTAL.inc()
+                    with self._write_lock:
+                        for collection, doc_id, data in documents:
+                            if collection == config.JOBS_COLLECTION:
+                                data.update(status="error", error="The job could not be saved. Please try again.")
+                            self._unsaved.set((collection, doc_id), data)
+                            self._unpersisted.pop((collection, doc_id), None)
+                            self._writes.pop((collection, doc_id), None)
+                    return
+                logger.warning(f"Persisting {names} failed (attempt {attempt}), retrying in {delay:.1f}s: {e}")
+                time.sleep(delay)
+                delay *= 2
+
+        JOB_WRITE_BEHIND_SECONDS.observe(time.perf_counter() - accepted_at)
+        with self._write_lock:
+            for collection, doc_id, _ in documents:
+                self._unpersisted.pop((collection, doc_id), None)
+                self._writes.pop((collection, doc_id), None)
+
+    def _pending_document(self, collection: str, doc_id: str) -> Optional[dict]:
+        """Copy of a document that is accepted but not written yet, or None."""
+        with self._write_lock:
+            pending = self._unpersisted.get((collection, doc_id))
+            return dict(pending) if pending is not None else None
+
+    def _unsaved_document(self, collection: str, doc_id: str) -> Optional[dict]:
+        """Copy of a document whose write failed for good (jobs read as failed), or None."""
+        unsaved = self._unsaved.get((collection, doc_id))
+        return dict(unsaved) if unsaved is not None else None
+
+    def _wait_persisted(self, job_id: str) -> None:
+        """Block until a job accepted by create_job/create_batch has its document."""
+        with self._write_lock:
+            future = self._writes.get((config.JOBS_COLLECTION, job_id))
+        if future is not None:
+            future.result()
+
+    def pending_writes(self) -> int:
+        """Number of accepted job and batch documents still being written."""
+        return len(self._writes)
+
+    def flush(self, timeout: float = None) -> None:
+        """Wait for pending job document writes (e.g. before the instance shuts down)."""
+        with self._write_lock:
+            futures = set(self._writes.values())
+        if futures:
+            logger.info(f"Flushing {len(futures)} pending job writes")
+            wait(futures, timeout=timeout)
+
+    # Idempotency keys
+
+    def find_idempotent_job(self, idempotency_key: str, fingerprint: str) -> Optional[str]:
+        """
+        Look up the job created earlier with this Idempotency-Key.
+
+        Args:
+            idempotency_key: Client-supplied key
+            fingerprint: Hash of the request body the key is being used with
+
+        Returns:
+            Job ID, or None if the key is unused (or expired)
+
+        Raises:
+            IdempotencyKeyConflict: If the key was used with a different request
+        """
+        entry = self._get(config.IDEMPOTENCY_COLLECTION, _key_doc_id(idempotency_key))
+        return self._idempotent_job_id(entry, fingerprint)
+
+    @staticmethod
+    def _idempotent_job_id(entry: Optional[dict], fingerprint: str) -> Optional[str]:
+        if entry is None or entry["expiresAt"] <= datetime.now(timezone.utc):
+            return None
+        if entry["fingerprint"] != fingerprint:
+            raise IdempotencyKeyConflict("Idempotency-Key was already used with a different request")
+        return entry["job_id"]
+
+    def create_job_idempotent(self, request_data: dict, idempotency_key: str, fingerprint: str) -> Tuple[str, bool]:
+        """
+        Create a job unless this Idempotency-Key already maps to one.
+
+        The key and the job document are written in one transaction, so concurrent
+        duplicates (e.g. a double-click reaching two instances) end up with one job.
+
+        Args:
+            request_data: Dictionary containing job details (prompt, audio_url, etc.)
+            idempotency_key: Client-supplied key
+            fingerprint: Hash of the request body
+
+        Returns:
+            (job_id, created) - created is False when an existing job was returned
+
+        Raises:
+            IdempotencyKeyConflict: If the key was used with a different request
+        """
+        job_id = new_job_id()
+        job_data = self._new_job_data(request_data)
+        key_id = _key_doc_id(idempotency_key)
+        now = datetime.now(timezone.utc)
+        key_entry = {
+            "fingerprint": fingerprint,
+            "job_id": job_id,
+            "createdAt": now,
+            "expiresAt": now + timedelta(seconds=config.IDEMPOTENCY_KEY_TTL_SECONDS)
+        }
+
+        def decide(entry: Optional[dict]) -> Tuple[List[Write], Tuple[str, bool]]:
+            existing = self._idempotent_job_id(entry, fingerprint)
+            if existing is not None:
+                return [], (existing, False)
+            return [
+                (config.JOBS_COLLECTION, job_id, job_data, False),
+                (config.IDEMPOTENCY_COLLECTION, key_id, key_entry, False),
+            ], (job_id, True)
+
+        job_id, created = self._transact(config.IDEMPOTENCY_COLLECTION, key_id, decide)
+
+        if created:
+            logger.info(f"Created job: {job_id}")
+
+        return job_id, created
+
+    # Job updates
+
+    def update_job_status(
+        self,
+        job_id: str,
+        status: str,
+        video_url: str = None,
+        error: str = None,
+        timings: dict = None
+    ) -> bool:
+        """
+        Update job status and related fields, unless the job has already finished.
+
+        The read and the write happen in one transaction, so a job cancelled or
+        failed meanwhile (e.g. by a DELETE between two heartbeats) never leaves
+        its terminal status again.
+
+        Args:
+            job_id: Job ID to update
+            status: New status (queued, processing, complete, error, cancelled)
+            video_url: Optional video URL for completed jobs
+            error: Optional error message for failed jobs
+            timings: Optional timing ledger of the run (stage durations, bytes, profile)
+
+        Returns:
+            Whether the status was written (False: the job was already complete, error or cancelled)
+
+        Raises:
+            DocumentNotFound: If the job doesn't exist
+        """
+        self._wait_persisted(job_id)
+
+        update_data = {
+            "status": status,
+            "updatedAt": datetime.utcnow()
+        }
+
+        # Start of the current run, for ETAs while processing
+        if status == "processing":
+            update_data["startedAt"] = datetime.utcnow()
+
+        # Add completion timestamp for completed jobs
+        if status == "complete":
+            update_data["completedAt"] = datetime.utcnow()
+            if video_url:
+                update_data["video_url"] = video_url
+
+        # Add error message for failed jobs
+        if status == "error" and error:
+            update_data["error"] = error
+            update_data["completedAt"] = datetime.utcnow()
+
+        if timings is not None:
+            update_data["timings"] = timings
+
+        # Finished jobs no longer need a worker
+        if status in TERMINAL_STATUSES:
+            update_data["lease_expires_at"] = None
+
+        def decide(job: Optional[dict]) -> Tuple[List[Write], Optional[str]]:
+            # result: the terminal status that refused the update, or None once written
+            if job is None:
+                raise DocumentNotFound(f"{config.JOBS_COLLECTION}/{job_id}")
+            if job.get("status") in TERMINAL_STATUSES:
+                return [], job["status"]
+            return [(config.JOBS_COLLECTION, job_id, update_data, True)], None
+
+        finished = self._transact(config.JOBS_COLLECTION, job_id, decide)
+
+        if finished is not None:
+            logger.warning(f"Not updating job {job_id} to status {status}: it is already {finished}")
+            return False
+
+        logger.info(f"Updated job {job_id} to status: {status}")
+        return True
+
+    def update_job(self, job_id: str, fields: dict) -> None:
+        """
+        Merge arbitrary fields into a job document without changing its status.
+
+        Args:
+            job_id: Job ID to update
+            fields: Field values to set (e.g. playlist_url while the job is processing)
+        """
+        self._wait_persisted(job_id)
+
+        update_data = dict(fields)
+        update_data["updatedAt"] = datetime.utcnow()
+
+        self._update(config.JOBS_COLLECTION, job_id, update_data)
+
+        logger.info(f"Updated job {job_id} fields: {sorted(fields)}")
+
+    def cancel_job(self, job_id: str) -> Optional[str]:
+        """
+        Mark a job cancelled unless it has already finished.
+
+        The read and the write happen in one transaction, so a job that completes
+        concurrently is never flipped back to cancelled.
+
+        Args:
+            job_id: Job ID to cancel
+
+        Returns:
+            The job's status before the call (left unchanged if it was terminal), or None if not found
+        """
+        self._wait_persisted(job_id)
+
+        def decide(job: Optional[dict]) -> Tuple[List[Write], Optional[str]]:
+            if job is None:
+                return [], None
+            previous = job.get("status")
+            if previous in TERMINAL_STATUSES:
+                return [], previous
+            return [(config.JOBS_COLLECTION, job_id, {
+                "status": "cancelled",
+                "updatedAt": datetime.utcnow(),
+                "completedAt": datetime.utcnow(),
+                "lease_expires_at": None
+            }, True)], previous
+
+        previous = self._transact(config.JOBS_COLLECTION, job_id, decide)
+
+        if previous is not None and previous not in TERMINAL_STATUSES:
+            logger.info(f"Cancelled job {job_id} (was {previous})")
+
+        return previous
+
+    # Leases
+
+    def find_expired_leases(self, limit: int = 20, expired_before: datetime = None) -> List[str]:
+        """
+        IDs of jobs whose worker stopped renewing their lease.
+
+        Terminal jobs have their lease cleared, so this only finds jobs that were
+        queued or processing on an instance that went away.
+
+        Args:
+            limit: Maximum number of IDs
+            expired_before: Only leases that expired before this time (default: now)
+        """
+        return self._expired_leases(expired_before or datetime.now(timezone.utc), limit)
+
+    def fail_stale_job(self, job_id: str, expired_before: datetime, error: str) -> bool:
+        """
+        Mark an unfinished job as failed if nothing is working on it.
+
+        A job is stale when its lease expired before `expired_before`, or when it
+        never got a lease. Runs as a transaction, so a job that was claimed or
+        finished in the meantime is left alone.
+
+        Args:
+            job_id: Job ID to fail
+            expired_before: Leases that expired after this time still count as live
+            error: Error message stored on the job
+
+        Returns:
+            Whether the job was marked as failed
+        """
+        def decide(job: Optional[dict]) -> Tuple[List[Write], bool]:
+            if job is None or job.get("status") in TERMINAL_STATUSES:
+                return [], False
+            lease = job.get("lease_expires_at")
+            if lease is not None and _utc(lease) >= expired_before:
+                return [], False
+            return [(config.JOBS_COLLECTION, job_id, {
+                "status": "error",
+                "error": error,
+                "updatedAt": datetime.utcnow(),
+                "completedAt": datetime.utcnow(),
+                "lease_expires_at": None
+            }, True)], True
+
+        failed = self._transact(config.JOBS_COLLECTION, job_id, decide)
+
+        if failed:
+            logger.warning(f"Marked stale job {job_id} as failed")
+
+        return failed
+
+    def claim_job(self, job_id: str, worker_id: str, lease_seconds: float, max_attempts: int) -> Optional[dict]:
+        """
+        Take over a job whose lease has expired.
+
+        Runs as a transaction, so when several instances find the same job only one
+        claims it. A job that has already run `max_attempts` times is failed instead.
+
+        Args:
+            job_id: Job ID to claim
+            worker_id: This instance's WORKER_ID
+            lease_seconds: Length of the new lease
+            max_attempts: Runs allowed per job
+
+        Returns:
+            The job data (including checkpoints) if claimed, otherwise None
+        """
+        now = datetime.now(timezone.utc)
+
+        def decide(job: Optional[dict]) -> Tuple[List[Write], Tuple[Optional[dict], Optional[dict]]]:
+            # result: (fields written, job data to return)
+            if job is None or job.get("lease_expires_at") is None or job["lease_expires_at"] >= now:
+                return [], (None, None)
+            if job.get("status") in TERMINAL_STATUSES:
+                fields, claimed = {"lease_expires_at": None}, None
+            elif job.get("attempts", 1) >= max_attempts:
+                fields, claimed = {
+                    "status": "error",
+                    "error": f"Job was interrupted {job.get('attempts', 1)} times and will not be retried",
+                    "completedAt": datetime.utcnow(),
+                    "lease_expires_at": None
+                }, None
+            else:
+                fields = {
+                    "worker_id": worker_id,
+                    "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                    "attempts": job.get("attempts", 1) + 1,
+                    "updatedAt": datetime.utcnow()
+                }
+                claimed = dict(job, **fields, job_id=job_id)
+            return [(config.JOBS_COLLECTION, job_id, fields, True)], (fields, claimed)
+
+        fields, claimed = self._transact(config.JOBS_COLLECTION, job_id, decide)
+
+        if claimed is not None:
+            logger.info(f"Claimed job {job_id} (attempt {claimed['attempts']})")
+        elif fields and fields.get("status") == "error":
+            logger.warning(f"Job {job_id} exceeded {max_attempts} attempts, marked as error")
+
+        return claimed
+
+    @staticmethod
+    def _held_elsewhere(job: dict, worker_id: str) -> bool:
+        """Whether another worker has claimed the job (new jobs have no worker until their first lease)."""
+        return job.get("worker_id") not in (None, worker_id)
+
+    def start_job(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        """
+        Move a job to "processing" for this worker, renewing its lease.
+
+        Runs as a transaction: a job that has finished (cancelled by the user,
+        failed by fail_stale_job) or was claimed by another worker while this run
+        waited is left alone. Resumed runs go through this too, so a lease that
+        expired while the job was queued here can't undo either.
+
+        Args:
+            job_id: Job ID to start
+            worker_id: This instance's WORKER_ID
+            lease_seconds: Length of the renewed lease
+
+        Returns:
+            Whether the job was started (False: this run must stop)
+        """
+        self._wait_persisted(job_id)
+        now = datetime.now(timezone.utc)
+
+        def decide(job: Optional[dict]) -> Tuple[List[Write], Optional[str]]:
+            # result: why the job wasn't started, or None once it was
+            if job is None:
+                return [], "not found"
+            if job.get("status") in TERMINAL_STATUSES:
+                return [], f"already {job['status']}"
+            if self._held_elsewhere(job, worker_id):
+                return [], f"claimed by {job['worker_id']}"
+            return [(config.JOBS_COLLECTION, job_id, {
+                "status": "processing",
+                "startedAt": datetime.utcnow(),
+                "updatedAt": datetime.utcnow(),
+                "worker_id": worker_id,
+                "lease_expires_at": now + timedelta(seconds=lease_seconds)
+            }, True)], None
+
+        refused = self._transact(config.JOBS_COLLECTION, job_id, decide)
+
+        if refused is not None:
+            logger.warning(f"Not starting job {job_id}: {refused}")
+            return False
+
+        logger.info(f"Updated job {job_id} to status: processing")
+        return True
+
+    def renew_lease(self, job_id: str, worker_id: str, lease_seconds: float) -> bool:
+        """
+        Extend this worker's lease on an unfinished job.
+
+        Runs as a transaction, so nothing is written once the job has finished or
+        another worker has claimed it.
+
+        Returns:
+            Whether the lease was renewed (False: the job finished or moved elsewhere)
+        """
+        self._wait_persisted(job_id)
+        now = datetime.now(timezone.utc)
+
+        def decide(job: Optional[dict]) -> Tuple[List[Write], bool]:
+            if job is None or job.get("status") in TERMINAL_STATUSES or self._held_elsewhere(job, worker_id):
+                return [], False
+            return [(config.JOBS_COLLECTION, job_id, {
+                "worker_id": worker_id,
+                "lease_expires_at": now + timedelta(seconds=lease_seconds),
+                "updatedAt": datetime.utcnow()
+            }, True)], True
+
+        return self._transact(config.JOBS_COLLECTION, job_id, decide)
+
+    # Clip library
+
+    def get_library_entries(self, keys: List[str]) -> Dict[str, dict]:
+        """
+        Retrieve clip library entries in one round trip.
+
+        Args:
+            keys: Entry keys (see services.clip_library)
+
+        Returns:
+            Entry data by key (entries that don't exist are left out)
+        """
+        return self._get_many(config.LIBRARY_COLLECTION, keys)
+
+    def update_library_entry(self, key: str, update: Callable[[Optional[dict]], Tuple[Optional[dict], object]]):
+        """
+        Read-modify-write a clip library entry atomically.
+
+        update(copy of the current entry or None) -> (new entry, or None to leave
+        it unchanged, result); returns result. May be called more than once if the
+        backend retries on contention.
+        """
+        def decide(entry: Optional[dict]) -> Tuple[List[Write], object]:
+            new_entry, result = update(copy.deepcopy(entry))
+            if new_entry is None:
+                return [], result
+            new_entry["updatedAt"] = datetime.utcnow()
+            # A full set: the entry may not exist yet
+            return [(config.LIBRARY_COLLECTION, key, new_entry, False)], result
+
+        return self._transact(config.LIBRARY_COLLECTION, key, decide)
+
+    # Reads
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        """
+        Retrieve job document by ID.
+
+        Args:
+            job_id: Job ID to retrieve
+
+        Returns:
+            Job data dictionary or None if not found
+        """
+        # Jobs accepted moments ago are served from memory until their document is written
+        job_data = self._pending_document(config.JOBS_COLLECTION, job_id)
+        if job_data is None:
+            job_data = self._get(config.JOBS_COLLECTION, job_id)
+        if job_data is None:
+            job_data = self._unsaved_document(config.JOBS_COLLECTION, job_id)
+
+        if job_data is None:
+            logger.warning(f"Job not found: {job_id}")
+            return None
+
+        job_data["job_id"] = job_id
+
+        logger.info(f"Retrieved job: {job_id}, status: {job_data.get('status')}", extra={"job_id": job_id, "sample": "job_read"})
+
+        return job_data
+
+    def get_jobs(self, job_ids: List[str], fields: Tuple[str, ...] = None) -> Dict[str, dict]:
+        """
+        Retrieve several job documents in one round trip.
+
+        Args:
+            job_ids: Job IDs to retrieve
+            fields: Only read these fields (a projection), or every field if None
+
+        Returns:
+            Job data by job ID (jobs that don't exist are left out)
+        """
+        jobs = {}
+        missing = []
+        for job_id in job_ids:
+            job_data = self._pending_document(config.JOBS_COLLECTION, job_id)
+            if job_data is not None:
+                jobs[job_id] = dict(_project(job_data, fields), job_id=job_id)
+            else:
+                missing.append(job_id)
+
+        if missing:
+            for job_id, job_data in self._get_many(config.JOBS_COLLECTION, missing, fields).items():
+                jobs[job_id] = dict(job_data, job_id=job_id)
+            for job_id in missing:
+                job_data = None if job_id in jobs else self._unsaved_document(config.JOBS_COLLECTION, job_id)
+                if job_data is not None:
+                    jobs[job_id] = dict(_project(job_data, fields), job_id=job_id)
+
+        return jobs
+
+    def list_jobs(
+        self,
+        job_filter: JobFilter = None,
+        limit: int = 50,
+        cursor: str = None,
+        fields: Tuple[str, ...] = JOB_SUMMARY_FIELDS
+    ) -> Tuple[List[dict], Optional[str]]:
+        """
+        List jobs newest first, one page at a time.
+
+        Pages are keyed by the last job's (createdAt, job ID), so every page costs
+        the same however deep it is (no offset scans), and jobs created meanwhile
+        don't shift later pages. Jobs accepted moments ago show up once their
+        document is written.
+
+        Args:
+            job_filter: Status, genre and creation-time filters
+            limit: Jobs per page
+            cursor: next_cursor of the previous page, or None for the first page
+            fields: Fields returned per job (a projection); job_id is always included
+
+        Returns:
+            (jobs, next_cursor) - next_cursor is None on the last page
+
+        Raises:
+            InvalidCursor: If the cursor is malformed
+        """
+        after = decode_cursor(cursor) if cursor else None
+        query_fields = tuple(dict.fromkeys(fields + ("createdAt",)))
+        rows = self._query_jobs(job_filter or JobFilter(), after, limit + 1, query_fields)
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last_id, last_data = rows[-1]
+            next_cursor = encode_cursor(last_data["createdAt"], last_id)
+
+        jobs = [dict(_project(data, fields), job_id=job_id) for job_id, data in rows]
+        return jobs, next_cursor
+
+    def get_batch(self, batch_id: str) -> Optional[dict]:
+        """
+        Retrieve a batch document by ID.
+
+        Args:
+            batch_id: Batch ID to retrieve
+
+        Returns:
+            Batch data dictionary (with its job_ids) or None if not found
+        """
+        batch_data = self._pending_document(config.BATCHES_COLLECTION, batch_id)
+        if batch_data is None:
+            batch_data = self._get(config.BATCHES_COLLECTION, batch_id)
+        if batch_data is None:
+            batch_data = self._unsaved_document(config.BATCHES_COLLECTION, batch_id)
+
+        if batch_data is None:
+            logger.warning(f"Batch not found: {batch_id}")
+            return None
+
+        batch_data["batch_id"] = batch_id
+        return batch_data
+
+
+class MemoryJobStore(JobStore):
+    """
+    Jobs in a thread-safe in-process dict, bounded per collection.
+
+    Documents expire `ttl_seconds` after their last write, and the least recently
+    used ones are evicted beyond `max_documents`; neither applies to queued or
+    processing jobs, since their run still writes to them. A sorted (createdAt, ID) index
+    serves list_jobs pages without scanning the collection. Nothing survives a
+    restart, and other instances can't see the jobs: meant for development and
+    load tests.
+    """
+
+    backend = "memory"
+
+    def __init__(self, max_documents: int, ttl_seconds: float):
+        super().__init__()
+        self.max_documents = max_documents
+        self.ttl_seconds = ttl_seconds
+        self._collections = {}  # collection -> OrderedDict(doc_id -> (data, written_at)), LRU first
+        self._created_index = {}  # collection -> sorted [(createdAt epoch, doc_id)]
+        self._lock = threading.RLock()
+        logger.info(f"MemoryJobStore initialized (max {max_documents} documents per collection, TTL {ttl_seconds:.0f}s)")
+
+    def _documents(self, collection: str) -> OrderedDict:
+        return self._collections.setdefault(collection, OrderedDict())
+
+    def _index(self, collection: str, doc_id: str, data: dict, add: bool) -> None:
+        """Add a document to (or remove it from) the createdAt index."""
+        created_at = _epoch(data.get("createdAt"))
+        if created_at is None:
+            return
+        index = self._created_index.setdefault(collection, [])
+        key = (created_at, doc_id)
+        position = bisect.bisect_left(index, key)
+        if add:
+            index.insert(position, key)
+        elif position < len(index) and index[position] == key:
+            del index[position]
+
+    def _drop(self, collection: str, doc_id: str) -> None:
+        data, _ = self._documents(collection).pop(doc_id)
+        self._index(collection, doc_id, data, add=False)
+
+    def _lookup(self, collection: str, doc_id: str) -> Optional[dict]:
+        """The stored data (not a copy), refreshing its LRU position; drops it if expired."""
+        documents = self._documents(collection)
+        entry = documents.get(doc_id)
+        if entry is None:
+            return None
+        if self._expired(collection, entry, time.monotonic()):
+            self._drop(collection, doc_id)
+            return None
+        documents.move_to_end(doc_id)
+        return entry[0]
+
+    def _store(self, collection: str, doc_id: str, data: dict) -> None:
+        documents = self._documents(collection)
+        if doc_id in documents:
+            self._drop(collection, doc_id)
+        documents[doc_id] = (data, time.monotonic())
+        self._index(collection, doc_id, data, add=True)
+        if len(documents) > self.max_documents:
+            now = time.monotonic()
+            for expired_id in [candidate for candidate, entry in documents.items() if self._expired(collection, entry, now)]:
+                self._drop(collection, expired_id)
+        while len(documents) > self.max_documents:
+            evicted_id = next(
+                (
+                    candidate for candidate, (candidate_data, _) in documents.items()
+                    if candidate != doc_id and self._evictable(collection, candidate_data)
+                ),
+                None
+            )
+            if evicted_id is None:
+                logger.warning(f"MemoryJobStore over its limit: every other {collection} document is an unfinished job")
+                break
+            self._drop(collection, evicted_id)
+            logger.warning(f"MemoryJobStore full, evicted {collection}/{evicted_id}")
+
+    @staticmethod
+    def _evictable(collection: str, data: dict) -> bool:
+        return collection != config.JOBS_COLLECTION or data.get("status") in TERMINAL_STATUSES
+
+    def _expired(self, collection: str, entry: Tuple[dict, float], now: float) -> bool:
+        data, written_at = entry
+        return now - written_at > self.ttl_seconds and self._evictable(collection, data)
+
+    def _apply(self, writes: List[Write]) -> None:
+        for collection, doc_id, data, merge in writes:
+            if merge:
+                current = self._lookup(collection, doc_id)
+                if current is None:
+                    raise DocumentNotFound(f"{collection}/{doc_id}")
+                data = dict(current, **data)
+            self._store(collection, doc_id, dict(data))
+
+    def _insert(self, documents: List[Tuple[str, str, dict]]) -> None:
+        with self._lock:
+            self._apply([(collection, doc_id, data, False) for collection, doc_id, data in documents])
+
+    def _get(self, collection: str, doc_id: str) -> Optional[dict]:
+        with self._lock:
+            data = self._lookup(collection, doc_id)
+            return dict(data) if data is not None else None
+
+    def _get_many(self, collection: str, doc_ids: List[str], fields: Tuple[str, ...] = None) -> Dict[str, dict]:
+        with self._lock:
+            found = {doc_id: self._lookup(collection, doc_id) for doc_id in doc_ids}
+            return {doc_id: dict(_project(data, fields)) for doc_id, data in found.items() if data is not None}
+
+    def _update(self, collection: str, doc_id: str, fields: dict) -> None:
+        with self._lock:
+            self._apply([(collection, doc_id, fields, True)])
+
+    def _transact(self, collection, doc_id, decide):
+        with self._lock:
+            current = self._lookup(collection, doc_id)
+            writes, result = decide(dict(current) if current is not None else None)
+            self._apply(writes)
+            return result
+
+    def _expired_leases(self, now: datetime, limit: int) -> List[str]:
+        with self._lock:
+            expired = [
+                doc_id for doc_id, (job, _) in self._documents(config.JOBS_COLLECTION).items()
+                if job.get("lease_expires_at") is not None and job["lease_expires_at"] < now
+            ]
+        return expired[:limit]
+
+    def _query_jobs(self, job_filter, after, limit, fields):
+        with self._lock:
+            documents = self._documents(config.JOBS_COLLECTION)
+            index = self._created_index.get(config.JOBS_COLLECTION, [])
+            # Walk the index backwards from the cursor (or the end of the created range)
+            position = len(index)
+            if after is not None:
+                position = bisect.bisect_left(index, (after[0].timestamp(), after[1]))
+            if job_filter.created_before is not None:
+                position = min(position, bisect.bisect_left(index, (job_filter.created_before.timestamp(), "")))
+            floor = job_filter.created_after.timestamp() if job_filter.created_after else None
+
+            rows = []
+            now = time.monotonic()
+            while position > 0 and len(rows) < limit:
+                position -= 1
+                created_at, job_id = index[position]
+                if floor is not None and created_at < floor:
+                    break
+                entry = documents[job_id]
+                if not self._expired(config.JOBS_COLLECTION, entry, now) and job_filter.matches(entry[0]):
+                    rows.append((job_id, _project(entry[0], fields)))
+        return rows
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {"$datetime": value.isoformat()}
+    raise TypeError(f"Cannot store {type(value).__name__} in SQLiteJobStore")
+
+
+def _decode_object(obj: dict):
+    if len(obj) == 1 and "$datetime" in obj:
+        return datetime.fromisoformat(obj["$datetime"])
+    return obj
+
+
+def _epoch(value) -> Optional[float]:
+    """Indexable form of a datetime field."""
+    return _utc(value).timestamp() if isinstance(value, datetime) else None
+
+
+class SQLiteJobStore(JobStore):
+    """
+    Jobs in a single SQLite database in WAL mode.
+
+    Every document is a JSON row. status, createdAt and lease_expires_at are also
+    kept in indexed columns for the lease scan and job listings, and list_jobs
+    filters use composite indexes ending in (created_at, id), so every page is an
+    index range scan. Projections are extracted in SQL, without decoding the prompt. Readers don't
+    block the writer (WAL), and each thread has its own connection. It suits a
+    single node (one instance, local benchmarks); the file isn't shared between
+    instances.
+    """
+
+    backend = "sqlite"
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS documents (
+            collection TEXT NOT NULL,
+            id TEXT NOT NULL,
+            data TEXT NOT NULL,
+            status TEXT,
+            created_at REAL,
+            lease_expires_at REAL,
+            PRIMARY KEY (collection, id)
+        );
+        CREATE INDEX IF NOT EXISTS documents_created_at ON documents (collection, created_at, id);
+        CREATE INDEX IF NOT EXISTS documents_status_created_at ON documents (collection, status, created_at, id);
+        CREATE INDEX IF NOT EXISTS documents_genre_created_at
+            ON documents (collection, json_extract(data, '$.genre'), created_at, id);
+        CREATE INDEX IF NOT EXISTS documents_status_genre_created_at
+            ON documents (collection, status, json_extract(data, '$.genre'), created_at, id);
+        CREATE INDEX IF NOT EXISTS documents_audio_url_created_at
+            ON documents (collection, json_extract(data, '$.audio_url'), created_at, id);
+        CREATE INDEX IF NOT EXISTS documents_lease_expires_at ON documents (collection, lease_expires_at);
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        connection = self._connection()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(self._SCHEMA)
+        logger.info(f"SQLiteJobStore initialized at {path}")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Autocommit mode; multi-statement writes use explicit BEGIN IMMEDIATE
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA synchronous=NORMAL")  # Durable at checkpoints, safe with WAL
+            self._local.connection = connection
+        return connection
+
+    @staticmethod
+    def _row(collection: str, doc_id: str, data: dict) -> tuple:
+        return (
+            collection,
+            doc_id,
+            json.dumps(data, default=_encode_value),
+            data.get("status"),
+            _epoch(data.get("createdAt")),
+            _epoch(data.get("lease_expires_at")),
+        )
+
+    def _select(self, connection: sqlite3.Connection, collection: str, doc_id: str) -> Optional[dict]:
+        row = connection.execute(
+            "SELECT data FROM documents WHERE collection = ? AND id = ?", (collection, doc_id)
+        ).fetchone()
+        return json.loads(row[0], object_hook=_decode_object) if row else None
+
+    def _apply(self, connection: sqlite3.Connection, writes: List[Write]) -> None:
+        for collection, doc_id, data, merge in writes:
+            if merge:
+                current = self._select(connection, collection, doc_id)
+                if current is None:
+                    raise DocumentNotFound(f"{collection}/{doc_id}")
+                data = dict(current, **data)
+            connection.execute(
+                "INSERT OR REPLACE INTO documents (collection, id, data, status, created_at, lease_expires_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                self._row(collection, doc_id, data)
+            )
+
+    def _write(self, run: Callable[[sqlite3.Connection], object]):
+        """Run reads and writes in one IMMEDIATE transaction (takes the write lock up front)."""
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            result = run(connection)
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+        return result
+
+    def _insert(self, documents: List[Tuple[str, str, dict]]) -> None:
+        self._write(lambda connection: self._apply(
+            connection, [(collection, doc_id, data, False) for collection, doc_id, data in documents]
+        ))
+
+    def _get(self, collection: str, doc_id: str) -> Optional[dict]:
+        return self._select(self._connection(), collection, doc_id)
+
+    @staticmethod
+    def _projection(fields: Optional[Tuple[str, ...]]) -> Tuple[str, tuple]:
+        """Column expression (and its parameters) selecting the document data, or only `fields` of it."""
+        if fields is None:
+            return "data", ()
+        expression = "json_object(" + ", ".join("?, data -> ?" for _ in fields) + ")"
+        return expression, tuple(value for field in fields for value in (field, f"$.{field}"))
+
+    @staticmethod
+    def _decode(data: str, fields: Optional[Tuple[str, ...]]) -> dict:
+        decoded = json.loads(data, object_hook=_decode_object)
+        if fields is None:
+            return decoded
+        # json_object has every projected key; leave out the ones the document doesn't set
+        return {field: value for field, value in decoded.items() if value is not None}
+
+    def _get_many(self, collection: str, doc_ids: List[str], fields: Tuple[str, ...] = None) -> Dict[str, dict]:
+        if not doc_ids:
+            return {}
+        projection, projection_params = self._projection(fields)
+        placeholders = ", ".join("?" for _ in doc_ids)
+        rows = self._connection().execute(
+            f"SELECT id, {projection} FROM documents WHERE collection = ? AND id IN ({placeholders})",
+            (*projection_params, collection, *doc_ids)
+        ).fetchall()
+        return {doc_id: self._decode(data, fields) for doc_id, data in rows}
+
+    def _update(self, collection: str, doc_id: str, fields: dict) -> None:
+        self._write(lambda connection: self._apply(connection, [(collection, doc_id, fields, True)]))
+
+    def _transact(self, collection, doc_id, decide):
+        def run(connection):
+            writes, result = decide(self._select(connection, collection, doc_id))
+            self._apply(connection, writes)
+            return result
+        return self._write(run)
+
+    def _expired_leases(self, now: datetime, limit: int) -> List[str]:
+        rows = self._connection().execute(
+            "SELECT id FROM documents WHERE collection = ? AND lease_expires_at < ? LIMIT ?",
+            (config.JOBS_COLLECTION, now.timestamp(), limit)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def _query_jobs(self, job_filter, after, limit, fields):
+        projection, params = self._projection(fields)
+        conditions = ["collection = ?"]
+        params += (config.JOBS_COLLECTION,)
+        if job_filter.status is not None:
+            conditions.append("status = ?")
+            params += (job_filter.status,)
+        if job_filter.genre is not None:
+            conditions.append("json_extract(data, '$.genre') = ?")
+            params += (job_filter.genre,)
+        if job_filter.audio_url is not None:
+            conditions.append("json_extract(data, '$.audio_url') = ?")
+            params += (job_filter.audio_url,)
+        if job_filter.created_after is not None:
+            conditions.append("created_at >= ?")
+            params += (job_filter.created_after.timestamp(),)
+        if job_filter.created_before is not None:
+            conditions.append("created_at < ?")
+            params += (job_filter.created_before.timestamp(),)
+        if after is not None:
+            conditions.append("(created_at, id) < (?, ?)")
+            params += (after[0].timestamp(), after[1])
+
+        rows = self._connection().execute(
+            f"SELECT id, {projection} FROM documents WHERE {' AND '.join(conditions)} "
+            "ORDER BY created_at DESC, id DESC LIMIT ?",
+            params + (limit,)
+        ).fetchall()
+        return [(job_id, self._decode(data, fields)) for job_id, data in rows]
+
+
+def create_job_store(backend: str = None) -> JobStore:
+    """
+    Build the job store selected by JOB_STORE (or `backend`).
+
+    Raises:
+        ValueError: For an unknown backend name
+    """
+    backend = (backend or config.JOB_STORE).lower()
+    if backend == "firestore":
+        from services.firestore_service import FirestoreService
+        return FirestoreService()
+    if backend == "sqlite":
+        return SQLiteJobStore(config.JOB_STORE_SQLITE_PATH)
+    if backend == "memory":
+        return MemoryJobStore(config.JOB_STORE_MEMORY_MAX_DOCUMENTS, config.JOB_STORE_MEMORY_TTL_SECONDS)
+    raise ValueError(f"Unknown JOB_STORE: {backend} (expected firestore, sqlite or memory)")
@@ -340,3 +340,19 @@ def build_enhanced_prompt(
     logger.info(f"Generated cinematic-quality prompt (style={visual_style}): {full_prompt[:200]}...")
     
     return full_prompt
+
+
+def warm_up() -> None:
+    """Build one prompt from the first entry of each descriptor table (startup warmup)."""
+    build_enhanced_prompt(
+        genre=next(iter(GENRE_DESCRIPTORS)),
+        mood=next(iter(MOOD_DESCRIPTORS)),
+        visual_style=next(iter(STYLE_DESCRIPTORS)),
+        camera_movement=next(iter(CAMERA_DESCRIPTORS)),
+        duration="8s",
+        lighting=next(iter(LIGHTING_DESCRIPTORS)),
+        camera_type=next(iter(CAMERA_TYPE_DESCRIPTORS)),
+        creative_intensity="Balanced",
+        subject=next(iter(SUBJECT_DESCRIPTORS)),
+        setting=next(iter(SETTING_DESCRIPTORS))
+    )
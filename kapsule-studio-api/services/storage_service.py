@@ -3,10 +3,28 @@ import uuid
 import os
 from typing import BinaryIO
 import config
+from utils import tracing
+from utils.cancellation import CancellableReader
 
 logger = logging.getLogger(__name__)
 
 
+def _upload_local_file(blob, local_path: str, content_type: str) -> None:
+    """
+    Upload a local file, aborting at the next chunk if the current job is cancelled.
+    
+    Files over 8 MB go up as a resumable upload in GCS_UPLOAD_CHUNK_BYTES chunks; an
+    aborted session never becomes an object.
+    """
+    blob.chunk_size = config.GCS_UPLOAD_CHUNK_BYTES
+    with open(local_path, "rb") as f:
+        blob.upload_from_file(
+            CancellableReader(f),
+            size=os.path.getsize(local_path),
+            content_type=content_type
+        )
+
+
 class StorageService:
     """Service for handling Google Cloud Storage operations."""
     
@@ -23,6 +41,12 @@ class StorageService:
             self.client = None
             self.bucket = None
     
+    def warm_up(self) -> None:
+        """Fetch an access token and open a connection to GCS with a one-object listing."""
+        if self.client is None:
+            return
+        next(iter(self.client.list_blobs(self.bucket, max_results=1)), None)
+    
     def upload_audio(self, file: BinaryIO, original_filename: str) -> str:
         """
         Upload audio file to GCS audio folder.
@@ -57,7 +81,8 @@ class StorageService:
         file.seek(0)
         
         # Upload file
-        blob.upload_from_file(file)
+        with tracing.span("gcs.upload", gcs_uri=f"gs://{config.GCS_BUCKET_NAME}/{blob_path}"):
+            blob.upload_from_file(file)
         
         gcs_uri = f"gs://{config.GCS_BUCKET_NAME}/{blob_path}"
         logger.info(f"Uploaded audio file to: {gcs_uri}")
@@ -89,10 +114,8 @@ class StorageService:
         blob.content_type = "video/mp4"
         
         # Upload file with proper metadata
-        blob.upload_from_filename(
-            local_path,
-            content_type="video/mp4"
-        )
+        with tracing.span("gcs.upload", gcs_uri=f"gs://{config.GCS_BUCKET_NAME}/{blob_path}"):
+            _upload_local_file(blob, local_path, "video/mp4")
         
         # Set CORS-friendly cache control and inline disposition for mobile Safari
         blob.cache_control = "public, max-age=3600"
@@ -104,6 +127,82 @@ class StorageService:
         
         return gcs_uri
     
+    def upload_hls_file(self, local_path: str, job_id: str, live: bool = True) -> str:
+        """
+        Upload one HLS artifact (playlist, init segment or media segment) to the job's HLS folder.
+        
+        Segments never change once written, so they are cached aggressively. The playlist
+        keeps changing while the render is in progress, so it is served uncached until final.
+        
+        Args:
+            local_path: Local path to the HLS file
+            job_id: Job ID used as the folder name
+            live: Whether the render is still in progress (affects playlist caching)
+            
+        Returns:
+            GCS URI (gs://bucket/hls/job_id/filename)
+        """
+        filename = os.path.basename(local_path)
+        blob_path = f"{config.HLS_FOLDER}{job_id}/{filename}"
+        gcs_uri = f"gs://{config.GCS_BUCKET_NAME}/{blob_path}"
+        
+        if filename.endswith(".m3u8"):
+            content_type = "application/vnd.apple.mpegurl"
+            cache_control = "no-cache, max-age=0" if live else "public, max-age=3600"
+        elif filename.endswith(".m4s"):
+            content_type = "video/iso.segment"
+            cache_control = "public, max-age=31536000, immutable"
+        else:
+            content_type = "video/mp4"
+            cache_control = "public, max-age=31536000, immutable"
+        
+        if self.client is None:
+            # Mock mode - just return a mock URL
+            logger.info(f"MOCK: Would upload HLS file to: {gcs_uri}")
+            return gcs_uri
+        
+        blob = self.bucket.blob(blob_path)
+        
+        # Set metadata before upload so a single request carries it (no follow-up patch)
+        blob.cache_control = cache_control
+        blob.content_disposition = "inline"
+        with tracing.span("gcs.upload", gcs_uri=gcs_uri):
+            _upload_local_file(blob, local_path, content_type)
+        
+        logger.info(f"Uploaded HLS file to: {gcs_uri}")
+        
+        return gcs_uri
+    
+    def upload_preview(self, local_path: str, filename: str) -> str:
+        """
+        Upload a preview artifact (poster frame JPEG or low-resolution clip) to the preview folder.
+        
+        Args:
+            local_path: Local path to the preview file
+            filename: Filename to use in GCS
+            
+        Returns:
+            GCS URI (gs://bucket/preview/filename)
+        """
+        blob_path = f"{config.PREVIEW_FOLDER}{filename}"
+        gcs_uri = f"gs://{config.GCS_BUCKET_NAME}/{blob_path}"
+        content_type = "image/jpeg" if filename.endswith((".jpg", ".jpeg")) else "video/mp4"
+        
+        if self.client is None:
+            # Mock mode - just return a mock URL
+            logger.info(f"MOCK: Would upload preview file to: {gcs_uri}")
+            return gcs_uri
+        
+        blob = self.bucket.blob(blob_path)
+        blob.cache_control = "public, max-age=3600"
+        blob.content_disposition = "inline"
+        with tracing.span("gcs.upload", gcs_uri=gcs_uri):
+            _upload_local_file(blob, local_path, content_type)
+        
+        logger.info(f"Uploaded preview file to: {gcs_uri}")
+        
+        return gcs_uri
+    
     def download_file(self, gcs_url: str, local_path: str) -> None:
         """
         Download file from GCS to local filesystem.
@@ -133,7 +232,8 @@ class StorageService:
         # Download file
         bucket = self.client.bucket(bucket_name)
         blob = bucket.blob(blob_path)
-        blob.download_to_filename(local_path)
+        with tracing.span("gcs.download", gcs_uri=gcs_url):
+            blob.download_to_filename(local_path)
         
         logger.info(f"Downloaded {gcs_url} to {local_path}")
     
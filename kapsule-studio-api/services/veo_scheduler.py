@@ -0,0 +1,173 @@
+"""
+Quota-aware scheduling of Veo predictLongRunning submissions.
+
+Submissions take a token from a token bucket (VEO_REQUESTS_PER_MINUTE, bursts of
+up to VEO_REQUEST_BURST) and an operation slot (at most
+VEO_MAX_CONCURRENT_OPERATIONS submitted-but-unfinished operations per instance).
+Waiting submissions are served from priority lanes (VEO_PRIORITY_LANES, highest
+first) in FIFO order within a lane.
+
+Quota errors (429) pause the whole bucket for the server's Retry-After, so
+queued jobs back off together instead of each burning a retry.
+"""
+
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, Optional
+
+import config
+from utils import cancellation
+
+logger = logging.getLogger(__name__)
+
+
+class VeoScheduler:
+    """Token bucket, operation budget and priority lanes in front of Veo submissions."""
+
+    def __init__(self, requests_per_minute: float, burst: int, max_operations: int, lanes: list):
+        self.rate = requests_per_minute / 60.0
+        self.burst = max(1, burst)
+        self.max_operations = max(1, max_operations)
+        self.lanes = list(lanes) or ["default"]
+        self._tokens = float(self.burst)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._waiting: Dict[str, deque] = {lane: deque() for lane in self.lanes}
+        self._operations = set()  # job_ids holding an operation slot
+        self._states: Dict[str, dict] = OrderedDict()  # job_id -> observable state
+        self._condition = threading.Condition()
+
+    def lane_for(self, priority: Optional[str]) -> str:
+        """Map a requested priority to a configured lane (unknown -> lowest lane)."""
+        return priority if priority in self.lanes else self.lanes[-1]
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+
+    def _is_next(self, job_id: str, lane: str) -> bool:
+        """Whether job_id is first in line: head of its lane, with every higher lane empty."""
+        for name in self.lanes:
+            queue = self._waiting[name]
+            if name == lane:
+                return bool(queue) and queue[0] == job_id
+            if queue:
+                return False
+        return False
+
+    def acquire(self, job_id: str, lane: str, hold_operation: bool) -> None:
+        """
+        Block until this job may send a submission.
+
+        Args:
+            job_id: Job making the request
+            lane: Priority lane (see lane_for)
+            hold_operation: Whether the job still needs an operation slot (first attempt)
+        """
+        with self._condition:
+            if hold_operation:
+                self._waiting[lane].append(job_id)
+            else:
+                self._waiting[lane].appendleft(job_id)  # Retries keep their place at the front
+            self._states[job_id] = {"state": "waiting", "lane": lane}
+            try:
+                while True:
+                    cancellation.check()
+                    now = time.monotonic()
+                    self._refill(now)
+                    wait = None
+                    if self._is_next(job_id, lane):
+                        if now < self._paused_until:
+                            wait = self._paused_until - now
+                        elif hold_operation and len(self._operations) >= self.max_operations:
+                            wait = None  # Woken when an operation finishes
+                        elif self._tokens < 1:
+                            wait = (1 - self._tokens) / self.rate if self.rate > 0 else 1.0
+                        else:
+                            self._tokens -= 1
+                            if hold_operation:
+                                self._operations.add(job_id)
+                            self._states[job_id] = {"state": "submitting", "lane": lane}
+                            self._condition.notify_all()
+                            return
+                    # Wake at least once a second so a cancelled job leaves the queue promptly
+                    self._condition.wait(timeout=min(wait, 1.0) if wait is not None else 1.0)
+            finally:
+                self._waiting[lane].remove(job_id)
+                self._condition.notify_all()  # The next job may be first in line now
+
+    def backoff(self, job_id: str, lane: str, attempt: int, retry_after: Optional[float], quota_error: bool) -> float:
+        """
+        Decide how long to wait before retrying a failed submission, and record it.
+
+        Uses the server's Retry-After when given, otherwise full-jitter exponential
+        backoff. A quota error pauses the whole bucket, not just this job.
+
+        Returns:
+            Seconds to sleep before the next attempt
+        """
+        if retry_after is not None:
+            delay = min(retry_after, config.VEO_RETRY_MAX_SECONDS)
+        else:
+            delay = random.uniform(0, min(config.VEO_RETRY_MAX_SECONDS, config.VEO_RETRY_BASE_SECONDS * 2 ** attempt))
+        with self._condition:
+            if quota_error:
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+                self._tokens = 0.0
+            self._states[job_id] = {
+                "state": "backoff",
+                "lane": lane,
+                "attempt": attempt + 1,
+                "retry_at": time.time() + delay,
+            }
+        return delay
+
+    def submitted(self, job_id: str) -> None:
+        with self._condition:
+            if job_id in self._states:
+                self._states[job_id] = {"state": "running", "lane": self._states[job_id]["lane"]}
+
+    def adopt(self, job_id: str, lane: str) -> None:
+        """Count an operation submitted by an earlier run of the job (resumed) against the budget."""
+        with self._condition:
+            self._operations.add(job_id)
+            self._states[job_id] = {"state": "running", "lane": lane}
+
+    def release(self, job_id: str) -> None:
+        """Free the job's operation slot once its operation has finished (or failed)."""
+        with self._condition:
+            self._operations.discard(job_id)
+            self._states.pop(job_id, None)
+            self._condition.notify_all()
+
+    def state(self, job_id: str) -> Optional[dict]:
+        """
+        Scheduler state of a job on this instance.
+
+        Returns:
+            Dict with "state" (waiting/submitting/backoff/running), "lane" and, while
+            waiting, "position" (submissions ahead across all lanes, 1 = next), or None
+        """
+        with self._condition:
+            state = self._states.get(job_id)
+            if state is None:
+                return None
+            state = dict(state)
+            if state["state"] == "waiting":
+                ahead = 0
+                for lane in self.lanes:
+                    if lane == state["lane"]:
+                        ahead += list(self._waiting[lane]).index(job_id) if job_id in self._waiting[lane] else 0
+                        break
+                    ahead += len(self._waiting[lane])
+                state["position"] = ahead + 1
+            return state
+
+    def waiting_by_lane(self) -> dict:
+        return {(lane,): len(queue) for lane, queue in self._waiting.items()}
+
+    def operations_in_flight(self) -> int:
+        return len(self._operations)
@@ -1,33 +1,105 @@
 import logging
+import threading
 import time
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from typing import Callable, Optional
 from google.auth import default
+from google.auth.credentials import AnonymousCredentials
 from google.auth.transport.requests import Request
 from google.cloud import storage
 import config
+from utils import cancellation, tracing
+from utils.metrics import VEO_SUBMIT_RETRIES_TOTAL, observe_upstream
+from utils.region_router import RegionRouter
+from utils.tracing import pipeline_stage
+from services.veo_scheduler import VeoScheduler
 
 logger = logging.getLogger(__name__)
 
 
+def _retry_after_seconds(response: Optional[requests.Response]) -> Optional[float]:
+    """Retry-After in seconds (delta form only; HTTP dates are ignored)."""
+    if response is None:
+        return None
+    try:
+        return max(0.0, float(response.headers.get("Retry-After", "")))
+    except ValueError:
+        return None
+
+
 class VeoService:
     """Service for handling Google Veo 3.0 video generation via REST API."""
     
     def __init__(self):
         """Initialize credentials and API endpoint."""
-        self.credentials, self.project_id = default()
-        self.api_base = f"https://{config.VEO_LOCATION}-aiplatform.googleapis.com/v1"
-        self.model_endpoint = f"{self.api_base}/projects/{config.GCP_PROJECT_ID}/locations/{config.VEO_LOCATION}/publishers/google/models/{config.VEO_MODEL}"
+        if config.VERTEX_API_ENDPOINT:
+            # Local stand-in (load tests) - no Google credentials involved
+            self.credentials, self.project_id = AnonymousCredentials(), config.GCP_PROJECT_ID
+        else:
+            self.credentials, self.project_id = default()
+        # New operations go to the healthiest region; each is polled in the region it started in
+        self.router = RegionRouter("veo", config.VEO_LOCATIONS, config.REGION_SLOW_CALL_SECONDS)
+        # Pooled connections: submits and polls reuse warm TLS connections instead of a handshake each
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=config.VEO_WAIT_SLOTS + 4)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._storage_client = None
+        self._storage_client_lock = threading.Lock()
+        self.scheduler = VeoScheduler(
+            config.VEO_REQUESTS_PER_MINUTE,
+            config.VEO_REQUEST_BURST,
+            config.VEO_MAX_CONCURRENT_OPERATIONS,
+            config.VEO_PRIORITY_LANES
+        )
         logger.info(f"VeoService initialized with model: {config.VEO_MODEL}")
-        logger.info(f"VeoService endpoint: {self.model_endpoint}")
+        logger.info(f"VeoService regions: {', '.join(self.router.regions)} (endpoint: {self._api_base(self.router.regions[0])})")
+    
+    @staticmethod
+    def _api_base(location: str) -> str:
+        """Vertex API base URL of a region (or of the local stand-in, which serves every region)."""
+        if config.VERTEX_API_ENDPOINT:
+            return f"{config.VERTEX_API_ENDPOINT}/v1"
+        return f"https://{location}-aiplatform.googleapis.com/v1"
+    
+    def _model_endpoint(self, location: str) -> str:
+        return f"{self._api_base(location)}/projects/{config.GCP_PROJECT_ID}/locations/{location}/publishers/google/models/{config.VEO_MODEL}"
     
     def _get_access_token(self) -> str:
         """Get a fresh access token."""
+        if isinstance(self.credentials, AnonymousCredentials):
+            return "anonymous"
         if not self.credentials.valid:
             self.credentials.refresh(Request())
         return self.credentials.token
     
-    def generate_video(self, prompt: str, duration: str, job_id: str) -> str:
+    def _storage(self) -> storage.Client:
+        """GCS client for clip downloads, created once."""
+        with self._storage_client_lock:
+            if self._storage_client is None:
+                self._storage_client = storage.Client()
+            return self._storage_client
+    
+    def warm_up(self) -> None:
+        """Fetch an access token, create the GCS client and open a pooled connection to each Vertex region."""
+        token = self._get_access_token()
+        self._storage()
+        # Any response will do: the point is the TLS handshake, kept in the pool
+        for api_base in dict.fromkeys(self._api_base(location) for location in self.router.regions):
+            self.session.get(api_base, headers={"Authorization": f"Bearer {token}"}, timeout=10)
+    
+    def generate_video(
+        self,
+        prompt: str,
+        duration: str,
+        job_id: str,
+        output_path: Optional[str] = None,
+        priority: Optional[str] = None,
+        resume: Optional[dict] = None,
+        checkpoint: Optional[Callable[[dict], None]] = None
+    ) -> str:
         """
         Generate video using Veo 3.0 REST API.
         
@@ -35,88 +107,235 @@ class VeoService:
             prompt: Text prompt for video generation
             duration: Video duration (must be "4s", "6s", or "8s" - Veo supported durations)
             job_id: Job ID for logging and temp file naming
+            output_path: Where to save the clip (defaults to /tmp/veo_video_{job_id}.mp4)
+            priority: Scheduler lane (see VEO_PRIORITY_LANES; defaults to the lowest)
+            resume: Checkpoints of an earlier run ("veo_operation", "veo_clip_uri"); an
+                existing operation is polled again and an existing clip is just downloaded
+            checkpoint: Called with {"veo_operation": name} once submitted and
+                {"veo_clip_uri": uri} once the clip exists, so a later run can resume
             
         Returns:
             Local path to generated video file
         """
         logger.info(f"[Job {job_id}] Starting Veo video generation via REST API")
-        logger.info(f"[Job {job_id}] Prompt: {prompt}")
+        logger.debug(f"[Job {job_id}] Prompt: {prompt}")
         logger.info(f"[Job {job_id}] Duration: {duration}")
         
+        resume = resume or {}
+        operation_name = resume.get("veo_operation")
+        video_uri = resume.get("veo_clip_uri")
+        lane = self.scheduler.lane_for(priority)
+        submitted_at = None
+        
+        try:
+            if video_uri:
+                logger.info(f"[Job {job_id}] Reusing Veo clip from an earlier run: {video_uri}")
+            else:
+                if operation_name:
+                    logger.info(f"[Job {job_id}] Resuming Veo operation: {operation_name}")
+                    self.scheduler.adopt(job_id, lane)
+                else:
+                    # Step 1: Submit video generation request
+                    operation_name = self._start_operation(prompt, duration, job_id, lane)
+                    submitted_at = time.monotonic()
+                    if checkpoint:
+                        checkpoint({"veo_operation": operation_name})
+                
+                # Step 2: Poll for completion
+                with pipeline_stage("veo_wait", operation=operation_name.rsplit("/", 1)[-1]):
+                    video_uri = self._poll_operation(operation_name, job_id, submitted_at=submitted_at)
+                if checkpoint:
+                    checkpoint({"veo_clip_uri": video_uri})
+            
+            # Step 3: Download video from GCS
+            with pipeline_stage("veo_download"):
+                temp_video_path = self._download_video_from_gcs(video_uri, job_id, output_path)
+            
+            logger.info(f"[Job {job_id}] Veo video downloaded to: {temp_video_path}")
+            
+            return temp_video_path
+            
+        except cancellation.JobCancelled:
+            logger.info(f"[Job {job_id}] Veo generation cancelled")
+            if operation_name:
+                self._cancel_operation(operation_name, job_id)
+            raise
+        except requests.exceptions.RequestException as e:
+            logger.error(f"[Job {job_id}] Veo API request failed: {str(e)}")
+            raise Exception(f"Veo API request failed: {str(e)}")
+        except Exception as e:
+            logger.error(f"[Job {job_id}] Veo generation failed: {str(e)}")
+            raise
+        finally:
+            self.scheduler.release(job_id)
+    
+    def generate_clip(self, prompt: str, duration: str, job_id: str, priority: Optional[str] = None) -> str:
+        """
+        Generate a clip without downloading it (for the clip library).
+        
+        Args:
+            prompt: Text prompt for video generation
+            duration: Video duration ("4s", "6s" or "8s")
+            job_id: ID for logging and scheduler bookkeeping
+            priority: Scheduler lane (defaults to the lowest, behind every user job)
+            
+        Returns:
+            GCS URI of the generated clip (in VEO_TEMP_FOLDER)
+        """
+        lane = self.scheduler.lane_for(priority)
         try:
-            # Parse duration to seconds
-            duration_seconds = int(duration.replace("s", ""))
-            
-            # Step 1: Submit video generation request
-            request_body = {
-                "instances": [
-                    {
-                        "prompt": prompt
-                    }
-                ],
-                "parameters": {
-                    "durationSeconds": duration_seconds,
-                    "storageUri": f"gs://{config.GCS_BUCKET_NAME}/veo-temp/",
-                    "sampleCount": 1,
-                    "aspectRatio": "9:16",  # Portrait mode for social media
-                    "resolution": "720p",
-                    "generateAudio": False  # We'll add our own audio
+            operation_name = self._start_operation(prompt, duration, job_id, lane)
+            submitted_at = time.monotonic()
+            with tracing.span("veo.wait", operation=operation_name.rsplit("/", 1)[-1]):
+                return self._poll_operation(operation_name, job_id, submitted_at=submitted_at)
+        except requests.exceptions.RequestException as e:
+            logger.error(f"[Job {job_id}] Veo API request failed: {str(e)}")
+            raise Exception(f"Veo API request failed: {str(e)}")
+        finally:
+            self.scheduler.release(job_id)
+    
+    def _start_operation(self, prompt: str, duration: str, job_id: str, lane: str) -> str:
+        """
+        Submit predictLongRunning through the quota scheduler.
+        
+        Returns:
+            Operation name to poll
+        """
+        # Parse duration to seconds
+        duration_seconds = int(duration.replace("s", ""))
+        
+        request_body = {
+            "instances": [
+                {
+                    "prompt": prompt
                 }
+            ],
+            "parameters": {
+                "durationSeconds": duration_seconds,
+                "storageUri": f"gs://{config.GCS_BUCKET_NAME}/{config.VEO_TEMP_FOLDER}",
+                "sampleCount": 1,
+                "aspectRatio": "9:16",  # Portrait mode for social media
+                "resolution": "720p",
+                "generateAudio": False  # We'll add our own audio
             }
+        }
+        
+        # Submit the request through the quota scheduler
+        response = self._submit(request_body, job_id, lane)
+        
+        operation_data = response.json()
+        operation_name = operation_data.get("name")
+        
+        if not operation_name:
+            raise Exception("No operation name returned from Veo API")
+        
+        logger.info(f"[Job {job_id}] Veo operation started: {operation_name}")
+        self.scheduler.submitted(job_id)
+        
+        return operation_name
+    
+    def _submit(self, request_body: dict, job_id: str, lane: str) -> requests.Response:
+        """
+        Send predictLongRunning when the scheduler allows it, retrying quota and server errors.
+        
+        Each attempt goes to the healthiest region (see utils/region_router.py). On
+        a 429, 5xx or transport error the next attempt fails over at once to a
+        region not tried yet; once every region has failed, attempts are retried
+        with jittered exponential backoff, honoring Retry-After, up to
+        VEO_SUBMIT_MAX_ATTEMPTS in total.
+        
+        Returns:
+            The successful (200) response
+        """
+        attempt = 0
+        failed_regions = set()
+        region = self.router.pick_or_preferred()
+        while True:
+            with pipeline_stage("veo_quota_wait"):
+                self.scheduler.acquire(job_id, lane, hold_operation=attempt == 0)
             
             headers = {
                 "Authorization": f"Bearer {self._get_access_token()}",
                 "Content-Type": "application/json"
             }
             
-            logger.info(f"[Job {job_id}] Calling Veo API: {self.model_endpoint}:predictLongRunning")
-            
-            # Submit the request
-            response = requests.post(
-                f"{self.model_endpoint}:predictLongRunning",
-                json=request_body,
-                headers=headers,
-                timeout=30
-            )
-            
-            if response.status_code != 200:
-                error_detail = response.json() if response.text else {"error": "Unknown error"}
-                logger.error(f"[Job {job_id}] Veo API error: {response.status_code} - {error_detail}")
-                raise Exception(f"Veo API request failed: {response.status_code} - {error_detail}")
+            logger.info(f"[Job {job_id}] Calling Veo API in {region}: predictLongRunning")
+            with pipeline_stage("veo_submit", attempt=attempt + 1, region=region) as submit_span:
+                start = time.perf_counter()
+                try:
+                    response = self.session.post(
+                        f"{self._model_endpoint(region)}:predictLongRunning",
+                        json=request_body,
+                        headers=headers,
+                        timeout=30
+                    )
+                    status = response.status_code
+                except requests.exceptions.RequestException as e:
+                    response, status = None, "error"
+                    error_detail = str(e)
+                observe_upstream("veo", "predictLongRunning", start, status)
+                submit_span.set_attribute("http.status_code", status)
             
-            operation_data = response.json()
-            operation_name = operation_data.get("name")
+            retryable = status == "error" or status == 429 or status >= 500
+            if retryable:
+                self.router.record_failure(region)
+            else:
+                # The region answered (a 4xx is about the request, not the region)
+                self.router.record_success(region, time.perf_counter() - start, observe_latency=False)
             
-            if not operation_name:
-                raise Exception("No operation name returned from Veo API")
+            if status == 200:
+                return response
             
-            logger.info(f"[Job {job_id}] Veo operation started: {operation_name}")
+            if response is not None:
+                try:
+                    error_detail = response.json() if response.text else {"error": "Unknown error"}
+                except ValueError:
+                    error_detail = response.text[:500]
             
-            # Step 2: Poll for completion
-            video_uri = self._poll_operation(operation_name, job_id)
+            if not retryable or attempt + 1 >= config.VEO_SUBMIT_MAX_ATTEMPTS:
+                logger.error(f"[Job {job_id}] Veo API error: {status} - {error_detail}")
+                raise Exception(f"Veo API request failed: {status} - {error_detail}")
             
-            # Step 3: Download video from GCS
-            temp_video_path = self._download_video_from_gcs(video_uri, job_id)
-            
-            logger.info(f"[Job {job_id}] Veo video downloaded to: {temp_video_path}")
-            
-            return temp_video_path
+            failed_regions.add(region)
+            next_region = self.router.pick(exclude=failed_regions)
+            if next_region is not None:
+                self.router.failed_over(region, next_region, status)
+                VEO_SUBMIT_RETRIES_TOTAL.inc(status=status)
+                region = next_region
+                attempt += 1
+                continue
             
-        except requests.exceptions.RequestException as e:
-            logger.error(f"[Job {job_id}] Veo API request failed: {str(e)}")
-            raise Exception(f"Veo API request failed: {str(e)}")
-        except Exception as e:
-            logger.error(f"[Job {job_id}] Veo generation failed: {str(e)}")
-            raise
+            # Every region failed this round: back off, then start over from the healthiest
+            failed_regions.clear()
+            delay = self.scheduler.backoff(
+                job_id,
+                lane,
+                attempt,
+                retry_after=_retry_after_seconds(response),
+                quota_error=status == 429
+            )
+            VEO_SUBMIT_RETRIES_TOTAL.inc(status=status)
+            logger.warning(f"[Job {job_id}] Veo submit got {status}, retrying in {delay:.1f}s (attempt {attempt + 1})")
+            cancellation.sleep(delay)
+            region = self.router.pick_or_preferred()
+            attempt += 1
     
-    def _poll_operation(self, operation_name: str, job_id: str, max_wait: int = 300) -> str:
+    def _poll_operation(
+        self,
+        operation_name: str,
+        job_id: str,
+        max_wait: int = 300,
+        submitted_at: Optional[float] = None
+    ) -> str:
         """
-        Poll the Veo operation until completion.
+        Poll the Veo operation until completion, in the region it was started in.
         
         Args:
             operation_name: Full operation name from initial request
             job_id: Job ID for logging
             max_wait: Maximum seconds to wait (default 5 minutes)
+            submitted_at: time.monotonic() of the submit, to record the region's
+                generation latency (None for resumed operations)
             
         Returns:
             GCS URI of generated video
@@ -124,7 +343,7 @@ class VeoService:
         logger.info(f"[Job {job_id}] Polling operation status...")
         
         start_time = time.time()
-        poll_interval = 10  # Poll every 10 seconds
+        poll_interval = config.VEO_POLL_INTERVAL_SECONDS  # Poll every 10 seconds by default
         
         headers = {
             "Authorization": f"Bearer {self._get_access_token()}",
@@ -139,20 +358,28 @@ class VeoService:
         model_id = parts[7]
         operation_id = parts[9]
         
-        fetch_url = f"{self.api_base}/projects/{project_id}/locations/{location}/publishers/google/models/{model_id}:fetchPredictOperation"
+        fetch_url = f"{self._api_base(location)}/projects/{project_id}/locations/{location}/publishers/google/models/{model_id}:fetchPredictOperation"
         
         while time.time() - start_time < max_wait:
             try:
-                response = requests.post(
-                    fetch_url,
-                    json={"operationName": operation_name},
-                    headers=headers,
-                    timeout=30
-                )
+                with tracing.span("veo.poll", operation=operation_id) as poll_span:
+                    start = time.perf_counter()
+                    try:
+                        response = self.session.post(
+                            fetch_url,
+                            json={"operationName": operation_name},
+                            headers=headers,
+                            timeout=30
+                        )
+                    except requests.exceptions.RequestException:
+                        observe_upstream("veo", "fetchPredictOperation", start, "error")
+                        raise
+                    observe_upstream("veo", "fetchPredictOperation", start, response.status_code)
+                    poll_span.set_attribute("http.status_code", response.status_code)
                 
                 if response.status_code != 200:
                     logger.warning(f"[Job {job_id}] Poll failed: {response.status_code}")
-                    time.sleep(poll_interval)
+                    cancellation.sleep(poll_interval)
                     continue
                 
                 result = response.json()
@@ -160,7 +387,7 @@ class VeoService:
                 # Check if operation is done
                 if result.get("done"):
                     logger.info(f"[Job {job_id}] Veo operation completed!")
-                    logger.info(f"[Job {job_id}] Full response: {result}")
+                    logger.debug("[Job %s] Full response: %s", job_id, result)  # Lazy: only rendered if DEBUG
                     
                     # Check for errors first
                     if "error" in result:
@@ -197,26 +424,65 @@ class VeoService:
                         raise Exception(f"No GCS URI in video response. Video data keys: {list(video_data.keys()) if isinstance(video_data, dict) else 'not a dict'}")
                     
                     logger.info(f"[Job {job_id}] Video generated at: {video_uri}")
+                    if submitted_at is not None:
+                        self.router.observe_latency(location, time.monotonic() - submitted_at)
                     return video_uri
                 
                 # Not done yet, continue polling
-                logger.info(f"[Job {job_id}] Still processing... (elapsed: {int(time.time() - start_time)}s)")
-                time.sleep(poll_interval)
+                logger.info(
+                    f"[Job {job_id}] Still processing... (elapsed: {int(time.time() - start_time)}s)",
+                    extra={"sample": "veo_poll"}
+                )
+                cancellation.sleep(poll_interval)
                 
             except requests.exceptions.RequestException as e:
                 logger.warning(f"[Job {job_id}] Poll request failed: {e}")
-                time.sleep(poll_interval)
+                cancellation.sleep(poll_interval)
                 continue
         
         raise Exception(f"Veo operation timed out after {max_wait} seconds")
     
-    def _download_video_from_gcs(self, gcs_uri: str, job_id: str) -> str:
+    def _cancel_operation(self, operation_name: str, job_id: str) -> None:
+        """
+        Best-effort cancel of a Veo operation whose job was cancelled.
+        
+        Not every long-running operation honors cancellation; when the call is
+        refused the operation runs to completion and its result is simply never
+        fetched (the clip it writes under veo-temp/ is left to the compactor).
+        """
+        if not config.VEO_CANCEL_OPERATIONS:
+            return
+        
+        start = time.perf_counter()
+        try:
+            response = self.session.post(
+                f"{self._api_base(operation_name.split('/')[3])}/{operation_name}:cancel",
+                json={},
+                headers={
+                    "Authorization": f"Bearer {self._get_access_token()}",
+                    "Content-Type": "application/json"
+                },
+                timeout=10
+            )
+        except requests.exceptions.RequestException as e:
+            observe_upstream("veo", "cancelOperation", start, "error")
+            logger.warning(f"[Job {job_id}] Veo operation cancel failed, ignoring its result instead: {e}")
+            return
+        observe_upstream("veo", "cancelOperation", start, response.status_code)
+        
+        if response.status_code == 200:
+            logger.info(f"[Job {job_id}] Cancelled Veo operation: {operation_name}")
+        else:
+            logger.info(f"[Job {job_id}] Veo operation cancel not supported ({response.status_code}), ignoring its result instead")
+    
+    def _download_video_from_gcs(self, gcs_uri: str, job_id: str, output_path: Optional[str] = None) -> str:
         """
         Download video from GCS to local temp file.
         
         Args:
             gcs_uri: GCS URI (gs://bucket/path)
             job_id: Job ID for naming
+            output_path: Local destination (defaults to /tmp/veo_video_{job_id}.mp4)
             
         Returns:
             Local path to downloaded video
@@ -232,12 +498,12 @@ class VeoService:
         blob_path = parts[1]
         
         # Download using GCS client
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
+        bucket = self._storage().bucket(bucket_name)
         blob = bucket.blob(blob_path)
         
-        temp_video_path = f"/tmp/veo_video_{job_id}.mp4"
-        blob.download_to_filename(temp_video_path)
+        temp_video_path = output_path or f"/tmp/veo_video_{job_id}.mp4"
+        with tracing.span("gcs.download", gcs_uri=gcs_uri):
+            blob.download_to_filename(temp_video_path)
         
         logger.info(f"[Job {job_id}] Video downloaded to: {temp_video_path}")
         
@@ -0,0 +1,279 @@
+"""
+JobStore conformance tests.
+
+Every backend runs the same tests, so the memory, SQLite and Firestore stores
+behave alike: write-behind creation, status updates, cancellation, lease
+claims, idempotency keys, batches and job listings. The Firestore backend only
+runs against the emulator (FIRESTORE_EMULATOR_HOST).
+
+Run from kapsule-studio-api/:
+    python -m pytest tests/test_job_store.py
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import pytest
+
+import config
+from services.job_store import (
+    DocumentNotFound,
+    IdempotencyKeyConflict,
+    InvalidCursor,
+    JOB_SUMMARY_FIELDS,
+    JobFilter,
+    MemoryJobStore,
+    SQLiteJobStore,
+    create_job_store,
+)
+
+REQUEST = {
+    "prompt": "A neon city at night",
+    "audio_url": "gs://kapsule-test/audio/track.mp3",
+    "duration": "8 seconds",
+    "genre": "Electronic",
+    "visualStyle": "Cinematic",
+    "cameraMovement": "Slow Push In",
+    "mood": "Energetic",
+    "subject": "None (Visual Only)",
+    "setting": "Color Studio Background",
+    "priority": "free",
+}
+VIDEO_URL = "https://example.com/v.mp4"
+
+
+@pytest.fixture(params=[
+    "memory",
+    "sqlite",
+    pytest.param("firestore", marks=pytest.mark.skipif(
+        not os.getenv("FIRESTORE_EMULATOR_HOST"), reason="needs the Firestore emulator (FIRESTORE_EMULATOR_HOST)"
+    )),
+])
+def store(request, tmp_path):
+    """A fresh store per test (the Firestore one shares the emulator's collections)."""
+    if request.param == "sqlite":
+        job_store = SQLiteJobStore(str(tmp_path / "jobs.sqlite3"))
+    elif request.param == "memory":
+        job_store = MemoryJobStore(config.JOB_STORE_MEMORY_MAX_DOCUMENTS, config.JOB_STORE_MEMORY_TTL_SECONDS)
+    else:
+        job_store = create_job_store("firestore")
+    yield job_store
+    job_store.flush()
+
+
+def test_create_and_read(store):
+    job_id = store.create_job(REQUEST)
+    pending = store.get_job(job_id)
+    assert pending is not None and pending["status"] == "queued", "new job is readable before it is written"
+    store.flush()
+    job = store.get_job(job_id)
+    assert job is not None, "job exists after flush"
+    assert job["job_id"] == job_id and job["prompt"] == REQUEST["prompt"], "job fields round-trip"
+    assert isinstance(job["createdAt"], datetime), "createdAt comes back as a datetime"
+    assert job["attempts"] == 1, "attempts starts at 1"
+    assert store.get_job(str(uuid4())) is None, "unknown job reads as None"
+
+
+def test_status_updates(store):
+    job_id = store.create_job(REQUEST)
+    store.update_job(job_id, {"playlist_url": "https://example.com/p.m3u8"})
+    job = store.get_job(job_id)
+    assert job["status"] == "queued" and job["playlist_url"].endswith(".m3u8"), "update_job merges without touching status"
+
+    store.update_job_status(job_id, "processing")
+    store.update_job(job_id, {"lease_expires_at": datetime.now(timezone.utc) + timedelta(minutes=5)})
+    store.update_job_status(job_id, "complete", video_url=VIDEO_URL)
+    job = store.get_job(job_id)
+    assert job["status"] == "complete" and job["video_url"] == VIDEO_URL, "complete sets video_url"
+    assert isinstance(job.get("completedAt"), datetime), "complete sets completedAt"
+    assert job.get("lease_expires_at") is None, "terminal status clears the lease"
+    assert job["playlist_url"].endswith(".m3u8"), "earlier fields are kept"
+
+    error_id = store.create_job(REQUEST)
+    store.update_job_status(error_id, "error", error="Veo failed")
+    assert store.get_job(error_id)["error"] == "Veo failed", "error sets the message"
+
+    with pytest.raises(DocumentNotFound):
+        store.update_job(str(uuid4()), {"x": 1})
+
+
+def test_cancel(store):
+    job_id = store.create_job(REQUEST)
+    assert store.cancel_job(job_id) == "queued", "cancel returns the previous status"
+    job = store.get_job(job_id)
+    assert job["status"] == "cancelled" and job.get("lease_expires_at") is None, "cancel marks the job cancelled"
+    assert store.cancel_job(job_id) == "cancelled", "cancelling twice is a no-op"
+
+    done_id = store.create_job(REQUEST)
+    store.update_job_status(done_id, "complete", video_url=VIDEO_URL)
+    assert store.cancel_job(done_id) == "complete", "finished jobs are not cancelled"
+    assert store.get_job(done_id)["status"] == "complete", "finished job keeps its status"
+
+    # A run that didn't notice the cancel can't bring the job back
+    assert not store.update_job_status(job_id, "processing"), "status updates are refused after a cancel"
+    assert not store.update_job_status(job_id, "complete", video_url=VIDEO_URL), "completing a cancelled job is refused"
+    assert store.get_job(job_id)["status"] == "cancelled", "cancelled job keeps its status"
+    assert store.cancel_job(str(uuid4())) is None, "unknown job cancels as None"
+
+
+def test_idempotency(store):
+    key = f"test-{uuid4()}"
+    job_id, created = store.create_job_idempotent(REQUEST, key, "fingerprint-a")
+    assert created, "first use of a key creates a job"
+    assert store.get_job(job_id) is not None, "idempotent job is written with its key"
+    again, created = store.create_job_idempotent(REQUEST, key, "fingerprint-a")
+    assert again == job_id and not created, "reusing a key returns the same job"
+    assert store.find_idempotent_job(key, "fingerprint-a") == job_id, "find_idempotent_job finds the job"
+    assert store.find_idempotent_job(f"test-{uuid4()}", "fingerprint-a") is None, "unused key finds nothing"
+    with pytest.raises(IdempotencyKeyConflict):
+        store.create_job_idempotent(REQUEST, key, "fingerprint-b")
+
+    # Concurrent duplicates end up with one job
+    key = f"test-{uuid4()}"
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: store.create_job_idempotent(REQUEST, key, "fingerprint-a"), range(8)))
+    assert len({job_id for job_id, _ in results}) == 1, "concurrent duplicates share one job"
+    assert sum(created for _, created in results) == 1, "exactly one concurrent duplicate creates the job"
+
+
+def test_leases(store):
+    job_id = store.create_job(REQUEST)
+    store.update_job_status(job_id, "processing")
+    store.update_job(job_id, {"worker_id": "gone", "lease_expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)})
+    assert job_id in store.find_expired_leases(limit=1000), "expired lease is found"
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        claims = list(pool.map(lambda i: store.claim_job(job_id, f"worker-{i}", 60, 3), range(8)))
+    claimed = [claim for claim in claims if claim is not None]
+    assert len(claimed) == 1, "exactly one of several concurrent claims wins"
+    assert claimed[0]["attempts"] == 2 and claimed[0]["job_id"] == job_id, "claim bumps attempts"
+    assert job_id not in store.find_expired_leases(limit=1000), "claimed job has a fresh lease"
+
+    store.update_job(job_id, {"lease_expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)})
+    assert store.claim_job(job_id, "worker-x", 60, 2) is None, "job past max_attempts is not claimed"
+    job = store.get_job(job_id)
+    assert job["status"] == "error" and job.get("lease_expires_at") is None, "job past max_attempts is failed"
+
+    done_id = store.create_job(REQUEST)
+    store.update_job_status(done_id, "complete", video_url=VIDEO_URL)
+    assert done_id not in store.find_expired_leases(limit=1000), "finished jobs hold no lease"
+
+
+def test_runs_only_start_unclaimed_unfinished_jobs(store):
+    run_id = store.create_job(REQUEST)
+    assert store.renew_lease(run_id, "worker-a", 60), "first lease on a new job is taken"
+    assert store.start_job(run_id, "worker-a", 60), "lease holder starts the job"
+    assert store.get_job(run_id)["status"] == "processing", "started job is processing"
+    store.update_job(run_id, {"lease_expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)})
+    assert store.claim_job(run_id, "worker-b", 60, 3) is not None, "expired job is claimed by another worker"
+    assert not store.renew_lease(run_id, "worker-a", 60), "previous worker can't renew a claimed job"
+    assert not store.start_job(run_id, "worker-a", 60), "previous worker can't restart a claimed job"
+    assert store.start_job(run_id, "worker-b", 60), "claiming worker resumes the job"
+    store.cancel_job(run_id)
+    assert not store.start_job(run_id, "worker-b", 60), "cancelled job is not started again"
+    assert not store.renew_lease(run_id, "worker-b", 60), "cancelled job gets no new lease"
+    assert store.get_job(run_id)["status"] == "cancelled", "cancelled job keeps its status"
+
+
+@pytest.mark.parametrize("read", ["pending", "written"])
+def test_batches(store, read):
+    requests_data = [dict(REQUEST, prompt=f"variant {i}") for i in range(5)]
+    batch_id, job_ids = store.create_batch(requests_data, {"priority": "paid"})
+    assert len(job_ids) == 5 and len(set(job_ids)) == 5, "one job per request"
+    if read == "written":
+        store.flush()
+    batch = store.get_batch(batch_id)
+    assert batch is not None and batch["job_ids"] == job_ids, "batch lists its jobs"
+    assert batch["priority"] == "paid", "batch fields are stored"
+    jobs = store.get_jobs(job_ids + [str(uuid4())])
+    assert set(jobs) == set(job_ids), "get_jobs returns existing jobs only"
+    assert all(job["batch_id"] == batch_id for job in jobs.values()), "jobs point at their batch"
+    assert jobs[job_ids[3]]["prompt"] == "variant 3", "jobs keep their order"
+    assert store.get_batch(str(uuid4())) is None, "unknown batch reads as None"
+    assert store.get_jobs([]) == {}, "get_jobs of nothing is empty"
+
+
+def test_listing(store):
+    genre = f"test-{uuid4()}"  # Isolates this test's jobs from the others'
+    job_ids = []
+    for i, status in enumerate(["complete", "error", "complete", "queued", "complete", "cancelled", "complete"]):
+        job_id = store.create_job(dict(REQUEST, genre=genre, prompt=f"long prompt {i} " * 50))
+        if status != "queued":
+            store.update_job_status(job_id, status, video_url=VIDEO_URL, error="failed")
+        job_ids.append(job_id)
+        time.sleep(0.002)  # Distinct createdAt
+    store.flush()
+    newest_first = list(reversed(job_ids))
+
+    seen, cursor, pages = [], None, 0
+    while True:
+        jobs, cursor = store.list_jobs(JobFilter(genre=genre), limit=3, cursor=cursor)
+        pages += 1
+        seen += [job["job_id"] for job in jobs]
+        assert all(set(job) <= set(JOB_SUMMARY_FIELDS) | {"job_id"} for job in jobs), "listing returns summary fields only"
+        if cursor is None:
+            break
+    assert seen == newest_first, "cursor pages cover every job once, newest first"
+    assert pages == 3, "pages hold `limit` jobs"
+
+    jobs, cursor = store.list_jobs(JobFilter(status="complete", genre=genre), limit=10)
+    assert [job["job_id"] for job in jobs] == [job_id for job_id in newest_first if job_id in job_ids[::2]], "status filter"
+    assert cursor is None, "no cursor after the last page"
+
+    middle = store.get_job(job_ids[3])["createdAt"]
+    jobs, _ = store.list_jobs(JobFilter(genre=genre, created_after=middle), limit=10)
+    assert [job["job_id"] for job in jobs] == newest_first[:4], "created_after is inclusive"
+    jobs, _ = store.list_jobs(JobFilter(genre=genre, created_before=middle), limit=10)
+    assert [job["job_id"] for job in jobs] == newest_first[4:], "created_before is exclusive"
+
+    jobs, _ = store.list_jobs(JobFilter(genre=genre), limit=1, fields=("status",))
+    assert jobs == [{"job_id": job_ids[-1], "status": "complete"}], "fields projects the listing"
+    projected = store.get_jobs(job_ids[:2], fields=("status", "video_url"))
+    assert projected[job_ids[0]] == {"job_id": job_ids[0], "status": "complete", "video_url": VIDEO_URL}, "get_jobs projects"
+    with pytest.raises(InvalidCursor):
+        store.list_jobs(cursor="not-a-cursor")
+
+
+# MemoryJobStore only: its LRU and TTL bounds
+
+def test_memory_store_evicts_least_recently_used_finished_jobs():
+    store = MemoryJobStore(max_documents=3, ttl_seconds=3600)
+    job_ids = [store.create_job(REQUEST) for _ in range(3)]
+    store.flush()
+    for job_id in job_ids:
+        store.update_job_status(job_id, "complete", video_url=VIDEO_URL)
+    store.get_job(job_ids[0])  # Most recently used now
+    newest = store.create_job(REQUEST)
+    store.flush()
+    assert store.get_job(job_ids[1]) is None, "least recently used job is evicted"
+    assert all(store.get_job(job_id) for job_id in (job_ids[0], job_ids[2], newest)), "other jobs are kept"
+
+
+def test_memory_store_keeps_unfinished_jobs_beyond_its_limit():
+    store = MemoryJobStore(max_documents=2, ttl_seconds=3600)
+    job_ids = [store.create_job(REQUEST) for _ in range(3)]
+    store.flush()
+    assert all(store.get_job(job_id) for job_id in job_ids), "queued jobs are never evicted"
+    store.update_job_status(job_ids[0], "complete", video_url=VIDEO_URL)
+    store.create_job(REQUEST)
+    store.flush()
+    assert store.get_job(job_ids[0]) is None, "finished jobs are evicted first"
+    assert all(store.get_job(job_id) for job_id in job_ids[1:]), "unfinished jobs are kept"
+
+
+def test_memory_store_expires_finished_jobs_only():
+    store = MemoryJobStore(max_documents=2, ttl_seconds=0.2)
+    finished, unfinished = store.create_job(REQUEST), store.create_job(REQUEST)
+    store.flush()
+    store.update_job_status(finished, "complete", video_url=VIDEO_URL)
+    assert store.get_job(finished) is not None, "job readable within its TTL"
+    time.sleep(0.3)
+    assert store.get_job(unfinished) is not None, "unfinished jobs don't expire"
+    assert [job["job_id"] for job in store.list_jobs()[0]] == [unfinished], "expired jobs aren't listed"
+    newest = store.create_job(REQUEST)
+    store.flush()
+    assert store.get_job(newest) and store.get_job(unfinished), "expired jobs make room before the limit is exceeded"
+    assert store.get_job(finished) is None, "job expires after its TTL"
@@ -0,0 +1,122 @@
+"""
+Veo region routing against the fake Vertex endpoint.
+
+Each test starts loadtest/fake_vertex.py in-process with per-region latency
+and error overrides, and points a VeoService at it (VERTEX_API_ENDPOINT serves
+every region, the location comes from the request path as on Vertex).
+
+Run from kapsule-studio-api/:
+    python -m pytest tests/test_region_router.py
+"""
+
+import random
+import threading
+
+import pytest
+import requests
+
+import config
+from loadtest import fake_vertex
+from services.veo_service import VeoService
+
+CLIP_URI = "gs://kapsule-test/veo-temp/clip.mp4"
+LOCATIONS = ["us-central1", "europe-west4"]  # Preferred first
+
+
+class _FixedDraw(random.Random):
+    """random.random() always returns `draw`: decides fake_vertex's injected errors (below 0.5: 429, else 503)."""
+
+    def __init__(self, draw: float):
+        super().__init__()
+        self.draw = draw
+
+    def random(self) -> float:
+        return self.draw
+
+
+@pytest.fixture
+def veo(monkeypatch):
+    """
+    Factory for a VeoService routed over LOCATIONS, served by a fake Vertex
+    started with the given --region overrides. Returns the service and a
+    function reading the fake's counters.
+    """
+    monkeypatch.setattr(config, "VEO_LOCATIONS", LOCATIONS)
+    monkeypatch.setattr(config, "VEO_POLL_INTERVAL_SECONDS", 0.02)
+    monkeypatch.setattr(config, "VEO_REQUESTS_PER_MINUTE", 6000)
+    monkeypatch.setattr(config, "VEO_REQUEST_BURST", 100)
+    servers = []
+
+    def start(*overrides):
+        argv = [
+            "--port", "0", "--clip-uri", CLIP_URI,
+            "--submit-latency", "fixed:0", "--poll-latency", "fixed:0", "--veo-run", "fixed:0.02",
+        ]
+        for override in overrides:
+            argv += ["--region", override]
+        server = fake_vertex.create_server(fake_vertex.build_parser().parse_args(argv))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+        monkeypatch.setattr(config, "VERTEX_API_ENDPOINT", endpoint)
+        return VeoService(), lambda: requests.get(f"{endpoint}/stats", timeout=5).json()["counters"]
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _location(operation_name: str) -> str:
+    return operation_name.split("/")[3]
+
+
+def test_new_submissions_go_to_the_healthiest_region(veo):
+    service, counters = veo("us-central1:veo_run=fixed:0.5")
+
+    # The first clip goes to the preferred region, the second probes the other one
+    for i in range(5):
+        assert service.generate_clip("A neon city at night", "8s", f"clip-{i}") == CLIP_URI
+
+    stats = counters()
+    assert stats["us-central1/submit_200"] == 1, "the slow region only gets its first call"
+    assert stats["europe-west4/submit_200"] == 4, "everything after the probe goes to the fast region"
+    assert service.router.ranked() == ["europe-west4", "us-central1"]
+
+
+@pytest.mark.parametrize("draw, status", [(0.0, 429), (0.9, 503)])
+def test_submit_fails_over_to_the_next_region(veo, monkeypatch, draw, status):
+    service, counters = veo("us-central1:submit_error_rate=1")
+    monkeypatch.setattr(fake_vertex, "random", _FixedDraw(draw))
+
+    operation_name = service._start_operation("A neon city at night", "8s", "job-1", "free")
+    service.scheduler.release("job-1")
+
+    assert _location(operation_name) == "europe-west4"
+    stats = counters()
+    assert stats[f"us-central1/submit_{status}"] == 1, "the preferred region was tried first"
+    assert stats["europe-west4/submit_200"] == 1, "the failed submit was sent to the next region at once"
+    assert service.router.snapshot()["us-central1"]["error_rate"] > 0
+
+
+def test_polls_stay_in_the_region_the_operation_started_in(veo):
+    service, counters = veo("us-central1:veo_run=fixed:0.3")
+    operation_name = service._start_operation("A neon city at night", "8s", "job-1", "free")
+    assert _location(operation_name) == "us-central1"
+
+    # us-central1 now ranks last: failing and much slower than europe-west4
+    for _ in range(config.REGION_FAILURE_THRESHOLD):
+        service.router.record_failure("us-central1")
+    service.router.observe_latency("us-central1", 60)
+    service.router.observe_latency("europe-west4", 1)
+    assert service.router.ranked() == ["europe-west4", "us-central1"]
+
+    try:
+        assert service._poll_operation(operation_name, "job-1", max_wait=10) == CLIP_URI
+    finally:
+        service.scheduler.release("job-1")
+
+    stats = counters()
+    assert stats["us-central1/poll_200"] >= 1, "polled where the operation lives"
+    assert not any(key.startswith("europe-west4/poll") for key in stats), "never polled in the newly preferred region"
+    assert "poll_404" not in stats
@@ -0,0 +1,165 @@
+"""
+Per-instance admission control for generation jobs.
+
+Jobs hold two kinds of slots, limited separately:
+    veo_wait - submitting to Veo and polling until the clip lands (I/O-bound, cheap)
+    encode   - FFmpeg rendering (CPU-bound; roughly one per vCPU)
+
+Jobs waiting for a Veo slot form a bounded FIFO queue. /api/generate refuses
+new jobs with 429 once the queue is full, and queued jobs get their position
+and an estimated start time from the recent slot hold times.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import config
+from utils.tracing import pipeline_stage
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFullError(Exception):
+    """Raised when the local job queue has no room for another job."""
+
+    def __init__(self, retry_after: int, queue_length: int):
+        super().__init__(f"Job queue is full ({queue_length} jobs waiting)")
+        self.retry_after = retry_after
+        self.queue_length = queue_length
+
+
+class SlotPool:
+    """FIFO counting semaphore that tracks who is waiting and how long slots are held."""
+
+    def __init__(self, name: str, size: int, initial_hold_seconds: float):
+        self.name = name
+        self.size = max(1, size)
+        self.active = {}  # job_id -> acquired at (monotonic)
+        self.waiters = OrderedDict()  # job_id -> Future
+        self.average_hold_seconds = initial_hold_seconds  # EWMA
+
+    def estimated_wait_seconds(self, position: int) -> float:
+        """Time until the waiter at `position` gets a slot, assuming average hold times."""
+        if position <= 0 or len(self.active) < self.size:
+            return 0.0
+        return math.ceil(position / self.size) * self.average_hold_seconds
+
+    async def acquire(self, job_id: str) -> None:
+        if len(self.active) < self.size and not self.waiters:
+            self.active[job_id] = time.monotonic()
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[job_id] = future
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(job_id)  # Slot was handed over just as we were cancelled
+            raise
+        finally:
+            self.waiters.pop(job_id, None)
+
+    def release(self, job_id: str) -> None:
+        acquired_at = self.active.pop(job_id, None)
+        if acquired_at is not None:
+            held = time.monotonic() - acquired_at
+            self.average_hold_seconds += 0.2 * (held - self.average_hold_seconds)
+        while self.waiters and len(self.active) < self.size:
+            next_id, future = self.waiters.popitem(last=False)
+            if future.done():
+                continue
+            self.active[next_id] = time.monotonic()
+            future.set_result(None)
+
+
+class JobAdmission:
+    """Veo-wait and encode slot pools plus the bounded queue in front of them."""
+
+    def __init__(self, veo_slots: int, encode_slots: int, max_queue: int):
+        self.veo = SlotPool("veo_wait", veo_slots, config.ADMISSION_INITIAL_VEO_SECONDS)
+        self.encode = SlotPool("encode", encode_slots, config.ADMISSION_INITIAL_ENCODE_SECONDS)
+        self.max_queue = max_queue
+        self._queued = OrderedDict()  # job_id -> admitted at (wall clock), until it gets a Veo slot
+
+    def queue_length(self) -> int:
+        return len(self._queued)
+
+    def check_capacity(self, jobs: int = 1) -> None:
+        """
+        Args:
+            jobs: Number of jobs about to be admitted together (a batch)
+
+        Raises:
+            QueueFullError: If the queue has no room for them (with a Retry-After hint in seconds)
+        """
+        if len(self._queued) + jobs > self.max_queue:
+            retry_after = self.veo.estimated_wait_seconds(1) or self.veo.average_hold_seconds
+            raise QueueFullError(int(min(600, max(1, retry_after))), len(self._queued))
+
+    def admit(self, job_id: str) -> dict:
+        """
+        Add a new job to the local queue (call check_capacity first).
+
+        Returns:
+            Queue info for the job (see queue_info)
+        """
+        self._queued[job_id] = time.time()
+        return self.queue_info(job_id)
+
+    def queue_info(self, job_id: str) -> Optional[dict]:
+        """
+        Position and estimated start of a queued job on this instance.
+
+        Returns:
+            {"queue_position": int, "estimated_start_at": epoch seconds}, or None if not queued here
+        """
+        if job_id not in self._queued:
+            return None
+        position = 1
+        for queued_id in self._queued:
+            if queued_id == job_id:
+                break
+            position += 1
+        wait = self.veo.estimated_wait_seconds(position)
+        return {"queue_position": position, "estimated_start_at": time.time() + wait}
+
+    @asynccontextmanager
+    async def veo_slot(self, job_id: str, needed: bool = True):
+        """
+        Hold a Veo-wait slot; the job leaves the queue once it has one.
+
+        Jobs that already have their clip (instant mode, resumed runs) pass
+        needed=False and leave the queue without taking a slot.
+        """
+        if not needed:
+            self._queued.pop(job_id, None)
+            yield
+            return
+        try:
+            with pipeline_stage("queue_wait"):
+                await self.veo.acquire(job_id)
+        finally:
+            self._queued.pop(job_id, None)
+        try:
+            yield
+        finally:
+            self.veo.release(job_id)
+
+    @asynccontextmanager
+    async def encode_slot(self, job_id: str):
+        """Hold an encode slot for the FFmpeg render."""
+        with pipeline_stage("encode_queue"):
+            await self.encode.acquire(job_id)
+        try:
+            yield
+        finally:
+            self.encode.release(job_id)
+
+    def forget(self, job_id: str) -> None:
+        """Drop a job that ended before getting a Veo slot."""
+        self._queued.pop(job_id, None)
@@ -0,0 +1,127 @@
+"""
+Cooperative cancellation of generation jobs.
+
+Each job gets a CancelToken, bound to the pipeline with `cancel_scope(token)`.
+Blocking code deep in the pipeline (Veo polling, FFmpeg, GCS uploads) reaches
+it through the module-level helpers below instead of taking it as a parameter,
+the same way the trace and log context travel into pipeline threads.
+
+Cancelling a token wakes every `sleep()` waiting on it, kills the FFmpeg
+processes registered with `track_process()` and makes `check()` raise
+JobCancelled, so each stage stops at its next checkpoint.
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+_current_token = contextvars.ContextVar("kapsule_cancel_token", default=None)
+
+
+class JobCancelled(Exception):
+    """Raised inside a pipeline whose job has been cancelled."""
+
+
+class CancelToken:
+    """Cancellation flag for one job, plus the subprocesses to kill when it is set."""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self._event = threading.Event()
+        self._processes = set()
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        """Set the flag and kill registered processes (safe to call from any thread, repeatedly)."""
+        with self._lock:
+            self._event.set()
+            processes = list(self._processes)
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+
+    def check(self) -> None:
+        if self._event.is_set():
+            raise JobCancelled(f"Job {self.job_id} was cancelled")
+
+    def sleep(self, seconds: float) -> None:
+        """Sleep, returning early with JobCancelled if the job is cancelled meanwhile."""
+        if self._event.wait(seconds):
+            self.check()
+
+    @contextmanager
+    def process(self, process):
+        """Kill `process` if the job is cancelled while this block runs."""
+        with self._lock:
+            self._processes.add(process)
+            cancelled = self._event.is_set()
+        if cancelled and process.poll() is None:
+            process.kill()
+        try:
+            yield process
+        finally:
+            with self._lock:
+                self._processes.discard(process)
+
+
+class CancellableReader:
+    """File wrapper that aborts an upload at its next read once the job is cancelled."""
+
+    def __init__(self, file, token: Optional[CancelToken] = None):
+        self._file = file
+        self._token = token or current()
+
+    def read(self, *args):
+        if self._token is not None:
+            self._token.check()
+        return self._file.read(*args)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+@contextmanager
+def cancel_scope(token: CancelToken):
+    """Bind `token` as the current job's token (inherited by copied contexts)."""
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
+
+
+def current() -> Optional[CancelToken]:
+    return _current_token.get()
+
+
+def check() -> None:
+    """Raise JobCancelled if the current job has been cancelled (no-op outside a job)."""
+    token = _current_token.get()
+    if token is not None:
+        token.check()
+
+
+def sleep(seconds: float) -> None:
+    """time.sleep that the current job's cancellation interrupts."""
+    token = _current_token.get()
+    if token is None:
+        time.sleep(seconds)
+    else:
+        token.sleep(seconds)
+
+
+@contextmanager
+def track_process(process):
+    """Register a subprocess with the current job's token, if any."""
+    token = _current_token.get()
+    if token is None:
+        yield process
+        return
+    with token.process(process):
+        yield process
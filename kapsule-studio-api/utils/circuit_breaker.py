@@ -0,0 +1,99 @@
+"""
+Circuit breaker for calls to a degraded upstream.
+
+    closed     - calls go through. failure_threshold consecutive failures (a call
+                 slower than slow_call_seconds counts as one) open the breaker
+    open       - calls are refused at once, so callers serve their fallback
+                 instead of waiting out a timeout. After reset_seconds the
+                 breaker turns half-open
+    half_open  - one probe call at a time goes through; success closes the
+                 breaker, failure opens it again. A probe whose outcome is never
+                 recorded (the caller went away) frees its slot after reset_seconds
+
+State changes and refused calls are counted in kapsule_circuit_breaker_transitions_total
+and kapsule_circuit_breaker_rejections_total.
+"""
+
+import logging
+import threading
+import time
+from typing import Optional
+
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATES = (CLOSED, HALF_OPEN, OPEN)
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker with a timed half-open probe."""
+
+    def __init__(self, name: str, failure_threshold: int, slow_call_seconds: float, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.slow_call_seconds = slow_call_seconds
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_started_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _transition(self, state: str) -> None:
+        if state == self.state:
+            return
+        logger.warning(f"Circuit breaker {self.name}: {self.state} -> {state}")
+        self.state = state
+        metrics.CIRCUIT_BREAKER_TRANSITIONS_TOTAL.inc(breaker=self.name, state=state)
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead now; a True must be followed by record_success or record_failure."""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN and now - self._opened_at >= self.reset_seconds:
+                self._transition(HALF_OPEN)
+                self._probe_started_at = None
+            if self.state == CLOSED:
+                return True
+            if self.state == HALF_OPEN and (
+                self._probe_started_at is None or now - self._probe_started_at >= self.reset_seconds
+            ):
+                self._probe_started_at = now
+                return True
+        metrics.CIRCUIT_BREAKER_REJECTIONS_TOTAL.inc(breaker=self.name)
+        return False
+
+    def record_success(self, duration: float) -> None:
+        """Record a finished call; one slower than slow_call_seconds counts as a failure."""
+        if self.slow_call_seconds > 0 and duration > self.slow_call_seconds:
+            self.record_failure()
+            return
+        with self._lock:
+            self.consecutive_failures = 0
+            self._probe_started_at = None
+            self._transition(CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probe_started_at = None
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                self._transition(OPEN)
+
+    def snapshot(self) -> dict:
+        """State for health checks."""
+        with self._lock:
+            snapshot = {"state": self.state, "consecutive_failures": self.consecutive_failures}
+            if self.state == OPEN:
+                snapshot["retry_in_seconds"] = round(max(0.0, self._opened_at + self.reset_seconds - time.monotonic()), 1)
+            return snapshot
+
+    def state_by_label(self) -> dict:
+        """Gauge callback: 1 for the current state, 0 for the others."""
+        state = self.state
+        return {(self.name, s): int(s == state) for s in STATES}
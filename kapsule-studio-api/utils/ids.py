@@ -0,0 +1,51 @@
+"""
+Time-ordered identifiers.
+
+Job IDs are generated locally instead of by Firestore, so /api/generate can
+answer before the job document is written. UUIDv7 (RFC 9562) puts a millisecond
+timestamp in the leading bits, so IDs sort by creation time, and index inserts
+stay roughly sequential.
+"""
+
+import os
+import threading
+import time
+import uuid
+
+_lock = threading.Lock()
+_last_ms = 0
+_counter = 0
+
+
+def uuid7() -> uuid.UUID:
+    """
+    A UUIDv7, monotonic within this process.
+
+    IDs created in the same millisecond use the 12-bit rand_a field as a counter
+    (RFC 9562, method 1). When the counter runs out, the timestamp borrows the
+    next millisecond, so ordering holds even under bursts.
+    """
+    global _last_ms, _counter
+    with _lock:
+        now_ms = time.time_ns() // 1_000_000
+        if now_ms > _last_ms:
+            _last_ms = now_ms
+            _counter = int.from_bytes(os.urandom(2), "big") & 0x3FF  # Leave headroom below 0xFFF
+        else:
+            _counter += 1
+            if _counter > 0xFFF:
+                _last_ms += 1
+                _counter = 0
+        timestamp_ms, counter = _last_ms, _counter
+
+    rand_b = int.from_bytes(os.urandom(8), "big") & ((1 << 62) - 1)
+    value = (timestamp_ms & ((1 << 48) - 1)) << 80
+    value |= 0x7 << 76
+    value |= counter << 64
+    value |= 0b10 << 62
+    value |= rand_b
+    return uuid.UUID(int=value)
+
+
+def new_job_id() -> str:
+    return str(uuid7())
@@ -0,0 +1,373 @@
+"""
+Per-job timing ledger and rolling latency percentiles.
+
+While a job's workflow runs, every pipeline_stage it passes through adds its
+duration to the job's TimingLedger (held in a context variable, so stages timed
+on worker threads count too). When the job finishes, the ledger is stored on the
+job document ("timings") and, for completed jobs, fed into JobStats:
+
+    stages    - seconds spent in each pipeline stage (queue_wait, veo_wait, encode, upload, ...)
+    run       - from the job going "processing" to its final status write
+    total     - from the workflow starting (right after admission) to the same write
+
+each kept overall and per option value (genre, style, duration). Percentiles
+come from streaming quantile sketches (log-spaced buckets with a bounded relative
+error, as in DDSketch), rolled over STATS_WINDOW_SECONDS in STATS_WINDOW_SLICES
+slices, so recording a job is a handful of bucket increments and answering
+/api/stats or an ETA never reads other jobs. The stats are per instance; at
+startup they are seeded from the last STATS_SEED_JOBS completed jobs' ledgers.
+"""
+
+import contextvars
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional, Tuple
+
+import config
+
+# Option dimensions stats are kept for: name in /api/stats -> job document field
+OPTION_FIELDS = {"genre": "genre", "style": "visualStyle", "duration": "duration"}
+
+# Most specific first: the first one with enough samples drives a job's ETA
+ETA_DIMENSIONS = ("duration", "style", "genre")
+
+REPORTED_QUANTILES = (0.5, 0.9, 0.95, 0.99)
+
+# Quantiles tried, in order, for the conditional remaining time of a running job
+_ETA_QUANTILES = (0.5, 0.75, 0.9, 0.95, 0.99)
+
+_MIN_VALUE = 0.001  # Seconds; shorter durations share the lowest bucket
+
+_current_ledger: contextvars.ContextVar = contextvars.ContextVar("timing_ledger", default=None)
+
+
+class TimingLedger:
+    """Stage durations, bytes moved, encode profile and (when profiling) resource usage of one job run."""
+
+    def __init__(self, profile: str):
+        self.profile = profile
+        self.started = time.time()
+        self.processing_started: Optional[float] = None
+        self.stages: Dict[str, float] = {}
+        self.bytes: Dict[str, int] = {}
+        self.resources: Dict[str, float] = {}  # Filled in by utils/profiling.py
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add_bytes(self, name: str, count: int) -> None:
+        with self._lock:
+            self.bytes[name] = self.bytes.get(name, 0) + count
+
+    def add_resource(self, name: str, value: float) -> None:
+        with self._lock:
+            self.resources[name] = self.resources.get(name, 0) + value
+
+    def max_resource(self, name: str, value: float) -> None:
+        with self._lock:
+            self.resources[name] = max(self.resources.get(name, 0), value)
+
+    def to_dict(self) -> dict:
+        """Compact form stored on the job document."""
+        now = time.time()
+        with self._lock:
+            timings = {
+                "stages": {stage: round(seconds, 3) for stage, seconds in self.stages.items()},
+                "bytes": dict(self.bytes),
+                "profile": self.profile,
+                "total_seconds": round(now - self.started, 3),
+            }
+            if self.resources:
+                timings["resources"] = {name: round(value, 3) for name, value in self.resources.items()}
+        if self.processing_started is not None:
+            timings["run_seconds"] = round(now - self.processing_started, 3)
+        return timings
+
+
+@contextmanager
+def ledger_scope(ledger: TimingLedger):
+    """Record every pipeline stage timed in this context (and contexts copied from it) on `ledger`."""
+    token = _current_ledger.set(ledger)
+    try:
+        yield ledger
+    finally:
+        _current_ledger.reset(token)
+
+
+def current_ledger() -> Optional[TimingLedger]:
+    return _current_ledger.get()
+
+
+def add_stage(stage: str, seconds: float) -> None:
+    """Add a stage duration to the current job's ledger, if any (called by pipeline_stage)."""
+    ledger = _current_ledger.get()
+    if ledger is not None:
+        ledger.add_stage(stage, seconds)
+
+
+def add_file_bytes(name: str, path: str) -> None:
+    """Add the size of a file the current job read or wrote to its ledger."""
+    ledger = _current_ledger.get()
+    if ledger is not None and os.path.exists(path):
+        ledger.add_bytes(name, os.path.getsize(path))
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with relative error `relative_accuracy`.
+
+    A value lands in the bucket ceil(log_gamma(value)); every value in a bucket is
+    within relative_accuracy of the bucket's representative value.
+    """
+
+    def __init__(self, relative_accuracy: float):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets: Dict[int, int] = {}
+        self.count = 0
+        self.sum = 0.0
+
+    def add(self, value: float) -> None:
+        index = math.ceil(math.log(max(value, _MIN_VALUE)) / self._log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other: "QuantileSketch") -> None:
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen > rank:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+
+class RollingSketch:
+    """QuantileSketch over the last `window_seconds`, rolled forward one slice at a time."""
+
+    def __init__(self, window_seconds: float, slices: int, relative_accuracy: float):
+        self.slice_seconds = window_seconds / max(1, slices)
+        self.slices = max(1, slices)
+        self.relative_accuracy = relative_accuracy
+        self._slices: deque = deque()  # (slice number, QuantileSketch), oldest first
+
+    def add(self, value: float, at: float) -> None:
+        number = int(at // self.slice_seconds)
+        # Usually the newest slice; seeded values can belong to an older one
+        position = len(self._slices)
+        while position and self._slices[position - 1][0] > number:
+            position -= 1
+        if position and self._slices[position - 1][0] == number:
+            sketch = self._slices[position - 1][1]
+        else:
+            sketch = QuantileSketch(self.relative_accuracy)
+            self._slices.insert(position, (number, sketch))
+        sketch.add(value)
+        self._expire(self._slices[-1][0])
+
+    def _expire(self, newest: int) -> None:
+        while self._slices and self._slices[0][0] <= newest - self.slices:
+            self._slices.popleft()
+
+    def merged(self, now: float) -> QuantileSketch:
+        self._expire(int(now // self.slice_seconds))
+        merged = QuantileSketch(self.relative_accuracy)
+        for _, sketch in self._slices:
+            merged.merge(sketch)
+        return merged
+
+
+def _summary(sketch: QuantileSketch) -> dict:
+    summary = {"count": sketch.count}
+    if sketch.count:
+        summary["mean"] = round(sketch.sum / sketch.count, 3)
+        for q in REPORTED_QUANTILES:
+            summary[f"p{round(q * 100)}"] = round(sketch.quantile(q), 3)
+    return summary
+
+
+def _epoch(value) -> Optional[float]:
+    # Job documents store naive UTC datetimes (utcnow)
+    if not isinstance(value, datetime):
+        return None
+    return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
+
+
+class JobStats:
+    """Rolling percentiles of completed jobs' timings, overall and per option value."""
+
+    def __init__(
+        self,
+        window_seconds: float = None,
+        slices: int = None,
+        relative_accuracy: float = None,
+        max_option_values: int = None,
+        min_samples: int = None
+    ):
+        self.window_seconds = window_seconds or config.STATS_WINDOW_SECONDS
+        self.slices = slices or config.STATS_WINDOW_SLICES
+        self.relative_accuracy = relative_accuracy or config.STATS_RELATIVE_ACCURACY
+        self.max_option_values = config.STATS_MAX_OPTION_VALUES if max_option_values is None else max_option_values
+        self.min_samples = config.STATS_MIN_SAMPLES if min_samples is None else min_samples
+        self._sketches: Dict[Tuple, RollingSketch] = {}  # (dimension, value, metric) -> sketch; ("all", "", metric) overall
+        self._option_values: Dict[str, set] = {dimension: set() for dimension in OPTION_FIELDS}
+        self._lock = threading.Lock()
+
+    def _option_value(self, dimension: str, value) -> str:
+        """The job's value for a dimension; values beyond max_option_values count as "other"."""
+        value = str(value) if value not in (None, "") else "unset"
+        values = self._option_values[dimension]
+        if value in values:
+            return value
+        if len(values) >= self.max_option_values:
+            return "other"
+        values.add(value)
+        return value
+
+    def _add(self, key: Tuple, value: float, at: float) -> None:
+        sketch = self._sketches.get(key)
+        if sketch is None:
+            sketch = self._sketches[key] = RollingSketch(self.window_seconds, self.slices, self.relative_accuracy)
+        sketch.add(value, at)
+
+    def record(self, job_data: dict, timings: dict, at: float = None) -> None:
+        """
+        Add a completed job's ledger.
+
+        Args:
+            job_data: The job's request or document (for its option values)
+            timings: TimingLedger.to_dict() of the run
+            at: When the job completed (epoch seconds; default now)
+        """
+        at = time.time() if at is None else at
+        values = [("total", timings.get("total_seconds")), ("run", timings.get("run_seconds"))]
+        values += [(f"stage:{stage}", seconds) for stage, seconds in timings.get("stages", {}).items()]
+        values = [(metric, value) for metric, value in values if value is not None]
+
+        with self._lock:
+            groups = [("all", "")] + [
+                (dimension, self._option_value(dimension, job_data.get(field)))
+                for dimension, field in OPTION_FIELDS.items()
+            ]
+            for dimension, option in groups:
+                for metric, value in values:
+                    self._add((dimension, option, metric), value, at)
+
+    def seed(self, jobs: Iterable[dict]) -> int:
+        """
+        Record completed job documents (with "timings" and "completedAt") from the window.
+
+        Returns:
+            Number of jobs recorded
+        """
+        cutoff = time.time() - self.window_seconds
+        recorded = 0
+        for job in jobs:
+            completed_at = _epoch(job.get("completedAt"))
+            if not isinstance(job.get("timings"), dict) or completed_at is None or completed_at < cutoff:
+                continue
+            self.record(job, job["timings"], at=completed_at)
+            recorded += 1
+        return recorded
+
+    def _sketch(self, dimension: str, option: str, metric: str, now: float) -> Optional[QuantileSketch]:
+        sketch = self._sketches.get((dimension, option, metric))
+        return None if sketch is None else sketch.merged(now)
+
+    def snapshot(self) -> dict:
+        """Percentiles per metric, overall and per option value (for /api/stats)."""
+        now = time.time()
+        with self._lock:
+            grouped: Dict[Tuple[str, str], Dict[str, QuantileSketch]] = {}
+            for (dimension, option, metric), rolling in self._sketches.items():
+                sketch = rolling.merged(now)
+                if sketch.count:
+                    grouped.setdefault((dimension, option), {})[metric] = sketch
+
+        def describe(metrics: Dict[str, QuantileSketch]) -> dict:
+            described = {"jobs": metrics["total"].count if "total" in metrics else 0}
+            for metric in ("total", "run"):
+                if metric in metrics:
+                    described[metric] = _summary(metrics[metric])
+            described["stages"] = {
+                metric.split(":", 1)[1]: _summary(sketch)
+                for metric, sketch in sorted(metrics.items()) if metric.startswith("stage:")
+            }
+            return described
+
+        snapshot = {"window_seconds": self.window_seconds}
+        snapshot.update(describe(grouped.get(("all", ""), {})))
+        snapshot["options"] = {
+            dimension: {
+                option: describe(metrics)
+                for (group_dimension, option), metrics in sorted(grouped.items()) if group_dimension == dimension
+            }
+            for dimension in OPTION_FIELDS
+        }
+        return snapshot
+
+    def _best_sketch(self, job_data: dict, metric: str, now: float) -> Optional[QuantileSketch]:
+        """The job's most specific option sketch with at least min_samples jobs, else the overall one."""
+        with self._lock:
+            for dimension in ETA_DIMENSIONS:
+                value = job_data.get(OPTION_FIELDS[dimension])
+                option = str(value) if value not in (None, "") else "unset"
+                if option not in self._option_values[dimension]:
+                    continue
+                sketch = self._sketch(dimension, option, metric, now)
+                if sketch is not None and sketch.count >= self.min_samples:
+                    return sketch
+            sketch = self._sketch("all", "", metric, now)
+        return sketch if sketch is not None and sketch.count >= self.min_samples else None
+
+    def remaining_seconds(self, job_data: dict, metric: str, elapsed: float) -> Optional[float]:
+        """
+        Expected time left for a job `elapsed` seconds into `metric` ("run" or "total").
+
+        Uses the median; once a job has outlived it, the first higher quantile it
+        hasn't reached yet (so slow jobs get a growing estimate instead of "now").
+
+        Returns:
+            Seconds (0 once the job is past every tracked quantile), or None without enough samples
+        """
+        sketch = self._best_sketch(job_data, metric, time.time())
+        if sketch is None:
+            return None
+        for q in _ETA_QUANTILES:
+            expected = sketch.quantile(q)
+            if expected > elapsed:
+                return expected - elapsed
+        return 0.0
+
+    def expected_seconds(self, job_data: dict, metric: str) -> Optional[float]:
+        """Median of `metric` for jobs like this one, or None without enough samples."""
+        sketch = self._best_sketch(job_data, metric, time.time())
+        return None if sketch is None else sketch.quantile(0.5)
+
+
+def retry_after_ms(remaining_seconds: Optional[float]) -> int:
+    """
+    Poll interval for a job expected to finish in `remaining_seconds`: half the
+    remaining time, within [RESULT_POLL_MIN_MS, RESULT_POLL_MAX_MS], so clients
+    poll sparsely early on and densely near completion.
+    """
+    if remaining_seconds is None:
+        return config.RESULT_POLL_DEFAULT_MS
+    interval = remaining_seconds * 1000 / 2
+    return int(min(config.RESULT_POLL_MAX_MS, max(config.RESULT_POLL_MIN_MS, interval)))
@@ -0,0 +1,173 @@
+"""
+Structured, non-blocking logging.
+
+Callers only enqueue records: a QueueHandler captures the request/job context
+(job_id, trace ids) and hands the record to a bounded queue, and a
+QueueListener thread does the JSON formatting and the actual write. When the
+queue is full, records are dropped and counted instead of blocking the caller.
+
+Every record carries a `job_id` field: pass `extra={"job_id": ...}` or bind it
+for a whole workflow with `job_context(job_id)`. Repetitive per-poll records
+are tagged `extra={"sample": "<key>"}` and only 1 in LOG_SAMPLE_EVERY of them
+(per key and job) is kept.
+
+LOG_FORMAT=text keeps the old synchronous plain-text console output.
+"""
+
+import contextvars
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Optional
+
+import config
+from utils import tracing
+from utils.metrics import LOG_RECORDS_DROPPED_TOTAL
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_job_id = contextvars.ContextVar("kapsule_log_job_id", default=None)
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+@contextmanager
+def job_context(job_id: str):
+    """Attach job_id to every record logged in this context (including copied contexts)."""
+    token = _job_id.set(job_id)
+    try:
+        yield
+    finally:
+        _job_id.reset(token)
+
+
+def truncate(text: str, limit: int) -> str:
+    if limit and len(text) > limit:
+        return f"{text[:limit]}... [truncated {len(text) - limit} chars]"
+    return text
+
+
+class SamplingFilter(logging.Filter):
+    """Keep the first and then every Nth record of each (sample key, job_id) stream."""
+
+    def __init__(self, every: int, max_streams: int = 10000):
+        super().__init__()
+        self.every = max(1, every)
+        self.max_streams = max_streams
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = getattr(record, "sample", None)
+        if key is None or self.every == 1:
+            return True
+        stream = (key, getattr(record, "job_id", None) or _job_id.get())
+        with self._lock:
+            count = self._counts.pop(stream, 0) + 1
+            self._counts[stream] = count
+            if len(self._counts) > self.max_streams:
+                self._counts.popitem(last=False)
+        if (count - 1) % self.every:
+            return False
+        record.sample_count = count
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, shaped for Cloud Logging's structured ingestion."""
+
+    # LogRecord attributes that are not user-supplied `extra` fields
+    _RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "sample"}
+
+    def __init__(self, max_chars: int):
+        super().__init__()
+        self.max_chars = max_chars
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "severity": record.levelname,
+            "logger": record.name,
+            "message": truncate(record.getMessage(), self.max_chars),
+            "job_id": getattr(record, "job_id", None),
+        }
+        if getattr(record, "trace_id", None):
+            entry["logging.googleapis.com/trace"] = record.trace_id
+            entry["logging.googleapis.com/spanId"] = record.span_id
+        for key, value in record.__dict__.items():
+            if key not in self._RESERVED and key not in entry and key not in ("trace_id", "span_id"):
+                entry[key] = value if isinstance(value, (int, float, bool, type(None))) else truncate(str(value), self.max_chars)
+        if record.exc_info:
+            entry["exception"] = truncate(self.formatException(record.exc_info), self.max_chars * 4)
+        return json.dumps(entry, default=str)
+
+
+class _ContextQueueHandler(logging.handlers.QueueHandler):
+    """Capture caller context into the record and enqueue it without blocking."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Formatting is left to the listener thread; only context has to be read here
+        if getattr(record, "job_id", None) is None:
+            record.job_id = _job_id.get()
+        context = tracing.current_context()
+        if context is not None and context.sampled:
+            record.trace_id = context.trace_id
+            record.span_id = context.span_id
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED_TOTAL.inc()
+
+
+def configure_logging() -> None:
+    """Install the root logging handlers for the API process (idempotent)."""
+    global _listener
+
+    root = logging.getLogger()
+    root.setLevel(config.LOG_LEVEL)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+    sampler = SamplingFilter(config.LOG_SAMPLE_EVERY)
+
+    if config.LOG_FORMAT == "text":
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        handler.addFilter(sampler)
+        root.addHandler(handler)
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter(config.LOG_MAX_MESSAGE_CHARS))
+
+    queue_handler = _ContextQueueHandler(queue.Queue(maxsize=config.LOG_QUEUE_SIZE))
+    queue_handler.addFilter(sampler)
+    root.addHandler(queue_handler)
+
+    # uvicorn installs its own synchronous stderr handlers before importing the app; route them here too
+    for name in ("uvicorn", "uvicorn.error", "uvicorn.access"):
+        uvicorn_logger = logging.getLogger(name)
+        uvicorn_logger.handlers.clear()
+        uvicorn_logger.propagate = True
+
+    _listener = logging.handlers.QueueListener(queue_handler.queue, output, respect_handler_level=True)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """Drain the queue and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
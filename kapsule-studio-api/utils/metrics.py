@@ -0,0 +1,437 @@
+"""
+Lightweight Prometheus-style metrics.
+
+Counters and histograms record into per-thread shards, so the hot path (the
+asyncio loop thread, threadpool workers, FFmpeg helper threads) never takes a
+lock per sample. Shards are only merged when /metrics is scraped. Gauges are
+computed by callbacks at scrape time.
+
+Exposition follows the Prometheus text format (version 0.0.4).
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; spans fast API calls up to multi-minute Veo waits
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+class _ShardSet:
+    """Per-thread dicts plus a merged total for shards whose threads have exited."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()  # Only taken once per thread and at scrape time
+        self._shards: List[Tuple[threading.Thread, dict]] = []
+        self.retired: dict = {}
+
+    def local(self) -> dict:
+        try:
+            return self._local.data
+        except AttributeError:
+            data = {}
+            with self._lock:
+                self._shards.append((threading.current_thread(), data))
+            self._local.data = data
+            return data
+
+    def snapshots(self, merge: Callable[[dict, dict], None]) -> dict:
+        """Merge every shard into a fresh dict, folding dead threads into `retired`."""
+        total = {}
+        with self._lock:
+            alive = []
+            for thread, data in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, data))
+                    merge(total, data.copy())  # dict.copy() is atomic under the GIL
+                else:
+                    merge(self.retired, data.copy())
+            self._shards = alive
+            merge(total, self.retired)
+        return total
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"'.replace("\n", " ") for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _label_values(labelnames: Tuple[str, ...], labels: dict) -> Tuple[str, ...]:
+    return tuple(str(labels.get(name, "")) for name in labelnames)
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._shards = _ShardSet()
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        data = self._shards.local()
+        key = _label_values(self.labelnames, labels)
+        data[key] = data.get(key, 0) + amount
+
+    @staticmethod
+    def _merge(into: dict, data: dict) -> None:
+        for key, value in data.items():
+            into[key] = into.get(key, 0) + value
+
+    def values(self) -> Dict[Tuple[str, ...], float]:
+        return self._shards.snapshots(self._merge)
+
+    def collect(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+            for key, value in sorted(self.values().items())
+        ]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._shards = _ShardSet()
+
+    def observe(self, value: float, **labels) -> None:
+        data = self._shards.local()
+        key = _label_values(self.labelnames, labels)
+        row = data.get(key)
+        if row is None:
+            # One slot per bucket plus +Inf, then sum and count
+            row = data[key] = [0] * (len(self.buckets) + 3)
+        row[bisect.bisect_left(self.buckets, value)] += 1
+        row[-2] += value
+        row[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time of the enclosed block (also on error)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    @staticmethod
+    def _merge(into: dict, data: dict) -> None:
+        for key, row in data.items():
+            target = into.get(key)
+            if target is None:
+                into[key] = list(row)
+            else:
+                for i, value in enumerate(row):
+                    target[i] += value
+
+    def values(self) -> dict:
+        return self._shards.snapshots(self._merge)
+
+    def collect(self) -> List[str]:
+        lines = []
+        for key, row in sorted(self.values().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), row):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                labels = _format_labels(self.labelnames, key, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {row[-2]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {row[-1]}")
+        return lines
+
+
+class Gauge:
+    """Gauge whose value(s) are computed by a callback at scrape time."""
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Tuple[str, ...] = (),
+        callback: Optional[Callable[[], object]] = None
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+
+    def set_callback(self, callback: Callable[[], object]) -> None:
+        """
+        Args:
+            callback: Returns a number (unlabelled gauge) or a dict mapping
+                label-value tuples to numbers
+        """
+        self.callback = callback
+
+    def collect(self) -> List[str]:
+        if self.callback is None:
+            return []
+        try:
+            value = self.callback()
+        except Exception:
+            return []
+        if isinstance(value, dict):
+            return [
+                f"{self.name}{_format_labels(self.labelnames, key if isinstance(key, tuple) else (key,))} {v}"
+                for key, v in sorted(value.items())
+            ]
+        return [f"{self.name} {value}"]
+
+
+class Registry:
+    """Ordered collection of metrics rendered together."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs) -> Counter:
+        return self.register(Counter(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs) -> Histogram:
+        return self.register(Histogram(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs) -> Gauge:
+        return self.register(Gauge(*args, **kwargs))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# Pipeline stages of process_video_generation:
+# queue_wait, veo_quota_wait, veo_submit, veo_wait, veo_download, audio_download, encode_queue, probe,
+# encode, segment_upload, upload, preview, firestore_write
+PIPELINE_STAGE_SECONDS = REGISTRY.histogram(
+    "kapsule_pipeline_stage_seconds",
+    "Duration of each video generation pipeline stage",
+    ("stage",)
+)
+
+PIPELINE_JOBS_TOTAL = REGISTRY.counter(
+    "kapsule_pipeline_jobs_total",
+    "Finished pipeline runs by outcome",
+    ("outcome",)
+)
+
+UPSTREAM_REQUEST_SECONDS = REGISTRY.histogram(
+    "kapsule_upstream_request_seconds",
+    "Latency of outbound Vertex AI HTTP calls",
+    ("service", "method")
+)
+
+UPSTREAM_REQUESTS_TOTAL = REGISTRY.counter(
+    "kapsule_upstream_requests_total",
+    "Outbound Vertex AI HTTP calls by status code ('error' for transport failures)",
+    ("service", "method", "status")
+)
+
+JOBS_IN_FLIGHT = REGISTRY.gauge(
+    "kapsule_jobs_in_flight",
+    "Jobs on this instance by local state",
+    ("state",)
+)
+
+TMP_BYTES_IN_USE = REGISTRY.gauge(
+    "kapsule_tmp_bytes_in_use",
+    "Bytes of job scratch files currently on local disk (tmpfs)"
+)
+
+SCRATCH_RESERVED_BYTES = REGISTRY.gauge(
+    "kapsule_scratch_reserved_bytes",
+    "Scratch bytes reserved by admitted jobs"
+)
+
+SCRATCH_ORPHANS_SWEPT_TOTAL = REGISTRY.counter(
+    "kapsule_scratch_orphans_swept_total",
+    "Orphaned job scratch directories removed by startup and periodic sweeps"
+)
+
+ADMISSION_REJECTIONS_TOTAL = REGISTRY.counter(
+    "kapsule_admission_rejections_total",
+    "Generation requests refused by admission control, by reason",
+    ("reason",)
+)
+
+SLOTS_IN_USE = REGISTRY.gauge(
+    "kapsule_slots_in_use",
+    "Admission slots held by running jobs, by kind (veo_wait, encode)",
+    ("kind",)
+)
+
+JOB_QUEUE_LENGTH = REGISTRY.gauge(
+    "kapsule_job_queue_length",
+    "Jobs queued on this instance waiting for a Veo slot"
+)
+
+VEO_SUBMIT_RETRIES_TOTAL = REGISTRY.counter(
+    "kapsule_veo_submit_retries_total",
+    "Veo predictLongRunning submissions retried, by status that triggered the retry",
+    ("status",)
+)
+
+VEO_SCHEDULER_WAITING = REGISTRY.gauge(
+    "kapsule_veo_scheduler_waiting",
+    "Jobs waiting for the Veo submission scheduler, by priority lane",
+    ("lane",)
+)
+
+VEO_OPERATIONS_IN_FLIGHT = REGISTRY.gauge(
+    "kapsule_veo_operations_in_flight",
+    "Veo operations submitted by this instance that have not finished"
+)
+
+JOBS_RESUMED_TOTAL = REGISTRY.counter(
+    "kapsule_jobs_resumed_total",
+    "Jobs taken over from an instance whose lease expired, by checkpoint resumed from",
+    ("checkpoint",)
+)
+
+IDEMPOTENT_REPLAYS_TOTAL = REGISTRY.counter(
+    "kapsule_idempotent_replays_total",
+    "Generation requests answered with an existing job because of a repeated Idempotency-Key"
+)
+
+JOB_WRITE_BEHIND_SECONDS = REGISTRY.histogram(
+    "kapsule_job_write_behind_seconds",
+    "Time from accepting a job to its document being persisted"
+)
+
+JOB_WRITES_PENDING = REGISTRY.gauge(
+    "kapsule_job_writes_pending",
+    "Accepted job and batch documents that have not been persisted yet"
+)
+
+JOB_WRITE_BEHIND_FAILURES_TOTAL = REGISTRY.counter(
+    "kapsule_job_write_behind_failures_total",
+    "Job documents that could not be persisted after all attempts"
+)
+
+CACHE_REQUESTS_TOTAL = REGISTRY.counter(
+    "kapsule_cache_requests_total",
+    "In-process cache lookups by cache and result (hit/miss)",
+    ("cache", "result")
+)
+
+PROMPT_PREVIEW_SECONDS = REGISTRY.histogram(
+    "kapsule_prompt_preview_seconds",
+    "Prompt preview latency until the first text is sent (first_token) and until the full prompt (total)",
+    ("mode", "phase", "source")
+)
+
+WARMUP_STEP_SECONDS = REGISTRY.gauge(
+    "kapsule_warmup_step_seconds",
+    "Duration of each startup warmup step on this instance",
+    ("step",)
+)
+
+GEMINI_HEDGES_TOTAL = REGISTRY.counter(
+    "kapsule_gemini_hedges_total",
+    "Gemini calls that sent a hedged second request, by which request answered (primary/hedge/none)",
+    ("winner",)
+)
+
+CIRCUIT_BREAKER_STATE = REGISTRY.gauge(
+    "kapsule_circuit_breaker_state",
+    "1 for each circuit breaker's current state (closed/half_open/open)",
+    ("breaker", "state")
+)
+
+CIRCUIT_BREAKER_TRANSITIONS_TOTAL = REGISTRY.counter(
+    "kapsule_circuit_breaker_transitions_total",
+    "Circuit breaker state changes, by the state entered",
+    ("breaker", "state")
+)
+
+CIRCUIT_BREAKER_REJECTIONS_TOTAL = REGISTRY.counter(
+    "kapsule_circuit_breaker_rejections_total",
+    "Calls refused by an open circuit breaker (served from the fallback)",
+    ("breaker",)
+)
+
+RATE_LIMIT_REJECTIONS_TOTAL = REGISTRY.counter(
+    "kapsule_rate_limit_rejections_total",
+    "Requests rejected by a rate limiter",
+    ("endpoint",)
+)
+
+COMPACTION_ITEMS_TOTAL = REGISTRY.counter(
+    "kapsule_compaction_items_total",
+    "Objects deleted or archived and jobs failed by compaction",
+    ("set", "action")
+)
+
+COMPACTION_BYTES_TOTAL = REGISTRY.counter(
+    "kapsule_compaction_bytes_total",
+    "Bytes of GCS objects deleted or archived by compaction",
+    ("set", "action")
+)
+
+REGION_FAILOVERS_TOTAL = REGISTRY.counter(
+    "kapsule_region_failovers_total",
+    "Vertex calls moved to another region after a quota, server or transport error",
+    ("service", "region")
+)
+
+REGION_LATENCY_SECONDS = REGISTRY.gauge(
+    "kapsule_region_latency_seconds",
+    "Moving average latency per Vertex region (Veo: submit to finished clip)",
+    ("service", "region")
+)
+
+LIBRARY_REQUESTS_TOTAL = REGISTRY.counter(
+    "kapsule_library_requests_total",
+    "Instant-mode requests by clip library outcome (hit, empty or ineligible)",
+    ("result",)
+)
+
+LIBRARY_CLIPS_TOTAL = REGISTRY.counter(
+    "kapsule_library_clips_total",
+    "Clip library clips generated, failed, retired, evicted and deleted",
+    ("action",)
+)
+
+LOG_RECORDS_DROPPED_TOTAL = REGISTRY.counter(
+    "kapsule_log_records_dropped_total",
+    "Log records dropped because the logging queue was full"
+)
+
+
+def observe_upstream(service: str, method: str, start: float, status) -> None:
+    """Record one outbound HTTP call started at `start` (perf_counter) with its status."""
+    UPSTREAM_REQUEST_SECONDS.observe(time.perf_counter() - start, service=service, method=method)
+    UPSTREAM_REQUESTS_TOTAL.inc(service=service, method=method, status=status)
@@ -0,0 +1,344 @@
+"""
+On-demand profiling of a live instance, behind the /admin endpoints.
+
+    cpu        - samples every thread's Python stack each PROFILE_SAMPLE_INTERVAL_SECONDS
+                 for N seconds and writes the counts as folded stacks (the input
+                 format of flamegraph.pl, speedscope and similar viewers)
+    memory     - tracemalloc snapshots N seconds apart; writes the allocation
+                 sites whose memory grew the most, with their tracebacks
+    tasks      - stack of every asyncio task and every thread, right now
+
+Each capture is written to PROFILE_ARTIFACT_DIR (oldest deleted beyond
+PROFILE_MAX_ARTIFACTS) and served back as a download. Captures are bounded
+(PROFILE_MAX_SECONDS, one at a time) and cost nothing when none is running;
+tracemalloc is only on during a memory capture.
+
+While profiling is enabled, ResourceMonitor also samples the process RSS and
+the FFmpeg processes of running jobs every PROFILE_RESOURCE_SAMPLE_SECONDS, and
+records each job's peak RSS and FFmpeg CPU time and peak RSS in its timing
+ledger (the "resources" of /api/stats timings). Reads come from /proc, so
+this part is Linux-only; elsewhere the ledger simply has no resources.
+"""
+
+import asyncio
+import io
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import config
+from utils import job_stats
+
+logger = logging.getLogger(__name__)
+
+ARTIFACT_KINDS = {"cpu": "folded", "memory": "txt", "tasks": "txt"}
+
+_MIN_SAMPLE_INTERVAL_SECONDS = 0.005
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+class CaptureInProgress(Exception):
+    """Raised when a CPU or memory capture is requested while another one is running."""
+
+
+# Artifacts
+
+def _artifact_path(kind: str) -> str:
+    os.makedirs(config.PROFILE_ARTIFACT_DIR, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+    return os.path.join(config.PROFILE_ARTIFACT_DIR, f"{kind}-{stamp}-{os.getpid()}.{ARTIFACT_KINDS[kind]}")
+
+
+def _write_artifact(kind: str, content: str) -> str:
+    """Write a capture, drop the oldest beyond PROFILE_MAX_ARTIFACTS; returns the file name."""
+    path = _artifact_path(kind)
+    with open(path, "w") as f:
+        f.write(content)
+    for stale in list_artifacts()[config.PROFILE_MAX_ARTIFACTS:]:
+        try:
+            os.remove(os.path.join(config.PROFILE_ARTIFACT_DIR, stale["name"]))
+        except OSError:
+            pass
+    return os.path.basename(path)
+
+
+def list_artifacts() -> List[dict]:
+    """Captures on disk, newest first."""
+    if not os.path.isdir(config.PROFILE_ARTIFACT_DIR):
+        return []
+    artifacts = []
+    for entry in os.scandir(config.PROFILE_ARTIFACT_DIR):
+        kind = entry.name.split("-", 1)[0]
+        if entry.is_file() and kind in ARTIFACT_KINDS:
+            stat = entry.stat()
+            artifacts.append({"name": entry.name, "kind": kind, "bytes": stat.st_size, "mtime": stat.st_mtime})
+    return sorted(artifacts, key=lambda artifact: artifact["mtime"], reverse=True)
+
+
+def artifact_path(name: str) -> Optional[str]:
+    """Path of a listed capture, or None (names are never joined unchecked)."""
+    if name not in {artifact["name"] for artifact in list_artifacts()}:
+        return None
+    return os.path.join(config.PROFILE_ARTIFACT_DIR, name)
+
+
+# Captures
+
+_capture_lock = threading.Lock()
+
+
+@contextmanager
+def _exclusive_capture():
+    if not _capture_lock.acquire(blocking=False):
+        raise CaptureInProgress("Another profile capture is running")
+    try:
+        yield
+    finally:
+        _capture_lock.release()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def profile_cpu(seconds: float, interval: float = None) -> dict:
+    """
+    Sample every thread's stack for `seconds` (blocking; run it off the event loop).
+
+    Returns:
+        {"artifact": file name, "samples": stack samples taken, "top": the 15 leaf
+        frames seen most often with their share of samples}
+    """
+    interval = max(_MIN_SAMPLE_INTERVAL_SECONDS, interval or config.PROFILE_SAMPLE_INTERVAL_SECONDS)
+    seconds = min(seconds, config.PROFILE_MAX_SECONDS)
+    own_thread = threading.get_ident()
+    stacks: Counter = Counter()
+    leaves: Counter = Counter()
+    samples = 0
+
+    with _exclusive_capture():
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame))
+                    frame = frame.f_back
+                if not labels:
+                    continue
+                thread_name = names.get(thread_id, str(thread_id))
+                stacks[";".join([thread_name] + labels[::-1])] += 1
+                leaves[labels[0]] += 1
+                samples += 1
+            time.sleep(interval)
+
+    content = "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+    artifact = _write_artifact("cpu", content)
+    logger.info(f"CPU profile captured over {seconds}s ({samples} samples): {artifact}")
+    return {
+        "artifact": artifact,
+        "samples": samples,
+        "top": [
+            {"frame": frame, "share": round(count / samples, 3)}
+            for frame, count in leaves.most_common(15)
+        ] if samples else [],
+    }
+
+
+def profile_memory(seconds: float) -> dict:
+    """
+    Diff two tracemalloc snapshots `seconds` apart (blocking; run it off the event loop).
+
+    Returns:
+        {"artifact": file name, "growth_bytes": net growth of traced memory,
+        "top": the 15 allocation sites that grew the most}
+    """
+    seconds = min(seconds, config.PROFILE_MAX_SECONDS)
+    filters = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ]
+
+    with _exclusive_capture():
+        started_here = not tracemalloc.is_tracing()
+        if started_here:
+            tracemalloc.start(config.PROFILE_TRACEMALLOC_FRAMES)
+        try:
+            before = tracemalloc.take_snapshot().filter_traces(filters)
+            time.sleep(seconds)
+            after = tracemalloc.take_snapshot().filter_traces(filters)
+        finally:
+            if started_here:
+                tracemalloc.stop()
+
+    diff = after.compare_to(before, "traceback")
+    top = diff[:config.PROFILE_TRACEMALLOC_TOP]
+    growth = sum(stat.size_diff for stat in diff)
+
+    out = io.StringIO()
+    out.write(f"tracemalloc diff over {seconds}s, net growth {growth} bytes\n")
+    if not started_here:
+        out.write("(tracemalloc was already running; allocations from before the capture are included in the sizes)\n")
+    for rank, stat in enumerate(top, 1):
+        out.write(f"\n#{rank}: {stat.size_diff:+d} bytes ({stat.count_diff:+d} blocks), now {stat.size} bytes in {stat.count} blocks\n")
+        for line in stat.traceback.format():
+            out.write(f"{line}\n")
+    artifact = _write_artifact("memory", out.getvalue())
+    logger.info(f"Memory profile captured over {seconds}s (net {growth:+d} bytes): {artifact}")
+    return {
+        "artifact": artifact,
+        "growth_bytes": growth,
+        "top": [
+            {"site": str(stat.traceback[-1]) if len(stat.traceback) else "?", "size_diff": stat.size_diff, "count_diff": stat.count_diff}
+            for stat in top[:15]
+        ],
+    }
+
+
+def dump_tasks() -> dict:
+    """
+    Stacks of every asyncio task on the running loop and of every thread (call on the event loop).
+
+    Returns:
+        {"artifact": file name, "tasks": number of tasks, "threads": number of threads}
+    """
+    tasks = asyncio.all_tasks()
+    out = io.StringIO()
+    out.write(f"{len(tasks)} asyncio tasks\n")
+    for task in sorted(tasks, key=lambda task: task.get_name()):
+        coro = task.get_coro()
+        out.write(f"\n--- Task {task.get_name()}: {getattr(coro, '__qualname__', coro)}\n")
+        task.print_stack(file=out)
+
+    frames = sys._current_frames()
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    out.write(f"\n\n{len(frames)} threads\n")
+    for thread_id, frame in frames.items():
+        out.write(f"\n--- Thread {names.get(thread_id, thread_id)}\n")
+        out.write("".join(traceback.format_stack(frame)))
+
+    artifact = _write_artifact("tasks", out.getvalue())
+    return {"artifact": artifact, "tasks": len(tasks), "threads": len(frames)}
+
+
+# Per-job resource usage
+
+def _process_rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _child_usage(pid: int) -> Optional[Dict[str, float]]:
+    """CPU seconds and peak RSS so far of a running child process."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status") as f:
+            peak_kib = next((int(line.split()[1]) for line in f if line.startswith("VmHWM:")), 0)
+    except (OSError, ValueError, IndexError):
+        return None
+    # utime and stime are fields 14 and 15 of /proc/<pid>/stat (11 and 12 after the command name)
+    return {"cpu_seconds": (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS, "peak_rss_bytes": peak_kib * 1024}
+
+
+class ResourceMonitor:
+    """Samples process RSS for running jobs and usage of their FFmpeg processes."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._jobs: Dict[int, job_stats.TimingLedger] = {}  # id(ledger) -> ledger
+        self._children: Dict[int, list] = {}  # pid -> [ledger, last usage]
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> None:
+        if self._thread is None and self.interval > 0:
+            self._thread = threading.Thread(target=self._run, name="resource-monitor", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sample()
+            except Exception as e:
+                logger.warning(f"Resource sampling failed: {e}")
+
+    def sample(self) -> None:
+        with self._lock:
+            ledgers = list(self._jobs.values())
+            children = list(self._children.items())
+        if ledgers:
+            rss = _process_rss_bytes()
+            if rss is not None:
+                for ledger in ledgers:
+                    ledger.max_resource("peak_rss_bytes", rss)
+        for pid, entry in children:
+            usage = _child_usage(pid)
+            if usage is not None:
+                entry[1] = usage
+
+    @contextmanager
+    def job(self, ledger: job_stats.TimingLedger):
+        """Track the process RSS while a job runs, as its peak_rss_bytes."""
+        if not self.running:
+            yield
+            return
+        with self._lock:
+            self._jobs[id(ledger)] = ledger
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._jobs.pop(id(ledger), None)
+
+    @contextmanager
+    def child(self, process):
+        """Track a subprocess of the current job; its usage is added to the job's ledger when it ends."""
+        ledger = job_stats.current_ledger()
+        if not self.running or ledger is None:
+            yield process
+            return
+        entry = [ledger, _child_usage(process.pid)]
+        with self._lock:
+            self._children[process.pid] = entry
+        try:
+            yield process
+        finally:
+            with self._lock:
+                self._children.pop(process.pid, None)
+            # The last sample, at most `interval` before the process exited
+            usage = entry[1]
+            ledger.add_resource("ffmpeg_processes", 1)
+            if usage is not None:
+                ledger.add_resource("ffmpeg_cpu_seconds", usage["cpu_seconds"])
+                ledger.max_resource("ffmpeg_peak_rss_bytes", usage["peak_rss_bytes"])
+
+
+monitor = ResourceMonitor(config.PROFILE_RESOURCE_SAMPLE_SECONDS)
+
+
+def track_child(process):
+    """Register a job's subprocess with the resource monitor (a no-op unless profiling is on)."""
+    return monitor.child(process)
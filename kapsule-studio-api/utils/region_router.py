@@ -0,0 +1,186 @@
+"""
+Routing of new Vertex work across an ordered list of regions.
+
+Each region has its own circuit breaker (see utils/circuit_breaker.py) plus a
+moving average of its latency and error rate. New work goes to the healthiest
+region:
+
+    1. regions whose breaker is closed, then half-open, then open
+    2. within those, by latency weighted by the error rate - regions within
+       REGION_LATENCY_TOLERANCE of the fastest count as equally fast, so the
+       configured order decides until a region is clearly slower. A region
+       without latency samples gets one call first (a probe), and ties with the
+       fastest while that call is outstanding
+    3. the configured order (the first region is the preferred one)
+
+Callers fail over to the next region on quota (429), server (5xx) and transport
+errors. Work already started in a region (a Veo operation) stays there: its
+region is part of the operation name, and polls go back to it.
+"""
+
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import config
+from utils import metrics
+from utils.circuit_breaker import CLOSED, HALF_OPEN, CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+_STATE_RANK = {CLOSED: 0, HALF_OPEN: 1}  # Anything else (open) ranks last
+
+
+class _RegionHealth:
+    """Breaker and moving averages of one region."""
+
+    def __init__(self, service: str, region: str, slow_call_seconds: float):
+        self.breaker = CircuitBreaker(
+            f"{service}:{region}",
+            config.REGION_FAILURE_THRESHOLD,
+            slow_call_seconds,
+            config.REGION_RESET_SECONDS
+        )
+        self.latency: Optional[float] = None  # EWMA seconds, None until the first sample
+        self.error_rate = 0.0  # EWMA of failed calls
+        self.probed = False  # Picked at least once while it had no latency sample
+
+
+class RegionRouter:
+    """Ranks regions for new work and records how calls to them went."""
+
+    def __init__(self, service: str, regions: List[str], slow_call_seconds: float = 0):
+        """
+        Args:
+            service: Name for logs and metrics ("veo", "gemini")
+            regions: Locations in order of preference (at least one)
+            slow_call_seconds: Calls slower than this count against a region's breaker (0 = never)
+        """
+        if not regions:
+            raise ValueError("RegionRouter needs at least one region")
+        self.service = service
+        self.regions = list(dict.fromkeys(regions))
+        self._health: Dict[str, _RegionHealth] = {
+            region: _RegionHealth(service, region, slow_call_seconds) for region in self.regions
+        }
+        self._lock = threading.Lock()
+
+    def _score(self, health: _RegionHealth) -> Optional[float]:
+        if health.latency is None:
+            return None
+        return health.latency * (1 + config.REGION_ERROR_PENALTY * health.error_rate)
+
+    def ranked(self, exclude: Iterable[str] = ()) -> List[str]:
+        """Regions in the order new work should try them."""
+        excluded = set(exclude)
+        with self._lock:
+            scores = {region: self._score(self._health[region]) for region in self.regions}
+            unprobed = {region for region in self.regions if not self._health[region].probed}
+        known = [score for score in scores.values() if score is not None]
+        # Scores within the tolerance of the best tie (as do regions whose probe is outstanding)
+        tied_below = min(known) * (1 + config.REGION_LATENCY_TOLERANCE) if known else 0.0
+
+        def key(item):
+            position, region = item
+            score = scores[region]
+            state_rank = _STATE_RANK.get(self._health[region].breaker.state, 2)
+            if score is None:
+                return (state_rank, -1.0 if region in unprobed else 0.0, position)
+            return (state_rank, score if score > tied_below else 0.0, position)
+
+        candidates = [(position, region) for position, region in enumerate(self.regions) if region not in excluded]
+        return [region for _, region in sorted(candidates, key=key)]
+
+    def pick(self, exclude: Iterable[str] = ()) -> Optional[str]:
+        """
+        The region for a new call: the best ranked one whose breaker lets it through.
+
+        A call made in the returned region must be followed by record_success or
+        record_failure.
+
+        Returns:
+            The region, or None if every region (not excluded) refuses calls right now
+        """
+        for region in self.ranked(exclude):
+            health = self._health[region]
+            if health.breaker.allow():
+                with self._lock:
+                    health.probed = True
+                return region
+        return None
+
+    def pick_or_preferred(self, exclude: Iterable[str] = ()) -> str:
+        """Like pick, but never refuses: with every breaker open, the best ranked region is tried anyway."""
+        region = self.pick(exclude)
+        if region is not None:
+            return region
+        return (self.ranked(exclude) or self.regions)[0]
+
+    def record_success(self, region: str, duration: float, observe_latency: bool = True) -> None:
+        """
+        Record a call that got an answer.
+
+        Args:
+            region: Region the call went to
+            duration: How long it took (slow calls count against the breaker)
+            observe_latency: Also fold duration into the region's latency average
+        """
+        health = self._health[region]
+        health.breaker.record_success(duration)
+        with self._lock:
+            health.error_rate *= 1 - config.REGION_EWMA_ALPHA
+        if observe_latency:
+            self.observe_latency(region, duration)
+
+    def record_failure(self, region: str) -> None:
+        """Record a quota, server or transport error from a region."""
+        health = self._health[region]
+        health.breaker.record_failure()
+        with self._lock:
+            health.error_rate += config.REGION_EWMA_ALPHA * (1 - health.error_rate)
+
+    def observe_latency(self, region: str, seconds: float) -> None:
+        """Fold a latency sample into a region's average (for Veo: submit to finished clip)."""
+        health = self._health.get(region)
+        if health is None:
+            return  # An operation from a region no longer configured
+        with self._lock:
+            if health.latency is None:
+                health.latency = seconds
+            else:
+                health.latency += config.REGION_EWMA_ALPHA * (seconds - health.latency)
+
+    def failed_over(self, from_region: str, to_region: str, reason) -> None:
+        logger.warning(f"{self.service} region {from_region} failed ({reason}), failing over to {to_region}")
+        metrics.REGION_FAILOVERS_TOTAL.inc(service=self.service, region=from_region)
+
+    def snapshot(self) -> dict:
+        """Per-region breaker state, latency and error rate, in routing order."""
+        with self._lock:
+            averages = {
+                region: (health.latency, health.error_rate) for region, health in self._health.items()
+            }
+        snapshot = {}
+        for region in self.ranked():
+            latency, error_rate = averages[region]
+            snapshot[region] = dict(
+                self._health[region].breaker.snapshot(),
+                latency_seconds=None if latency is None else round(latency, 3),
+                error_rate=round(error_rate, 3)
+            )
+        return snapshot
+
+    def breaker_states(self) -> dict:
+        """Gauge callback: circuit breaker states of every region."""
+        states = {}
+        for health in self._health.values():
+            states.update(health.breaker.state_by_label())
+        return states
+
+    def latency_by_region(self) -> dict:
+        """Gauge callback: latency average of each region that has one."""
+        with self._lock:
+            return {
+                (self.service, region): health.latency
+                for region, health in self._health.items() if health.latency is not None
+            }
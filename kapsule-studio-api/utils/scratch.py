@@ -0,0 +1,214 @@
+"""
+Per-job scratch space on the instance's local (memory-backed) disk.
+
+Every job works inside its own directory under SCRATCH_DIR and reserves a byte
+budget up front, sized from the requested track duration. New jobs are only
+admitted while the sum of reservations stays under SCRATCH_LIMIT_BYTES (and the
+filesystem actually has the space), so several long renders can't fill tmpfs
+and get the instance OOM-killed. Jobs that don't fit wait for space instead.
+
+Job directories are removed when the job releases them. Directories left by a
+crash or a killed instance are swept on startup and periodically.
+"""
+
+import asyncio
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import Dict, Optional
+
+import config
+from utils.video_utils import OutputLimitExceeded, disk_usage_bytes
+
+logger = logging.getLogger(__name__)
+
+OWNER_FILE = ".owner"
+
+
+class ScratchFullError(Exception):
+    """Raised when a job can't be given scratch space right now."""
+
+
+class ScratchQuotaExceeded(OutputLimitExceeded):
+    """Raised when a job has written more than its scratch budget (stops a running encode)."""
+
+
+def estimate_job_bytes(duration: Optional[str]) -> int:
+    """
+    Projected peak scratch usage of a job.
+
+    Args:
+        duration: Requested track duration, e.g. "15s"
+
+    Returns:
+        Bytes to reserve for the job
+    """
+    try:
+        seconds = float(str(duration).rstrip("s"))
+    except (TypeError, ValueError):
+        seconds = 60
+    return int(config.SCRATCH_JOB_BASE_BYTES + seconds * config.SCRATCH_BYTES_PER_SECOND)
+
+
+class JobScratch:
+    """A job's scratch directory and its byte budget."""
+
+    def __init__(self, job_id: str, path: str, budget: int):
+        self.job_id = job_id
+        self.path = path
+        self.budget = budget
+
+    def file(self, name: str) -> str:
+        """Path for a scratch file (or subdirectory) of this job."""
+        return os.path.join(self.path, name)
+
+    def usage(self) -> int:
+        return disk_usage_bytes(self.path)
+
+    def check(self) -> None:
+        """
+        Raise ScratchQuotaExceeded if the job is over its budget.
+
+        Passed to the FFmpeg helpers as their `check`, so an encode is killed as
+        soon as its output pushes the job over, not after it filled the disk.
+        """
+        used = self.usage()
+        if used > self.budget:
+            raise ScratchQuotaExceeded(
+                f"Job {self.job_id} scratch usage {used} bytes exceeds its budget of {self.budget} bytes"
+            )
+
+
+class ScratchManager:
+    """Hands out job directories, tracks reservations and sweeps orphans."""
+
+    def __init__(self, root: str, limit_bytes: int):
+        self.root = root
+        self.limit_bytes = limit_bytes
+        self._jobs: Dict[str, JobScratch] = {}
+        self._lock = threading.Lock()
+        self.waiting = 0  # Jobs currently deferred in acquire()
+
+    def reserved_bytes(self) -> int:
+        return sum(job.budget for job in list(self._jobs.values()))
+
+    def usage_bytes(self) -> int:
+        return sum(job.usage() for job in list(self._jobs.values()))
+
+    def _free_bytes(self) -> int:
+        try:
+            return shutil.disk_usage(self.root).free
+        except OSError:
+            return 0
+
+    def fits(self, budget: int) -> bool:
+        """Whether a job with this budget could be admitted right now."""
+        if self.reserved_bytes() + budget > self.limit_bytes:
+            return False
+        # Reservations only cover our own jobs; the filesystem must really have the space
+        return self._free_bytes() - max(0, self.reserved_bytes() - self.usage_bytes()) >= budget
+
+    def reserve(self, job_id: str, budget: int) -> JobScratch:
+        """
+        Reserve scratch space and create the job directory without waiting.
+
+        Raises:
+            ScratchFullError: If the reservation would exceed the limit
+        """
+        with self._lock:
+            if job_id in self._jobs:
+                return self._jobs[job_id]
+            os.makedirs(self.root, exist_ok=True)
+            if not self.fits(budget):
+                raise ScratchFullError(
+                    f"Scratch space exhausted ({self.reserved_bytes()} of {self.limit_bytes} bytes reserved)"
+                )
+            path = os.path.join(self.root, job_id)
+            os.makedirs(path, exist_ok=True)
+            with open(os.path.join(path, OWNER_FILE), "w") as f:
+                f.write(str(os.getpid()))
+            job = JobScratch(job_id, path, budget)
+            self._jobs[job_id] = job
+        logger.info(f"[Job {job_id}] Reserved {budget} bytes of scratch space at {path}")
+        return job
+
+    async def acquire(self, job_id: str, budget: int, timeout: float) -> JobScratch:
+        """
+        Reserve scratch space, deferring until enough has been released.
+
+        Raises:
+            ScratchFullError: If no space became available within `timeout` seconds
+        """
+        deadline = time.monotonic() + timeout
+        self.waiting += 1
+        try:
+            while True:
+                try:
+                    return self.reserve(job_id, budget)
+                except ScratchFullError:
+                    if time.monotonic() >= deadline:
+                        raise
+                await asyncio.sleep(1)
+        finally:
+            self.waiting -= 1
+
+    def release(self, job_id: str) -> None:
+        """Delete the job directory and drop its reservation."""
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is not None:
+            shutil.rmtree(job.path, ignore_errors=True)
+            logger.info(f"[Job {job_id}] Released scratch space")
+
+    def sweep(self, max_age_seconds: float) -> int:
+        """
+        Remove job directories no live job owns.
+
+        A directory is orphaned when it isn't an active job of this process and
+        its owning process is gone (or is this process, e.g. a restarted PID 1),
+        or when it is older than `max_age_seconds`.
+
+        Returns:
+            Number of directories removed
+        """
+        try:
+            entries = os.listdir(self.root)
+        except FileNotFoundError:
+            return 0
+
+        removed = 0
+        now = time.time()
+        with self._lock:
+            for name in entries:
+                path = os.path.join(self.root, name)
+                if name in self._jobs or not os.path.isdir(path):
+                    continue
+                try:
+                    with open(os.path.join(path, OWNER_FILE)) as f:
+                        owner = int(f.read().strip() or 0)
+                except (OSError, ValueError):
+                    owner = 0
+                try:
+                    age = now - os.path.getmtime(path)
+                except OSError:
+                    continue
+                if owner != os.getpid() and _pid_alive(owner) and age < max_age_seconds:
+                    continue  # Another worker process on this instance is using it
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+                logger.info(f"Swept orphaned scratch directory: {path}")
+        return removed
+
+
+def _pid_alive(pid: int) -> bool:
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,261 @@
+"""
+Minimal distributed tracing.
+
+Spans carry W3C trace context (trace_id/span_id), nest through contextvars,
+and are head-sampled per trace (TRACE_SAMPLE_RATIO). Finished spans go into a
+bounded lock-free buffer; a daemon thread batches them to the configured
+exporter, so neither the asyncio loop nor pipeline threads ever do export I/O.
+
+Exporters (TRACE_EXPORTER):
+    none  - tracing disabled (spans are no-ops)
+    otlp  - OTLP/HTTP JSON to TRACE_OTLP_ENDPOINT (e.g. a local collector on :4318)
+    file  - one JSON span per line appended to TRACE_FILE_PATH
+"""
+
+import contextvars
+import json
+import logging
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Optional
+
+import requests
+
+import config
+from utils import job_stats
+from utils.metrics import PIPELINE_STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar("kapsule_current_span", default=None)
+
+
+class SpanContext:
+    """Identity of a span that other spans (or other processes) can parent to."""
+
+    __slots__ = ("trace_id", "span_id", "sampled")
+
+    def __init__(self, trace_id: str, span_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    def to_traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    @classmethod
+    def from_traceparent(cls, header: Optional[str]) -> Optional["SpanContext"]:
+        """Parse a W3C traceparent header; returns None if absent or malformed."""
+        if not header:
+            return None
+        parts = header.strip().split("-")
+        if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+            return None
+        try:
+            int(parts[1], 16), int(parts[2], 16)
+            flags = int(parts[3], 16)
+        except ValueError:
+            return None
+        return cls(parts[1], parts[2], bool(flags & 1))
+
+
+class Span:
+    """A timed operation; only recorded when its trace is sampled."""
+
+    __slots__ = ("name", "context", "parent_span_id", "start_ns", "end_ns", "attributes", "status", "error")
+
+    def __init__(self, name: str, context: SpanContext, parent_span_id: Optional[str], attributes: dict):
+        self.name = name
+        self.context = context
+        self.parent_span_id = parent_span_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.status = "OK"
+        self.error = None
+
+    def set_attribute(self, key: str, value) -> None:
+        if self.context.sampled:
+            self.attributes[key] = value
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.context.trace_id,
+            "span_id": self.context.span_id,
+            "parent_span_id": self.parent_span_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "status": self.status,
+            "error": self.error,
+        }
+
+
+def _new_id(n_bytes: int) -> str:
+    return f"{random.getrandbits(n_bytes * 8):0{n_bytes * 2}x}"
+
+
+class _Exporter:
+    """Buffers finished spans and exports them in batches from a daemon thread."""
+
+    def __init__(self, kind: str, max_queue: int, flush_interval: float):
+        self.kind = kind
+        self.flush_interval = flush_interval
+        self._buffer = deque(maxlen=max_queue)  # append/popleft are thread-safe; oldest dropped when full
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._started = threading.Lock()
+
+    def submit(self, span: Span) -> None:
+        self._buffer.append(span)
+        if self._thread is None:
+            self._start()
+
+    def _start(self) -> None:
+        with self._started:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        while self._buffer:
+            batch = []
+            while self._buffer and len(batch) < 512:
+                batch.append(self._buffer.popleft())
+            self._export(batch)
+
+    def _export(self, batch: list) -> None:
+        try:
+            if self.kind == "file":
+                with open(config.TRACE_FILE_PATH, "a") as f:
+                    for span in batch:
+                        f.write(json.dumps(span.to_dict(), default=str) + "\n")
+            elif self.kind == "otlp":
+                requests.post(config.TRACE_OTLP_ENDPOINT, json=_to_otlp(batch), timeout=5)
+        except Exception as e:
+            logger.warning(f"Trace export failed ({len(batch)} spans dropped): {e}")
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _to_otlp(spans: list) -> dict:
+    """Encode spans as an OTLP/HTTP JSON ExportTraceServiceRequest."""
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [
+                {"key": "service.name", "value": {"stringValue": config.TRACE_SERVICE_NAME}},
+            ]},
+            "scopeSpans": [{
+                "scope": {"name": "kapsule-studio-api"},
+                "spans": [
+                    {
+                        "traceId": span.context.trace_id,
+                        "spanId": span.context.span_id,
+                        "parentSpanId": span.parent_span_id or "",
+                        "name": span.name,
+                        "kind": 1,
+                        "startTimeUnixNano": str(span.start_ns),
+                        "endTimeUnixNano": str(span.end_ns),
+                        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items()],
+                        "status": {"code": 2, "message": span.error or ""} if span.status == "ERROR" else {"code": 1},
+                    }
+                    for span in spans
+                ],
+            }],
+        }]
+    }
+
+
+_exporter = _Exporter(config.TRACE_EXPORTER, config.TRACE_MAX_QUEUE, config.TRACE_FLUSH_INTERVAL_SECONDS)
+ENABLED = config.TRACE_EXPORTER in ("otlp", "file")
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_context() -> Optional[SpanContext]:
+    current = _current_span.get()
+    return current.context if current is not None else None
+
+
+@contextmanager
+def span(name: str, parent: Optional[SpanContext] = None, **attributes):
+    """
+    Open a span as a child of `parent` (or of the current span, or as a new root).
+
+    Args:
+        name: Span name, e.g. "veo.poll"
+        parent: Explicit parent (for work detached from the creating request)
+        **attributes: Initial span attributes
+
+    Yields:
+        The Span (use set_attribute to annotate it)
+    """
+    if parent is None:
+        parent = current_context()
+
+    if parent is not None:
+        context = SpanContext(parent.trace_id, _new_id(8), parent.sampled)
+        parent_span_id = parent.span_id
+    else:
+        sampled = ENABLED and random.random() < config.TRACE_SAMPLE_RATIO
+        context = SpanContext(_new_id(16), _new_id(8), sampled)
+        parent_span_id = None
+
+    current = Span(name, context, parent_span_id, attributes if context.sampled else {})
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = "ERROR"
+        current.error = str(e)[:500]
+        raise
+    finally:
+        _current_span.reset(token)
+        if context.sampled and ENABLED:
+            current.end_ns = time.time_ns()
+            _exporter.submit(current)
+
+
+@contextmanager
+def pipeline_stage(stage: str, **attributes):
+    """Time a pipeline stage into the stage histogram and the job's timing ledger, and trace it as a child span."""
+    start = time.perf_counter()
+    try:
+        with span(f"stage.{stage}", stage=stage, **attributes) as current:
+            yield current
+    finally:
+        elapsed = time.perf_counter() - start
+        PIPELINE_STAGE_SECONDS.observe(elapsed, stage=stage)
+        job_stats.add_stage(stage, elapsed)
+
+
+def run_in_context(target, *args, **kwargs):
+    """Wrap a callable so it runs in a copy of the caller's context (for threading.Thread)."""
+    context = contextvars.copy_context()
+    return lambda: context.run(target, *args, **kwargs)
+
+
+def flush() -> None:
+    """Export everything buffered so far (used at shutdown)."""
+    _exporter.flush()
@@ -2,144 +2,514 @@ import logging
 import ffmpeg
 import os
 import math
+import shutil
+import subprocess
+import threading
+import time
+from typing import Callable, List, Optional
+from utils import cancellation, profiling
+from utils.tracing import pipeline_stage
 
 logger = logging.getLogger(__name__)
 
+# HLS output layout (all files live flat in one per-job directory)
+HLS_PLAYLIST_NAME = "playlist.m3u8"
+HLS_INIT_NAME = "init.mp4"
+HLS_SEGMENT_PATTERN = "segment_%05d.m4s"
 
-def merge_audio_video(video_path: str, audio_path: str, output_path: str) -> bool:
+# Encoder settings shared by every render path
+ENCODE_ARGS = {
+    'vcodec': 'libx264',
+    'acodec': 'aac',
+    'audio_bitrate': '192k',
+    'video_bitrate': '2M',
+    'preset': 'fast',  # Fast encoding preset
+    'crf': 23,  # Quality setting
+    'pix_fmt': 'yuv420p',  # Ensure compatibility
+}
+
+
+class OutputLimitExceeded(Exception):
+    """Raised by an encode's `check` callback to stop FFmpeg (e.g. a job over its scratch budget)."""
+
+
+# Seconds between `check` calls while FFmpeg runs
+CHECK_INTERVAL_SECONDS = 0.5
+
+
+def _run(stream_spec, check: Optional[Callable[[], None]] = None) -> None:
+    """
+    Run FFmpeg to completion like `.run(capture_stdout=True, capture_stderr=True)`,
+    but as a process the current job's cancellation can kill.
+
+    Args:
+        stream_spec: FFmpeg command to run
+        check: Called every CHECK_INTERVAL_SECONDS while FFmpeg runs; if it raises,
+            FFmpeg is killed and the exception propagates
+
+    Raises:
+        JobCancelled: If the job was cancelled (FFmpeg was killed)
+        ffmpeg.Error: If FFmpeg exits non-zero
+    """
+    process = stream_spec.run_async(pipe_stdout=True, pipe_stderr=True)
+    with cancellation.track_process(process), profiling.track_child(process):
+        try:
+            while True:
+                try:
+                    stdout, stderr = process.communicate(timeout=CHECK_INTERVAL_SECONDS if check else None)
+                    break
+                except subprocess.TimeoutExpired:
+                    check()
+        except BaseException:
+            if process.poll() is None:
+                process.kill()
+                process.communicate()
+            raise
+    cancellation.check()
+    if process.returncode != 0:
+        raise ffmpeg.Error('ffmpeg', stdout, stderr)
+
+
+def _build_streams(video_path: str, audio_path: str):
+    """
+    Probe both inputs and build the filtered video stream and the audio stream.
+    Loops the video to match audio duration if needed, otherwise trims it.
+
+    Args:
+        video_path: Path to video file (silent video from Veo)
+        audio_path: Path to audio file (user's music track)
+
+    Returns:
+        Tuple of (video_stream, audio_stream, audio_duration)
+    """
+    # Validate input files exist
+    if not os.path.exists(video_path):
+        raise FileNotFoundError(f"Video file not found: {video_path}")
+    if not os.path.exists(audio_path):
+        raise FileNotFoundError(f"Audio file not found: {audio_path}")
+
+    # Get duration of both video and audio
+    with pipeline_stage("probe"):
+        video_probe = ffmpeg.probe(video_path)
+        audio_probe = ffmpeg.probe(audio_path)
+
+    video_duration = float(video_probe['format']['duration'])
+    audio_duration = float(audio_probe['format']['duration'])
+
+    # Get video stream info
+    video_info = next((s for s in video_probe['streams'] if s['codec_type'] == 'video'), None)
+    if video_info:
+        logger.info(f"  Video resolution: {video_info.get('width')}x{video_info.get('height')}")
+        logger.info(f"  Video codec: {video_info.get('codec_name')}")
+
+    logger.info(f"  Video duration: {video_duration:.2f}s")
+    logger.info(f"  Audio duration: {audio_duration:.2f}s")
+
+    # Load streams
+    video_stream = ffmpeg.input(video_path)
+    audio_stream = ffmpeg.input(audio_path)
+
+    # If video is shorter than audio, loop it
+    if video_duration < audio_duration:
+        # Calculate how many loops we need
+        loop_count = math.ceil(audio_duration / video_duration)
+        logger.info(f"  Looping video {loop_count} times to match audio duration")
+
+        # Use loop filter and trim to exact audio duration
+        video_stream = (
+            video_stream
+            .video  # Explicitly select video stream
+            .filter('loop', loop=loop_count - 1, size=32767)  # loop filter
+            .filter('setpts', 'N/FRAME_RATE/TB')  # reset timestamps
+            .filter('trim', duration=audio_duration)  # trim to exact audio length
+            .filter('setpts', 'PTS-STARTPTS')  # reset PTS after trim
+        )
+    else:
+        # Video is same length or longer - just merge
+        logger.info(f"  Video is long enough, trimming to audio duration")
+
+        # Trim video to audio duration
+        video_stream = video_stream.video.filter('trim', duration=audio_duration).filter('setpts', 'PTS-STARTPTS')
+
+    return video_stream, audio_stream.audio, audio_duration
+
+
+def merge_audio_video(
+    video_path: str,
+    audio_path: str,
+    output_path: str,
+    check: Optional[Callable[[], None]] = None
+) -> bool:
     """
     Merge video and audio files using FFmpeg.
     Loops the video to match audio duration if needed.
-    
+
     Args:
         video_path: Path to video file (silent video from Veo)
         audio_path: Path to audio file (user's music track)
         output_path: Path where merged video should be saved
-        
+        check: Called periodically while FFmpeg encodes; raise OutputLimitExceeded to stop it
+
     Returns:
         True if successful, False otherwise
+
+    Raises:
+        JobCancelled: If the job was cancelled (FFmpeg is killed)
+        OutputLimitExceeded: If `check` stopped the encode (FFmpeg is killed)
     """
     try:
         logger.info(f"Merging video and audio...")
         logger.info(f"  Video: {video_path}")
         logger.info(f"  Audio: {audio_path}")
         logger.info(f"  Output: {output_path}")
-        
-        # Validate input files exist
-        if not os.path.exists(video_path):
-            raise FileNotFoundError(f"Video file not found: {video_path}")
-        if not os.path.exists(audio_path):
-            raise FileNotFoundError(f"Audio file not found: {audio_path}")
-        
-        # Get duration of both video and audio
-        video_probe = ffmpeg.probe(video_path)
-        audio_probe = ffmpeg.probe(audio_path)
-        
-        video_duration = float(video_probe['format']['duration'])
-        audio_duration = float(audio_probe['format']['duration'])
-        
-        # Get video stream info
-        video_info = next((s for s in video_probe['streams'] if s['codec_type'] == 'video'), None)
-        if video_info:
-            logger.info(f"  Video resolution: {video_info.get('width')}x{video_info.get('height')}")
-            logger.info(f"  Video codec: {video_info.get('codec_name')}")
-        
-        logger.info(f"  Video duration: {video_duration:.2f}s")
-        logger.info(f"  Audio duration: {audio_duration:.2f}s")
-        
-        # Load streams
-        video_stream = ffmpeg.input(video_path)
-        audio_stream = ffmpeg.input(audio_path)
-        
-        # If video is shorter than audio, loop it
-        if video_duration < audio_duration:
-            # Calculate how many loops we need
-            loop_count = math.ceil(audio_duration / video_duration)
-            logger.info(f"  Looping video {loop_count} times to match audio duration")
-            
-            # Use loop filter and trim to exact audio duration
-            video_stream = (
-                video_stream
-                .video  # Explicitly select video stream
-                .filter('loop', loop=loop_count - 1, size=32767)  # loop filter
-                .filter('setpts', 'N/FRAME_RATE/TB')  # reset timestamps
-                .filter('trim', duration=audio_duration)  # trim to exact audio length
-                .filter('setpts', 'PTS-STARTPTS')  # reset PTS after trim
-            )
-            
-            # Re-encode video since we applied filters
-            (
+
+        video_stream, audio_stream, _ = _build_streams(video_path, audio_path)
+
+        # Re-encode video since we applied filters
+        with pipeline_stage("encode", ffmpeg_output=os.path.basename(output_path)):
+            _run(
                 ffmpeg
                 .output(
                     video_stream,
-                    audio_stream.audio,
+                    audio_stream,
                     output_path,
-                    vcodec='libx264',  # Need to re-encode with filters
-                    acodec='aac',
-                    audio_bitrate='192k',
-                    video_bitrate='2M',
-                    preset='fast',  # Fast encoding preset
-                    crf=23,  # Quality setting
-                    **{
-                        'pix_fmt': 'yuv420p',  # Ensure compatibility
-                        'movflags': '+faststart'  # Move moov atom to beginning for mobile Safari streaming
-                    }
+                    **ENCODE_ARGS,
+                    movflags='+faststart'  # Move moov atom to beginning for mobile Safari streaming
                 )
-                .overwrite_output()
-                .run(capture_stdout=True, capture_stderr=True)
+                .overwrite_output(),
+                check=check
             )
-        else:
-            # Video is same length or longer - just merge
-            logger.info(f"  Video is long enough, trimming to audio duration")
-            
-            # Trim video to audio duration
-            video_stream = video_stream.video.filter('trim', duration=audio_duration).filter('setpts', 'PTS-STARTPTS')
-            
-            (
-                ffmpeg
-                .output(
-                    video_stream,
-                    audio_stream.audio,
-                    output_path,
+
+        logger.info(f"Successfully merged video and audio to: {output_path}")
+
+        return True
+
+    except (cancellation.JobCancelled, OutputLimitExceeded):
+        raise
+    except ffmpeg.Error as e:
+        logger.error(f"FFmpeg error: {e.stderr.decode() if e.stderr else str(e)}")
+        return False
+    except Exception as e:
+        logger.error(f"Error merging video and audio: {str(e)}")
+        return False
+
+
+def _read_hls_playlist(playlist_path: str) -> List[str]:
+    """
+    List the files referenced by an HLS playlist, init segment first.
+
+    Args:
+        playlist_path: Path to the .m3u8 playlist
+
+    Returns:
+        File names (relative to the playlist directory) in playback order
+    """
+    try:
+        with open(playlist_path, "r") as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return []
+
+    files = []
+    for line in lines:
+        line = line.strip()
+        if line.startswith("#EXT-X-MAP:") and 'URI="' in line:
+            files.append(line.split('URI="', 1)[1].split('"', 1)[0])
+        elif line and not line.startswith("#"):
+            files.append(line)
+    return files
+
+
+def _drain_stream(stream, sink: list, max_bytes: int = 64 * 1024) -> None:
+    """Read a subprocess pipe to EOF so it never blocks, keeping only the tail."""
+    size = 0
+    for chunk in iter(lambda: stream.read(4096), b""):
+        sink.append(chunk)
+        size += len(chunk)
+        while size > max_bytes and len(sink) > 1:
+            size -= len(sink.pop(0))
+
+
+def merge_audio_video_hls(
+    video_path: str,
+    audio_path: str,
+    output_dir: str,
+    segment_seconds: int = 2,
+    on_update: Optional[Callable[[List[str], str], None]] = None,
+    poll_interval: float = 0.25,
+    check: Optional[Callable[[], None]] = None
+) -> bool:
+    """
+    Merge video and audio into HLS (fMP4 segments plus playlist) using FFmpeg.
+
+    Segments are reported through `on_update` as soon as FFmpeg finalizes them,
+    so the caller can publish them while the rest of the track is still encoding.
+
+    Args:
+        video_path: Path to video file (silent video from Veo)
+        audio_path: Path to audio file (user's music track)
+        output_dir: Directory where the playlist, init segment and media segments are written
+        segment_seconds: Target segment duration in seconds
+        on_update: Callback receiving (new_file_paths, playlist_path) each time new
+            segments are referenced by the playlist; it is also called once more with
+            the final playlist after FFmpeg exits
+        poll_interval: Seconds between checks of the output directory
+        check: Called at every poll while FFmpeg encodes; raise OutputLimitExceeded to stop it
+
+    Returns:
+        True if successful, False otherwise
+
+    Raises:
+        JobCancelled: If the job was cancelled (FFmpeg is killed)
+        OutputLimitExceeded: If `check` stopped the encode (FFmpeg is killed)
+    """
+    process = None
+    try:
+        logger.info(f"Packaging video and audio as HLS...")
+        logger.info(f"  Video: {video_path}")
+        logger.info(f"  Audio: {audio_path}")
+        logger.info(f"  Output dir: {output_dir}")
+
+        os.makedirs(output_dir, exist_ok=True)
+        playlist_path = os.path.join(output_dir, HLS_PLAYLIST_NAME)
+
+        video_stream, audio_stream, _ = _build_streams(video_path, audio_path)
+
+        process = (
+            ffmpeg
+            .output(
+                video_stream,
+                audio_stream,
+                playlist_path,
+                **ENCODE_ARGS,
+                format='hls',
+                hls_time=segment_seconds,
+                hls_playlist_type='event',  # Players keep reloading until EXT-X-ENDLIST
+                hls_segment_type='fmp4',
+                hls_fmp4_init_filename=HLS_INIT_NAME,
+                hls_segment_filename=os.path.join(output_dir, HLS_SEGMENT_PATTERN),
+                hls_flags='independent_segments+temp_file',  # Segments appear only once complete
+                force_key_frames=f"expr:gte(t,n_forced*{segment_seconds})"  # Cut exactly on segment boundaries
+            )
+            .overwrite_output()
+            .run_async(pipe_stderr=True)
+        )
+
+        stderr_tail = []
+        drain_thread = threading.Thread(target=_drain_stream, args=(process.stderr, stderr_tail), daemon=True)
+        drain_thread.start()
+
+        published = set()
+
+        def publish_new() -> None:
+            new_files = [
+                os.path.join(output_dir, name)
+                for name in _read_hls_playlist(playlist_path)
+                if name not in published
+            ]
+            if new_files and on_update:
+                on_update(new_files, playlist_path)
+            published.update(os.path.basename(path) for path in new_files)
+
+        with pipeline_stage("encode", ffmpeg_output="hls") as encode_span, cancellation.track_process(process), profiling.track_child(process):
+            while process.poll() is None:
+                time.sleep(poll_interval)
+                if check:
+                    check()
+                publish_new()
+
+            drain_thread.join(timeout=5)
+            encode_span.set_attribute("ffmpeg_returncode", process.returncode)
+
+        cancellation.check()
+
+        if process.returncode != 0:
+            logger.error(f"FFmpeg error: {b''.join(stderr_tail).decode(errors='replace')}")
+            return False
+
+        publish_new()
+        # Final call so the caller republishes the playlist with EXT-X-ENDLIST
+        if on_update:
+            on_update([], playlist_path)
+
+        logger.info(f"Successfully packaged HLS output to: {output_dir}")
+
+        return True
+
+    except (cancellation.JobCancelled, OutputLimitExceeded):
+        if process is not None and process.poll() is None:
+            process.kill()
+        raise
+    except Exception as e:
+        logger.error(f"Error packaging HLS output: {str(e)}")
+        if process is not None and process.poll() is None:
+            process.kill()
+        return False
+
+
+def remux_hls_to_mp4(playlist_path: str, output_path: str, check: Optional[Callable[[], None]] = None) -> bool:
+    """
+    Remux an fMP4 HLS rendition into a single progressive MP4 without re-encoding.
+
+    Args:
+        playlist_path: Path to the local .m3u8 playlist
+        output_path: Path where the MP4 should be saved
+        check: Called periodically while FFmpeg runs; raise OutputLimitExceeded to stop it
+
+    Returns:
+        True if successful, False otherwise
+
+    Raises:
+        JobCancelled: If the job was cancelled (FFmpeg is killed)
+        OutputLimitExceeded: If `check` stopped the remux (FFmpeg is killed)
+    """
+    try:
+        _run(
+            ffmpeg
+            .input(playlist_path, allowed_extensions='ALL')
+            .output(output_path, c='copy', movflags='+faststart')
+            .overwrite_output(),
+            check=check
+        )
+        logger.info(f"Remuxed HLS playlist to: {output_path}")
+        return True
+    except (cancellation.JobCancelled, OutputLimitExceeded):
+        raise
+    except ffmpeg.Error as e:
+        logger.error(f"FFmpeg error: {e.stderr.decode() if e.stderr else str(e)}")
+        return False
+
+
+def create_preview(
+    video_path: str,
+    audio_path: str,
+    thumbnail_path: str,
+    preview_path: str,
+    seconds: float = 3,
+    width: int = 240
+) -> bool:
+    """
+    Create a poster frame JPEG and a short low-resolution preview clip in one FFmpeg pass.
+
+    Only the first `seconds` of each input are decoded and the clip is encoded at low
+    resolution, frame rate and bitrate with the fastest x264 preset on a single thread,
+    so this costs a fraction of a CPU second and does not compete with the main render.
+
+    Args:
+        video_path: Path to video file (silent video from Veo)
+        audio_path: Path to audio file (user's music track)
+        thumbnail_path: Path where the poster frame JPEG should be saved
+        preview_path: Path where the preview MP4 should be saved
+        seconds: Preview length in seconds
+        width: Preview width in pixels (height follows the aspect ratio)
+
+    Returns:
+        True if successful, False otherwise
+
+    Raises:
+        JobCancelled: If the job was cancelled (FFmpeg is killed)
+    """
+    try:
+        logger.info(f"Creating preview ({seconds}s at {width}px wide)...")
+
+        video_input = ffmpeg.input(video_path, t=seconds, threads=1)
+        audio_input = ffmpeg.input(audio_path, t=seconds)
+        # Drop frames before scaling so the scaler only touches what gets encoded
+        scaled = video_input.video.filter('fps', 12).filter('scale', width, -2, flags='fast_bilinear')
+        split = scaled.split()
+        poster, clip = split[0], split[1]
+
+        _run(
+            ffmpeg
+            .merge_outputs(
+                ffmpeg.output(poster, thumbnail_path, vframes=1, **{'q:v': 5}),
+                ffmpeg.output(
+                    clip,
+                    audio_input.audio,
+                    preview_path,
                     vcodec='libx264',
                     acodec='aac',
-                    audio_bitrate='192k',
-                    video_bitrate='2M',
-                    preset='fast',
-                    crf=23,
-                    **{
-                        'pix_fmt': 'yuv420p',
-                        'movflags': '+faststart'  # Move moov atom to beginning for mobile Safari streaming
-                    }
+                    audio_bitrate='64k',
+                    video_bitrate='200k',
+                    preset='ultrafast',
+                    threads=1,
+                    ac=1,
+                    t=seconds,
+                    pix_fmt='yuv420p',
+                    movflags='+faststart'
                 )
-                .overwrite_output()
-                .run(capture_stdout=True, capture_stderr=True)
             )
-        
-        logger.info(f"Successfully merged video and audio to: {output_path}")
-        
+            .overwrite_output()
+        )
+
+        logger.info(f"Successfully created preview: {preview_path}, poster: {thumbnail_path}")
+
         return True
-        
+
+    except cancellation.JobCancelled:
+        raise
     except ffmpeg.Error as e:
         logger.error(f"FFmpeg error: {e.stderr.decode() if e.stderr else str(e)}")
         return False
     except Exception as e:
-        logger.error(f"Error merging video and audio: {str(e)}")
+        logger.error(f"Error creating preview: {str(e)}")
         return False
 
 
+def warm_up_ffmpeg() -> None:
+    """
+    Run ffprobe and a tiny H.264/AAC encode on synthetic input, so the first job
+    doesn't pay for loading the binaries, their libraries and the encoders.
+
+    Raises:
+        ffmpeg.Error: If ffprobe or FFmpeg fails
+    """
+    ffmpeg.probe("color=c=black:s=64x64:d=0.1", f="lavfi")
+    video = ffmpeg.input("color=c=black:s=64x64:d=0.1", f="lavfi")
+    audio = ffmpeg.input("anullsrc", f="lavfi", t=0.1)
+    ffmpeg.output(video, audio, "-", f="null", vcodec=ENCODE_ARGS['vcodec'], acodec=ENCODE_ARGS['acodec']).run(
+        capture_stdout=True, capture_stderr=True
+    )
+
+
+def disk_usage_bytes(*paths: str) -> int:
+    """
+    Total size in bytes of the given files and of every file under the given directories.
+
+    Args:
+        *paths: File or directory paths (missing paths count as 0)
+
+    Returns:
+        Total size in bytes
+    """
+    total = 0
+    for path in paths:
+        try:
+            if os.path.isdir(path):
+                for root, _, files in os.walk(path):
+                    total += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+            elif os.path.exists(path):
+                total += os.path.getsize(path)
+        except OSError:
+            # Files can disappear mid-walk (temp_file renames, cleanup)
+            continue
+    return total
+
+
 def cleanup_temp_files(*file_paths: str) -> None:
     """
-    Delete temporary files.
-    
+    Delete temporary files (and temporary directories, recursively).
+
     Args:
-        *file_paths: Variable number of file paths to delete
+        *file_paths: Variable number of file or directory paths to delete
     """
     for file_path in file_paths:
         try:
-            if os.path.exists(file_path):
+            if os.path.isdir(file_path):
+                shutil.rmtree(file_path)
+                logger.info(f"Deleted temp directory: {file_path}")
+            elif os.path.exists(file_path):
                 os.remove(file_path)
                 logger.info(f"Deleted temp file: {file_path}")
         except Exception as e:
             logger.warning(f"Failed to delete temp file {file_path}: {str(e)}")
-
@@ -0,0 +1,90 @@
+"""
+Startup warmup behind the /readyz readiness check.
+
+Steps (access tokens, client construction, pooled TLS connections to Vertex and
+GCS, a first ffprobe/FFmpeg run, ...) run concurrently on worker threads right
+after startup, so the first requests routed to a new instance don't pay for
+them. The instance reports ready once every step has finished or
+WARMUP_TIMEOUT_SECONDS has passed. A failed step is reported but doesn't keep
+the instance unready, since the request path retries the same work anyway.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Warmup:
+    """Named warmup steps, run once, with per-step timings for /readyz."""
+
+    def __init__(self, timeout_seconds: float):
+        self.timeout_seconds = timeout_seconds
+        self._steps: List[Tuple[str, Callable[[], object]]] = []
+        self._results: Dict[str, dict] = {}
+        self._started: Optional[float] = None
+        self._finished: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def add(self, name: str, step: Callable[[], object]) -> None:
+        self._steps.append((name, step))
+
+    def _run_step(self, name: str, step: Callable[[], object]) -> None:
+        start = time.perf_counter()
+        try:
+            step()
+            result = {"ok": True}
+        except Exception as e:
+            logger.warning(f"Warmup step {name} failed: {e}")
+            result = {"ok": False, "error": str(e)[:200]}
+        elapsed = time.perf_counter() - start
+        result["ms"] = round(elapsed * 1000, 1)
+        with self._lock:
+            self._results[name] = result
+
+    def run(self) -> None:
+        """Run every step concurrently; returns once all finished or the timeout passed."""
+        self._started = time.perf_counter()
+        if self._steps:
+            executor = ThreadPoolExecutor(max_workers=len(self._steps), thread_name_prefix="warmup")
+            futures = [executor.submit(self._run_step, name, step) for name, step in self._steps]
+            _, not_done = wait(futures, timeout=self.timeout_seconds)
+            executor.shutdown(wait=False)
+            if not_done:
+                logger.warning(f"Warmup timed out after {self.timeout_seconds}s, reporting ready anyway")
+        self._finished = time.perf_counter()
+        logger.info(
+            f"Warmup finished in {(self._finished - self._started) * 1000:.0f} ms: "
+            + ", ".join(
+                f"{name}=" + ("pending" if "ms" not in result else f"{result['ms']}ms" + ("" if result["ok"] else " (failed)"))
+                for name, result in self.steps().items()
+            )
+        )
+
+    def skip(self) -> None:
+        """Report ready without running anything (warmup disabled)."""
+        self._started = self._finished = time.perf_counter()
+
+    @property
+    def ready(self) -> bool:
+        return self._finished is not None
+
+    def steps(self) -> Dict[str, dict]:
+        with self._lock:
+            return {name: self._results.get(name, {"ok": False, "pending": True}) for name, _ in self._steps}
+
+    def step_seconds(self) -> dict:
+        """Gauge callback: duration of each finished step."""
+        with self._lock:
+            return {(name,): result["ms"] / 1000 for name, result in self._results.items()}
+
+    def status(self) -> dict:
+        """Readiness and per-step outcome and timing."""
+        status = {"ready": self.ready, "steps": self.steps()}
+        if self._started is not None:
+            end = self._finished if self._finished is not None else time.perf_counter()
+            status["elapsed_ms"] = round((end - self._started) * 1000, 1)
+        return status
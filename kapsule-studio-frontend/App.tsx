@@ -1,10 +1,20 @@
-import React, { useState, useEffect, useCallback } from 'react';
+import React, { useState, useEffect, useCallback, useRef } from 'react';
 import { UploadSection } from './components/UploadSection';
 import { PromptForm } from './components/PromptForm';
 import { VideoPreview } from './components/VideoPreview';
 import type { PromptOptions } from './types';
 import { DURATIONS, GENRES, VISUAL_STYLES, CAMERA_MOVEMENTS, CAMERA_MOVEMENTS_VISUAL, MOODS, SUBJECTS, SETTINGS, LIGHTING_STYLES, CAMERA_TYPES, CREATIVE_INTENSITIES, VISUAL_SUBJECTS } from './constants';
 
+// Stable per-browser ID, so instant mode never serves this browser the same pre-rendered clip twice
+const getClientId = (): string => {
+  let id = localStorage.getItem('kapsule_client_id');
+  if (!id) {
+    id = crypto.randomUUID();
+    localStorage.setItem('kapsule_client_id', id);
+  }
+  return id;
+};
+
 const App: React.FC = () => {
   const [uploadedFile, setUploadedFile] = useState<File | null>(null);
   const [audioUrl, setAudioUrl] = useState<string | null>(null);
@@ -28,13 +38,19 @@ const App: React.FC = () => {
   const [jobId, setJobId] = useState<string | null>(null);
   const [errorMessage, setErrorMessage] = useState<string | null>(null);
   const [customPrompt, setCustomPrompt] = useState<string | null>(null);
+  // Token of the last preview: generating with it reuses exactly the previewed prompt
+  const [previewToken, setPreviewToken] = useState<string | null>(null);
+  // Idempotency-Key for the current generate request: reused by double-clicks and
+  // retries of the same request, replaced when the request changes or the job ends
+  const generateKeyRef = useRef<{ key: string; body: string } | null>(null);
 
-  // Poll for job status
+  // Poll for job status, as often as the API's retry_after_ms hint suggests
   useEffect(() => {
     if (!jobId || !isVideoProcessing) return;
 
     const API_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
-    let pollInterval: number;
+    let pollTimeout: number;
+    let stopped = false;
 
     const pollJobStatus = async () => {
       try {
@@ -45,30 +61,39 @@ const App: React.FC = () => {
         }
 
         const data = await response.json();
+        if (stopped) return;
+
+        if (['complete', 'error', 'cancelled'].includes(data.status)) {
+          generateKeyRef.current = null;
+        }
 
         if (data.status === 'complete') {
           setVideoUrl(data.video_url);
           setIsVideoProcessing(false);
-          clearInterval(pollInterval);
         } else if (data.status === 'error') {
           setErrorMessage(data.error || 'Video generation failed');
           setIsVideoProcessing(false);
-          clearInterval(pollInterval);
+        } else if (data.status === 'cancelled') {
+          setErrorMessage('Video generation was cancelled');
+          setIsVideoProcessing(false);
+        } else {
+          // Still queued or processing: sparse polls early on, dense ones near the ETA
+          pollTimeout = window.setTimeout(pollJobStatus, data.retry_after_ms ?? 3000);
         }
-        // Continue polling if status is 'queued' or 'processing'
       } catch (error) {
+        if (stopped) return;
         console.error('Polling error:', error);
         setErrorMessage('Failed to check job status');
         setIsVideoProcessing(false);
-        clearInterval(pollInterval);
       }
     };
 
-    // Start polling every 3 seconds
-    pollInterval = window.setInterval(pollJobStatus, 3000);
     pollJobStatus(); // Call immediately
 
-    return () => clearInterval(pollInterval);
+    return () => {
+      stopped = true;
+      clearTimeout(pollTimeout);
+    };
   }, [jobId, isVideoProcessing]);
 
   // Reset camera movement when switching between visual/performance modes
@@ -110,14 +135,27 @@ const App: React.FC = () => {
         console.log("Using custom prompt from preview");
       } else {
         console.log("Backend will build enhanced prompt from options");
+        // The backend ignores the token if the options changed since the preview
+        if (previewToken) {
+          requestBody.preview_token = previewToken;
+        }
+        // Use a pre-rendered clip for these options when the backend has one (else a normal render)
+        requestBody.mode = 'instant';
+        requestBody.user_id = getClientId();
       }
       
+      const body = JSON.stringify(requestBody);
+      if (generateKeyRef.current?.body !== body) {
+        generateKeyRef.current = { key: crypto.randomUUID(), body };
+      }
+
       const response = await fetch(`${API_URL}/api/generate`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
+          'Idempotency-Key': generateKeyRef.current.key,
         },
-        body: JSON.stringify(requestBody),
+        body,
       });
 
       if (!response.ok) {
@@ -127,7 +165,7 @@ const App: React.FC = () => {
 
       const data = await response.json();
       setJobId(data.job_id);
-      console.log("Job created:", data.job_id);
+      console.log("Job created:", data.job_id, data.instant ? "(instant)" : "");
     } catch (error) {
       setIsVideoProcessing(false);
       console.error('Generation error:', error);
@@ -167,6 +205,7 @@ const App: React.FC = () => {
               onGenerate={handleGenerateClick}
               isDisabled={!areAllOptionsSelected || !audioUrl}
               onUsePreview={handleUsePreview}
+              onPreviewToken={setPreviewToken}
             />
           </div>
           <div className="lg:col-span-1 flex flex-col">
@@ -9,6 +9,7 @@ interface PromptFormProps {
   onGenerate: () => void;
   isDisabled: boolean;
   onUsePreview: (text: string) => void;
+  onPreviewToken: (token: string | null) => void;
 }
 
 const SelectInput: React.FC<{label: string, name: keyof PromptOptions, value: string, onChange: (e: React.ChangeEvent<HTMLSelectElement>) => void, options: string[]}> = ({label, name, value, onChange, options}) => (
@@ -27,7 +28,7 @@ const SelectInput: React.FC<{label: string, name: keyof PromptOptions, value: st
 );
 
 
-export const PromptForm: React.FC<PromptFormProps> = ({ promptOptions, setPromptOptions, onGenerate, isDisabled, onUsePreview }) => {
+export const PromptForm: React.FC<PromptFormProps> = ({ promptOptions, setPromptOptions, onGenerate, isDisabled, onUsePreview, onPreviewToken }) => {
   const [isPreviewing, setIsPreviewing] = useState(false);
   const [showPreview, setShowPreview] = useState(false);
   const [previewText, setPreviewText] = useState<string>('');
@@ -96,6 +97,7 @@ export const PromptForm: React.FC<PromptFormProps> = ({ promptOptions, setPrompt
       const data = await res.json();
       setPreviewText(data.enhanced_prompt || '');
       setPreviewSource(data.source || null);
+      onPreviewToken(data.preview_token || null);
       setShowPreview(true);
     } catch (err) {
       setPreviewText(`Failed to load preview: ${err instanceof Error ? err.message : 'Unknown error'}`);
@@ -136,16 +138,43 @@ export const PromptForm: React.FC<PromptFormProps> = ({ promptOptions, setPrompt
         force_gemini: true, // Force Gemini enhancement
       };
       
-      const res = await fetch(`${API_URL}/api/prompt/preview`, {
+      // Streamed as server-sent events: 'token' events with partial text, then one 'done' event
+      const res = await fetch(`${API_URL}/api/prompt/preview/stream`, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify(body),
       });
       
-      if (!res.ok) throw new Error('Failed to enhance with Gemini');
-      const data = await res.json();
-      setPreviewText(data.enhanced_prompt || '');
-      setPreviewSource('gemini');
+      if (!res.ok || !res.body) throw new Error('Failed to enhance with Gemini');
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let streamed = '';
+      let finished = false;
+      while (!finished) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop() || '';
+        for (const raw of events) {
+          const event = raw.match(/^event: (.*)$/m)?.[1];
+          const data = raw.match(/^data: (.*)$/m)?.[1];
+          if (!event || !data) continue;
+          const payload = JSON.parse(data);
+          if (event === 'token') {
+            streamed += payload.text;
+            setPreviewText(streamed);
+          } else if (event === 'done') {
+            // Falls back to the rule-based prompt if Gemini was too slow or failed
+            setPreviewText(payload.enhanced_prompt || '');
+            setPreviewSource(payload.source || null);
+            onPreviewToken(payload.preview_token || null);
+            finished = true;
+          }
+        }
+      }
+      if (!finished) throw new Error('Stream ended early');
     } catch (err) {
       alert(`Gemini enhancement failed: ${err instanceof Error ? err.message : 'Unknown error'}`);
     } finally {